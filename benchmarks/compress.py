@@ -0,0 +1,62 @@
+""" McbdscParallelCompressor の、プロセス数に対するスループットのスケーリングを計測するベンチマーク。
+
+ワールドの .ldb ファイルに近い、圧縮しにくいデータと圧縮しやすいデータが混在したデータを圧縮します。
+
+    python benchmarks/compress.py --size 512 --compression gz --level 6
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymcbdsc.compress import McbdscParallelCompressor  # noqa: E402
+
+
+class NullWriter(object):
+    """ 書き込まれたデータを捨てるファイルオブジェクト。 """
+
+    def write(self, b) -> int:
+        return len(b)
+
+    def flush(self) -> None:
+        pass
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark McbdscParallelCompressor with various numbers of workers.")
+    parser.add_argument("--size", type=int, default=256, help="Size of the data in MB.")
+    parser.add_argument("--compression", default="gz", choices=["gz", "bz2", "xz"])
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--block-size", type=int, default=4, help="Block size in MB.")
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="Numbers of workers to measure. Defaults to 1, 2, 4, ... up to the number of CPUs.")
+    args = parser.parse_args()
+
+    workers_list = args.workers
+    if not workers_list:
+        cpus = os.cpu_count() or 1
+        workers_list = sorted(set([2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus] + [cpus]))
+    chunk = (os.urandom(512 * 1024) + bytes(range(256)) * 2048)
+    n = args.size * 1024 * 1024 // len(chunk)
+
+    base = None
+    print("cpus={cpus} size={size}MB compression={c} level={level}"
+          .format(cpus=os.cpu_count(), size=args.size, c=args.compression, level=args.level))
+    for workers in workers_list:
+        started = time.perf_counter()
+        with McbdscParallelCompressor(NullWriter(), compression=args.compression, level=args.level, workers=workers,
+                                      block_size=args.block_size * 1024 * 1024) as f:
+            for _ in range(n):
+                f.write(chunk)
+        sec = time.perf_counter() - started
+        mbps = f.bytes_in / 1024 / 1024 / sec
+        base = base or mbps
+        print("workers={workers:<3} throughput={mbps:>8.1f}MB/s speedup={speedup:.2f}x ratio={ratio:.3f}"
+              .format(workers=workers, mbps=mbps, speedup=mbps / base, ratio=f.bytes_out / f.bytes_in))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+""" ベンチマークで利用する、ダウンロードページと Docker Engine API のスタンドイン。
+
+どちらもローカルの HTTP サーバとして動作するので、 requests や docker-py をそのまま利用でき、
+HTTP のオーバーヘッドを含めて計測できます。ネットワークや Docker ホストは必要ありません。
+"""
+
+from typing import Dict, List, Optional
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # Python 3.5/3.6 には http.server.ThreadingHTTPServer が無いので定義する。
+    daemon_threads = True
+
+
+class LocalServer(object):
+    """ ハンドラのクラスを、別スレッドの HTTP サーバで動作させるクラス。 """
+
+    def __init__(self, handler_class) -> None:
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        self._httpd.owner = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{port}".format(port=self._httpd.server_address[1])
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="bench-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ヘッダとボディを別々に送信するので、 Nagle アルゴリズムを無効にしないと応答毎に遅延 ACK の待ち時間が加わる。
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    @property
+    def owner(self):
+        return self.server.owner
+
+    def read_body(self) -> int:
+        """ リクエストボディを読み捨て、そのバイト数を戻すメソッド。 """
+        n = 0
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                n += len(self.rfile.read(size + 2)) - 2
+                if size == 0:
+                    return n
+        length = int(self.headers.get("Content-Length") or 0)
+        while n < length:
+            data = self.rfile.read(min(length - n, 1024 * 1024))
+            if not data:
+                break
+            n += len(data)
+        return n
+
+    def send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for (k, v) in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, obj, status: int = 200) -> None:
+        self.send(status, json.dumps(obj).encode("utf-8"))
+
+
+class DownloadSite(LocalServer):
+    """ minecraft.net のダウンロードページと、 BDS の Zip ファイルを配信するスタンドイン。
+
+    Zip ファイルは、圧縮しない(ZIP_STORED)ランダムなデータで `size` バイトの大きさになり、
+    一時ディレクトリ(フォルダ)に作成され、 `with` を抜ける時に削除されます。
+    """
+
+    def __init__(self, size: int, version: str = "1.99.0.1") -> None:
+        super().__init__(DownloadHandler)
+        self.version = version
+        self.work_dir = tempfile.mkdtemp(prefix="mcbdsc-bench-site-")
+        self.zip_path = os.path.join(self.work_dir, "bedrock-server-{version}.zip".format(version=version))
+        chunk = 4 * 1024 * 1024
+        with zipfile.ZipFile(self.zip_path, "w", compression=zipfile.ZIP_STORED) as z:
+            with z.open("bedrock_server", "w", force_zip64=True) as f:
+                for offset in range(0, size, chunk):
+                    f.write(os.urandom(min(chunk, size - offset)))
+
+    def __exit__(self, *exc) -> None:
+        super().__exit__(*exc)
+        shutil.rmtree(self.work_dir)
+
+    @property
+    def page_url(self) -> str:
+        return self.url + "/download/server/bedrock/"
+
+    @property
+    def zip_url_pat(self) -> str:
+        return re.escape(self.url + "/bin-linux/") + r"bedrock-server-([0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)\.zip"
+
+
+class DownloadHandler(Handler):
+
+    def do_GET(self) -> None:
+        site = self.owner
+        if self.path.startswith("/download/"):
+            link = "{url}/bin-linux/{name}".format(url=site.url, name=os.path.basename(site.zip_path))
+            html = "<html><body>" + "<p>filler</p>" * 2000 + '<a href="{link}">Download</a></body></html>'.format(link=link)
+            self.send(200, html.encode("utf-8"), content_type="text/html")
+        elif self.path.startswith("/bin-linux/"):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(os.path.getsize(site.zip_path)))
+            self.end_headers()
+            with open(site.zip_path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+        else:
+            self.send(404)
+
+
+def make_world_tar(size: int, file_size: int = 2 * 1024 * 1024) -> bytes:
+    """ `get_archive("/volume/worlds")` の応答と同じ構成の、 `size` バイトのワールドの tar を作成する関数。
+
+    .ldb ファイルに近い、圧縮しにくいデータと圧縮しやすいデータが混在したデータとします。
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for i in range(max(size // file_size, 1)):
+            data = (os.urandom(file_size // 2) + bytes(range(256)) * (file_size // 512))[:file_size]
+            info = tarfile.TarInfo("worlds/Bedrock level/db/{i:06d}.ldb".format(i=i))
+            info.size = len(data)
+            info.mtime = 1600000000
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class FakeDocker(LocalServer):
+    """ docker-py が利用する範囲の Docker Engine API を、メモリ上のコンテナとイメージで模倣するスタンドイン。
+
+    全てのリクエストは、応答する前に `latency` 秒待機します。
+
+    Args:
+        containers (List[str]): 作成済みのコンテナの名前のリスト.
+        image_tags (List[str]): 作成済みのイメージのタグ("bedrock:1.16.201.02" 等)のリスト. タグ毎に一つのイメージとなる.
+        latency (float): API 毎の待ち時間の秒数.
+        world (bytes): 全てのコンテナの `get_archive` が戻す tar.
+    """
+
+    def __init__(self, containers: List[str] = (), image_tags: List[str] = (), latency: float = 0.0,
+                 world: bytes = b"") -> None:
+        super().__init__(FakeDockerHandler)
+        self.latency = latency
+        self.world = world
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.build_context_bytes = 0
+        self.containers = {}
+        self.images = {}
+        for name in containers:
+            self.add_container(name, {"Image": "bedrock:latest", "Labels": {"pymcbdsc": "true"}})
+        for tag in image_tags:
+            self.add_image([tag])
+
+    def client(self):
+        import docker
+        return docker.DockerClient(base_url=self.url.replace("http://", "tcp://"), version="1.41")
+
+    @classmethod
+    def _id(cls, *parts) -> str:
+        return hashlib.sha256("/".join(parts).encode("utf-8")).hexdigest()
+
+    def add_container(self, name: str, config: dict) -> dict:
+        cid = self._id("container", name)
+        attrs = {"Id": cid, "Name": "/" + name, "Config": config, "Image": "sha256:" + self._id("image", "latest"),
+                 "State": {"Status": "exited", "Running": False}, "HostConfig": {}, "NetworkSettings": {}}
+        self.containers[cid] = attrs
+        return attrs
+
+    def add_image(self, tags: List[str], image_id: Optional[str] = None) -> dict:
+        image_id = image_id or "sha256:" + self._id("image", *tags)
+        attrs = self.images.setdefault(image_id, {"Id": image_id, "RepoTags": [], "Created": "2021-01-01T00:00:00Z"})
+        attrs["RepoTags"].extend(t for t in tags if t not in attrs["RepoTags"])
+        return attrs
+
+    def find_container(self, key: str) -> Optional[dict]:
+        return next((c for (cid, c) in self.containers.items() if cid.startswith(key) or c["Name"] == "/" + key), None)
+
+    def find_image(self, key: str) -> Optional[dict]:
+        for (image_id, attrs) in self.images.items():
+            if image_id.startswith(key) or image_id[7:].startswith(key) or key in attrs["RepoTags"]:
+                return attrs
+        return None
+
+
+class FakeDockerHandler(Handler):
+    _version_re = re.compile(r"^/v[0-9.]+")
+
+    def route(self, method: str) -> None:
+        docker = self.owner
+        with docker.lock:
+            docker.calls += 1
+        time.sleep(docker.latency)
+        url = urlparse(self.path)
+        path = self._version_re.sub("", url.path)
+        query = {k: v[-1] for (k, v) in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        handler = getattr(self, "{method}_{name}".format(method=method, name=parts[0].lstrip("_")), None)
+        if handler is None:
+            self.read_body()
+            self.send_json({"message": "not implemented: " + path}, status=404)
+            return
+        handler(parts[1:], query)
+
+    def do_GET(self) -> None:
+        self.route("get")
+
+    def do_POST(self) -> None:
+        self.route("post")
+
+    def do_HEAD(self) -> None:
+        self.route("get")
+
+    def get_ping(self, parts, query) -> None:
+        self.send(200, b"OK", content_type="text/plain")
+
+    def get_version(self, parts, query) -> None:
+        self.send_json({"ApiVersion": "1.41", "Version": "20.10.0", "MinAPIVersion": "1.12"})
+
+    def get_containers(self, parts, query) -> None:
+        docker = self.owner
+        with docker.lock:
+            containers = list(docker.containers.items())
+            container = docker.find_container(parts[0]) if parts != ["json"] else None
+        if parts == ["json"]:
+            self.send_json([{"Id": cid, "Names": [c["Name"]], "Image": c["Config"]["Image"],
+                             "State": c["State"]["Status"], "Labels": c["Config"].get("Labels", {})}
+                            for (cid, c) in containers])
+            return
+        if container is None:
+            self.send_json({"message": "No such container: " + parts[0]}, status=404)
+        elif parts[1] == "json":
+            self.send_json(container)
+        elif parts[1] == "archive":
+            # dockerd と同じく、 tar はチャンク形式で少しずつ送信する。
+            stat = base64.b64encode(json.dumps({"name": "worlds", "size": 4096, "mode": 2147484141}).encode())
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-tar")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("X-Docker-Container-Path-Stat", stat.decode())
+            self.end_headers()
+            world = memoryview(docker.world)
+            for offset in range(0, len(world), 32 * 1024):
+                chunk = world[offset:offset + 32 * 1024]
+                self.wfile.write("{n:x}\r\n".format(n=len(chunk)).encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_json({"message": "not implemented"}, status=404)
+
+    def post_containers(self, parts, query) -> None:
+        docker = self.owner
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if parts == ["create"]:
+            with docker.lock:
+                attrs = docker.add_container(query["name"], {"Image": body.get("Image"), "Labels": body.get("Labels") or {}})
+            self.send_json({"Id": attrs["Id"], "Warnings": []}, status=201)
+        else:
+            self.send(204)
+
+    def get_images(self, parts, query) -> None:
+        docker = self.owner
+        with docker.lock:
+            images = [(image_id, list(attrs["RepoTags"])) for (image_id, attrs) in docker.images.items()]
+            image = docker.find_image("/".join(parts[:-1])) if parts != ["json"] else None
+        if parts == ["json"]:
+            reference = json.loads(query.get("filters", "{}")).get("reference", {})
+            repos = list(reference) if isinstance(reference, dict) else reference
+            self.send_json([{"Id": image_id, "RepoTags": tags} for (image_id, tags) in images
+                            if not repos or any(t.split(":")[0] in repos for t in tags)])
+            return
+        if image is None:
+            self.send_json({"message": "No such image"}, status=404)
+        else:
+            self.send_json(image)
+
+    def post_images(self, parts, query) -> None:
+        docker = self.owner
+        self.read_body()
+        with docker.lock:
+            image = docker.find_image("/".join(parts[:-1]))
+            if image is not None:
+                docker.add_image(["{repo}:{tag}".format(repo=query["repo"], tag=query.get("tag", "latest"))], image["Id"])
+        if image is None:
+            self.send_json({"message": "No such image"}, status=404)
+        else:
+            self.send(201)
+
+    def post_build(self, parts, query) -> None:
+        docker = self.owner
+        n = self.read_body()
+        with docker.lock:
+            docker.build_context_bytes += n
+            image = docker.add_image([query["t"]] if "t" in query else [], "sha256:" + docker._id("build", str(n)))
+        lines = [{"stream": "Step 1/1 : FROM scratch\n"}, {"aux": {"ID": image["Id"]}},
+                 {"stream": "Successfully built {id}\n".format(id=image["Id"][7:19])}]
+        # dockerd と同じく、出力は一行ずつチャンク形式で送信する。
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for line in lines:
+            data = (json.dumps(line) + "\r\n").encode("utf-8")
+            self.wfile.write("{n:x}\r\n".format(n=len(data)).encode() + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def fleet_names(n: int) -> List[str]:
+    return ["bench{i:04d}".format(i=i) for i in range(n)]
+
+
+def fleet_versions(n: int) -> List[str]:
+    """ マイナーバージョン毎に 100 個のパッチを持つ、 `n` 個の BDS のバージョンを戻す関数。 """
+    return ["1.{minor}.{patch}.1".format(minor=16 + i // 100, patch=i % 100) for i in range(n)]
+
+
+def fleet_params(n: int) -> List[Dict[str, str]]:
+    return [{"name": name, "image": "bedrock:latest"} for name in fleet_names(n)]
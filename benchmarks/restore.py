@@ -0,0 +1,142 @@
+""" McbdscDockerContainer.restore のスループットとダウンタイムを計測するベンチマーク。
+
+Docker の代わりにローカルのディレクトリをボリュームとして扱うスタンドインを利用するので、
+Docker ホストなしで実行できます。 `put_archive` に渡された tar ストリームは、実際にディレクトリに展開されます。
+
+    python benchmarks/restore.py --size 1024 --changed 0.05
+"""
+
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymcbdsc import McbdscDockerContainer  # noqa: E402
+from pymcbdsc.backup import McbdscChunkReader  # noqa: E402
+from pymcbdsc.repository import McbdscBackupRepository  # noqa: E402
+
+
+class LocalVolumeContainer(object):
+    """ ローカルのディレクトリを /volume として扱う、 docker-py の Container のスタンドイン。 """
+
+    def __init__(self, volume_dir: str, stop_seconds: float = 0.0, start_seconds: float = 0.0) -> None:
+        self.volume_dir = volume_dir
+        self.stop_seconds = stop_seconds
+        self.start_seconds = start_seconds
+        self.status = "running"
+        self.id = "local"
+        self.attrs = {"Config": {"Image": "bedrock:latest"}}
+        self.client = self
+
+    @property
+    def containers(self):
+        return self
+
+    def _local(self, path: str) -> str:
+        return os.path.join(self.volume_dir, os.path.relpath(path, "/volume"))
+
+    def _exec(self, cmd) -> bytes:
+        if cmd[0] == "find":
+            base = self._local(cmd[1])
+            lines = []
+            for (dirpath, _dirnames, filenames) in os.walk(base):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    st = os.stat(path)
+                    rel = os.path.relpath(path, base).replace(os.sep, "/")
+                    lines.append("{p}\t{s}\t{m}\n".format(p=rel, s=st.st_size, m=st.st_mtime))
+            return "".join(lines).encode("utf-8")
+        if cmd[0] == "rm":
+            for path in cmd[3:]:
+                os.remove(self._local(path))
+            return b""
+        raise ValueError(cmd)
+
+    def exec_run(self, cmd):
+        return (0, self._exec(cmd))
+
+    def run(self, image, entrypoint, **kwargs) -> bytes:
+        return self._exec(entrypoint)
+
+    def put_archive(self, path, data) -> bool:
+        with tarfile.open(fileobj=io.BufferedReader(McbdscChunkReader(data)), mode="r|") as tar:
+            tar.extractall(self._local(path))
+        return True
+
+    def reload(self) -> None:
+        pass
+
+    def stop(self, **kwargs) -> None:
+        time.sleep(self.stop_seconds)
+        self.status = "exited"
+
+    def start(self, **kwargs) -> None:
+        time.sleep(self.start_seconds)
+        self.status = "running"
+
+
+def make_world(repo: McbdscBackupRepository, size_mb: int, file_mb: int):
+    """ `size_mb` MB のワールドのスナップショットを、リポジトリに作成する関数。 """
+    snapshot = repo.new_snapshot("bench")
+    n = max(size_mb // file_mb, 1)
+    for i in range(n):
+        data = os.urandom(file_mb * 1024 * 1024)
+        (sha256, size) = repo.store_object(io.BytesIO(data))
+        snapshot.add("Bedrock level/db/{i:06d}.ldb".format(i=i), sha256=sha256, size=size, mtime=1600000000)
+    repo.save_snapshot(snapshot)
+    return snapshot
+
+
+def touch_files(volume_dir: str, ratio: float) -> int:
+    """ ボリューム内のファイルのうち `ratio` の割合を変更する関数。 """
+    db = os.path.join(volume_dir, "worlds", "Bedrock level", "db")
+    files = sorted(os.listdir(db))
+    n = int(len(files) * ratio)
+    for filename in files[:n]:
+        with open(os.path.join(db, filename), "ab") as f:
+            f.write(b"x")
+    return n
+
+
+def report(label: str, result) -> None:
+    print("{label:<14} files={files:<5} size={mb:>8.1f}MB removed={removed:<4} "
+          "throughput={mbps:>8.1f}MB/s downtime={downtime:.2f}s"
+          .format(label=label, files=result.files, mb=result.size / 1024 / 1024, removed=result.removed,
+                  mbps=result.throughput / 1024 / 1024, downtime=result.downtime))
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark McbdscDockerContainer.restore with a local Docker stand-in.")
+    parser.add_argument("--size", type=int, default=512, help="World size in MB.")
+    parser.add_argument("--file-size", type=int, default=2, help="Size of each .ldb file in MB.")
+    parser.add_argument("--changed", type=float, default=0.05, help="Ratio of the files changed before the restore.")
+    parser.add_argument("--stop-seconds", type=float, default=0.0, help="Simulated seconds to stop the container.")
+    parser.add_argument("--start-seconds", type=float, default=0.0, help="Simulated seconds to start the container.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="mcbdsc-bench-")
+    try:
+        repo = McbdscBackupRepository(os.path.join(work_dir, "repository"))
+        snapshot = make_world(repo, args.size, args.file_size)
+        volume_dir = os.path.join(work_dir, "volume")
+        os.makedirs(os.path.join(volume_dir, "worlds"))
+        local = LocalVolumeContainer(volume_dir, stop_seconds=args.stop_seconds, start_seconds=args.start_seconds)
+        container = McbdscDockerContainer(name="bench", container=local)
+
+        report("full (empty)", container.restore(repo, snapshot, only_changed=False))
+        report("full", container.restore(repo, snapshot, only_changed=False))
+        touch_files(volume_dir, args.changed)
+        report("only changed", container.restore(repo, snapshot))
+        report("no changes", container.restore(repo, snapshot))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
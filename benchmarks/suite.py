@@ -0,0 +1,234 @@
+""" pymcbdsc の主要な処理の性能を、ネットワークや Docker ホストなしで計測するベンチマークスイート。
+
+ローカルの HTTP サーバが配信するダウンロードページと Zip ファイル、及び Docker Engine API のスタンドイン
+(benchmarks/fakes.py)を相手に、 requests と docker-py をそのまま利用して次の項目を計測します。
+
+* download: ダウンロードページの取得時間、 Zip ファイルのスループットと、ダウンロード中の最大 RSS の増加量.
+* build: Build コンテキストのバイト数と、コンテキストの作成・アップロード・ Build の時間.
+* fleet.<N>: N 個のコンテナ及びイメージに対する `factory_containers()` と `set_minor_tags()` の時間と API の呼び出し回数.
+* backup: 停止しているコンテナのワールドをバックアップするスループット.
+
+結果は JSON で保存でき、リリース間で比較して性能の劣化を検出できます。
+
+    python benchmarks/suite.py --output bench-0.2.0.json
+    python benchmarks/suite.py --compare bench-0.2.0.json --threshold 0.1
+"""
+
+from typing import Dict, Optional
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymcbdsc  # noqa: E402
+from pymcbdsc.trace import McbdscProfile, tracer  # noqa: E402
+from fakes import DownloadSite, FakeDocker, fleet_names, fleet_params, fleet_versions, make_world_tar  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+phases = ["download", "build", "fleet", "backup"]
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+class Results(object):
+    """ 計測結果を、名前と値・単位・良い方向("lower" 又は "higher")の dict として保持するクラス。
+
+    同じ名前の値を複数回追加した場合は、その中央値を結果とします。
+    """
+
+    def __init__(self) -> None:
+        self.samples = {}
+
+    def add(self, name: str, value: float, unit: str, better: str = "lower") -> None:
+        self.samples.setdefault(name, {"values": [], "unit": unit, "better": better})["values"].append(value)
+
+    @property
+    def metrics(self) -> Dict[str, dict]:
+        return {name: {"value": statistics.median(s["values"]), "min": min(s["values"]), "max": max(s["values"]),
+                       "unit": s["unit"], "better": s["better"]} for (name, s) in self.samples.items()}
+
+    def report(self) -> None:
+        print("{name:<44} {value:>12} {min:>12} {max:>12}".format(name="metric", value="median", min="min", max="max"))
+        for (name, m) in self.metrics.items():
+            print("{name:<44} {value:>12.3f} {min:>12.3f} {max:>12.3f} {unit}".format(name=name, **m))
+
+    def to_dict(self, args) -> dict:
+        return {"meta": {"pymcbdsc": pymcbdsc.__version__, "python": platform.python_version(),
+                         "platform": platform.platform(), "cpus": os.cpu_count(), "time": time.time(),
+                         "args": vars(args)},
+                "metrics": self.metrics}
+
+
+def peak_rss() -> Optional[int]:
+    """ このプロセスの最大 RSS のバイト数を戻す関数。計測できない OS では None を戻す。 """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux では KiB 、 macOS ではバイト単位。
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+@contextmanager
+def profiled():
+    """ `with` で囲んだ間に終了したスパンを集計する McbdscProfile を戻すコンテキストマネージャ。 """
+    profile = McbdscProfile()
+    tracer.add_listener(profile.record)
+    try:
+        yield profile
+    finally:
+        tracer.remove_listener(profile.record)
+
+
+def phase(profile: McbdscProfile, path: str) -> Dict[str, float]:
+    return profile.summary().get(path, {"seconds": 0.0})
+
+
+def bench_download(results: Results, root_dir: str, size_mb: int) -> None:
+    with DownloadSite(size_mb * MB) as site:
+        dl = pymcbdsc.McbdscDownloader(pymcbdsc_root_dir=root_dir, url=site.page_url, zip_url_pat=site.zip_url_pat,
+                                       agree_to_meula_and_pp=True)
+        os.makedirs(dl.download_dir(), exist_ok=True)
+        rss = peak_rss()
+        with profiled() as profile:
+            dl.download_latest_version_zip_file()
+        download = phase(profile, "download")
+        results.add("download.zip_url_seconds", phase(profile, "zip_url")["seconds"], "s")
+        results.add("download.seconds", download["seconds"], "s")
+        results.add("download.throughput", os.path.getsize(dl.latest_version_zip_filepath()) / MB / download["seconds"],
+                    "MB/s", better="higher")
+        # 最大 RSS は減らないので、初回のみ計測する。
+        if rss is not None and "download.peak_rss_growth" not in results.samples:
+            results.add("download.peak_rss_growth", (peak_rss() - rss) / MB, "MB")
+
+
+def bench_build(results: Results, root_dir: str) -> None:
+    for name in ("Dockerfile", "entrypoint.sh"):
+        shutil.copy(os.path.join(repo_dir, "docker", name), os.path.join(root_dir, name))
+    with FakeDocker() as fake:
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=root_dir, docker_client=fake.client(), state_db_file=None)
+        with profiled() as profile:
+            manager.build_image()
+        results.add("build.context_bytes", fake.build_context_bytes / MB, "MB")
+        results.add("build.context_seconds", phase(profile, "build_image/build_image.context")["seconds"], "s")
+        results.add("build.upload_seconds", phase(profile, "build_image/build_image.build").get("upload_seconds", 0.0), "s")
+        results.add("build.seconds", phase(profile, "build_image")["seconds"], "s")
+
+
+def bench_fleet(results: Results, root_dir: str, n: int, latency: float) -> None:
+    image_tags = ["bedrock:" + version for version in fleet_versions(n)]
+    with FakeDocker(containers=fleet_names(n), image_tags=image_tags, latency=latency) as fake:
+        client = fake.client()
+        fleet_dir = os.path.join(root_dir, "fleet-{n}".format(n=n))
+
+        def manager(state_db_file=None):
+            return pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=fleet_dir, docker_client=client,
+                                                containers_param=fleet_params(n), state_db_file=state_db_file)
+
+        name = "fleet.{n}.".format(n=n)
+        # データベースなし、データベースの同期、同期済みのデータベースの順に計測する。
+        for (label, state_db_file) in (("", None), ("_db_sync", "state.db"), ("_db", "state.db")):
+            with profiled() as profile:
+                manager(state_db_file).factory_containers()
+            containers = phase(profile, "factory_containers")
+            results.add(name + "factory_containers" + label + "_seconds", containers["seconds"], "s")
+            results.add(name + "factory_containers" + label + "_docker_calls", containers.get("docker_calls", 0), "calls")
+        with profiled() as profile:
+            manager().set_minor_tags()
+        tags = phase(profile, "set_minor_tags")
+        results.add(name + "set_minor_tags_seconds", tags["seconds"], "s")
+        results.add(name + "set_minor_tags_docker_calls", tags.get("docker_calls", 0), "calls")
+
+
+def bench_backup(results: Results, root_dir: str, size_mb: int, compression: str, level: int) -> None:
+    world = make_world_tar(size_mb * MB)
+    with FakeDocker(containers=fleet_names(1), world=world) as fake:
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=root_dir, docker_client=fake.client(),
+                                               containers_param=fleet_params(1), state_db_file=None)
+        with profiled() as profile:
+            paths = manager.backup(compression=compression, level=level)
+        backup = phase(profile, "backup")
+        results.add("backup.throughput", len(world) / MB / backup["seconds"], "MB/s", better="higher")
+        results.add("backup.ratio", os.path.getsize(paths[fleet_names(1)[0]]) / len(world), "x")
+
+
+def compare(metrics: Dict[str, dict], baseline: Dict[str, dict], threshold: float, min_delta: float) -> int:
+    """ 基準の結果と比較し、 `threshold` の割合を超えて悪化した項目の数を戻す関数。
+
+    秒数の項目は、差が `min_delta` 秒以下であれば誤差として扱います。
+    """
+    regressions = 0
+    print("\n{name:<44} {old:>12} {new:>12} {change:>8}".format(name="metric", old="baseline", new="current", change="change"))
+    for (name, metric) in sorted(metrics.items()):
+        if name not in baseline:
+            continue
+        (old, new) = (baseline[name]["value"], metric["value"])
+        change = (new - old) / old if old else 0.0
+        worse = change > threshold if metric["better"] == "lower" else change < -threshold
+        worse = worse and not (metric["unit"] == "s" and abs(new - old) <= min_delta)
+        regressions += 1 if worse else 0
+        print("{name:<44} {old:>12.3f} {new:>12.3f} {change:>+7.1%}{flag}".format(
+            name=name, old=old, new=new, change=change, flag=" REGRESSION" if worse else ""))
+    return regressions
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark pymcbdsc offline with a local HTTP server and a fake Docker API.")
+    parser.add_argument("--only", nargs="*", choices=phases, help="Phases to run. Defaults to all.")
+    parser.add_argument("--zip-size", type=int, default=128, help="Size of the BDS zip file in MB.")
+    parser.add_argument("--fleet", type=int, nargs="*", default=[1, 10, 100, 1000], help="Numbers of containers and images.")
+    parser.add_argument("--latency", type=float, default=0.001, help="Seconds the fake Docker API waits for each call.")
+    parser.add_argument("--world-size", type=int, default=128, help="Size of the world to back up in MB.")
+    parser.add_argument("--compression", default="gz", choices=["gz", "bz2", "xz", ""])
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=3, help="Run each phase this many times and take the median.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare the results with this JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Ratio of the change reported as a regression. Defaults to 0.1 (10%%).")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="Changes of the seconds up to this are not regressions. Defaults to 0.005.")
+    args = parser.parse_args()
+
+    only = args.only or phases
+    results = Results()
+    for _ in range(args.repeat):
+        root_dir = tempfile.mkdtemp(prefix="mcbdsc-bench-")
+        try:
+            # 最大 RSS の増加量を計測する為に、ダウンロードは最初に計測する。
+            if "download" in only or "build" in only:
+                bench_download(results, root_dir, args.zip_size)
+            if "build" in only:
+                bench_build(results, root_dir)
+            if "fleet" in only:
+                for n in args.fleet:
+                    bench_fleet(results, root_dir, n, args.latency)
+            if "backup" in only:
+                bench_backup(results, root_dir, args.world_size, args.compression, args.level)
+        finally:
+            shutil.rmtree(root_dir)
+    results.report()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results.to_dict(args), f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["metrics"]
+        if compare(results.metrics, baseline, args.threshold, args.min_delta):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
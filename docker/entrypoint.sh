@@ -12,6 +12,32 @@ __perm_dirs=("worlds")
 # これらのファイルは、 docker volume から読み込まれ、 docker volume に保存されます。
 __perm_files=("whitelist.json" "permissions.json")
 
+# Prepare the server files from the read-only version store if it is mounted.
+# バージョンストアがマウントされていれば、そこからサーバのファイルを準備する。
+# 起動するバージョンは /volume/bedrock_server_version 、無ければ BEDROCK_SERVER_VER で指定する。
+if [ -n "${BEDROCK_VERSIONS_DIR}" -a -d "${BEDROCK_VERSIONS_DIR}" ]; then
+  __version=$(cat /volume/bedrock_server_version 2>/dev/null || echo "${BEDROCK_SERVER_VER}")
+  __dist="${BEDROCK_VERSIONS_DIR}/${__version}"
+  if [ -z "${__version}" -o ! -d "${__dist}" ]; then
+    echo "The version \"${__version}\" is not found in ${BEDROCK_VERSIONS_DIR}." >&2
+    exit 1
+  fi
+  # Remove the files of the previous version.
+  # 前回起動したバージョンのファイルを削除する。
+  find . -mindepth 1 -maxdepth 1 ! -name entrypoint.sh -exec rm -rf {} +
+  for __entry in "${__dist}"/*
+  do
+    __name=$(basename "${__entry}")
+    case "${__name}" in
+      # Copy the files which the server may write, and link the others.
+      # サーバが書き込む可能性のある設定ファイルはコピーし、それ以外はリンクする。
+      *.json|*.properties|*.txt) cp "${__entry}" ./ ;;
+      *) ln -s "${__entry}" ./ ;;
+    esac
+  done
+  echo "${__version}" > ./bedrock_server_version
+fi
+
 cat <<__EOT__ > ./server.properties
 gamemode=${GAMEMODE:-"survival"}
 difficulty=${DIFFICULTY:-"easy"}
@@ -1,8 +1,32 @@
 # flake8: noqa
+import importlib
+import sys
 from .constants import version
-from .docker import McbdscDockerContainer, McbdscDockerManager
-from .downloader import McbdscDownloader
 from .utils import pymcbdsc_root_dir
 
 
 __version__ = version
+
+# 属性名と、その属性を定義しているモジュールの dict.
+# `import pymcbdsc` を速くする為に、これらのモジュール(と docker-py, requests)は属性に初めてアクセスした時点で import する。
+_lazy_attrs = {"McbdscDockerContainer": ".docker",
+               "McbdscDockerManager": ".docker",
+               "McbdscDownloader": ".downloader",
+               "McbdscServerStatus": ".raknet"}
+
+__all__ = ["version", "pymcbdsc_root_dir"] + list(_lazy_attrs)
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name: str):
+        if name not in _lazy_attrs:
+            raise AttributeError("module {module!r} has no attribute {name!r}".format(module=__name__, name=name))
+        value = getattr(importlib.import_module(_lazy_attrs[name], __name__), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(list(globals()) + list(_lazy_attrs))
+else:  # モジュールの __getattr__ (PEP 562) が無い Python3.5, 3.6 では、これまで通り import する。
+    from .docker import McbdscDockerContainer, McbdscDockerManager
+    from .downloader import McbdscDownloader
+    from .raknet import McbdscServerStatus
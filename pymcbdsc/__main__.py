@@ -7,13 +7,27 @@
 """
 
 import os
+import re
 import sys
 import shutil
+import time
 from logging import basicConfig, getLogger, DEBUG, INFO
-from argparse import ArgumentParser, Namespace
-from pymcbdsc import McbdscDownloader, McbdscDockerManager
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from typing import TYPE_CHECKING
+from typing import Any, Optional
+import pymcbdsc
+from pymcbdsc.control import McbdscControlClient, McbdscControlServer, McbdscControlService, control_socket_path
+from pymcbdsc.downloader import McbdscDownloader
+from pymcbdsc.exceptions import McbdscControlError, McbdscDaemonUnavailableError
+from pymcbdsc.metrics import write_textfile
+from pymcbdsc.progress import McbdscProgressPrinter
+from pymcbdsc.trace import McbdscProfile, tracer
 from pymcbdsc.utils import pymcbdsc_root_dir
 
+if TYPE_CHECKING:
+    from pymcbdsc.autoscaler import McbdscServerGroup
+    from pymcbdsc.pool import McbdscDockerClientPool
+
 
 # これはメインのファイルにのみ書く
 basicConfig(level=INFO)
@@ -41,6 +55,75 @@ def copy_if_not_exists(src_file: str, dest_file: str) -> None:
         shutil.copyfile(src_file, dest_file)
 
 
+def client_pool(args: Namespace) -> "McbdscDockerClientPool":
+    """ `--docker-host` が指定されていれば、それらのホストの McbdscDockerClientPool インスタンスを戻す関数。 """
+    if not args.docker_host:
+        return None
+    from pymcbdsc.pool import McbdscDockerClientPool
+    urls = dict(h.split("=", 1) if "=" in h else (h, h) for h in args.docker_host)
+    return McbdscDockerClientPool.from_urls(urls)
+
+
+def control_service(args: Namespace, downloader: McbdscDownloader) -> McbdscControlService:
+    """ 引数に従って McbdscDockerManager を作成する McbdscControlService インスタンスを戻す関数。 """
+    def manager_factory() -> "pymcbdsc.McbdscDockerManager":
+        containers_params = [{"name": "mbdsc_test", "image": "bedrock:latest"}]
+        return pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=args.root_dir, containers_param=containers_params,
+                                            client_pool=client_pool(args), progress=progress(args))
+    return McbdscControlService(manager_factory, downloader)
+
+
+def server_group(spec: str) -> "McbdscServerGroup":
+    """ "NAME=TEMPLATE[:MIN-MAX]" 形式の `--group` の値から、 McbdscServerGroup インスタンスを作成する関数。 """
+    from pymcbdsc.autoscaler import McbdscServerGroup
+    m = re.fullmatch(r"([^=]+)=([^:]+)(?::(\d+)-(\d+))?", spec)
+    if m is None:
+        raise ArgumentTypeError("The group must be NAME=TEMPLATE[:MIN-MAX]: {spec}".format(spec=spec))
+    if m.group(3) is None:
+        return McbdscServerGroup(m.group(1), template=m.group(2))
+    try:
+        return McbdscServerGroup(m.group(1), template=m.group(2), min_servers=int(m.group(3)), max_servers=int(m.group(4)))
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+
+
+def warm_pool_spec(spec: str) -> dict:
+    """ "IMAGE[=SIZE[:LOW]]" 形式の `--warm-pool` の値を、 `image`, `size` 及び `low_water` の dict にする関数。 """
+    m = re.fullmatch(r"([^=]+)(?:=(\d+)(?::(\d+))?)?", spec)
+    if m is None:
+        raise ArgumentTypeError("The warm pool must be IMAGE[=SIZE[:LOW]]: {spec}".format(spec=spec))
+    size = int(m.group(2)) if m.group(2) is not None else 2
+    low_water = int(m.group(3)) if m.group(3) is not None else max(size // 2, 1)
+    if size < 1 or low_water > size:
+        raise ArgumentTypeError("LOW must not be greater than SIZE: {spec}".format(spec=spec))
+    return {"image": m.group(1), "size": size, "low_water": low_water}
+
+
+def progress(args: Namespace) -> Optional[McbdscProgressPrinter]:
+    """ ダウンロードや Build の進み具合を標準エラー出力に表示するコールバックを戻す関数。 """
+    return None if args.no_progress else McbdscProgressPrinter()
+
+
+def call(args: Namespace, downloader: McbdscDownloader, method: str,
+         service: Optional[McbdscControlService] = None, **params) -> Any:
+    """ デーモンが起動していればデーモンで、起動していなければこのプロセスで `method` を実行する関数。
+
+    デーモンで実行する場合は、 `--docker-host` 等の指定ではなく、デーモンの起動時の指定が使われる。
+    `--profile` が指定された場合は、処理時間を計測する為に常にこのプロセスで実行する。
+    このプロセスで実行する場合は `service` を、それが None であれば新たに作成した McbdscControlService を利用する。
+
+    `install`, `uninstall` (ファイルの配置のみ)と `daemon` (デーモン自身)を除く全てのサブコマンドは、この関数を経由する。
+    """
+    if not args.no_daemon and not args.profile:
+        try:
+            return McbdscControlClient(control_socket_path(args.root_dir)).call(method, **params)
+        except McbdscDaemonUnavailableError:
+            logger.debug("The daemon is not running. Run {method} in this process.".format(method=method))
+    if service is None:
+        service = control_service(args, downloader)
+    return service.call(method, params)
+
+
 def install(args: Namespace, downloader: McbdscDownloader) -> None:
     root_dir = args.root_dir
     dl_dir = downloader.download_dir()
@@ -50,6 +133,8 @@ def install(args: Namespace, downloader: McbdscDownloader) -> None:
     data_files_dir = os.path.join(sys.prefix, "share", "mcbdsc")
     df_docker_dir = os.path.join(data_files_dir, "docker")
     copy_if_not_exists(src_file=os.path.join(df_docker_dir, "Dockerfile"), dest_file=os.path.join(root_dir, "Dockerfile"))
+    copy_if_not_exists(src_file=os.path.join(df_docker_dir, "Dockerfile.runtime"),
+                       dest_file=os.path.join(root_dir, "Dockerfile.runtime"))
     copy_if_not_exists(src_file=os.path.join(df_docker_dir, "entrypoint.sh"),
                        dest_file=os.path.join(root_dir, "entrypoint.sh"))
 
@@ -59,36 +144,164 @@ def uninstall(args: Namespace, downloader: McbdscDownloader) -> None:
 
 
 def download(args: Namespace, downloader: McbdscDownloader) -> None:
-    downloader.download_latest_version_zip_file_if_needed()
+    result = call(args, downloader, "download", agree_to_meula_and_pp=args.i_agree_to_meula_and_pp, extract=args.extract)
+    counts = result["extracted"]
+    if counts is not None:
+        logger.info("Extracted {files} files into the version store ({linked} files are shared with other versions)."
+                    .format(**counts))
 
 
 def build(args: Namespace, downloader: McbdscDownloader) -> None:
-    root_dir = args.root_dir
-    manager = McbdscDockerManager(pymcbdsc_root_dir=root_dir)
-    b_version = args.bedrock_version if args.bedrock_version else manager.get_bds_latest_version_from_local_file()
-    available_versions = manager.get_bds_versions_from_local_file()
-    if b_version in available_versions:
-        manager.build_image(version=b_version)
-        manager.set_latest_tag_to_latest_image()
-        manager.set_minor_tags()
-    else:
-        logger.error('The version specified is "{version}", but the available versions are as follows: {available_versions}'
-                     .format(version=b_version, available_versions=", ".join(available_versions)))
+    try:
+        call(args, downloader, "build", version=args.bedrock_version, runtime=args.runtime)
+    except McbdscControlError as e:
+        logger.error(str(e))
 
 
 def create(args: Namespace, downloader: McbdscDownloader) -> None:
-    root_dir = args.root_dir
-    containers_params = [{"name": "mbdsc_test", "image": "bedrock:latest"}]
-    manager = McbdscDockerManager(pymcbdsc_root_dir=root_dir, containers_param=containers_params)
-    manager.factory_containers()
+    allocations = call(args, downloader, "create", allocate=args.allocate, cpus=args.cpus)
+    for (name, allocation) in allocations.items():
+        logger.info("{name}: port {port}/{portv6}, cpuset {cpuset}, mems {mems}".format(name=name, **allocation))
 
 
 def start(args: Namespace, downloader: McbdscDownloader) -> None:
-    root_dir = args.root_dir
-    containers_params = [{"name": "mbdsc_test", "image": "bedrock:latest"}]
-    manager = McbdscDockerManager(pymcbdsc_root_dir=root_dir, containers_param=containers_params)
-    manager.factory_containers()[0].start()
-    manager.backup()
+    call(args, downloader, "start")
+
+
+def status(args: Namespace, downloader: McbdscDownloader) -> None:
+    statuses = call(args, downloader, "status", timeout=args.timeout)
+    for (name, st) in statuses.items():
+        if st["online"]:
+            print("{name}\tonline\t{players}/{max_players}\t{version}\t{latency:.1f}ms\t{motd}"
+                  .format(name=name, players=st["players"], max_players=st["max_players"], version=st["version"],
+                          latency=st["latency"] * 1000, motd=st["motd"]))
+        else:
+            print("{name}\toffline\t{error}".format(name=name, error=st["error"]))
+
+
+def health(args: Namespace, downloader: McbdscDownloader) -> None:
+    for (name, h) in sorted(call(args, downloader, "health", timeout=args.timeout).items()):
+        availability = "-" if h["availability"] is None else "{a:.2%}".format(a=h["availability"])
+        latency = "-" if h["latency"] is None else "{ms:.1f}ms".format(ms=h["latency"] * 1000)
+        print("{name}\t{state}\t{availability}\t{restarts} restarts\t{failures}/{checks} failed\t{latency}\t{error}"
+              .format(availability=availability, latency=latency, error=h["last_error"] or "", **h))
+
+
+def groups(args: Namespace, downloader: McbdscDownloader) -> None:
+    for (name, g) in sorted(call(args, downloader, "autoscale").items()):
+        occupancy = "-" if g["occupancy"] is None else "{o:.0%}".format(o=g["occupancy"])
+        print("{name}\t{n}/{max_servers} servers\t{players}/{capacity} players\t{occupancy}\t{servers}\t{draining}"
+              .format(name=name, n=len(g["servers"]), occupancy=occupancy, servers=",".join(g["servers"]),
+                      draining="draining: " + ",".join(g["draining"]) if g["draining"] else "", **g))
+
+
+def warm_pools(args: Namespace, downloader: McbdscDownloader) -> None:
+    for (image, p) in sorted(call(args, downloader, "warm_pools").items()):
+        print("{image}\t{n}/{size} available\t{warming} warming\tlow water {low_water}\t{available}"
+              .format(image=image, n=len(p["available"]), available=",".join(p["available"]),
+                      size=p["size"], warming=p["warming"], low_water=p["low_water"]))
+
+
+def metrics(args: Namespace, downloader: McbdscDownloader) -> None:
+    # デーモンが起動していなければ、このプロセスで収集を続ける為に同じ McbdscControlService を使い続ける。
+    # デーモンで実行する場合は、収集と HTTP エンドポイントはデーモンが保持し、このプロセスはファイルの出力のみを行う。
+    service = control_service(args, downloader)
+    call(args, downloader, "metrics", service=service, port=args.port)
+    try:
+        while True:
+            time.sleep(args.interval)
+            if args.textfile is not None:
+                write_textfile(args.textfile, call(args, downloader, "metrics", service=service))
+    except KeyboardInterrupt:
+        service.close()
+
+
+def backup(args: Namespace, downloader: McbdscDownloader) -> None:
+    results = call(args, downloader, "backup", archive=args.archive, compression=args.compression, level=args.level,
+                   workers=args.workers)
+    for (name, result) in results.items():
+        if args.archive:
+            print("{name}\t{path}".format(name=name, path=result))
+        else:
+            print("{name}\t{snapshot_id}\t{files} files\t{size} bytes".format(name=name, **result))
+
+
+def switch_version(args: Namespace, downloader: McbdscDownloader) -> None:
+    call(args, downloader, "switch_version", name=args.name, version=args.bedrock_version, restart=not args.no_restart)
+
+
+def list_backups(args: Namespace, downloader: McbdscDownloader) -> None:
+    for snapshot in call(args, downloader, "list_backups", name=args.name):
+        print("{server}\t{snapshot_id}\t{time}\t{files} files\t{size} bytes"
+              .format(time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot["timestamp"])), **snapshot))
+
+
+def restore(args: Namespace, downloader: McbdscDownloader) -> None:
+    result = call(args, downloader, "restore", name=args.name, snapshot_id=args.snapshot, only_changed=not args.full)
+    print("Restored {files} files ({size} bytes), removed {removed} files, {mbps:.1f} MB/s, downtime {downtime:.1f}s."
+          .format(mbps=result["throughput"] / 1000 / 1000, **result))
+
+
+def gc(args: Namespace, downloader: McbdscDownloader) -> None:
+    result = call(args, downloader, "gc", keep=args.keep, grace=args.grace)
+    for snapshot in result["pruned"]:
+        logger.info("Remove the snapshot: {server}/{snapshot_id}".format(**snapshot))
+    print("Removed {count} objects ({size} bytes).".format(**result))
+
+
+def daemon(args: Namespace, downloader: McbdscDownloader) -> None:
+    # デーモンは一つの McbdscControlService (と McbdscDockerManager)を、制御ソケットとバックアップスケジューラで共有する。
+    service = control_service(args, downloader)
+    manager = service.manager
+    if not manager.start_state_cache().is_ready():
+        logger.warning("The state cache is not synchronized yet. The Docker API is used until it is.")
+    server = McbdscControlServer(service, control_socket_path(args.root_dir))
+    server.start()
+    bytes_per_second = args.bandwidth * 1000 * 1000 if args.bandwidth else None
+    scheduler = manager.backup_scheduler(interval=args.interval, window=args.window,
+                                         max_concurrent=args.max_concurrent, bytes_per_second=bytes_per_second)
+    monitor = manager.log_monitor()
+    monitor.add_listener(scheduler.record_event)
+    monitor.start()
+    if args.health_interval > 0:
+        service.health_monitor = manager.health_monitor(interval=args.health_interval, restart=not args.no_auto_restart)
+        service.health_monitor.start()
+        logger.info("Start the health monitor: every {interval} seconds.".format(interval=args.health_interval))
+    pools = [manager.warm_pool(**spec) for spec in args.warm_pool or []]
+    for pool in pools:
+        pool.start()
+        logger.info("Start the warm pool of {image}.".format(image=pool.image))
+    if args.group:
+        service.autoscaler = manager.autoscaler(args.group, interval=args.scale_interval)
+        monitor.add_listener(service.autoscaler.record_event)
+        service.autoscaler.start()
+        logger.info("Start the autoscaler of {groups}.".format(groups=", ".join(g.name for g in args.group)))
+    logger.info("Start the backup scheduler: every {interval} seconds.".format(interval=args.interval))
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        monitor.stop()
+    finally:
+        if service.autoscaler is not None:
+            service.autoscaler.stop()
+        for pool in pools:
+            pool.stop()
+        if service.health_monitor is not None:
+            service.health_monitor.stop()
+        server.stop()
+        service.close()
+        manager.stop_state_cache()
+
+
+def verify(args: Namespace, downloader: McbdscDownloader) -> None:
+    results = call(args, downloader, "verify", workers=args.workers, use_cache=not args.no_cache)
+    failures = [r for r in results if not r["ok"]]
+    for r in failures:
+        print("{kind}\t{path}\t{error}".format(**r))
+    print("Verified {n} files ({cached} unchanged), {failed} corrupted."
+          .format(n=len(results), cached=sum(1 for r in results if r["cached"]), failed=len(failures)))
+    if failures:
+        sys.exit(1)
 
 
 def parse_args() -> Namespace:
@@ -99,7 +312,12 @@ def parse_args() -> Namespace:
     """
     parser = ArgumentParser(description=("This project provides very easier setup and management "
                                          "for Minecraft Bedrock Dedicated Server."))
-    parser.add_argument('-d', '--debug', action='store_true', help="Show verbose messages.")
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help="Show verbose messages, including the timing of each phase as JSON.")
+    parser.add_argument('--profile', action='store_true',
+                        help="Print the time, bytes and API calls of each phase at the end. Implies --no-daemon.")
+    parser.add_argument('--no-progress', action='store_true',
+                        help="Do not show the progress of downloads and image builds.")
     subparsers = parser.add_subparsers(dest="subcommand")
     subparsers.required = True
 
@@ -110,6 +328,12 @@ def parse_args() -> Namespace:
     common_parser.add_argument('--i-agree-to-meula-and-pp', action='store_true',
                                help=("You have to agree to the MEULA and Privacy Policy at download the Bedrock Server. "
                                      "If you specify this argument, you agree to them."))
+    common_parser.add_argument('-H', '--docker-host', action='append', metavar="NAME=URL",
+                               help=("Manage the servers on this Docker host (e.g. host1=tcp://10.0.0.1:2375). "
+                                     "Can be specified multiple times. Defaults to the local Docker host."))
+    common_parser.add_argument('--no-daemon', action='store_true',
+                               help=("Run in this process even if `mcbdsc daemon` is running. "
+                                     "When the daemon is running, the subcommands use its settings such as --docker-host."))
 
     # サブコマンドと、それぞれ特有の引数を定義。
     subcmd_install = subparsers.add_parser("install", parents=[common_parser], help="TODO")
@@ -118,21 +342,126 @@ def parse_args() -> Namespace:
     subcmd_download = subparsers.add_parser("download", parents=[common_parser],
                                             help=("Download and storage latest version "
                                                   "of the Minecraft Bedrock Dedicated Server."))
+    subcmd_download.add_argument('-x', '--extract', action='store_true',
+                                 help="Also extract the downloaded version into the shared version store.")
     subcmd_download.set_defaults(func=download)
 
     subcmd_build = subparsers.add_parser("build", parents=[common_parser],
                                          help="Build the Docker Image of the Minecraft Bedrock Dedicated Server.")
     subcmd_build.add_argument('-V', '--bedrock-version')
+    subcmd_build.add_argument('--runtime', action='store_true',
+                              help="Build the generic image which runs a version of the version store.")
     subcmd_build.set_defaults(func=build)
 
     subcmd_create = subparsers.add_parser("create", parents=[common_parser],
                                           help="TODO")
+    subcmd_create.add_argument('-a', '--allocate', action='store_true',
+                               help="Allocate the UDP ports and the CPUs to the servers automatically.")
+    subcmd_create.add_argument('--cpus', type=int, default=2,
+                               help="Number of CPUs allocated to each server with --allocate. 0 disables the cpuset.")
     subcmd_create.set_defaults(func=create)
 
     subcmd_start = subparsers.add_parser("start", parents=[common_parser],
                                          help="TODO")
     subcmd_start.set_defaults(func=start)
 
+    subcmd_status = subparsers.add_parser("status", parents=[common_parser],
+                                          help="Show the status of the servers by RakNet ping.")
+    subcmd_status.add_argument('-t', '--timeout', type=float, default=1.0,
+                               help="Seconds to wait for the response of each server.")
+    subcmd_status.set_defaults(func=status)
+
+    subcmd_health = subparsers.add_parser("health", parents=[common_parser],
+                                          help=("Show the health, availability and restarts of the servers "
+                                                "monitored by the daemon."))
+    subcmd_health.add_argument('-t', '--timeout', type=float, default=1.0,
+                               help="Seconds to wait for the response of each server when the daemon is not running.")
+    subcmd_health.set_defaults(func=health)
+
+    subcmd_groups = subparsers.add_parser("groups", parents=[common_parser],
+                                          help="Show the servers, players and occupancy of the groups scaled by the daemon.")
+    subcmd_groups.set_defaults(func=groups)
+
+    subcmd_warm_pools = subparsers.add_parser("warm-pools", parents=[common_parser],
+                                              help="Show the warm pools of pre-started containers kept by the daemon.")
+    subcmd_warm_pools.set_defaults(func=warm_pools)
+
+    subcmd_metrics = subparsers.add_parser("metrics", parents=[common_parser],
+                                           help="Collect the resource usage of the containers as Prometheus metrics.")
+    subcmd_metrics.add_argument('-o', '--textfile', help="Write the metrics to this file periodically.")
+    subcmd_metrics.add_argument('-p', '--port', type=int, help="Serve the metrics over HTTP on this port.")
+    subcmd_metrics.add_argument('-i', '--interval', type=float, default=15.0,
+                                help="Seconds between each write of the textfile.")
+    subcmd_metrics.set_defaults(func=metrics)
+
+    subcmd_backup = subparsers.add_parser("backup", parents=[common_parser],
+                                          help="Backup the worlds into the deduplicated backup repository.")
+    subcmd_backup.add_argument('-a', '--archive', action='store_true',
+                               help="Write a full tar archive instead of an incremental snapshot.")
+    subcmd_backup.add_argument('-c', '--compression', default="gz", choices=["gz", "bz2", "xz", ""],
+                               help="Compression of the archive. Only used with --archive.")
+    subcmd_backup.add_argument('-l', '--level', type=int, default=6, help="Compression level. Only used with --archive.")
+    subcmd_backup.add_argument('-w', '--workers', type=int,
+                               help="Number of processes to compress the archive. Defaults to the number of CPUs.")
+    subcmd_backup.set_defaults(func=backup)
+
+    subcmd_switch_version = subparsers.add_parser("switch-version", parents=[common_parser],
+                                                  help="Switch the server to another version of the version store.")
+    subcmd_switch_version.add_argument('name', help="Name of the server.")
+    subcmd_switch_version.add_argument('bedrock_version', help="Version of the Minecraft Bedrock Dedicated Server.")
+    subcmd_switch_version.add_argument('--no-restart', action='store_true', help="Do not restart the running server.")
+    subcmd_switch_version.set_defaults(func=switch_version)
+
+    subcmd_list_backups = subparsers.add_parser("list-backups", parents=[common_parser],
+                                                help="List the snapshots in the backup repository.")
+    subcmd_list_backups.add_argument('-n', '--name', help="Only list the snapshots of this server.")
+    subcmd_list_backups.set_defaults(func=list_backups)
+
+    subcmd_restore = subparsers.add_parser("restore", parents=[common_parser],
+                                           help="Restore a snapshot of the backup repository into the server.")
+    subcmd_restore.add_argument('name', help="Name of the server.")
+    subcmd_restore.add_argument('-s', '--snapshot', help="ID of the snapshot. The latest one is used by default.")
+    subcmd_restore.add_argument('-f', '--full', action='store_true',
+                                help="Write all the files even if they are not changed.")
+    subcmd_restore.set_defaults(func=restore)
+
+    subcmd_daemon = subparsers.add_parser("daemon", parents=[common_parser],
+                                          help=("Run the backup scheduler of all the servers, and serve the other "
+                                                "subcommands on the control socket."))
+    subcmd_daemon.add_argument('-i', '--interval', type=float, default=3600.0, help="Seconds between each backup cycle.")
+    subcmd_daemon.add_argument('-W', '--window', type=float,
+                               help="Seconds over which the backups of a cycle are spread. Defaults to half the interval.")
+    subcmd_daemon.add_argument('-c', '--max-concurrent', type=int, default=1, help="Maximum number of concurrent backups.")
+    subcmd_daemon.add_argument('-b', '--bandwidth', type=float, help="Maximum MB/s written by all the backups.")
+    subcmd_daemon.add_argument('--health-interval', type=float, default=2.0,
+                               help="Seconds between each health check of the servers. 0 disables the health monitor.")
+    subcmd_daemon.add_argument('--no-auto-restart', action='store_true',
+                               help="Only monitor the health, and do not restart the hung or crashed servers.")
+    subcmd_daemon.add_argument('-g', '--group', action='append', type=server_group, metavar="NAME=TEMPLATE[:MIN-MAX]",
+                               help=("Scale the servers NAME-01, NAME-02, ... created from TEMPLATE between MIN and MAX "
+                                     "(defaults to 1-4) according to the players. Can be specified multiple times."))
+    subcmd_daemon.add_argument('--scale-interval', type=float, default=30.0,
+                               help="Seconds between each check of the players of the server groups.")
+    subcmd_daemon.add_argument('-w', '--warm-pool', action='append', type=warm_pool_spec, metavar="IMAGE[=SIZE[:LOW]]",
+                               help=("Keep SIZE (defaults to 2) stopped containers of IMAGE which have started once, "
+                                     "and refill them when fewer than LOW are left. New servers of the groups are "
+                                     "created from them. Can be specified multiple times."))
+    subcmd_daemon.set_defaults(func=daemon)
+
+    subcmd_verify = subparsers.add_parser("verify", parents=[common_parser],
+                                          help="Verify the BDS zip files and the objects of the backup repository.")
+    subcmd_verify.add_argument('-w', '--workers', type=int, help="Number of processes. Defaults to the number of CPUs.")
+    subcmd_verify.add_argument('--no-cache', action='store_true', help="Verify all the files even if they are unchanged.")
+    subcmd_verify.set_defaults(func=verify)
+
+    subcmd_gc = subparsers.add_parser("gc", parents=[common_parser],
+                                      help="Remove the objects which are not referenced by any snapshot.")
+    subcmd_gc.add_argument('-k', '--keep', type=int,
+                           help="Before the gc, remove the old snapshots of each server but the newest KEEP ones.")
+    subcmd_gc.add_argument('-g', '--grace', type=float, default=3600.0,
+                           help="Seconds for which the newly stored objects are kept.")
+    subcmd_gc.set_defaults(func=gc)
+
     # 以下、ヘルプコマンドの定義。
 
     # "help" 以外の subcommand のリストを保持する。
@@ -160,11 +489,23 @@ def main():
     if args.debug:
         logger.info("Set log level to DEBUG.")
         logger.setLevel(DEBUG)
-    if args.subcommand in ["install", "download", "build", "create", "start"]:
-        dl = McbdscDownloader(pymcbdsc_root_dir=args.root_dir, agree_to_meula_and_pp=args.i_agree_to_meula_and_pp)
-        args.func(args, dl)
-    else:
-        args.func(args)
+        getLogger("pymcbdsc.trace").setLevel(DEBUG)
+    profile = McbdscProfile() if args.profile else None
+    if profile is not None:
+        tracer.add_listener(profile.record)
+    try:
+        if args.subcommand in ["install", "download", "build", "create", "start", "status", "health", "groups",
+                               "warm-pools", "metrics", "backup", "list-backups", "restore", "switch-version", "daemon",
+                               "verify", "gc"]:
+            dl = McbdscDownloader(pymcbdsc_root_dir=args.root_dir, agree_to_meula_and_pp=args.i_agree_to_meula_and_pp,
+                                  progress=progress(args))
+            args.func(args, dl)
+        else:
+            args.func(args)
+    finally:
+        if profile is not None:
+            tracer.remove_listener(profile.record)
+            print(profile.render(), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,359 @@
+""" 一つのホストで多数のサーバを動かす為に、 UDP ポートと CPU を自動で割り当てるモジュール。
+
+各サーバには、重複しない UDP ポートの組(IPv4 と IPv6)と、 CPU のスロット(cpuset と NUMA ノード)を割り当てます。
+CPU は NUMA ノード毎に `cpus_per_server` 個ずつのスロットに分割し、スロットの番号は NUMA ノードを交互に巡るように
+振るので、番号の小さい空きスロットから割り当てることで、サーバが各 NUMA ノードに均等に配置されます。
+ポート及びスロットの空きは、番号のヒープ(インデックス付きのフリーリスト)で管理します。
+
+割り当ては JSON ファイルに保存するので、何度 `reconcile()` しても既存のサーバの割り当ては変わりません。
+割り当ての変更は、ファイルのロックを取得してファイルを読み込み直してから行うので、同じファイルを共有する
+他のインスタンスや他のプロセスと、同じポートやスロットを割り当てることはありません。
+
+This module allocates the UDP ports and the CPUs to the servers on a dense host.
+"""
+
+from typing import Callable, Dict, List, Optional
+import contextlib
+import heapq
+import json
+import os
+import tempfile
+import threading
+from logging import getLogger
+from .constants import bds_default_port
+from .locks import McbdscLockManager
+
+
+logger = getLogger(__name__)
+
+_node_dir = "/sys/devices/system/node"
+
+
+def parse_cpulist(cpulist: str) -> List[int]:
+    """ "0-3,8,10-11" 形式の CPU のリストを、 CPU 番号のリストに変換する関数。
+
+    Examples:
+
+        >>> from pymcbdsc.allocator import parse_cpulist
+        >>>
+        >>> parse_cpulist("0-3,8,10-11")
+        [0, 1, 2, 3, 8, 10, 11]
+    """
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            (first, last) = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus: List[int]) -> str:
+    """ CPU 番号のリストを、 Docker の cpuset_cpus に指定できる "0-3,8" 形式に変換する関数。
+
+    Examples:
+
+        >>> from pymcbdsc.allocator import format_cpulist
+        >>>
+        >>> format_cpulist([0, 1, 2, 3, 8, 10, 11])
+        '0-3,8,10-11'
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else "{a}-{b}".format(a=a, b=b) for (a, b) in ranges)
+
+
+def numa_topology(node_dir: str = _node_dir) -> Dict[int, List[int]]:
+    """ NUMA ノードの番号と、そのノードの CPU 番号のリストの dict を戻す関数。
+
+    NUMA の情報が得られない場合は、このプロセスが利用できる全ての CPU をノード 0 とします。
+    """
+    nodes = {}
+    if os.path.isdir(node_dir):
+        for name in os.listdir(node_dir):
+            if not (name.startswith("node") and name[4:].isdigit()):
+                continue
+            try:
+                with open(os.path.join(node_dir, name, "cpulist")) as f:
+                    cpus = parse_cpulist(f.read())
+            except OSError:
+                continue
+            if cpus:
+                nodes[int(name[4:])] = cpus
+    if not nodes:
+        if hasattr(os, "sched_getaffinity"):
+            nodes[0] = sorted(os.sched_getaffinity(0))
+        else:
+            nodes[0] = list(range(os.cpu_count() or 1))
+    return nodes
+
+
+class McbdscResourceAllocator(object):
+    """ サーバに UDP ポートの組と CPU のスロットを割り当て、その結果を保存するクラス。
+
+    割り当ての結果は、次の key を持つ dict です。
+
+    * "port", "portv6": IPv4 及び IPv6 の UDP ポート.
+    * "cpuset": Docker の cpuset_cpus に指定する CPU のリスト. CPU を割り当てない場合は None.
+    * "mems": Docker の cpuset_mems に指定する NUMA ノード. CPU を割り当てない場合は None.
+    * "threads": `MAX_THREADS` に指定するスレッド数. cpuset の CPU の数.
+
+    全てのスロットが割り当て済みの場合は、割り当てられているサーバが最も少ないスロットを共有します。
+
+    Examples:
+
+        >>> from pymcbdsc.allocator import McbdscResourceAllocator
+        >>>
+        >>> allocator = McbdscResourceAllocator(topology={0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}, cpus_per_server=2)
+        >>> sorted(allocator.allocate("a").items())
+        [('cpuset', '0-1'), ('mems', '0'), ('port', 19132), ('portv6', 19133), ('threads', 2)]
+        >>> sorted(allocator.allocate("b").items())
+        [('cpuset', '4-5'), ('mems', '1'), ('port', 19134), ('portv6', 19135), ('threads', 2)]
+    """
+
+    def __init__(self,
+                 state_path: Optional[str] = None,
+                 port_base: int = bds_default_port,
+                 port_limit: int = 65535,
+                 cpus_per_server: Optional[int] = 2,
+                 topology: Optional[Dict[int, List[int]]] = None,
+                 locks: Optional[McbdscLockManager] = None) -> None:
+        """ McbdscResourceAllocator インスタンスの初期化メソッド。
+
+        Args:
+            state_path (str, optional): 割り当てを保存するファイルのパス. None の場合は保存しない. Defaults to None.
+            port_base (int, optional): 割り当てる最初のポート. Defaults to bds_default_port.
+            port_limit (int, optional): 割り当てる最後のポート. Defaults to 65535.
+            cpus_per_server (int, optional): 一つのサーバに割り当てる CPU の数. None の場合は CPU を割り当てない.
+                                             Defaults to 2.
+            topology (Dict[int, List[int]], optional): NUMA ノードと CPU 番号のリストの dict.
+                                                       None の場合は `numa_topology()` の戻り値. Defaults to None.
+            locks (McbdscLockManager, optional): 他のプロセスと共有する、割り当てのファイルのロックを取得する
+                                                 McbdscLockManager インスタンス. None の場合は、このインスタンスの中でのみ
+                                                 排他制御する. Defaults to None.
+        """
+        self._state_path = state_path
+        self._locks = locks
+        self._port_base = port_base
+        self._max_pairs = (port_limit - port_base + 1) // 2
+        self._slots = self._make_slots(topology if topology is not None else numa_topology(), cpus_per_server)
+        self._lock = threading.RLock()
+        self._servers = self._load()
+        self._rebuild_free_lists()
+
+    @classmethod
+    def _make_slots(cls, topology: Dict[int, List[int]], cpus_per_server: Optional[int]) -> List[dict]:
+        if not cpus_per_server:
+            return []
+        per_node = []
+        for node in sorted(topology):
+            cpus = sorted(topology[node])
+            chunks = [cpus[i:i + cpus_per_server] for i in range(0, len(cpus), cpus_per_server)]
+            # 端数の CPU だけのスロットは作らない(ノードの CPU が足りない場合はノード全体を一つのスロットとする)。
+            if len(chunks) > 1 and len(chunks[-1]) < cpus_per_server:
+                chunks.pop()
+            per_node.append([{"cpuset": format_cpulist(c), "mems": str(node), "threads": len(c)} for c in chunks])
+        # NUMA ノードを交互に巡るように番号を振る。
+        slots = []
+        for i in range(max(len(s) for s in per_node)):
+            slots.extend(s[i] for s in per_node if i < len(s))
+        return slots
+
+    def _load(self) -> Dict[str, dict]:
+        if self._state_path is None or not os.path.exists(self._state_path):
+            return {}
+        with open(self._state_path) as f:
+            return json.load(f).get("servers", {})
+
+    def _save(self) -> None:
+        if self._state_path is None:
+            return
+        # 書き込み途中のファイルを他のプロセスが読まないよう、同じディレクトリの一時ファイルに書いてから置き換える。
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self._state_path)),
+                                     prefix=os.path.basename(self._state_path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"servers": self._servers}, f, indent=2, sort_keys=True)
+            os.replace(tmp, self._state_path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def _reload(self) -> None:
+        if self._state_path is not None:
+            self._servers = self._load()
+            self._rebuild_free_lists()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """ 割り当てのファイルのロックを取得し、保存されている割り当てを読み込み直すコンテキストマネージャ。
+
+        割り当てを変更する処理は、この中で変更して `_save()` をコールします。
+        """
+        with self._lock, contextlib.ExitStack() as stack:
+            if self._locks is not None and self._state_path is not None:
+                stack.enter_context(self._locks.lock("allocations", os.path.basename(self._state_path)))
+            self._reload()
+            yield
+
+    def _rebuild_free_lists(self) -> None:
+        used_pairs = {s["pair"] for s in self._servers.values()}
+        self._next_pair = max(used_pairs) + 1 if used_pairs else 0
+        self._free_pairs = [i for i in range(self._next_pair) if i not in used_pairs]
+        heapq.heapify(self._free_pairs)
+        self._slot_users = [0] * len(self._slots)
+        for s in self._servers.values():
+            slot = s.get("slot")
+            if slot is not None and slot < len(self._slots):
+                self._slot_users[slot] += 1
+        self._free_slots = [i for (i, n) in enumerate(self._slot_users) if n == 0]
+        heapq.heapify(self._free_slots)
+
+    def _pop_pair(self) -> int:
+        if self._free_pairs:
+            return heapq.heappop(self._free_pairs)
+        if self._next_pair >= self._max_pairs:
+            raise RuntimeError("No free UDP port is left.")
+        self._next_pair += 1
+        return self._next_pair - 1
+
+    def _pop_slot(self) -> Optional[int]:
+        if not self._slots:
+            return None
+        while self._free_slots:
+            slot = heapq.heappop(self._free_slots)
+            if self._slot_users[slot] == 0:
+                return slot
+        # 空きスロットが無ければ、割り当てられているサーバが最も少ないスロットを共有する。
+        return min(range(len(self._slots)), key=lambda i: (self._slot_users[i], i))
+
+    def _result(self, state: dict) -> dict:
+        port = self._port_base + state["pair"] * 2
+        slot = self._slots[state["slot"]] if state.get("slot") is not None else {}
+        return {"port": port, "portv6": port + 1,
+                "cpuset": slot.get("cpuset"), "mems": slot.get("mems"), "threads": slot.get("threads")}
+
+    def allocate(self, name: str) -> dict:
+        """ サーバに UDP ポートの組と CPU のスロットを割り当てるメソッド。割り当て済みであれば、同じ結果を戻す。
+
+        Raises:
+            RuntimeError: 割り当てられる UDP ポートが無い場合に raise.
+        """
+        with self._transaction():
+            if self._allocate(name):
+                self._save()
+            return self._result(self._servers[name])
+
+    def _allocate(self, name: str) -> bool:
+        if name in self._servers:
+            return False
+        pair = self._pop_pair()
+        slot = self._pop_slot()
+        if slot is not None:
+            self._slot_users[slot] += 1
+        self._servers[name] = {"pair": pair, "slot": slot}
+        logger.info("Allocated {name}: {result}".format(name=name, result=self._result(self._servers[name])))
+        return True
+
+    def release(self, name: str) -> None:
+        """ サーバに割り当てた UDP ポートと CPU のスロットを解放するメソッド。 """
+        with self._transaction():
+            if self._release(name):
+                self._save()
+
+    def _release(self, name: str) -> bool:
+        state = self._servers.pop(name, None)
+        if state is None:
+            return False
+        heapq.heappush(self._free_pairs, state["pair"])
+        slot = state.get("slot")
+        if slot is not None and slot < len(self._slots):
+            self._slot_users[slot] -= 1
+            if self._slot_users[slot] == 0:
+                heapq.heappush(self._free_slots, slot)
+        logger.info("Released {name}.".format(name=name))
+        return True
+
+    def rename(self, name: str, new_name: str) -> None:
+        """ サーバに割り当てた UDP ポートと CPU のスロットを、 `new_name` のサーバに引き継ぐメソッド。
+
+        Raises:
+            KeyError: `name` に割り当てが無い、又は `new_name` に割り当てが有る場合に raise.
+        """
+        with self._transaction():
+            if name not in self._servers or new_name in self._servers:
+                raise KeyError("Cannot move the allocation of {name} to {new_name}.".format(name=name, new_name=new_name))
+            self._servers[new_name] = self._servers.pop(name)
+            self._save()
+            logger.info("Moved the allocation of {name} to {new_name}.".format(name=name, new_name=new_name))
+
+    def reconcile(self, names: List[str], keep: Optional[Callable[[str], bool]] = None) -> Dict[str, dict]:
+        """ `names` のサーバのみが割り当てを持つように、割り当てと解放を行うメソッド。
+
+        解放を先に行うので、削除されたサーバのポートとスロットは、同じ呼び出しで追加されたサーバに再利用されます。
+
+        Args:
+            names (List[str]): 割り当てを持つサーバ名のリスト.
+            keep (Callable[[str], bool], optional): `names` に無くても解放しないサーバを判定する関数. Defaults to None.
+
+        Returns:
+            Dict[str, dict]: サーバ名と、割り当ての結果の dict.
+        """
+        with self._transaction():
+            changed = False
+            for name in [n for n in self._servers if n not in names and not (keep is not None and keep(n))]:
+                changed = self._release(name) or changed
+            for name in names:
+                changed = self._allocate(name) or changed
+            if changed:
+                self._save()
+            return {name: self._result(self._servers[name]) for name in names}
+
+    def allocations(self) -> Dict[str, dict]:
+        with self._lock:
+            self._reload()
+            return {name: self._result(state) for (name, state) in self._servers.items()}
+
+    @classmethod
+    def apply(cls, container_param: dict, allocation: dict) -> None:
+        """ 割り当ての結果を、コンテナのパラメータに反映するクラスメソッド。
+
+        コンテナ内の Bedrock Server もホストと同じポートで待ち受けるように、環境変数 `SERVER_PORT` 及び
+        `SERVER_PORTV6` を設定し、同じ番号のポートを公開します。 `MAX_THREADS` は cpuset の CPU の数とします。
+
+        Examples:
+
+            >>> from pymcbdsc.allocator import McbdscResourceAllocator
+            >>>
+            >>> param = {"name": "a", "environment": ["SERVER_NAME=a"]}
+            >>> allocation = {"port": 19134, "portv6": 19135, "cpuset": "2-3", "mems": "0", "threads": 2}
+            >>> McbdscResourceAllocator.apply(param, allocation)
+            >>> param["environment"]
+            ['SERVER_NAME=a', 'SERVER_PORT=19134', 'SERVER_PORTV6=19135', 'MAX_THREADS=2']
+            >>> sorted(param["ports"].items()), param["cpuset_cpus"], param["cpuset_mems"]
+            ([('19134/udp', 19134), ('19135/udp', 19135)], '2-3', '0')
+        """
+        # Python 3.5 の dict は順序を保持しないので、環境変数の順序が変わらないよう (名前, 値) の list とする。
+        env = [("SERVER_PORT", str(allocation["port"])), ("SERVER_PORTV6", str(allocation["portv6"]))]
+        if allocation.get("threads"):
+            env.append(("MAX_THREADS", str(allocation["threads"])))
+        names = [k for (k, v) in env]
+        # docker-py の environment には dict 又は list を指定できる。
+        environment = container_param.setdefault("environment", {})
+        if isinstance(environment, list):
+            environment[:] = [e for e in environment if e.split("=", 1)[0] not in names]
+            environment.extend("{k}={v}".format(k=k, v=v) for (k, v) in env)
+        else:
+            environment.update(env)
+        container_param["ports"] = {"{port}/udp".format(port=allocation["port"]): allocation["port"],
+                                    "{port}/udp".format(port=allocation["portv6"]): allocation["portv6"]}
+        if allocation.get("cpuset") is not None:
+            container_param["cpuset_cpus"] = allocation["cpuset"]
+            container_param["cpuset_mems"] = allocation["mems"]
@@ -0,0 +1,334 @@
+""" サーバグループのプレイヤー数に応じて、サーバを自動的に追加・削除するモジュール。
+
+サーバグループは、同じテンプレートのワールドから作成する "<グループ名>-01", "<グループ名>-02", ... という名前のサーバの集まりです。
+一定の間隔で全てのサーバに RakNet の Unconnected Ping を送信し、グループのプレイヤー数と定員(最大プレイヤー数の合計)から
+使用率を求めて、次のように台数を調整します。
+
+* 使用率が `scale_up_occupancy` 以上: 使用率が `target_occupancy` となる台数まで、サーバを追加します.
+* 使用率が `scale_down_occupancy` 以下: 使用率が `target_occupancy` となる台数まで、プレイヤーの少ないサーバから
+  ドレインします. ドレイン中のサーバは定員に数えず、プレイヤーが居なくなるか `drain_timeout` 秒経ってから
+  停止・削除します.
+
+追加と削除には、それぞれ前回の追加・削除からの待ち時間(クールダウン)があり、台数は常に `min_servers` から
+`max_servers` の間に保ちます. Ping に応答しないサーバのプレイヤー数は、 McbdscLogMonitor のリスナーとして
+`record_event()` を登録していれば、ログから数えた接続中のプレイヤー数を利用します.
+
+This module scales the servers of each server group according to their occupancy.
+"""
+
+from typing import Callable, Dict, List, Optional
+import math
+import os
+import re
+import threading
+import time
+from logging import getLogger
+from .logs import EVENT_PLAYER_CONNECTED, EVENT_PLAYER_DISCONNECTED, EVENT_SERVER_STARTED, McbdscLogEvent
+
+
+logger = getLogger(__name__)
+
+# Bedrock Server の server.properties の max-players のデフォルト値。
+bds_default_max_players = 10
+
+
+class McbdscServerGroup(object):
+    """ 同じテンプレートから作成し、プレイヤー数に応じて台数を調整するサーバの集まりを表すクラス。
+
+    Examples:
+
+        >>> from pymcbdsc.autoscaler import McbdscServerGroup
+        >>>
+        >>> group = McbdscServerGroup("event", template="event", min_servers=1, max_servers=4)
+        >>> group.server_name(3)
+        'event-03'
+        >>> (group.server_index("event-03"), group.server_index("lobby-01"))
+        (3, None)
+    """
+
+    def __init__(self,
+                 name: str,
+                 template: str,
+                 min_servers: int = 1,
+                 max_servers: int = 4,
+                 image: Optional[str] = None,
+                 max_players: int = bds_default_max_players,
+                 allocate: bool = True) -> None:
+        """ McbdscServerGroup インスタンスの初期化メソッド。
+
+        Args:
+            name (str): グループ名. サーバ名の接頭辞となる.
+            template (str): サーバを作成するテンプレート名.
+            min_servers (int, optional): サーバの最小の台数. Defaults to 1.
+            max_servers (int, optional): サーバの最大の台数. Defaults to 4.
+            image (str, optional): サーバのコンテナイメージ. None の場合は "<repository>:latest". Defaults to None.
+            max_players (int, optional): Ping に応答しないサーバの定員. Defaults to 10.
+            allocate (bool, optional): 追加するサーバに UDP ポートと CPU を割り当てるか否か. Defaults to True.
+        """
+        if min_servers < 0 or max_servers < max(min_servers, 1):
+            raise ValueError("Invalid number of servers: min {min}, max {max}".format(min=min_servers, max=max_servers))
+        self.name = name
+        self.template = template
+        self.min_servers = min_servers
+        self.max_servers = max_servers
+        self.image = image
+        self.max_players = max_players
+        self.allocate = allocate
+        self._name_re = re.compile(r"{name}-(\d+)".format(name=re.escape(name)))
+
+    def server_name(self, index: int) -> str:
+        """ `index` 番目のサーバ名を戻すメソッド。 """
+        return "{name}-{index:02d}".format(name=self.name, index=index)
+
+    def server_index(self, name: str) -> Optional[int]:
+        """ このグループのサーバ名であれば、その番号を戻すメソッド。そうでなければ None. """
+        m = self._name_re.fullmatch(name)
+        return int(m.group(1)) if m else None
+
+
+class McbdscAutoscaler(object):
+    """ サーバグループ毎に、プレイヤー数に応じてサーバを追加・削除するクラス。
+
+    サーバの追加は McbdscDockerManager.add_server() で、削除は McbdscDockerManager.remove_server() で行います。
+    削除するサーバのワールドは、テンプレートから複製したものなので残しません。
+
+    Examples:
+
+        >>> from pymcbdsc import McbdscDockerManager
+        >>> from pymcbdsc.autoscaler import McbdscServerGroup
+        >>>
+        >>> manager = McbdscDockerManager()  # doctest: +SKIP
+        >>> autoscaler = manager.autoscaler([McbdscServerGroup("event", template="event", max_servers=8)])  # doctest: +SKIP
+        >>> monitor = manager.log_monitor()  # doctest: +SKIP
+        >>> monitor.add_listener(autoscaler.record_event)  # doctest: +SKIP
+        >>> autoscaler.start()  # doctest: +SKIP
+    """
+
+    def __init__(self,
+                 manager,
+                 groups: List[McbdscServerGroup],
+                 interval: float = 30.0,
+                 timeout: float = 1.0,
+                 scale_up_occupancy: float = 0.8,
+                 scale_down_occupancy: float = 0.3,
+                 target_occupancy: float = 0.6,
+                 scale_up_cooldown: float = 120.0,
+                 scale_down_cooldown: float = 600.0,
+                 drain_timeout: float = 300.0,
+                 drain_message: Optional[str] = "This server will close soon. Please move to another server.",
+                 clock: Callable[[], float] = time.time) -> None:
+        """ McbdscAutoscaler インスタンスの初期化メソッド。
+
+        Args:
+            manager (McbdscDockerManager): サーバを管理する McbdscDockerManager インスタンス.
+            groups (List[McbdscServerGroup]): 台数を調整するサーバグループのリスト.
+            interval (float, optional): 台数を確認する間隔の秒数. Defaults to 30.0.
+            timeout (float, optional): 各サーバの Ping の応答を待つ秒数. Defaults to 1.0.
+            scale_up_occupancy (float, optional): サーバを追加する使用率. Defaults to 0.8.
+            scale_down_occupancy (float, optional): サーバを削除する使用率. Defaults to 0.3.
+            target_occupancy (float, optional): 追加・削除した後の台数を決める使用率. Defaults to 0.6.
+            scale_up_cooldown (float, optional): 前回の追加から、次に追加するまでの秒数. Defaults to 120.0.
+            scale_down_cooldown (float, optional): 前回の追加又は削除から、次に削除するまでの秒数. Defaults to 600.0.
+            drain_timeout (float, optional): ドレインを始めてから、プレイヤーが居ても削除するまでの秒数. Defaults to 300.0.
+            drain_message (str, optional): ドレインを始める時にプレイヤーに送るメッセージ. None の場合は送らない.
+                                           Defaults to "This server will close soon. Please move to another server.".
+            clock (Callable[[], float], optional): 現在時刻(UNIX 時間)を戻す関数. Defaults to time.time.
+        """
+        if not scale_down_occupancy < target_occupancy < scale_up_occupancy:
+            raise ValueError("The occupancies must be scale_down_occupancy < target_occupancy < scale_up_occupancy.")
+        self._manager = manager
+        self._groups = groups
+        self._interval = interval
+        self._timeout = timeout
+        self._scale_up_occupancy = scale_up_occupancy
+        self._scale_down_occupancy = scale_down_occupancy
+        self._target_occupancy = target_occupancy
+        self._scale_up_cooldown = scale_up_cooldown
+        self._scale_down_cooldown = scale_down_cooldown
+        self._drain_timeout = drain_timeout
+        self._drain_message = drain_message
+        self._clock = clock
+        self._lock = threading.Lock()
+        # ログから数えた、サーバ名と接続中のプレイヤーの dict.
+        self._online = {}
+        # ドレイン中のサーバ名と、ドレインを始めた時刻の dict.
+        self._draining = {}
+        # グループ名と、前回サーバを追加・削除した時刻の dict.
+        self._last_scale_up = {}
+        self._last_scale_down = {}
+        self._status = {}
+        self._adopted = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record_event(self, event: McbdscLogEvent) -> None:
+        """ McbdscLogMonitor のリスナーとして、プレイヤーの接続・切断を記録するメソッド。 """
+        with self._lock:
+            online = self._online.setdefault(event.container, set())
+            if event.kind == EVENT_PLAYER_CONNECTED:
+                online.add(event.player)
+            elif event.kind == EVENT_PLAYER_DISCONNECTED:
+                online.discard(event.player)
+            elif event.kind == EVENT_SERVER_STARTED:
+                online.clear()
+
+    def _players(self, name: str, status) -> int:
+        if status is not None and status.online and status.players is not None:
+            return status.players
+        with self._lock:
+            return len(self._online.get(name, ()))
+
+    def _adopt(self) -> None:
+        """ 前回のデーモンの起動中に追加したサーバ(ワールドが残っているサーバ)を、再び管理するメソッド。 """
+        manager = self._manager
+        volume_dir = manager.volume_dir()
+        names = set(manager.server_addresses())
+        for group in self._groups:
+            found = sorted(n for n in (os.listdir(volume_dir) if os.path.isdir(volume_dir) else [])
+                           if group.server_index(n) is not None and n not in names)
+            for name in found:
+                logger.info("Adopt the server {name} of the group {group}.".format(name=name, group=group.name))
+                manager.add_server(name, group.template, image=group.image, allocate=group.allocate)
+
+    def members(self, group: McbdscServerGroup) -> List[str]:
+        """ グループのサーバ名を、番号の順に戻すメソッド。ドレイン中のサーバを含む。 """
+        return sorted((n for n in self._manager.server_addresses() if group.server_index(n) is not None),
+                      key=group.server_index)
+
+    def status(self) -> Dict[str, dict]:
+        """ グループ名と、前回の確認時のサーバ、プレイヤー数、定員及び使用率の dict を戻すメソッド。 """
+        with self._lock:
+            return {name: dict(st) for (name, st) in self._status.items()}
+
+    def check(self) -> Dict[str, dict]:
+        """ 全てのグループの台数を一度確認し、必要があればサーバを追加・ドレイン・削除するメソッド。
+
+        Returns:
+            Dict[str, dict]: グループ名と、追加("added")、ドレインを始めた("drained")及び削除した("removed")
+                             サーバ名のリストの dict.
+        """
+        if not self._adopted:
+            self._adopt()
+            self._adopted = True
+        statuses = self._manager.query_status(timeout=self._timeout)
+        now = self._clock()
+        results = {}
+        for group in self._groups:
+            try:
+                results[group.name] = self._scale(group, statuses, now)
+            except Exception:
+                logger.exception("Failed to scale the group {group}.".format(group=group.name))
+        return results
+
+    def _scale(self, group: McbdscServerGroup, statuses: dict, now: float) -> dict:
+        manager = self._manager
+        result = {"added": [], "drained": [], "removed": []}
+        # 起動した直後に(引き継いだサーバ等を)削除しないよう、最初の確認から削除のクールダウンを数える。
+        self._last_scale_down.setdefault(group.name, now)
+        members = self.members(group)
+        for name in [n for n in self._draining if group.server_index(n) is not None and n not in members]:
+            # 他の処理で削除されたサーバは、ドレインを終える。
+            del self._draining[name]
+        players = {name: self._players(name, statuses.get(name)) for name in members}
+        # プレイヤーが居なくなった、又は待ち時間を過ぎたドレイン中のサーバを削除する。
+        for name in [n for n in members if n in self._draining]:
+            if players[name] == 0 or now - self._draining[name] >= self._drain_timeout:
+                manager.remove_server(name)
+                del self._draining[name]
+                members.remove(name)
+                result["removed"].append(name)
+        active = [n for n in members if n not in self._draining]
+        draining = [n for n in members if n in self._draining]
+        # ドレイン中のサーバのプレイヤーも、いずれ他のサーバに移るものとして数える。
+        total = sum(players[n] for n in members)
+
+        def capacity(name):
+            st = statuses.get(name)
+            return st.max_players if st is not None and st.online and st.max_players else group.max_players
+
+        slots = sum(capacity(n) for n in active)
+        occupancy = total / slots if slots else (math.inf if total else 0.0)
+        # 使用率が target_occupancy となる台数。
+        per_server = slots / len(active) if active else group.max_players
+        needed = math.ceil(total / (per_server * self._target_occupancy))
+        desired = len(active)
+        if len(active) < group.min_servers or occupancy >= self._scale_up_occupancy:
+            desired = max(needed, len(active) + 1, group.min_servers)
+        elif occupancy <= self._scale_down_occupancy:
+            desired = max(needed, group.min_servers)
+        desired = min(desired, group.max_servers)
+        last_up = self._last_scale_up.get(group.name)
+        last_scale = max(last_up or -math.inf, self._last_scale_down[group.name])
+        if desired > len(active) and (len(active) < group.min_servers or last_up is None
+                                      or now - last_up >= self._scale_up_cooldown):
+            # ドレイン中のサーバを戻す方が、新しく追加するより速い。
+            for name in sorted(draining, key=lambda n: -players[n])[:desired - len(active)]:
+                logger.info("Stop draining the server {name}.".format(name=name))
+                del self._draining[name]
+                active.append(name)
+            used = {group.server_index(n) for n in members}
+            index = 1
+            while len(active) < desired:
+                while index in used:
+                    index += 1
+                name = group.server_name(index)
+                used.add(index)
+                manager.add_server(name, group.template, image=group.image, allocate=group.allocate)
+                active.append(name)
+                result["added"].append(name)
+            logger.info("Scaled up the group {group} to {n} servers: {players} players, occupancy {occupancy:.0%}."
+                        .format(group=group.name, n=len(active), players=total, occupancy=occupancy))
+            self._last_scale_up[group.name] = now
+        elif desired < len(active) and now - last_scale >= self._scale_down_cooldown:
+            # プレイヤーの少ない、新しいサーバからドレインする。
+            for name in sorted(active, key=lambda n: (players[n], -group.server_index(n)))[:len(active) - desired]:
+                self._drain(name)
+                active.remove(name)
+                result["drained"].append(name)
+                self._draining[name] = now
+            logger.info("Scaled down the group {group} to {n} servers: {players} players, occupancy {occupancy:.0%}."
+                        .format(group=group.name, n=len(active), players=total, occupancy=occupancy))
+            self._last_scale_down[group.name] = now
+        # 追加・ドレインした後の定員と使用率を記録する。
+        slots = sum(capacity(n) for n in active)
+        with self._lock:
+            self._status[group.name] = {"servers": sorted(active, key=group.server_index),
+                                        "draining": sorted(self._draining.keys() & set(members), key=group.server_index),
+                                        "players": total, "capacity": slots, "occupancy": total / slots if slots else None,
+                                        "min_servers": group.min_servers, "max_servers": group.max_servers}
+        return result
+
+    def _drain(self, name: str) -> None:
+        logger.info("Drain the server {name}.".format(name=name))
+        if self._drain_message is None:
+            return
+        containers = [c for c in self._manager.factory_containers() if c.name == name]
+        try:
+            for c in containers:
+                c.send_command("say {message}".format(message=self._drain_message))
+        except Exception as e:
+            logger.warning("Failed to notify the players of {name}: {e}".format(name=name, e=e))
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """ `stop` がセットされるまで、 `interval` 秒毎に `check()` を実行するメソッド。 """
+        stop = stop if stop is not None else threading.Event()
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Failed to scale the server groups.")
+            stop.wait(max(self._interval - (time.monotonic() - started), 0))
+
+    def start(self) -> None:
+        """ バックグラウンドのスレッドで台数の調整を開始するメソッド。 """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(self._stop,), name="mcbdsc-autoscaler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ 台数の調整を停止するメソッド。ドレイン中のサーバはそのまま残す。 """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,349 @@
+""" 動作中の Bedrock Server のワールドを、一貫性を保ったままバックアップするモジュール。
+
+Bedrock Server の `save hold` コマンドでワールドへの書き込みを一時停止し、 `save query` で
+コピーするべきファイルとその長さを取得した上で、それらのファイルを `get_archive` でコンテナから読み出します。
+読み出したデータはディスクに一時保存せず、そのまま圧縮したアーカイブに書き込みます。
+コピーが終わり次第 `save resume` を送信するので、ワールドへの書き込みが停止する時間はコピーに要する時間のみです。
+
+This module backs up the world of the running Bedrock Server consistently.
+
+See Also:
+    https://docs.microsoft.com/en-us/minecraft/creator/documents/dedicatedserver (Backup commands)
+"""
+
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
+import io
+import re
+import tarfile
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from .compress import McbdscParallelCompressor
+from .exceptions import McbdscBackupError, McbdscCommandTimeoutError
+from .utils import lazy_import
+
+
+logger = getLogger(__name__)
+
+docker = lazy_import("docker")
+
+# コンテナ内でワールドが保存されているディレクトリ。
+worlds_dir = "/volume/worlds"
+
+_save_hold_expect = re.compile(r"(Saving|already running)")
+# `save query` の応答は、準備ができていれば "Data saved. Files are now ready to be copied." の次の行にファイルの一覧が出力される。
+_save_query_expect = re.compile(r"(not been completed|not yet complete|:\d+\s*$)")
+_save_ready_re = re.compile(r"Data saved\. Files are now ready to be copied\.")
+_save_query_file_re = re.compile(r"(.+?):(\d+)(?:, |$)")
+_save_resume_expect = re.compile(r"(resumed|not been saved|no save)", re.IGNORECASE)
+
+
+class McbdscChunkReader(io.RawIOBase):
+    """ bytes を戻すイテレータを、読み込み可能なファイルオブジェクトとして扱うクラス。
+
+    `get_archive` が戻すストリームを tarfile のストリームモードで読み込む為に利用します。
+    `read()` は要求した長さより短いデータを戻し得るので、通常は `io.BufferedReader` で包んで利用します。
+
+    Examples:
+
+        >>> import io
+        >>> from pymcbdsc.backup import McbdscChunkReader
+        >>>
+        >>> reader = io.BufferedReader(McbdscChunkReader(iter([b"abc", b"defg"])))
+        >>> (reader.read(2), reader.read(4), reader.read())
+        (b'ab', b'cdef', b'g')
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._buf = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf:
+            try:
+                self._buf = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        # bytes をスライスすると残りをコピーするので、大きなチャンクでは読み込む毎に全体をコピーすることになる。
+        self._buf = self._buf[n:]
+        return n
+
+
+class McbdscLimitedReader(io.RawIOBase):
+    """ ファイルオブジェクトから、先頭の `length` バイトのみを読み込めるようにするクラス。
+
+    `save query` が報告した長さでファイルを切り詰める為に利用します。
+    """
+
+    def __init__(self, fileobj: BinaryIO, length: int) -> None:
+        self._fileobj = fileobj
+        self._remaining = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(b)[:min(len(b), self._remaining)]
+        data = self._fileobj.read(len(view))
+        n = len(data)
+        view[:n] = data
+        self._remaining -= n
+        return n
+
+
+class McbdscWorldFile(object):
+    """ バックアップするファイルの一つを表すクラス。 """
+
+    def __init__(self, path: str, size: int, mtime: float, fileobj: BinaryIO) -> None:
+        """ McbdscWorldFile インスタンスの初期化メソッド。
+
+        Args:
+            path (str): worlds ディレクトリからの相対パス.
+            size (int): バックアップする長さ.
+            mtime (float): 最終更新時刻.
+            fileobj (BinaryIO): 内容を `size` バイトだけ読み込めるファイルオブジェクト.
+        """
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.fileobj = fileobj
+
+
+def parse_save_query(lines: List[str]) -> Optional[List[Tuple[str, int]]]:
+    """ `save query` の応答を解析し、コピーするファイルとその長さのリストを戻す関数。
+
+    Args:
+        lines (List[str]): `save query` の応答の行.
+
+    Returns:
+        Optional[List[Tuple[str, int]]]: ファイルのパス(worlds ディレクトリからの相対パス)と長さのリスト.
+                                         まだコピーできる状態でない場合は None.
+
+    Examples:
+
+        >>> from pymcbdsc.backup import parse_save_query
+        >>>
+        >>> parse_save_query(["Data saved. Files are now ready to be copied.",
+        ...                   "Bedrock level/db/000005.ldb:1234, Bedrock level/db/CURRENT:16, Bedrock level/level.dat:2000"])
+        [('Bedrock level/db/000005.ldb', 1234), ('Bedrock level/db/CURRENT', 16), ('Bedrock level/level.dat', 2000)]
+        >>> parse_save_query(["A previous save has not been completed."]) is None
+        True
+    """
+    for (i, line) in enumerate(lines):
+        if _save_ready_re.search(line):
+            if i + 1 >= len(lines):
+                return None
+            # ファイル名にはカンマを含み得るので、 ":<数字>" の後の ", " を区切りとする。
+            files = [(path, int(length)) for (path, length) in _save_query_file_re.findall(lines[i + 1].strip())]
+            if not files:
+                raise McbdscBackupError("Unexpected response of save query: {line}".format(line=lines[i + 1]))
+            return files
+    return None
+
+
+@contextmanager
+def save_hold(channel, timeout: float = 60.0, poll_interval: float = 0.5, command_timeout: float = 10.0):
+    """ ワールドへの書き込みを一時停止し、コピーするファイルの一覧を戻すコンテキストマネージャ。
+
+    コンテキストを抜ける際には、例外の有無によらず `save resume` を送信します。
+
+    Args:
+        channel (McbdscCommandChannel): 対象のコンテナのコマンドチャネル.
+        timeout (float, optional): ファイルの準備ができるのを待つ秒数. Defaults to 60.0.
+        poll_interval (float, optional): `save query` を送信する間隔の秒数. Defaults to 0.5.
+        command_timeout (float, optional): 各コマンドの応答を待つ秒数. Defaults to 10.0.
+
+    Raises:
+        McbdscBackupError: `timeout` 秒以内にファイルの準備ができなかった場合に raise.
+
+    Yields:
+        List[Tuple[str, int]]: ファイルのパス(worlds ディレクトリからの相対パス)と長さのリスト.
+    """
+    channel.send_command("save hold", timeout=command_timeout, expect=_save_hold_expect)
+    held_at = time.monotonic()
+    try:
+        deadline = held_at + timeout
+        while True:
+            lines = channel.send_command("save query", timeout=command_timeout, expect=_save_query_expect)
+            files = parse_save_query(lines)
+            if files is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise McbdscBackupError("The world was not ready to be copied within {timeout} seconds."
+                                        .format(timeout=timeout))
+            time.sleep(poll_interval)
+        yield files
+    finally:
+        try:
+            channel.send_command("save resume", timeout=command_timeout, expect=_save_resume_expect)
+        except McbdscCommandTimeoutError:
+            logger.warning("No response to the save resume command.")
+        logger.info("The world was held for {sec:.2f} seconds.".format(sec=time.monotonic() - held_at))
+
+
+def run_in_volume(container, cmd: List[str], running: bool = True) -> bytes:
+    """ コンテナのボリューム(/volume)に対してコマンドを実行し、その出力を戻す関数。
+
+    起動しているコンテナでは `exec_run` で実行します。停止しているコンテナでは exec できないので、
+    同じイメージから `volumes_from` で同じボリュームをマウントした一時的なコンテナを作成して実行します。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        cmd (List[str]): 実行するコマンド.
+        running (bool, optional): コンテナが起動しているか否か. Defaults to True.
+
+    Raises:
+        McbdscBackupError: コマンドが失敗した場合に raise.
+
+    Returns:
+        bytes: コマンドの出力.
+    """
+    if running:
+        (exit_code, output) = container.exec_run(cmd)
+        if exit_code != 0:
+            raise McbdscBackupError("{cmd} failed: {output}".format(cmd=cmd[0], output=output))
+        return output
+    if "Config" not in container.attrs:
+        # 状態のキャッシュ等から作成した Container インスタンスは Config を持たないので、取得し直す。
+        container.reload()
+    try:
+        return container.client.containers.run(container.attrs["Config"]["Image"], entrypoint=cmd,
+                                               volumes_from=[container.id], network_disabled=True, remove=True)
+    except docker.errors.ContainerError as e:
+        raise McbdscBackupError("{cmd} failed: {e}".format(cmd=cmd[0], e=e))
+
+
+def iter_world_files(container, files: List[Tuple[str, int]], base_dir: str = worlds_dir) -> Iterator[McbdscWorldFile]:
+    """ コンテナから `get_archive` でファイルを一つずつ読み出す関数。
+
+    各ファイルの内容は、戻した McbdscWorldFile の `fileobj` から読み込んだ分だけコンテナから受信するので、
+    ファイル全体をメモリに保持することはありません。
+    次のファイルに進む前に `fileobj` を最後まで読み込む必要があります。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        files (List[Tuple[str, int]]): ファイルのパス(`base_dir` からの相対パス)と、読み込む長さのリスト.
+        base_dir (str, optional): コンテナ内のワールドのディレクトリ. Defaults to worlds_dir.
+
+    Raises:
+        McbdscBackupError: ファイルが報告された長さよりも短い場合に raise.
+
+    Yields:
+        McbdscWorldFile: 読み出したファイル.
+    """
+    for (path, length) in files:
+        (stream, _stat) = container.get_archive("{base}/{path}".format(base=base_dir, path=path), chunk_size=None)
+        with tarfile.open(fileobj=io.BufferedReader(McbdscChunkReader(stream)), mode="r|") as tar:
+            member = tar.next()
+            if member is None or not member.isfile():
+                raise McbdscBackupError("{path} is not a regular file.".format(path=path))
+            if member.size < length:
+                raise McbdscBackupError("{path} is shorter ({size}) than reported ({length})."
+                                        .format(path=path, size=member.size, length=length))
+            yield McbdscWorldFile(path=path, size=length, mtime=member.mtime,
+                                  fileobj=io.BufferedReader(McbdscLimitedReader(tar.extractfile(member), length)))
+        # 切り詰めた残りのデータを読み捨て、 Docker API への接続を再利用できるようにする。
+        for _ in stream:
+            pass
+
+
+def write_archive(world_files: Iterable[McbdscWorldFile],
+                  fileobj: BinaryIO,
+                  compression: str = "gz",
+                  arcname_prefix: str = "worlds",
+                  on_file: Optional[Callable[[McbdscWorldFile], None]] = None,
+                  level: int = 6,
+                  workers: Optional[int] = None) -> int:
+    """ ファイルを読み込みながら、ストリームモードで tar アーカイブに書き込む関数。
+
+    圧縮する場合は、 McbdscParallelCompressor で `workers` 個のプロセスで並列に圧縮します。
+
+    Args:
+        world_files (Iterable[McbdscWorldFile]): 書き込むファイル.
+        fileobj (BinaryIO): 書き込み先のファイルオブジェクト. シークできる必要はない.
+        compression (str, optional): 圧縮方式. "gz", "bz2", "xz" 又は "" (無圧縮). Defaults to "gz".
+        arcname_prefix (str, optional): アーカイブ内のパスの接頭辞. Defaults to "worlds".
+        on_file (Callable[[McbdscWorldFile], None], optional): 各ファイルを書き込んだ後にコールされる関数. Defaults to None.
+        level (int, optional): 圧縮レベル. Defaults to 6.
+        workers (int, optional): 圧縮するプロセスの数. None の場合は CPU の数. Defaults to None.
+
+    Returns:
+        int: 書き込んだファイルの内容の合計バイト数.
+    """
+    if compression:
+        with McbdscParallelCompressor(fileobj, compression=compression, level=level, workers=workers) as out:
+            return write_archive(world_files, out, compression="", arcname_prefix=arcname_prefix, on_file=on_file)
+    total = 0
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        for wf in world_files:
+            info = tarfile.TarInfo(name="{prefix}/{path}".format(prefix=arcname_prefix, path=wf.path))
+            info.size = wf.size
+            info.mtime = wf.mtime
+            info.mode = 0o644
+            tar.addfile(info, fileobj=wf.fileobj)
+            total += wf.size
+            if on_file is not None:
+                on_file(wf)
+    return total
+
+
+def online_backup(container, channel, fileobj: BinaryIO, compression: str = "gz", level: int = 6,
+                  workers: Optional[int] = None, **hold_opt) -> List[Tuple[str, int]]:
+    """ 動作中のコンテナのワールドを、一貫性を保ったまま圧縮したアーカイブに書き込む関数。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        channel (McbdscCommandChannel): 対象のコンテナのコマンドチャネル.
+        fileobj (BinaryIO): 書き込み先のファイルオブジェクト.
+        compression (str, optional): 圧縮方式. Defaults to "gz".
+        level (int, optional): 圧縮レベル. Defaults to 6.
+        workers (int, optional): 圧縮するプロセスの数. None の場合は CPU の数. Defaults to None.
+        **hold_opt: `save_hold` に渡す引数.
+
+    Returns:
+        List[Tuple[str, int]]: バックアップしたファイルのパスと長さのリスト.
+    """
+    with save_hold(channel, **hold_opt) as files:
+        write_archive(iter_world_files(container, files), fileobj=fileobj, compression=compression,
+                      level=level, workers=workers)
+    return files
+
+
+def offline_backup(container, fileobj: BinaryIO, compression: str = "gz", level: int = 6,
+                   workers: Optional[int] = None) -> List[Tuple[str, int]]:
+    """ 停止しているコンテナのワールドを、圧縮したアーカイブに書き込む関数。
+
+    ワールドへの書き込みは行われていないので、 worlds ディレクトリ全体を一度の `get_archive` で読み出します。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        fileobj (BinaryIO): 書き込み先のファイルオブジェクト.
+        compression (str, optional): 圧縮方式. Defaults to "gz".
+        level (int, optional): 圧縮レベル. Defaults to 6.
+        workers (int, optional): 圧縮するプロセスの数. None の場合は CPU の数. Defaults to None.
+
+    Returns:
+        List[Tuple[str, int]]: バックアップしたファイルのパスと長さのリスト.
+    """
+    (stream, _stat) = container.get_archive(worlds_dir, chunk_size=None)
+    files = []
+
+    def world_files():
+        with tarfile.open(fileobj=io.BufferedReader(McbdscChunkReader(stream)), mode="r|") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                # get_archive のアーカイブは "worlds/..." となっているので、先頭のディレクトリ名を取り除く。
+                path = member.name.split("/", 1)[1]
+                files.append((path, member.size))
+                yield McbdscWorldFile(path=path, size=member.size, mtime=member.mtime, fileobj=tar.extractfile(member))
+
+    write_archive(world_files(), fileobj=fileobj, compression=compression, level=level, workers=workers)
+    return files
@@ -0,0 +1,161 @@
+""" バックアップのアーカイブを、複数のプロセスで並列に圧縮するモジュール。
+
+書き込まれたデータを一定のサイズのブロックに分割し、各ブロックをプロセスプールで独立した
+gzip メンバー(xz, bz2 の場合はストリーム)に圧縮して、元の順序のまま連結して出力します。
+連結された gzip メンバー及び xz, bz2 のストリームは、それぞれの形式の仕様上正しいファイルであり、
+`gzip -d`, `xz -d`, `tarfile.open(mode="r:gz")` 等の通常のツールでそのまま展開できます。
+
+This module compresses the archive of the backup in parallel on the process pool.
+"""
+
+from typing import BinaryIO, Optional
+import bz2
+import gzip
+import io
+import lzma
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+# 一つのブロックのサイズ。小さ過ぎると圧縮率が下がり、大き過ぎると並列度とメモリ使用量に影響する。
+_block_size = 4 * 1024 * 1024
+
+
+def compress_block(block: bytes, compression: str, level: int) -> bytes:
+    """ 一つのブロックを、単独で展開できる gzip メンバー又は xz, bz2 のストリームに圧縮する関数。
+
+    プロセスプールのワーカーで実行される為、モジュールのトップレベルに定義しています。
+
+    Args:
+        block (bytes): 圧縮するデータ.
+        compression (str): 圧縮方式. "gz", "bz2" 又は "xz".
+        level (int): 圧縮レベル. gz と bz2 は 1-9, xz は 0-9.
+
+    Returns:
+        bytes: 圧縮したデータ.
+
+    Examples:
+
+        >>> import gzip
+        >>> from pymcbdsc.compress import compress_block
+        >>>
+        >>> gzip.decompress(compress_block(b"abc", "gz", 6) + compress_block(b"def", "gz", 6))
+        b'abcdef'
+    """
+    if compression == "gz":
+        return gzip.compress(block, compresslevel=level)
+    if compression == "xz":
+        return lzma.compress(block, format=lzma.FORMAT_XZ, preset=level)
+    if compression == "bz2":
+        return bz2.compress(block, compresslevel=level)
+    raise ValueError("Unsupported compression: {compression}".format(compression=compression))
+
+
+class McbdscParallelCompressor(io.RawIOBase):
+    """ 書き込まれたデータを並列に圧縮して、 `fileobj` に書き込むファイルオブジェクトのクラス。
+
+    同時に圧縮するブロックの数は `workers` の2倍までに制限するので、メモリ使用量は
+    概ね `block_size * workers * 2` に収まります。
+    `close()` しても `fileobj` は閉じません。
+
+    Examples:
+
+        >>> import gzip
+        >>> import io
+        >>> from pymcbdsc.compress import McbdscParallelCompressor
+        >>>
+        >>> out = io.BytesIO()
+        >>> with McbdscParallelCompressor(out, compression="gz", workers=1, block_size=4) as f:
+        ...     _ = f.write(b"0123456789")
+        >>> gzip.decompress(out.getvalue())
+        b'0123456789'
+    """
+
+    def __init__(self,
+                 fileobj: BinaryIO,
+                 compression: str = "gz",
+                 level: int = 6,
+                 workers: Optional[int] = None,
+                 block_size: int = _block_size,
+                 executor: Optional[Executor] = None) -> None:
+        """ McbdscParallelCompressor インスタンスの初期化メソッド。
+
+        Args:
+            fileobj (BinaryIO): 圧縮したデータの書き込み先.
+            compression (str, optional): 圧縮方式. "gz", "bz2" 又は "xz". Defaults to "gz".
+            level (int, optional): 圧縮レベル. Defaults to 6.
+            workers (int, optional): 圧縮するプロセスの数. None の場合は CPU の数. 1 の場合はプロセスプールを利用せず、
+                                     このプロセスで圧縮する. Defaults to None.
+            block_size (int, optional): 一つのブロックのサイズ. Defaults to _block_size.
+            executor (Executor, optional): 圧縮に利用する Executor. 指定した場合は `workers` 個のプロセスを作成せず、
+                                           `close()` でも shutdown しない. Defaults to None.
+        """
+        compress_block(b"", compression, level)
+        self._fileobj = fileobj
+        self._compression = compression
+        self._level = level
+        self._workers = workers if workers is not None else (os.cpu_count() or 1)
+        self._block_size = block_size
+        self._buf = bytearray()
+        self._pending = deque()
+        self._own_executor = executor is None and self._workers > 1
+        self._executor = ProcessPoolExecutor(max_workers=self._workers) if self._own_executor else executor
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        n = len(b)
+        self._buf += b
+        while len(self._buf) >= self._block_size:
+            block = bytes(self._buf[:self._block_size])
+            del self._buf[:self._block_size]
+            self._submit(block)
+        return n
+
+    def _submit(self, block: bytes) -> None:
+        self.bytes_in += len(block)
+        if self._executor is None:
+            self._write_out(compress_block(block, self._compression, self._level))
+            return
+        self._pending.append(self._executor.submit(compress_block, block, self._compression, self._level))
+        # 圧縮済みのブロックを順に書き出し、未処理のブロックが溜まり過ぎないようにする。
+        while self._pending and (self._pending[0].done() or len(self._pending) > self._workers * 2):
+            self._write_out(self._pending.popleft().result())
+
+    def _write_out(self, data: bytes) -> None:
+        self._fileobj.write(data)
+        self.bytes_out += len(data)
+
+    def flush(self) -> None:
+        """ 書き込まれた全てのデータを圧縮し、 `fileobj` に書き込むメソッド。
+
+        ブロックの途中でフラッシュすると圧縮率が下がるので、通常は `close()` でのみ呼び出されます。
+        """
+        if self.closed:
+            return
+        if self._buf:
+            block = bytes(self._buf)
+            self._buf = bytearray()
+            self._submit(block)
+        while self._pending:
+            self._write_out(self._pending.popleft().result())
+        self._fileobj.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            if self._own_executor:
+                self._executor.shutdown()
+            super().close()
@@ -0,0 +1,310 @@
+""" コンテナで動作する Bedrock Server のコンソールへ、コマンドを送信するモジュール。
+
+コンテナ毎に一つの attach ソケットを開いたままにし、送信するコマンドをキューに積んで順に書き込みます。
+コマンドの応答は、コンテナの出力ストリームを読み続けることで取得します。
+
+This module sends commands to the console of the Bedrock Server running in the container
+through a persistent attach socket.
+"""
+
+from typing import Callable, List, Optional, Pattern, Union
+import collections
+import queue
+import re
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from logging import getLogger
+from .exceptions import McbdscCommandChannelClosedError, McbdscCommandTimeoutError
+
+
+logger = getLogger(__name__)
+
+# tty が無効なコンテナの出力ストリームは、 8 バイトのヘッダ(ストリーム種別(1) + 予約(3) + 長さ(4))で多重化されている。
+_frame_header = struct.Struct(">BxxxL")
+
+
+class _Command(object):
+
+    def __init__(self, command: str, timeout: float, expect: Optional[Pattern], expect_response: bool) -> None:
+        self.command = command
+        self.timeout = timeout
+        self.expect = expect
+        self.expect_response = expect_response
+        self.future = Future()
+        self.lines = []
+        self.deadline = None
+        self.last_output = None
+        self.echoed = False
+
+
+class McbdscCommandChannel(object):
+    """ コンテナの標準入出力に attach し続け、コマンドの送信と応答の取得を行うクラス。
+
+    コマンドはキューに積まれ、専用のスレッドが順に書き込みます。
+    Bedrock Server のコンソールは応答にコマンドとの対応付けを含まないので、出力された行は
+    応答を待っているコマンドのうち、最も古いものの応答とします(FIFO)。
+    コンテナ毎にチャネルは独立しているので、複数のコンテナへのコマンドは並行して処理されます。
+
+    応答は次のいずれかで完了とします。
+
+    *   `expect` を指定した場合は、その正規表現に一致する行を受信した時点。
+    *   `expect` を指定しない場合は、応答の行を受信してから `idle` 秒の間、出力がなかった時点。
+
+    `expect` を指定したコマンドは応答の終わりが分かるので、応答を待たずに後続のコマンドを書き込みます(パイプライン)。
+    `expect` を指定しないコマンドの後に書き込むと応答の境目が分からなくなるので、その応答が完了するまで
+    後続のコマンドは書き込みません。多数のコマンドを送信する場合は `expect` を指定してください。
+
+    Examples:
+
+        >>> from pymcbdsc.console import McbdscCommandChannel
+        >>>
+        >>> channel = McbdscCommandChannel(container)  # doctest: +SKIP
+        >>> channel.send_command("list", expect=r"players online")  # doctest: +SKIP
+        ['There are 0/10 players online:']
+    """
+
+    def __init__(self, container, idle: float = 0.05, tty: Optional[bool] = None) -> None:
+        """ McbdscCommandChannel インスタンスの初期化メソッド。
+
+        Args:
+            container (Container): 対象となる docker-py の Container インスタンス.
+            idle (float, optional): `expect` を指定しないコマンドで、応答が終わったとみなす無出力の秒数.
+                                    Defaults to 0.05.
+            tty (bool, optional): コンテナの tty が有効か否か. None の場合はコンテナの設定から判断する.
+                                  Defaults to None.
+        """
+        self._container = container
+        self._idle = idle
+        self._tty = tty
+        self._queue = queue.Queue()
+        self._sock = None
+        self._raw = None
+        self._inflight = collections.deque()
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._connected = threading.Event()
+        self._closed = False
+        self._listeners = []
+        self._writer = None
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """ コンテナが出力した全ての行を受け取るリスナーを登録するメソッド。
+
+        Args:
+            listener (Callable[[str], None]): 出力された一行を引数としてコールされる関数.
+        """
+        self._listeners.append(listener)
+
+    def send(self,
+             command: str,
+             timeout: float = 5.0,
+             expect: Union[str, Pattern, None] = None,
+             expect_response: bool = True) -> Future:
+        """ コマンドをキューに積み、その応答を受け取る Future を戻すメソッド。
+
+        Args:
+            command (str): 送信するコマンド. 末尾の改行は不要.
+            timeout (float, optional): コマンドを書き込んでから応答を待つ秒数. Defaults to 5.0.
+            expect (Union[str, Pattern, None], optional): 応答の最終行に一致する正規表現. Defaults to None.
+            expect_response (bool, optional): False の場合は、書き込んだ時点で完了とする. Defaults to True.
+
+        Raises:
+            McbdscCommandChannelClosedError: チャネルが既に閉じられている場合に raise.
+
+        Returns:
+            Future: 応答の行のリストを結果とする Future.
+        """
+        if self._closed:
+            raise McbdscCommandChannelClosedError("The command channel is already closed.")
+        if isinstance(expect, str):
+            expect = re.compile(expect)
+        cmd = _Command(command=command, timeout=timeout, expect=expect, expect_response=expect_response)
+        self._start()
+        self._queue.put(cmd)
+        return cmd.future
+
+    def send_command(self,
+                     command: str,
+                     timeout: float = 5.0,
+                     expect: Union[str, Pattern, None] = None,
+                     expect_response: bool = True) -> List[str]:
+        """ コマンドを送信し、その応答を戻すメソッド。
+
+        Args:
+            command (str): 送信するコマンド. 末尾の改行は不要.
+            timeout (float, optional): コマンドを書き込んでから応答を待つ秒数. Defaults to 5.0.
+            expect (Union[str, Pattern, None], optional): 応答の最終行に一致する正規表現. Defaults to None.
+            expect_response (bool, optional): False の場合は、書き込んだ時点で完了とする. Defaults to True.
+
+        Raises:
+            McbdscCommandTimeoutError: `timeout` 秒以内に応答が完了しなかった場合に raise.
+
+        Returns:
+            List[str]: 応答の行のリスト.
+        """
+        return self.send(command=command, timeout=timeout, expect=expect, expect_response=expect_response).result()
+
+    def close(self) -> None:
+        """ チャネルを閉じるメソッド。
+
+        キューに残っているコマンドは McbdscCommandChannelClosedError で失敗します。
+        """
+        self._closed = True
+        self._queue.put(None)
+        self._disconnect()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True,
+                                                name="mcbdsc-console-{name}".format(name=self._container.name))
+                self._writer.start()
+
+    def _connect(self) -> None:
+        container = self._container
+        if self._tty is None:
+            # 状態のキャッシュ等から作成した Container インスタンスは Config を持たないので、取得し直してから判定する。
+            container.reload()
+            self._tty = bool(container.attrs.get("Config", {}).get("Tty", False))
+        params = {"stdin": 1, "stdout": 1, "stderr": 1, "stream": 1}
+        sock = container.attach_socket(params=params)
+        # docker-py が戻すソケットは、接続方法により SocketIO であったり socket であったりする。
+        raw = getattr(sock, "_sock", sock)
+        raw.settimeout(0.05)
+        self._sock = sock
+        self._raw = raw
+        self._connected.set()
+        threading.Thread(target=self._read_loop, args=(raw,), daemon=True,
+                         name="mcbdsc-console-reader-{name}".format(name=container.name)).start()
+
+    def _disconnect(self) -> None:
+        self._connected.clear()
+        sock = self._sock
+        self._sock = None
+        self._raw = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _write_loop(self) -> None:
+        while True:
+            cmd = self._queue.get()
+            if cmd is None or self._closed:
+                if cmd is not None:
+                    cmd.future.set_exception(McbdscCommandChannelClosedError("The command channel is closed."))
+                break
+            try:
+                if not self._connected.is_set():
+                    self._connect()
+                with self._lock:
+                    # `expect` の無いコマンドの応答が完了するまで、後続のコマンドは書き込まない。
+                    # 出力ストリームを読むスレッドが期限を確認するが、そのスレッドが終了していた場合に備えて自身でも期限を確認する。
+                    while self._inflight and self._inflight[-1].expect is None and not self._closed:
+                        self._done.wait(0.1)
+                        self._expire(time.monotonic() - 1)
+                    cmd.deadline = time.monotonic() + cmd.timeout
+                    if cmd.expect_response:
+                        self._inflight.append(cmd)
+                logger.debug("send command: {command}".format(command=cmd.command))
+                self._raw.sendall((cmd.command + "\n").encode("utf-8"))
+            except Exception as e:
+                with self._lock:
+                    if cmd in self._inflight:
+                        self._inflight.remove(cmd)
+                self._disconnect()
+                cmd.future.set_exception(e)
+                continue
+            if not cmd.expect_response:
+                cmd.future.set_result([])
+        # 閉じられたチャネルに残っているコマンドを失敗させる。
+        while True:
+            try:
+                cmd = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if cmd is not None:
+                cmd.future.set_exception(McbdscCommandChannelClosedError("The command channel is closed."))
+
+    def _read_loop(self, raw) -> None:
+        buf = b""
+        pending = b""
+        while True:
+            try:
+                data = raw.recv(65536)
+            except socket.timeout:
+                self._check_inflight()
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                break
+            if self._tty:
+                buf += data
+            else:
+                pending += data
+                while len(pending) >= _frame_header.size:
+                    (_stream, length) = _frame_header.unpack_from(pending)
+                    if len(pending) < _frame_header.size + length:
+                        break
+                    buf += pending[_frame_header.size:_frame_header.size + length]
+                    pending = pending[_frame_header.size + length:]
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                self._dispatch(line.decode("utf-8", errors="replace").rstrip("\r"))
+            self._check_inflight()
+        # コンテナの停止などで出力ストリームが終了した場合は、次のコマンドの送信時に再接続する。
+        if raw is self._raw:
+            self._disconnect()
+        with self._lock:
+            cmds = list(self._inflight)
+            self._inflight.clear()
+            self._done.notify_all()
+        for cmd in cmds:
+            if not cmd.future.done():
+                cmd.future.set_exception(McbdscCommandChannelClosedError("The output stream of the container was closed."))
+
+    def _dispatch(self, line: str) -> None:
+        for listener in self._listeners:
+            try:
+                listener(line)
+            except Exception as e:
+                logger.warning("A listener of the command channel raised an exception: {e}".format(e=e))
+        with self._lock:
+            # tty が有効な場合は、書き込んだコマンドがエコーバックされるので応答には含めない。
+            for cmd in self._inflight:
+                if not cmd.echoed and not cmd.lines and line.strip() == cmd.command:
+                    cmd.echoed = True
+                    return
+            if not self._inflight:
+                return
+            cmd = self._inflight[0]
+            cmd.lines.append(line)
+            cmd.last_output = time.monotonic()
+            if cmd.expect is not None and cmd.expect.search(line):
+                self._inflight.popleft()
+                self._done.notify_all()
+                cmd.future.set_result(cmd.lines)
+
+    def _check_inflight(self) -> None:
+        with self._lock:
+            self._expire(time.monotonic())
+
+    def _expire(self, now: float) -> None:
+        """ 応答が完了した、又は期限を過ぎたコマンドを完了させるメソッド。 `_lock` を取得した状態でコールすること。 """
+        if self._inflight:
+            cmd = self._inflight[0]
+            if cmd.expect is None and cmd.last_output is not None and now - cmd.last_output >= self._idle:
+                self._inflight.popleft()
+                self._done.notify_all()
+                cmd.future.set_result(cmd.lines)
+        for cmd in [c for c in self._inflight if now >= c.deadline]:
+            self._inflight.remove(cmd)
+            self._done.notify_all()
+            cmd.future.set_exception(McbdscCommandTimeoutError(
+                "No response to the command \"{command}\" within {timeout} seconds."
+                .format(command=cmd.command, timeout=cmd.timeout)))
@@ -1,4 +1,24 @@
 version = "0.3.1"
 
 bds_version_pat = "[0-9]+\\.[0-9]+\\.[0-9]+\\.[0-9]+"
-bds_zip_file_pat = "bedrock-server-({version_pat})\\.zip".format(version_pat=bds_version_pat)
\ No newline at end of file
+bds_zip_file_pat = "bedrock-server-({version_pat})\\.zip".format(version_pat=bds_version_pat)
+# Bedrock Server が待ち受ける UDP ポートのデフォルト値。
+bds_default_port = 19132
+
+# pymcbdsc が作成・管理するコンテナに付与するラベル。
+container_label = "pymcbdsc"
+
+# バージョンストアを利用するコンテナで、展開済みの全バージョンを読み込み専用でマウントするパス。
+store_versions_mount = "/opt/bedrock-versions"
+# バージョンストアを利用するコンテナで、起動する BDS のバージョンを記録する /volume 配下のファイル名。
+server_version_file = "bedrock_server_version"
+
+# `mcbdsc daemon` が待ち受ける制御ソケットの、 pymcbdsc_root_dir 配下のファイル名。
+control_socket_file = "mcbdsc.sock"
+# pymcbdsc の状態を保持する SQLite データベースの、 pymcbdsc_root_dir 配下のファイル名。
+state_db_file = "state.db"
+# リソース毎のロックファイルを作成する、 pymcbdsc_root_dir 配下のディレクトリ名。
+lock_dir = "locks"
+# ウォームプールのコンテナ名の接頭辞と、そのコンテナに付与する(値をコンテナイメージとする)ラベル。
+warm_container_prefix = "mcbdsc-warm-"
+warm_label = "pymcbdsc.warm"
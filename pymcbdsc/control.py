@@ -0,0 +1,443 @@
+""" `mcbdsc daemon` の制御ソケットを提供するモジュール。
+
+デーモンは McbdscDockerManager 及び McbdscDownloader のインスタンスと、それらが保持するキャッシュや Docker への接続を
+起動している間保持し続け、 Unix ドメインソケットで小さな JSON API を提供します。
+サブコマンドはデーモンが起動していればこの API を呼び出し、起動していなければ同じ処理を自身のプロセスで実行します。
+
+プロトコルは改行区切りの JSON です。一つの接続で複数のリクエストを順に送信できます。
+
+    リクエスト: {"method": "status", "params": {"timeout": 1.0}}
+    応答:       {"result": {...}} 又は {"error": "...", "type": "..."}
+
+This module provides the control socket of `mcbdsc daemon`, which keeps the manager, the downloader and their caches.
+"""
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from logging import getLogger
+from .constants import control_socket_file, version
+from .exceptions import McbdscControlError, McbdscDaemonUnavailableError
+
+if TYPE_CHECKING:
+    # 型コメントでのみ参照するものは、 pyflakes が未使用と判定するので noqa とする。
+    from .autoscaler import McbdscAutoscaler  # noqa: F401
+    from .docker import McbdscDockerManager
+    from .downloader import McbdscDownloader
+    from .health import McbdscHealthMonitor  # noqa: F401
+    from .metrics import McbdscMetricsCollector  # noqa: F401
+    from .repository import McbdscSnapshot
+
+
+logger = getLogger(__name__)
+
+
+def control_socket_path(root_dir: str) -> str:
+    """ `root_dir` を利用するデーモンの、制御ソケットのパスを戻す関数。
+
+    Args:
+        root_dir (str): pymcbdsc が利用するディレクトリ(フォルダ).
+
+    Returns:
+        str: 制御ソケットのパス.
+
+    Examples:
+
+        >>> from pymcbdsc.control import control_socket_path
+        >>>
+        >>> control_socket_path("/var/lib/pymcbdsc")
+        '/var/lib/pymcbdsc/mcbdsc.sock'
+    """
+    return os.path.join(root_dir, control_socket_file)
+
+
+def snapshot_summary(snapshot: "McbdscSnapshot") -> dict:
+    """ スナップショットの、ファイルの一覧を除いた概要を dict で戻す関数。 """
+    return {"server": snapshot.server, "snapshot_id": snapshot.snapshot_id, "timestamp": snapshot.timestamp,
+            "files": len(snapshot.files), "size": snapshot.size}
+
+
+class McbdscControlService(object):
+    """ 制御ソケットで提供する処理を実装するクラス。
+
+    デーモンはこのクラスのインスタンスを一つだけ作成して全てのリクエストで共有し、デーモンが起動していない場合は
+    サブコマンドがその場で作成して `call()` します。どちらの場合も戻り値は JSON に変換できる値です。
+
+    状態を変更する処理は同時に一つだけ実行し、参照のみの処理(`read_only_methods`)は同時に実行します。
+
+    Examples:
+
+        >>> from pymcbdsc import McbdscDockerManager, McbdscDownloader
+        >>> from pymcbdsc.control import McbdscControlService
+        >>>
+        >>> service = McbdscControlService(McbdscDockerManager, McbdscDownloader())
+        >>> sorted(service.call("ping", {}))
+        ['pid', 'uptime', 'version']
+    """
+
+    read_only_methods = ("ping", "status", "health", "autoscale", "warm_pools", "metrics", "list_backups")
+
+    def __init__(self, manager_factory: Callable[[], "McbdscDockerManager"], downloader: "McbdscDownloader") -> None:
+        """ McbdscControlService インスタンスの初期化メソッド。
+
+        Args:
+            manager_factory (Callable[[], McbdscDockerManager]): McbdscDockerManager インスタンスを作成する関数.
+                                                                 Docker を利用する処理を初めて実行する時点で一度だけ呼び出す.
+            downloader (McbdscDownloader): 利用する McbdscDownloader インスタンス.
+        """
+        self._manager_factory = manager_factory
+        self._manager = None
+        self._downloader = downloader
+        self._started = time.monotonic()
+        self._lock = threading.RLock()
+        # デーモンが死活監視をしている場合に、その McbdscHealthMonitor インスタンスを設定する。
+        self.health_monitor = None  # type: Optional[McbdscHealthMonitor]
+        # デーモンがサーバグループの台数を調整している場合に、その McbdscAutoscaler インスタンスを設定する。
+        self.autoscaler = None  # type: Optional[McbdscAutoscaler]
+        # `metrics` を初めて呼び出した時点で作成し、以降の呼び出しで共有する McbdscMetricsCollector インスタンス。
+        self.metrics_collector = None  # type: Optional[McbdscMetricsCollector]
+        self._metrics_servers = {}
+        self._metrics_lock = threading.Lock()
+        self.methods = {"ping": self.ping,
+                        "refresh": self.refresh,
+                        "download": self.download,
+                        "build": self.build,
+                        "verify": self.verify,
+                        "create": self.create,
+                        "start": self.start,
+                        "stop": self.stop,
+                        "status": self.status,
+                        "health": self.health,
+                        "autoscale": self.autoscale,
+                        "warm_pools": self.warm_pools,
+                        "metrics": self.metrics,
+                        "backup": self.backup,
+                        "list_backups": self.list_backups,
+                        "restore": self.restore,
+                        "switch_version": self.switch_version,
+                        "gc": self.gc}
+
+    @property
+    def manager(self) -> "McbdscDockerManager":
+        """ 利用する McbdscDockerManager インスタンス。初めて参照した時点で作成する。 """
+        with self._lock:
+            if self._manager is None:
+                self._manager = self._manager_factory()
+            return self._manager
+
+    def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """ `method` を `params` を引数として実行し、その戻り値を戻すメソッド。
+
+        Args:
+            method (str): 実行する処理の名前.
+            params (Dict[str, Any]): 処理に渡すキーワード引数.
+
+        Raises:
+            McbdscControlError: `method` が存在しない場合.
+
+        Returns:
+            Any: 処理の戻り値.
+        """
+        if method not in self.methods:
+            raise McbdscControlError("Unknown method: {method}".format(method=method))
+        func = self.methods[method]
+        if method in self.read_only_methods:
+            return func(**params)
+        with self._lock:
+            return func(**params)
+
+    def ping(self) -> dict:
+        """ デーモンのバージョン、プロセス ID 及び起動してからの秒数を戻すメソッド。 """
+        return {"version": version, "pid": os.getpid(), "uptime": time.monotonic() - self._started}
+
+    def refresh(self) -> None:
+        """ 保持しているコンテナの一覧と取得済みの最新バージョンを破棄し、状態のデータベースを同期し直させるメソッド。 """
+        if self._manager is not None:
+            self._manager.reset_containers()
+            if self._manager.state_db() is not None:
+                self._manager.state_db().expire()
+        self._downloader.reset_latest_version()
+
+    def download(self, agree_to_meula_and_pp: Optional[bool] = None, extract: bool = False) -> dict:
+        """ 必要があれば最新バージョンをダウンロードし、そのバージョンとバージョンストアへの展開結果を戻すメソッド。 """
+        downloader = self._downloader
+        # デーモンが起動してから新しいバージョンが公開されている可能性があるので、ダウンロードページを取得し直す。
+        downloader.reset_latest_version()
+        downloader.download_latest_version_zip_file_if_needed(agree_to_meula_and_pp=agree_to_meula_and_pp)
+        counts = downloader.extract_latest_version_zip_file_if_needed() if extract else None
+        return {"version": downloader.latest_version(), "extracted": counts}
+
+    def build(self, version: Optional[str] = None, runtime: bool = False) -> dict:
+        """ Docker Image を Build し、 latest 及びマイナーバージョンのタグを付け直すメソッド。
+
+        `runtime` が True の場合は、バージョンストアを利用するランタイムイメージを Build します。
+
+        Raises:
+            McbdscControlError: `version` の BDS Zip ファイルがダウンロードされていない場合.
+        """
+        manager = self.manager
+        if runtime:
+            manager.build_runtime_image()
+            return {"version": None}
+        version = version if version else manager.get_bds_latest_version_from_local_file()
+        available_versions = manager.get_bds_versions_from_local_file()
+        if version not in available_versions:
+            raise McbdscControlError('The version specified is "{version}", but the available versions are as follows: '
+                                     '{available_versions}'.format(version=version,
+                                                                   available_versions=", ".join(available_versions)))
+        manager.build_image(version=version)
+        manager.set_latest_tag_to_latest_image()
+        manager.set_minor_tags()
+        return {"version": version}
+
+    def verify(self, workers: Optional[int] = None, use_cache: bool = True) -> List[dict]:
+        """ BDS Zip ファイルとバックアップリポジトリのオブジェクトを検証し、ファイル毎の結果を戻すメソッド。 """
+        return [{"kind": r.kind, "path": r.path, "ok": r.ok, "error": r.error, "size": r.size, "cached": r.cached}
+                for r in self.manager.verify(workers=workers, use_cache=use_cache)]
+
+    def create(self, allocate: bool = False, cpus: Optional[int] = None) -> Dict[str, dict]:
+        """ 未作成のコンテナを作成し、 `allocate` が True であれば割り当てたリソースを戻すメソッド。 """
+        manager = self.manager
+        allocations = manager.allocate_resources(cpus_per_server=cpus or None) if allocate else {}
+        manager.reset_containers()
+        manager.factory_containers()
+        return allocations
+
+    def start(self) -> None:
+        """ 全コンテナを起動するメソッド。 """
+        self.manager.start_containers()
+
+    def stop(self) -> None:
+        """ 全コンテナを停止するメソッド。 """
+        self.manager.stop_containers()
+
+    def status(self, timeout: float = 1.0) -> Dict[str, dict]:
+        """ 全サーバの状態を、サーバ名と McbdscServerStatus.to_dict() の dict で戻すメソッド。 """
+        return {name: st.to_dict() for (name, st) in self.manager.query_status(timeout=timeout).items()}
+
+    def health(self, timeout: float = 1.0) -> Dict[str, dict]:
+        """ 全サーバの死活の状態と稼働率等の統計を、サーバ名と McbdscServerHealth.to_dict() の dict で戻すメソッド。
+
+        デーモンが死活監視をしていなければ、再起動せずに一度だけ確認した結果を戻します。
+        """
+        monitor = self.health_monitor
+        if monitor is None:
+            monitor = self.manager.health_monitor(timeout=timeout, restart=False)
+            monitor.check()
+        return {name: h.to_dict() for (name, h) in monitor.health().items()}
+
+    def autoscale(self) -> Dict[str, dict]:
+        """ サーバグループ毎の、前回の確認時のサーバ、プレイヤー数、定員及び使用率を戻すメソッド。
+
+        デーモンがサーバグループの台数を調整していなければ、空の dict を戻します。
+        """
+        autoscaler = self.autoscaler
+        return autoscaler.status() if autoscaler is not None else {}
+
+    def warm_pools(self) -> Dict[str, dict]:
+        """ コンテナイメージ毎の、ウォームプールのコンテナと補充中のコンテナの数等を戻すメソッド。 """
+        return {image: pool.status() for (image, pool) in self.manager.warm_pools().items()}
+
+    def metrics(self, port: Optional[int] = None) -> str:
+        """ 全コンテナのリソース使用状況を、 Prometheus のテキスト形式で戻すメソッド。
+
+        初めての呼び出しで収集を開始し、以降の呼び出しは同じ McbdscMetricsCollector の値を戻します。
+        `port` を指定した場合は、そのポートの HTTP エンドポイントも開始します(開始済みであれば何もしません)。
+        """
+        with self._metrics_lock:
+            if self.metrics_collector is None:
+                self.metrics_collector = self.manager.metrics_collector()
+                self.metrics_collector.start()
+            if port is not None and port not in self._metrics_servers:
+                self._metrics_servers[port] = self.metrics_collector.serve(port=port)
+                logger.info("Serve the metrics on port {port}.".format(port=port))
+            return self.metrics_collector.render_prometheus()
+
+    def close(self) -> None:
+        """ `metrics` で開始した収集と HTTP エンドポイントを停止するメソッド。 """
+        with self._metrics_lock:
+            for server in self._metrics_servers.values():
+                server.shutdown()
+                server.server_close()
+            self._metrics_servers = {}
+            if self.metrics_collector is not None:
+                self.metrics_collector.stop()
+                self.metrics_collector = None
+
+    def backup(self, archive: bool = False, compression: str = "gz", level: int = 6,
+               workers: Optional[int] = None) -> Dict[str, Any]:
+        """ 全サーバをバックアップし、アーカイブのパス又はスナップショットの概要を戻すメソッド。 """
+        manager = self.manager
+        if archive:
+            return manager.backup(compression=compression, level=level, workers=workers)
+        return {name: snapshot_summary(snapshot) for (name, snapshot) in manager.snapshot().items()}
+
+    def list_backups(self, name: Optional[str] = None) -> List[dict]:
+        """ スナップショットの概要を古い順に戻すメソッド。 """
+        return [snapshot_summary(s) for s in self.manager.backup_repository().list_snapshots(server=name)]
+
+    def restore(self, name: str, snapshot_id: Optional[str] = None, only_changed: bool = True) -> dict:
+        """ スナップショットをリストアし、その結果を戻すメソッド。 """
+        result = self.manager.restore(name, snapshot_id=snapshot_id, only_changed=only_changed)
+        return {"files": result.files, "size": result.size, "removed": result.removed, "seconds": result.seconds,
+                "downtime": result.downtime, "throughput": result.throughput}
+
+    def switch_version(self, name: str, version: str, restart: bool = True) -> None:
+        """ サーバが起動する BDS のバージョンを切り替えるメソッド。 """
+        self.manager.switch_version(name, version, restart=restart)
+
+    def gc(self, keep: Optional[int] = None, grace: float = 3600.0) -> dict:
+        """ 必要があれば古いスナップショットを削除した上で、参照されていないオブジェクトを削除するメソッド。 """
+        repository = self.manager.backup_repository()
+        pruned = repository.prune(keep=keep) if keep is not None else []
+        (count, size) = repository.gc(grace=grace)
+        return {"pruned": [snapshot_summary(s) for s in pruned], "count": count, "size": size}
+
+
+class McbdscControlServer(object):
+    """ McbdscControlService を Unix ドメインソケットで提供するクラス。
+
+    接続毎に一つのスレッドでリクエストを処理します。ソケットは所有者のみが読み書きできるパーミッションで作成します。
+
+    Examples:
+
+        >>> from pymcbdsc.control import McbdscControlServer, control_socket_path
+        >>>
+        >>> server = McbdscControlServer(service, control_socket_path("/var/lib/pymcbdsc"))  # doctest: +SKIP
+        >>> server.start()  # doctest: +SKIP
+    """
+
+    def __init__(self, service: McbdscControlService, socket_path: str) -> None:
+        """ McbdscControlServer インスタンスの初期化メソッド。
+
+        Args:
+            service (McbdscControlService): リクエストを処理する McbdscControlService インスタンス.
+            socket_path (str): 待ち受ける Unix ドメインソケットのパス.
+        """
+        self._service = service
+        self._socket_path = socket_path
+        self._server = None
+
+    @property
+    def socket_path(self) -> str:
+        return self._socket_path
+
+    def _remove_stale_socket(self) -> None:
+        """ 以前のデーモンが残したソケットファイルを削除するメソッド。他のデーモンが待ち受けていれば例外を raise する。 """
+        if not os.path.exists(self._socket_path):
+            return
+        try:
+            McbdscControlClient(self._socket_path, timeout=1.0).call("ping")
+        except McbdscDaemonUnavailableError:
+            logger.info("Remove the stale control socket: {path}".format(path=self._socket_path))
+            os.remove(self._socket_path)
+        else:
+            raise RuntimeError("Another daemon is listening on {path}.".format(path=self._socket_path))
+
+    def start(self) -> None:
+        """ 制御ソケットでの待ち受けを、バックグラウンドのスレッドで開始するメソッド。 """
+        service = self._service
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    self.wfile.write(json.dumps(self.dispatch(line)).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+
+            def dispatch(self, line: bytes) -> dict:
+                try:
+                    request = json.loads(line.decode("utf-8"))
+                    return {"result": service.call(request["method"], request.get("params") or {})}
+                except Exception as e:
+                    logger.debug("The request failed: {line!r}".format(line=line), exc_info=True)
+                    return {"error": str(e), "type": type(e).__name__}
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        self._remove_stale_socket()
+        old_umask = os.umask(0o077)
+        try:
+            self._server = Server(self._socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        threading.Thread(target=self._server.serve_forever, name="mcbdsc-control", daemon=True).start()
+        logger.info("Listen on the control socket: {path}".format(path=self._socket_path))
+
+    def stop(self) -> None:
+        """ 待ち受けを停止し、ソケットファイルを削除するメソッド。 """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+
+
+class McbdscControlClient(object):
+    """ 制御ソケットに接続し、デーモンの McbdscControlService を呼び出すクラス。
+
+    Examples:
+
+        >>> from pymcbdsc.control import McbdscControlClient, control_socket_path
+        >>>
+        >>> client = McbdscControlClient(control_socket_path("/var/lib/pymcbdsc"))
+        >>> client.call("status", timeout=1.0)  # doctest: +SKIP
+        {'mcbdsc_test': {'address': ['127.0.0.1', 19132], 'online': True, ...}}
+    """
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None) -> None:
+        """ McbdscControlClient インスタンスの初期化メソッド。
+
+        Args:
+            socket_path (str): デーモンの制御ソケットのパス.
+            timeout (float, optional): 応答を待つ秒数. None の場合は処理が終わるまで待つ. Defaults to None.
+        """
+        self._socket_path = socket_path
+        self._timeout = timeout
+
+    def call(self, method: str, **params) -> Any:
+        """ デーモンで `method` を実行し、その戻り値を戻すメソッド。
+
+        デーモンに接続できなかった場合は、処理を依頼していないことが確実なので McbdscDaemonUnavailableError を raise します。
+        呼び出し側はこの例外を受け取った場合に限り、同じ処理を自身のプロセスで実行できます。
+
+        Args:
+            method (str): 実行する処理の名前.
+            **params: 処理に渡すキーワード引数. JSON に変換できる値である必要がある.
+
+        Raises:
+            McbdscDaemonUnavailableError: デーモンが起動していない場合.
+            McbdscControlError: デーモンでの処理が失敗した場合.
+
+        Returns:
+            Any: 処理の戻り値.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            raise McbdscDaemonUnavailableError("Unix domain sockets are not supported on this platform.")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self._timeout)
+            try:
+                sock.connect(self._socket_path)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise McbdscDaemonUnavailableError(str(e))
+            request = {"method": method, "params": params}
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise McbdscControlError("The daemon closed the connection without a response.")
+        response = json.loads(line.decode("utf-8"))
+        if "error" in response:
+            raise McbdscControlError("{type}: {error}".format(**response))
+        return response["result"]
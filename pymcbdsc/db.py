@@ -0,0 +1,311 @@
+""" pymcbdsc の状態を、実行をまたいで SQLite に保持するモジュール。
+
+ダウンロード済みの BDS Zip ファイル(ハッシュ値・サイズ)、ビルドしたコンテナイメージ(フィンガープリント・タグ)、
+管理しているコンテナ(パラメータのハッシュ値・ポート)、コンテナのログを読み込んだ位置及びバックアップのスナップショットを、インデックス付きのテーブルに保存します。
+これにより、バージョンやタグやスナップショットの一覧を、ディレクトリの走査や Docker API の呼び出しではなく
+インデックスの参照で取得できます。
+
+データベースはキャッシュであり、正しい状態はファイルシステムと Docker ホストが持っています。
+
+* ディレクトリから作成した表は、ディレクトリの更新時刻(mtime)が記録した値と一致する間だけ利用します。
+* Docker API から作成した表は、同期してから `ttl` 秒の間だけ利用します。
+* pymcbdsc 自身による変更は、その時点で書き込みます(write-through)。
+
+書き込みに失敗した場合は警告を出力して処理を続けるので、データベースが壊れていても pymcbdsc は動作します。
+
+This module keeps the state of pymcbdsc in SQLite between the runs, so that the lookups are the index hits.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+# mtime がこの秒数以内のディレクトリは、同じ mtime のまま更新される可能性があるので記録しない。
+racy_seconds = 2.0
+
+_schema = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS zips (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS zips_dir_version ON zips (dir, version);
+CREATE TABLE IF NOT EXISTS images (
+    tag TEXT PRIMARY KEY,
+    repository TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS images_repository ON images (repository);
+CREATE TABLE IF NOT EXISTS containers (
+    name TEXT PRIMARY KEY,
+    host TEXT,
+    container_id TEXT NOT NULL,
+    spec_hash TEXT,
+    ports TEXT
+);
+CREATE TABLE IF NOT EXISTS log_offsets (
+    container TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    seen INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    repository TEXT NOT NULL,
+    server TEXT NOT NULL,
+    snapshot_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    file_count INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    PRIMARY KEY (repository, server, snapshot_id)
+);
+CREATE INDEX IF NOT EXISTS snapshots_server_timestamp ON snapshots (repository, server, timestamp);
+"""
+
+
+class McbdscStateDB(object):
+    """ pymcbdsc の状態を保持する SQLite データベースのクラス。
+
+    一つの接続を全てのスレッドで共有し、操作はロックで直列化します。複数のプロセスからは WAL モードで同時に利用できます。
+
+    Examples:
+
+        >>> import os
+        >>> import tempfile
+        >>> from pymcbdsc.db import McbdscStateDB
+        >>>
+        >>> db = McbdscStateDB(os.path.join(tempfile.mkdtemp(), "state.db"))
+        >>> db.add_image_tag("bedrock", "bedrock:1.16.201.02", "sha256:0123", fingerprint="ab" * 32)
+        >>> db.add_image_tag("bedrock", "bedrock:latest", "sha256:0123")
+        >>> db.image_tags("bedrock")
+        ['bedrock:1.16.201.02', 'bedrock:latest']
+    """
+
+    def __init__(self, path: str, ttl: float = 300.0) -> None:
+        """ McbdscStateDB インスタンスの初期化メソッド。データベースが存在しなければ作成する。
+
+        Args:
+            path (str): データベースファイルのパス.
+            ttl (float, optional): Docker API から同期した表を利用する秒数. Defaults to 300.0.
+        """
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_schema)
+            self._conn.commit()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def _write(self, statements: Iterable[Tuple[str, Iterable]]) -> bool:
+        """ 複数の SQL を一つのトランザクションで実行するメソッド。失敗した場合は警告を出力して False を戻す。 """
+        with self._lock:
+            try:
+                with self._conn:
+                    for (sql, params) in statements:
+                        self._conn.execute(sql, tuple(params))
+                return True
+            except (sqlite3.Error, ValueError) as e:
+                logger.warning("Failed to update the state database {path}: {e}".format(path=self._path, e=e))
+                return False
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self._write([("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))])
+
+    def dir_is_fresh(self, path: str) -> bool:
+        """ ディレクトリの mtime が `mark_dir()` で記録した値と一致するか否かを戻すメソッド。
+
+        Raises:
+            FileNotFoundError: ディレクトリが存在しない場合.
+        """
+        return self.get_meta("dir:" + path) == str(os.stat(path).st_mtime_ns)
+
+    def mark_dir(self, path: str, st: os.stat_result) -> None:
+        """ ディレクトリを走査した時点の mtime を記録するメソッド。 `st` は走査する前に取得した stat である必要がある。 """
+        # mtime の精度が粗いファイルシステムでは、直後の変更で mtime が変わらない可能性があるので、次回も走査させる。
+        if time.time() - st.st_mtime < racy_seconds:
+            return
+        self.set_meta("dir:" + path, str(st.st_mtime_ns))
+
+    def is_synced(self, key: str) -> bool:
+        """ `key` の表が `ttl` 秒以内に Docker API から同期されたか否かを戻すメソッド。 """
+        synced_at = self.get_meta("synced:" + key)
+        return synced_at is not None and time.time() - float(synced_at) < self._ttl
+
+    def mark_synced(self, key: str) -> None:
+        self.set_meta("synced:" + key, repr(time.time()))
+
+    def expire(self, key: str = None) -> None:
+        """ Docker API から同期した表を、次回の参照で同期し直すようにするメソッド。 None の場合は全ての表。 """
+        if key is None:
+            self._write([("DELETE FROM meta WHERE key LIKE 'synced:%'", ())])
+        else:
+            self._write([("DELETE FROM meta WHERE key = ?", ("synced:" + key,))])
+
+    def zips(self, zip_dir: str) -> List[dict]:
+        """ ディレクトリに保存されている BDS Zip ファイルの、パス・バージョン・サイズ・mtime・ハッシュ値を戻すメソッド。 """
+        return [dict(r) for r in self._query("SELECT path, version, size, mtime_ns, sha256 FROM zips WHERE dir = ?",
+                                             (zip_dir,))]
+
+    def zip_versions(self, zip_dir: str) -> List[str]:
+        return [r["version"] for r in self._query("SELECT version FROM zips WHERE dir = ?", (zip_dir,))]
+
+    def add_zip(self, path: str, version: str, size: int, mtime_ns: int, sha256: Optional[str] = None) -> None:
+        self._write([("INSERT OR REPLACE INTO zips (path, dir, version, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                      (path, os.path.dirname(path), version, size, mtime_ns, sha256))])
+
+    def replace_zips(self, zip_dir: str, zips: List[dict]) -> None:
+        """ ディレクトリの BDS Zip ファイルの行を `zips` で置き換えるメソッド。
+
+        サイズと mtime が変わっていないファイルは、記録済みのハッシュ値を引き継ぎます。
+        """
+        known = {z["path"]: z for z in self.zips(zip_dir)}
+        statements = [("DELETE FROM zips WHERE dir = ?", (zip_dir,))]
+        for z in zips:
+            old = known.get(z["path"])
+            sha256 = z.get("sha256")
+            if sha256 is None and old is not None and (old["size"], old["mtime_ns"]) == (z["size"], z["mtime_ns"]):
+                sha256 = old["sha256"]
+            statements.append(("INSERT INTO zips (path, dir, version, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                               (z["path"], zip_dir, z["version"], z["size"], z["mtime_ns"], sha256)))
+        self._write(statements)
+
+    def image_tags(self, repository: str) -> List[str]:
+        return [r["tag"] for r in self._query("SELECT tag FROM images WHERE repository = ? ORDER BY tag", (repository,))]
+
+    def image(self, tag: str) -> Optional[dict]:
+        """ タグが付与されたコンテナイメージの ID とフィンガープリントを戻すメソッド。 """
+        rows = self._query("SELECT tag, repository, image_id, fingerprint FROM images WHERE tag = ?", (tag,))
+        return dict(rows[0]) if rows else None
+
+    def add_image_tag(self, repository: str, tag: str, image_id: str, fingerprint: Optional[str] = None) -> None:
+        self._write([("INSERT OR REPLACE INTO images (tag, repository, image_id, fingerprint) VALUES (?, ?, ?, ?)",
+                      (tag, repository, image_id, fingerprint))])
+
+    def replace_images(self, repository: str, images: Dict[str, List[str]]) -> None:
+        """ リポジトリのコンテナイメージの行を、イメージ ID とタグのリストの dict で置き換えるメソッド。
+
+        ID が変わっていないタグは、記録済みのフィンガープリントを引き継ぎます。
+        """
+        known = {r["tag"]: r for r in self._query("SELECT tag, image_id, fingerprint FROM images WHERE repository = ?",
+                                                  (repository,))}
+        statements = [("DELETE FROM images WHERE repository = ?", (repository,))]
+        for (image_id, tags) in images.items():
+            for tag in tags:
+                old = known.get(tag)
+                fingerprint = old["fingerprint"] if old is not None and old["image_id"] == image_id else None
+                statements.append(("INSERT OR REPLACE INTO images (tag, repository, image_id, fingerprint) "
+                                   "VALUES (?, ?, ?, ?)", (tag, repository, image_id, fingerprint)))
+        if self._write(statements):
+            self.mark_synced("images:" + repository)
+
+    def containers(self) -> Dict[str, dict]:
+        """ 記録されているコンテナの、コンテナ名とホスト・ID・パラメータのハッシュ値・ポートの dict を戻すメソッド。 """
+        return {r["name"]: {"host": r["host"], "container_id": r["container_id"], "spec_hash": r["spec_hash"],
+                            "ports": json.loads(r["ports"]) if r["ports"] else None}
+                for r in self._query("SELECT name, host, container_id, spec_hash, ports FROM containers")}
+
+    def _container_statement(self, name: str, host: Optional[str], container_id: str, spec_hash: Optional[str],
+                             ports: Optional[dict]) -> Tuple[str, tuple]:
+        return ("INSERT OR REPLACE INTO containers (name, host, container_id, spec_hash, ports) VALUES (?, ?, ?, ?, ?)",
+                (name, host, container_id, spec_hash, json.dumps(ports, sort_keys=True) if ports else None))
+
+    def add_container(self, name: str, host: Optional[str], container_id: str, spec_hash: Optional[str] = None,
+                      ports: Optional[dict] = None) -> None:
+        self._write([self._container_statement(name, host, container_id, spec_hash, ports)])
+
+    def replace_containers(self, names: List[str], containers: Dict[str, dict]) -> None:
+        """ `names` のコンテナの行を、 Docker API から取得したコンテナで置き換えるメソッド。
+
+        Args:
+            names (List[str]): 対象のコンテナ名. このうち `containers` に含まれないコンテナの行は削除する.
+            containers (Dict[str, dict]): コンテナ名と、 host, container_id をキーとする dict の dict.
+                                          ID が変わっていないコンテナは、記録済みのハッシュ値とポートを引き継ぐ.
+        """
+        known = self.containers()
+        statements = []
+        for name in names:
+            if name not in containers:
+                statements.append(("DELETE FROM containers WHERE name = ?", (name,)))
+                continue
+            c = containers[name]
+            old = known.get(name)
+            if old is not None and old["container_id"] == c["container_id"]:
+                statements.append(self._container_statement(name, c["host"], c["container_id"], old["spec_hash"],
+                                                            old["ports"]))
+            else:
+                statements.append(self._container_statement(name, c["host"], c["container_id"], None, None))
+        if self._write(statements):
+            self.mark_synced("containers")
+
+    def log_offset(self, container: str) -> Optional[Tuple[str, int]]:
+        """ コンテナのログを読み込んだ位置(McbdscLogTailer の `offset`)を戻すメソッド。記録が無ければ None. """
+        rows = self._query("SELECT timestamp, seen FROM log_offsets WHERE container = ?", (container,))
+        return (rows[0]["timestamp"], rows[0]["seen"]) if rows else None
+
+    def set_log_offset(self, container: str, offset: Tuple[str, int]) -> None:
+        self._write([("INSERT OR REPLACE INTO log_offsets (container, timestamp, seen) VALUES (?, ?, ?)",
+                      (container, offset[0], offset[1]))])
+
+    def remove_log_offset(self, container: str) -> None:
+        self._write([("DELETE FROM log_offsets WHERE container = ?", (container,))])
+
+    def snapshot_ids(self, repository: str, server: str) -> List[str]:
+        return [r["snapshot_id"] for r in self._query("SELECT snapshot_id FROM snapshots WHERE repository = ? AND server = ?",
+                                                      (repository, server))]
+
+    def snapshots(self, repository: str, server: Optional[str] = None) -> List[dict]:
+        """ スナップショットを古い順に戻すメソッド。 files はパスとファイルの情報の dict. """
+        sql = "SELECT server, snapshot_id, timestamp, file_count, size, files FROM snapshots WHERE repository = ?"
+        params = [repository]
+        if server is not None:
+            sql += " AND server = ?"
+            params.append(server)
+        rows = self._query(sql + " ORDER BY timestamp, snapshot_id", params)
+        return [{"server": r["server"], "snapshot_id": r["snapshot_id"], "timestamp": r["timestamp"],
+                 "file_count": r["file_count"], "size": r["size"], "files": json.loads(r["files"])} for r in rows]
+
+    def _snapshot_statement(self, repository: str, snapshot) -> Tuple[str, tuple]:
+        return ("INSERT OR REPLACE INTO snapshots (repository, server, snapshot_id, timestamp, file_count, size, files) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (repository, snapshot.server, snapshot.snapshot_id, snapshot.timestamp, len(snapshot.files),
+                 snapshot.size, json.dumps(snapshot.files, sort_keys=True)))
+
+    def add_snapshots(self, repository: str, snapshots: list) -> None:
+        """ McbdscSnapshot インスタンスのリストを記録するメソッド。 """
+        self._write([self._snapshot_statement(repository, s) for s in snapshots])
+
+    def remove_snapshots(self, repository: str, server: str, snapshot_ids: List[str]) -> None:
+        self._write([("DELETE FROM snapshots WHERE repository = ? AND server = ? AND snapshot_id = ?",
+                      (repository, server, snapshot_id)) for snapshot_id in snapshot_ids])
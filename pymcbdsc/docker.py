@@ -1,17 +1,56 @@
-from typing import List, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+import copy
+import hashlib
+import io
+import json
 import os.path
 from os import listdir
 import re
+import shutil
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-import docker
-from docker.models.containers import Container
-from docker.client import DockerClient
-from .constants import bds_version_pat, bds_zip_file_pat
-from .utils import pymcbdsc_root_dir
+from .constants import (bds_version_pat, bds_zip_file_pat, bds_default_port, container_label, lock_dir,
+                        server_version_file, state_db_file, store_versions_mount, warm_container_prefix)
+from .allocator import McbdscResourceAllocator
+from .autoscaler import McbdscAutoscaler, McbdscServerGroup
+from .backup import offline_backup, online_backup
+from .clone import McbdscWorldCloner
+from .db import McbdscStateDB
+from .health import McbdscHealthMonitor
+from .locks import McbdscLockManager
+from .console import McbdscCommandChannel
+from .logs import McbdscLogMonitor, McbdscLogTailer
+from .metrics import McbdscMetricsCollector
+from .pool import McbdscDockerClientPool
+from .progress import McbdscProgressEvent, McbdscProgressMeter
+from .raknet import McbdscServerStatus, query_status
+from .repository import McbdscBackupRepository, McbdscSnapshot, offline_snapshot, online_snapshot
+from .restore import McbdscRestoreResult, restore_snapshot
+from .scheduler import McbdscBackupScheduler
+from .store import McbdscVersionStore
+from .verify import KIND_OBJECT, KIND_ZIP, McbdscVerifier, McbdscVerifyResult
+from .warmpool import McbdscWarmPool
+from .state import McbdscStateCache
+from .trace import McbdscCountingReader, instrument_session, span
+from .utils import lazy_import, pymcbdsc_root_dir
+
+if TYPE_CHECKING:
+    from docker.client import DockerClient
+    from docker.models.containers import Container
+
+# docker-py の import には時間がかかるので、最初に利用する時点で import する。
+docker = lazy_import("docker")
 
 
 logger = getLogger(__name__)
 
+# docker build の出力のうち、ステップの開始を表す行("Step 3/12 : RUN ...")と、完成したイメージの ID を表す行。
+_build_step_re = re.compile(r"^Step (\d+)/(\d+) : (.*)")
+_build_success_re = re.compile(r"(^Successfully built |sha256:)([0-9a-f]+)$")
+
 
 class McbdscDockerManager(object):
     """ Bedrock Server のコンテナとコンテナイメージの作成・管理を行うクラス。
@@ -25,10 +64,15 @@ class McbdscDockerManager(object):
     def __init__(self,
                  containers_param: List[dict] = None,
                  pymcbdsc_root_dir: str = pymcbdsc_root_dir(),
-                 docker_client: DockerClient = None,
+                 docker_client: "DockerClient" = None,
                  dockerfile: str = "Dockerfile",
+                 runtime_dockerfile: str = "Dockerfile.runtime",
                  bds_zip_dir: str = "downloads",
-                 repository: str = "bedrock") -> None:
+                 repository: str = "bedrock",
+                 status_host: str = "127.0.0.1",
+                 client_pool: McbdscDockerClientPool = None,
+                 state_db_file: Optional[str] = state_db_file,
+                 progress: Optional[Callable[[McbdscProgressEvent], None]] = None) -> None:
         """[summary]
 
         Args:
@@ -40,10 +84,25 @@ class McbdscDockerManager(object):
                                                     None の場合は `docker.from_env()` の戻り値を利用する. Defaults to None.
             dockerfile (str, optional): Dockerfile のファイル名. pymcbdsc_root_dir の配下にあるこのファイルを読み込む.
                                         Defaults to "Dockerfile".
+            runtime_dockerfile (str, optional): バージョンストアを利用する汎用イメージの Dockerfile のファイル名.
+                                                pymcbdsc_root_dir の配下にあるこのファイルを読み込む.
+                                                Defaults to "Dockerfile.runtime".
             bds_zip_dir (str, optional): BDS Zip ファイルが保存されているディレクトリの名前.
                                          pymcbdsc_root_dir の配下にあるこの名前のディレクトリ内の BDS Zip ファイルを利用する。
                                          Defaults to "downloads".
             repository (str, optional): [description]. Defaults to "bedrock".
+            status_host (str, optional): 状態の問い合わせ(RakNet Ping)を送信する、 Docker ホストのアドレス.
+                                         Defaults to "127.0.0.1".
+            client_pool (McbdscDockerClientPool, optional): 複数の Docker ホストでコンテナを管理する場合の、
+                                                            McbdscDockerClientPool インスタンス. 指定した場合は、
+                                                            コンテナを全てのホストから探し、新しいコンテナは余裕が
+                                                            最も大きいホストに作成する. コンテナイメージとボリュームは
+                                                            `docker_client` (省略時は最初のホスト)で扱う. Defaults to None.
+            state_db_file (str, optional): 状態を保持する SQLite データベースのファイル名. pymcbdsc_root_dir の配下に作成する.
+                                           None の場合はデータベースを利用せず、毎回ディレクトリと Docker API から取得する.
+                                           Defaults to "state.db".
+            progress (Callable[[McbdscProgressEvent], None], optional): Build の進み具合を受け取るコールバック.
+                                                                         Defaults to None.
 
         Examples:
 
@@ -60,10 +119,42 @@ class McbdscDockerManager(object):
         # import することも patch することもできない。
         # docker_client: DockerClient = docker.from_env()
         # このため、デフォルト値を None としておき、 None の場合に docker.from_env() をコールする。
-        self._docker_client = docker.from_env() if docker_client is None else docker_client
+        self._client_pool = client_pool
+        if docker_client is None and client_pool is not None:
+            docker_client = client_pool.client(client_pool.hosts[0])
+        # None の場合は、 Docker API を初めて利用する時点で docker.from_env() を呼び出す。
+        self._docker_client = docker_client
+        if docker_client is not None:
+            instrument_session(docker_client.api, "docker")
         self._dockerfile = os.path.join(self._root_dir, dockerfile)
+        self._runtime_dockerfile = os.path.join(self._root_dir, runtime_dockerfile)
         self._bds_zip_dir = bds_zip_dir
         self._repository = repository
+        self._status_host = status_host
+        self._state_cache = None
+        self._state_db_file = state_db_file
+        self._state_db = None
+        self._progress = progress
+        # コンテナイメージと、 McbdscWarmPool インスタンスの dict.
+        self._warm_pools = {}
+        # `reset_containers()` で破棄した McbdscDockerContainer インスタンスの dict. 開いているコマンドチャネルを、
+        # 次の `factory_containers()` で同じコンテナのインスタンスに引き継ぐか、閉じる為に保持する。
+        self._dropped_containers = {}
+        self._resource_allocator = None
+        self._allocator_lock = threading.Lock()
+        # `log_monitor()` が最後に作成した McbdscLogMonitor インスタンスと、そのコンテナ毎のイベントの最大数。
+        self._log_monitor = None
+        self._log_max_events = 1000
+        # `metrics_collector()` が最後に作成した McbdscMetricsCollector インスタンス。
+        self._metrics_collector = None
+
+    @property
+    def docker_client(self) -> "DockerClient":
+        """ Docker ホストに接続する DockerClient インスタンス。初めて参照した時点で接続する。 """
+        if self._docker_client is None:
+            self._docker_client = docker.from_env()
+            instrument_session(self._docker_client.api, "docker")
+        return self._docker_client
 
     def factory_containers(self) -> list:
         """ McbdscDockerContainer インスタンスを初期化しリストで戻すメソッド。
@@ -72,29 +163,257 @@ class McbdscDockerManager(object):
             list: McbdscDockerContainer インスタンスのリスト。
         """
         if not hasattr(self, "_containers"):
-            dc_containers = self._docker_client.containers
-            exist_containers = dc_containers.list(all=True)
-            # name から container インスタンスを取得できる dict を作成。
-            name2container = {c.name: c for c in exist_containers}
-            containers_param = self._containers_param
-            mcbdsc_containers = []
-            for container_param in containers_param:
-                name = container_param["name"]
-                if name in name2container:
-                    # コンテナが作成済みあればそのインスタンスを指定。
-                    container = name2container[name]
+            with span("factory_containers", containers=len(self._containers_param)) as sp:
+                dc_containers = self.docker_client.containers
+                pool = self._client_pool
+                cache = self._ready_state_cache()
+                db = self.state_db()
+                names = [param["name"] for param in self._containers_param]
+                known = db.containers() if db is not None else {}
+                # キャッシュ及びデータベースは、ラベルの無いコンテナや他のホストのコンテナを含まないので、
+                # そこに無いコンテナは作成する前に Docker ホストから探す。
+                # また、そこから作成した Container インスタンスは Id, Name 及び状態しか持たないので、
+                # Config や Mounts 等を参照する処理は、 reload() してから参照すること。
+                listed_all = False
+                if cache is not None:
+                    # キャッシュが有効な場合は、 API を呼び出さずに Container インスタンスを作成する。
+                    sp.set(source="cache")
+                    name2container = {name: (None, dc_containers.prepare_model(attrs))
+                                      for (name, attrs) in cache.container_attrs().items()}
+                elif db is not None and db.is_synced("containers") and all(self._known_host(known, name) for name in names):
+                    # 全てのコンテナが、現在の Docker ホストにあるものとしてデータベースに記録されていれば、
+                    # API を呼び出さずに Container インスタンスを作成する。
+                    sp.set(source="db")
+                    name2container = {}
+                    for name in names:
+                        (host, container_id) = (known[name]["host"], known[name]["container_id"])
+                        client_containers = pool.client(host).containers if host is not None else dc_containers
+                        attrs = {"Id": container_id, "Name": "/" + name}
+                        name2container[name] = (host, client_containers.prepare_model(attrs))
                 else:
-                    # コンテナが未作成であれば作成。
-                    container = dc_containers.create(**container_param)
-                # start 時に処理が停止してしまうため、 detach オプションを強制的に有効。
-                # container_param["detach"] = True
-                container_param["stdin_open"] = True
-                container_param["tty"] = True
-                mcbdsc_container = McbdscDockerContainer(name=name, container=container)
-                mcbdsc_containers.append(mcbdsc_container)
-            self._containers = mcbdsc_containers
+                    sp.set(source="api")
+                    listed_all = True
+                    if pool is not None:
+                        # 全てのホストのコンテナの一覧を同時に取得する。
+                        name2container = pool.containers_by_name(all=True)
+                    else:
+                        exist_containers = dc_containers.list(all=True)
+                        # name から container インスタンスを取得できる dict を作成。
+                        name2container = {c.name: (None, c) for c in exist_containers}
+                    if db is not None:
+                        db.replace_containers(names, {name: {"host": host, "container_id": c.id}
+                                                      for (name, (host, c)) in name2container.items() if name in names})
+                        known = db.containers()
+                containers_param = self._containers_param
+                mcbdsc_containers = []
+                headrooms = None
+                for container_param in containers_param:
+                    name = container_param["name"]
+                    if name in name2container:
+                        # コンテナが作成済みあればそのインスタンスを指定。
+                        (host, container) = name2container[name]
+                        spec_hash = known.get(name, {}).get("spec_hash")
+                        if spec_hash is not None and spec_hash != self.container_spec_hash(container_param):
+                            logger.warning("The container {name} was created with different parameters. "
+                                           "Recreate it to apply the current ones.".format(name=name))
+                    else:
+                        # コンテナが未作成であれば作成。
+                        self.set_container_label(container_param)
+                        host = container_param.get("host")
+                        create_param = {k: v for (k, v) in container_param.items() if k != "host"}
+                        with self.locks().lock("container", name) as lock:
+                            # ロックを待つ間に、他のプロセスが作成したコンテナがあればそれを利用する。
+                            found = self._find_container(name) if lock.waited or not listed_all else None
+                            if found is not None:
+                                (host, container) = found
+                            elif pool is None:
+                                container = dc_containers.create(**create_param)
+                            else:
+                                if host is None:
+                                    # 余裕は一度だけ取得し、配置する毎に差し引くことで、一つのホストに集中しないようにする。
+                                    headrooms = headrooms if headrooms is not None else pool.headroom()
+                                    host = pool.place(headrooms)
+                                    container_param["host"] = host
+                                container = pool.client(host).containers.create(**create_param)
+                            if found is None:
+                                sp.add(created=1)
+                                if db is not None:
+                                    db.add_container(name, host, container.id,
+                                                     spec_hash=self.container_spec_hash(container_param),
+                                                     ports=container_param.get("ports"))
+                    # start 時に処理が停止してしまうため、 detach オプションを強制的に有効。
+                    # container_param["detach"] = True
+                    container_param["stdin_open"] = True
+                    container_param["tty"] = True
+                    mcbdsc_container = McbdscDockerContainer(name=name, container=container, host=host)
+                    mcbdsc_containers.append(mcbdsc_container)
+                (dropped, self._dropped_containers) = (self._dropped_containers, {})
+                for mcbdsc_container in mcbdsc_containers:
+                    if mcbdsc_container.name in dropped:
+                        mcbdsc_container.take_over(dropped.pop(mcbdsc_container.name))
+                for mcbdsc_container in dropped.values():
+                    mcbdsc_container.close()
+                self._containers = mcbdsc_containers
         return self._containers
 
+    def _find_container(self, name: str) -> Optional[tuple]:
+        """ `name` のコンテナを Docker ホストから探し、ホスト名と Container インスタンスの tuple を戻すメソッド。無ければ None. """
+        pool = self._client_pool
+        if pool is not None:
+            return pool.containers_by_name(all=True).get(name)
+        found = [c for c in self.docker_client.containers.list(all=True, filters={"name": "^/{name}$".format(name=name)})
+                 if c.name == name]
+        return (None, found[0]) if found else None
+
+    def _known_host(self, known: Dict[str, dict], name: str) -> bool:
+        if name not in known:
+            return False
+        host = known[name]["host"]
+        return host is None if self._client_pool is None else host in self._client_pool.hosts
+
+    def reset_containers(self) -> None:
+        """ `factory_containers()` が保持している McbdscDockerContainer インスタンスのリストを破棄するメソッド。
+
+        pymcbdsc の外でコンテナが作成・削除された場合に、次の `factory_containers()` で一覧を取得し直します。
+        破棄したインスタンスのコマンドチャネルは、次の `factory_containers()` で同じコンテナのインスタンスに引き継ぎ、
+        管理しなくなったコンテナのものは閉じます。
+        """
+        if hasattr(self, "_containers"):
+            for container in self._containers:
+                previous = self._dropped_containers.get(container.name)
+                if previous is not None and previous is not container:
+                    previous.close()
+                self._dropped_containers[container.name] = container
+            del self._containers
+        if self.state_db() is not None:
+            self.state_db().expire("containers")
+
+    @classmethod
+    def container_spec_hash(cls, container_param: dict) -> str:
+        """ コンテナのパラメータのうち、コンテナの作成に利用するもののハッシュ値を戻すクラスメソッド。
+
+        Examples:
+
+            >>> from pymcbdsc import McbdscDockerManager
+            >>>
+            >>> a = McbdscDockerManager.container_spec_hash({"name": "a", "image": "bedrock:latest"})
+            >>> b = McbdscDockerManager.container_spec_hash({"image": "bedrock:latest", "name": "a", "host": "host1"})
+            >>> a == b
+            True
+        """
+        param = copy.deepcopy({k: v for (k, v) in container_param.items() if k not in ("host", "stdin_open", "tty")})
+        cls.set_container_label(param)
+        return hashlib.sha256(json.dumps(param, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def state_db(self) -> Optional[McbdscStateDB]:
+        """ 状態を保持する McbdscStateDB インスタンスを戻すメソッド。 `state_db_file` が None の場合は None を戻す。 """
+        if self._state_db is None and self._state_db_file is not None:
+            os.makedirs(self._root_dir, exist_ok=True)
+            self._state_db = McbdscStateDB(os.path.join(self._root_dir, self._state_db_file))
+        return self._state_db
+
+    def locks(self) -> McbdscLockManager:
+        """ McbdscDownloader や他のプロセスと共有する、リソース毎のロックを管理する McbdscLockManager インスタンスを戻すメソッド。
+
+        イメージのタグ毎("image")とコンテナ毎("container")のロックを利用し、同じリソースを操作する処理のみを互いに待たせます。
+        """
+        return McbdscLockManager(os.path.join(self._root_dir, lock_dir))
+
+    def map_containers(self, func, containers: list = None, locked: bool = False) -> dict:
+        """ 管理する全コンテナに対して `func(container)` を同時に呼び出すメソッド。
+
+        コンテナ毎に一つのスレッドで呼び出すので、全体の所要時間は最も時間のかかるコンテナの所要時間程度となります。
+        いずれかの呼び出しが例外を raise した場合は、全ての呼び出しが終わってから最初の例外を raise します。
+
+        Args:
+            func (Callable[[McbdscDockerContainer], T]): 呼び出す関数.
+            containers (list, optional): 対象の McbdscDockerContainer インスタンスのリスト.
+                                         None の場合は `factory_containers()` の戻り値. Defaults to None.
+            locked (bool, optional): コンテナ毎のロックを取得してから `func` を呼び出すか否か. Defaults to False.
+
+        Returns:
+            dict: コンテナ名と、 `func` の戻り値の dict.
+        """
+        containers = containers if containers is not None else self.factory_containers()
+        if not containers:
+            return {}
+        if locked:
+            locks = self.locks()
+            unlocked_func = func
+
+            def func(c):
+                with locks.lock("container", c.name):
+                    return unlocked_func(c)
+        with ThreadPoolExecutor(max_workers=len(containers)) as executor:
+            futures = {c.name: executor.submit(func, c) for c in containers}
+        errors = [f.exception() for f in futures.values() if f.exception() is not None]
+        if errors:
+            raise errors[0]
+        return {name: f.result() for (name, f) in futures.items()}
+
+    def start_containers(self) -> None:
+        """ 管理する全コンテナを同時に起動するメソッド。 """
+        self.map_containers(lambda c: c.start(), locked=True)
+
+    def stop_containers(self) -> None:
+        """ 管理する全コンテナを同時に停止するメソッド。 """
+        self.map_containers(lambda c: c.stop(), locked=True)
+
+    def container_stats(self) -> Dict[str, dict]:
+        """ 管理する全コンテナの stats を、同時に一度ずつ取得するメソッド。 """
+        return self.map_containers(lambda c: c.stats(stream=False))
+
+    @classmethod
+    def set_container_label(cls, container_param: dict) -> None:
+        """ コンテナのパラメータに、 pymcbdsc が管理するコンテナであることを示すラベルを追加するクラスメソッド。
+
+        Args:
+            container_param (dict): コンテナのパラメータ.
+
+        Examples:
+
+            >>> from pymcbdsc import McbdscDockerManager
+            >>>
+            >>> param = {"name": "mcbdsc_test", "labels": ["foo"]}
+            >>> McbdscDockerManager.set_container_label(param)
+            >>> param["labels"]
+            ['foo', 'pymcbdsc']
+        """
+        labels = container_param.setdefault("labels", {})
+        # docker-py の labels には dict 又は list を指定できる。
+        if isinstance(labels, list):
+            if container_label not in labels:
+                labels.append(container_label)
+        else:
+            labels.setdefault(container_label, "true")
+
+    def start_state_cache(self, timeout: Optional[float] = 10.0) -> McbdscStateCache:
+        """ Docker の events API を購読し、コンテナとコンテナイメージの状態のキャッシュを開始するメソッド。
+
+        キャッシュが同期されている間は、コンテナの一覧やコンテナイメージのタグの取得は API を呼び出さずにメモリから読み込みます。
+
+        Args:
+            timeout (float, optional): キャッシュが同期されるまで待つ秒数. Defaults to 10.0.
+
+        Returns:
+            McbdscStateCache: 開始した McbdscStateCache インスタンス.
+        """
+        if self._state_cache is None:
+            self._state_cache = McbdscStateCache(docker_client=self.docker_client, repository=self._repository)
+            self._state_cache.start()
+        self._state_cache.wait_ready(timeout)
+        return self._state_cache
+
+    def stop_state_cache(self) -> None:
+        """ コンテナとコンテナイメージの状態のキャッシュを停止するメソッド。 """
+        if self._state_cache is not None:
+            self._state_cache.stop()
+            self._state_cache = None
+
+    def _ready_state_cache(self) -> Optional[McbdscStateCache]:
+        cache = self._state_cache
+        return cache if cache is not None and cache.is_ready() else None
+
     def build_image(self, version: str = None, extra_buildargs: dict = None, **extra_build_opt):
         """ Minecraft Bedrock Server の Docker Image を Build するメソッド。
 
@@ -104,12 +423,13 @@ class McbdscDockerManager(object):
             version (str, optional): Build する Docker Image の Minecraft のバージョン. None の場合は、最新バージョンとなる. Defaults to None.
             extra_buildargs (dict, optional): Docker Image を Build する際の、追加の引数. Defaults to None.
 
+        状態のデータベースに記録されたフィンガープリント(Dockerfile, entrypoint.sh, BDS Zip ファイル及びビルド引数から
+        計算する値)が一致し、そのイメージがまだ存在する場合は、 Build せずにそのイメージを戻します。
+
         Returns:
-            [type]: Build した Docker Image.
+            [type]: Build した Docker Image と、 Build のログの tuple.
         """
-        dc_images = self._docker_client.images
-        root_dir = self._root_dir
-        dockerfile = self._dockerfile
+        dc_images = self.docker_client.images
         if version is None:
             version = self.get_bds_latest_version_from_local_file()
         buildargs = {"BEDROCK_SERVER_VER": version,
@@ -117,8 +437,210 @@ class McbdscDockerManager(object):
         if extra_buildargs is not None:
             buildargs.update(extra_buildargs)
         tag = "{repository}:{version}".format(repository=self._repository, version=version)
-        logger.info("Build image: {tag}".format(tag=tag))
-        return dc_images.build(path=root_dir, dockerfile=dockerfile, buildargs=buildargs, tag=tag, **extra_build_opt)
+        # 同じタグの Build は一つずつ行い、待っている間に他のプロセスが Build したイメージは、フィンガープリントで再利用する。
+        with self.locks().lock("image", tag):
+            db = self.state_db()
+            fingerprint = self.image_fingerprint(version, buildargs)
+            known = db.image(tag) if db is not None and not extra_build_opt else None
+            if known is not None and known["fingerprint"] == fingerprint:
+                try:
+                    image = dc_images.get(tag)
+                except docker.errors.ImageNotFound:
+                    image = None
+                if image is not None and image.id == known["image_id"]:
+                    logger.info("Skip building the image {tag}: it is up to date.".format(tag=tag))
+                    return (image, [])
+            logger.info("Build image: {tag}".format(tag=tag))
+            with span("build_image", tag=tag):
+                # Build コンテキストの作成とアップロードの時間を分けて計測する為に、コンテキストは docker-py に任せずに作成する。
+                with span("build_image.context") as sp:
+                    (context, dockerfile) = self.build_context()
+                    size = context.seek(0, os.SEEK_END)
+                    sp.add(bytes=size)
+                    context.seek(0)
+                with span("build_image.build") as sp:
+                    upload = McbdscProgressMeter(self._progress, "build.context", total=size)
+                    reader = McbdscCountingReader(context, callback=upload.update)
+                    started = time.monotonic()
+                    try:
+                        result = self._stream_build(reader, upload, dockerfile=dockerfile, buildargs=buildargs, tag=tag,
+                                                    **extra_build_opt)
+                    finally:
+                        context.close()
+                    # コンテキストを最後まで読み込んだ時点で、アップロードが完了したものとする。
+                    if reader.eof_at is not None:
+                        sp.add(upload_seconds=reader.eof_at - started)
+                    sp.add(upload_bytes=reader.bytes)
+                if db is not None:
+                    db.add_image_tag(self._repository, tag, result[0].id, fingerprint=fingerprint)
+            return result
+
+    def _stream_build(self, fileobj, upload: McbdscProgressMeter, **build_opt) -> Tuple[object, Iterator[dict]]:
+        """ Build の出力を逐次読み込みながら、ステップとレイヤーの進み具合を通知するメソッド。
+
+        docker-py の `images.build()` は Build が終わるまで出力を戻さないので、低レベル API の `build()` を利用し、
+        `images.build()` と同じく Build した Image と出力のイテレータの tuple を戻します。
+
+        Raises:
+            BuildError: Build に失敗した場合に raise.
+        """
+        steps = McbdscProgressMeter(self._progress, "build.step")
+        layers = {}
+        logs = []
+        image_id = None
+        for chunk in self.docker_client.api.build(fileobj=fileobj, custom_context=True, decode=True, **build_opt):
+            # 出力が始まった時点で、 Docker デーモンはコンテキストを全て受信している。
+            if upload is not None:
+                upload.finish()
+                upload = None
+            logs.append(chunk)
+            if "error" in chunk:
+                raise docker.errors.BuildError(chunk["error"], iter(logs))
+            if "ID" in chunk.get("aux", {}):
+                image_id = chunk["aux"]["ID"]
+            line = chunk.get("stream", "").strip()
+            m = _build_step_re.match(line)
+            if m:
+                steps.update(current=int(m.group(1)), total=int(m.group(2)), message=m.group(3), force=True)
+            m = _build_success_re.search(line)
+            if m:
+                image_id = m.group(2)
+            detail = chunk.get("progressDetail") or {}
+            if "id" in chunk and detail.get("total"):
+                # ベースイメージのダウンロード等、レイヤー毎の進み具合。
+                meter = layers.setdefault(chunk["id"], McbdscProgressMeter(self._progress, "build.layer"))
+                meter.update(current=detail.get("current", 0), total=detail["total"],
+                             message="{id} {status}".format(id=chunk["id"], status=chunk.get("status", "")))
+        steps.finish()
+        if image_id is None:
+            raise docker.errors.BuildError(logs[-1].get("stream", "Unknown") if logs else "Unknown", iter(logs))
+        return (self.docker_client.images.get(image_id), iter(logs))
+
+    def build_context(self):
+        """ `pymcbdsc_root_dir` を Build コンテキストとする tar アーカイブを作成するメソッド。
+
+        docker-py が `path` を指定された場合と同じく、 .dockerignore に記載されたファイルを除外します。
+
+        Returns:
+            tuple: tar アーカイブの一時ファイルと、コンテキスト内の Dockerfile のパスの tuple.
+        """
+        root_dir = self._root_dir
+        exclude = []
+        dockerignore = os.path.join(root_dir, ".dockerignore")
+        if os.path.exists(dockerignore):
+            with open(dockerignore) as f:
+                exclude = [line for line in (x.strip() for x in f.read().splitlines()) if line and line[0] != "#"]
+        dockerfile = os.path.relpath(self._dockerfile, root_dir)
+        return (docker.utils.tar(root_dir, exclude=exclude, dockerfile=(dockerfile, None)), dockerfile)
+
+    def image_fingerprint(self, version: str, buildargs: dict) -> str:
+        """ コンテナイメージの内容を決める、 Dockerfile, entrypoint.sh, BDS Zip ファイル及びビルド引数のハッシュ値を戻すメソッド。
+
+        BDS Zip ファイルは内容ではなく、サイズと更新時刻をハッシュ値の計算に利用します。
+
+        Args:
+            version (str): BDS のバージョン.
+            buildargs (dict): ビルド引数.
+
+        Returns:
+            str: SHA-256 のハッシュ値.
+        """
+        h = hashlib.sha256()
+        for path in (self._dockerfile, os.path.join(self._root_dir, "entrypoint.sh")):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    h.update(f.read())
+            h.update(b"\0")
+        zip_path = os.path.join(self._root_dir, self._bds_zip_dir, "bedrock-server-{version}.zip".format(version=version))
+        if os.path.exists(zip_path):
+            st = os.stat(zip_path)
+            h.update("{size}:{mtime}".format(size=st.st_size, mtime=st.st_mtime_ns).encode())
+        h.update(json.dumps(buildargs, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def version_store(self) -> McbdscVersionStore:
+        """ 展開した BDS をバージョン毎に保存する McbdscVersionStore インスタンスを戻すメソッド。
+
+        McbdscDownloader.version_store() と同じく、 pymcbdsc_root_dir 配下の "store" ディレクトリ(フォルダ)を利用します。
+
+        Returns:
+            McbdscVersionStore: バージョンストア.
+        """
+        return McbdscVersionStore(os.path.join(self._root_dir, "store"))
+
+    def runtime_image_tag(self) -> str:
+        """ バージョンストアを利用する汎用イメージのタグを戻すメソッド。 """
+        return "{repository}-runtime:latest".format(repository=self._repository)
+
+    def build_runtime_image(self, **extra_build_opt):
+        """ BDS を含まず、バージョンストアを読み込み専用でマウントして利用する汎用イメージを Build するメソッド。
+
+        この汎用イメージは BDS のバージョンに依存しないので、新しいバージョンの BDS を利用する際にも Build し直す必要はありません。
+
+        Returns:
+            [type]: Build した Docker Image.
+        """
+        tag = self.runtime_image_tag()
+        with self.locks().lock("image", tag):
+            logger.info("Build image: {tag}".format(tag=tag))
+            return self.docker_client.images.build(path=self._root_dir, dockerfile=self._runtime_dockerfile,
+                                                   tag=tag, **extra_build_opt)
+
+    def set_version_store_param(self, container_param: dict, version: str) -> None:
+        """ コンテナのパラメータを、汎用イメージとバージョンストアを利用するように変更するメソッド。
+
+        バージョンストアの全バージョンを読み込み専用でマウントし、 `version` を既定のバージョンとします。
+        パラメータの変更は、これから作成するコンテナにのみ反映されます。
+
+        Args:
+            container_param (dict): コンテナのパラメータ.
+            version (str): 起動する BDS のバージョン.
+
+        Raises:
+            ValueError: `version` がバージョンストアに展開されていない場合に raise.
+        """
+        store = self.version_store()
+        if not store.has_version(version):
+            raise ValueError("The version store does not have {version}.".format(version=version))
+        container_param["image"] = self.runtime_image_tag()
+        versions_dir = os.path.abspath(store.versions_dir)
+        # docker-py の volumes 及び environment には dict 又は list を指定できる。
+        volumes = container_param.setdefault("volumes", {})
+        if isinstance(volumes, list):
+            volume = "{host}:{bind}:ro".format(host=versions_dir, bind=store_versions_mount)
+            if volume not in volumes:
+                volumes.append(volume)
+        else:
+            volumes[versions_dir] = {"bind": store_versions_mount, "mode": "ro"}
+        env = {"BEDROCK_VERSIONS_DIR": store_versions_mount, "BEDROCK_SERVER_VER": version}
+        environment = container_param.setdefault("environment", {})
+        if isinstance(environment, list):
+            environment[:] = [e for e in environment if e.split("=", 1)[0] not in env]
+            environment.extend("{k}={v}".format(k=k, v=v) for (k, v) in env.items())
+        else:
+            environment.update(env)
+
+    def switch_version(self, name: str, version: str, restart: bool = True) -> None:
+        """ バージョンストアを利用するコンテナの BDS のバージョンを切り替えるメソッド。
+
+        コンテナの /volume にバージョンを書き込み、起動していれば再起動します。
+        コンテナイメージの Build やコンテナの再作成は行いません。
+
+        Args:
+            name (str): コンテナ名.
+            version (str): 切り替え先の BDS のバージョン.
+            restart (bool, optional): 起動しているコンテナを再起動するか否か. Defaults to True.
+
+        Raises:
+            ValueError: コンテナが存在しない場合や、 `version` がバージョンストアに展開されていない場合に raise.
+        """
+        if not self.version_store().has_version(version):
+            raise ValueError("The version store does not have {version}.".format(version=version))
+        containers = [c for c in self.factory_containers() if c.name == name]
+        if not containers:
+            raise ValueError("There is no container named {name}.".format(name=name))
+        with self.locks().lock("container", name):
+            containers[0].set_server_version(version, restart=restart)
 
     def get_image(self, version: str = None):
         """ Minecraft Bedrock Server の、指定されたバージョンの Docker Image を戻すメソッド。
@@ -131,21 +653,27 @@ class McbdscDockerManager(object):
         Returns:
             [type]: 指定されたバージョンの Docker Image.
         """
-        dc_images = self._docker_client.images
+        dc_images = self.docker_client.images
         if version is None:
             version = self.get_bds_latest_version_from_local_file()
         tag = "{repository}:{version}".format(repository=self._repository, version=version)
         return dc_images.get(name=tag)
 
     def list_images(self):
-        dc_images = self._docker_client.images
+        dc_images = self.docker_client.images
         repository = self._repository
         return dc_images.list(repository)
 
     def set_tag(self, version, tag) -> bool:
         logger.info("Set tag \"{tag}\" to version: {version}".format(tag=tag, version=version))
-        image = self.get_image(version=version)
-        return image.tag(repository=self._repository, tag=tag)
+        repository_tag = "{repository}:{tag}".format(repository=self._repository, tag=tag)
+        with span("set_tag", tag=tag, version=version), self.locks().lock("image", repository_tag):
+            image = self.get_image(version=version)
+            result = image.tag(repository=self._repository, tag=tag)
+            db = self.state_db()
+            if db is not None:
+                db.add_image_tag(self._repository, repository_tag, image.id)
+        return result
 
     def set_latest_tag_to_latest_image(self) -> bool:
         latest_version = self.get_bds_versions_from_container_image(sort=True, reverse=False)[-1]
@@ -168,28 +696,47 @@ class McbdscDockerManager(object):
         例えば 1.16 のマイナーバージョンの Docker Image を使用するように指定されたコンテナは、
         1.16 の最新バージョンで動作し続けますが、バージョン 1.17 以上に更新されることはありません。
         """
-        bds_versions = self.get_bds_versions_from_container_image(sort=True, reverse=False)
-        # マイナーバージョンと、その最新パッチ(またはリビジョン)の組み合わせを作る。
-        d = {}
-        for bds_version in bds_versions:
-            # version が "1.2.3.4" なら major_minor には "1.2" が入る。
-            major_minor = ".".join(bds_version.split(".")[0:2])
-            # versions は昇順なので、特に条件式を入れなくても
-            # マイナーバージョンとその最新パッチ(またはリビジョン)の組み合わせになる。
-            d[major_minor] = bds_version
-        for (major_minor, bds_version) in d.items():
-            self.set_tag(version=bds_version, tag=major_minor)
+        with span("set_minor_tags"):
+            bds_versions = self.get_bds_versions_from_container_image(sort=True, reverse=False)
+            # マイナーバージョンと、その最新パッチ(またはリビジョン)の組み合わせを作る。
+            d = {}
+            for bds_version in bds_versions:
+                # version が "1.2.3.4" なら major_minor には "1.2" が入る。
+                major_minor = ".".join(bds_version.split(".")[0:2])
+                # versions は昇順なので、特に条件式を入れなくても
+                # マイナーバージョンとその最新パッチ(またはリビジョン)の組み合わせになる。
+                d[major_minor] = bds_version
+            for (major_minor, bds_version) in d.items():
+                self.set_tag(version=bds_version, tag=major_minor)
 
-    def get_bds_versions_from_container_image(self, sort=True, reverse=False) -> List[str]:
+    def list_image_tags(self) -> List[str]:
+        """ Minecraft Bedrock Server の全ての Docker Image のタグ("bedrock:1.16" 等)のリストを戻すメソッド。
+
+        状態のキャッシュが同期されている場合は、 API を呼び出さずにキャッシュから戻します。
+        状態のデータベースが `ttl` 秒以内に同期されている場合は、 API を呼び出さずにデータベースから戻します。
+
+        Returns:
+            List[str]: タグのリスト.
+        """
+        cache = self._ready_state_cache()
+        if cache is not None:
+            return cache.image_tags()
+        db = self.state_db()
+        if db is not None and db.is_synced("images:" + self._repository):
+            return db.image_tags(self._repository)
         images = self.list_images()
+        if db is not None:
+            db.replace_images(self._repository, {image.id: list(image.tags) for image in images})
+        return [tag for image in images for tag in image.tags]
+
+    def get_bds_versions_from_container_image(self, sort=True, reverse=False) -> List[str]:
         versions = []
-        for image in images:
-            for tag in image.tags:
-                version = tag.split(":")[1]
-                m = self.bds_version_pat_compile.fullmatch(version)
-                if not m:
-                    continue
-                versions.append(version)
+        for tag in self.list_image_tags():
+            version = tag.split(":")[1]
+            m = self.bds_version_pat_compile.fullmatch(version)
+            if not m:
+                continue
+            versions.append(version)
         if sort:
             self.sort_bds_versions(versions, reverse)
         return versions
@@ -208,20 +755,33 @@ class McbdscDockerManager(object):
         """
         root_dir = self._root_dir
         bds_zip_dir = os.path.join(root_dir, self._bds_zip_dir)
-        dir_contents = listdir(bds_zip_dir)
-        files = [c for c in dir_contents if os.path.isfile(os.path.join(bds_zip_dir, c))]
-        if not files:
-            return []
-        bds_zip_file_re = re.compile(bds_zip_file_pat)
-        versions = []
-        for file in files:
-            m = bds_zip_file_re.fullmatch(file)
-            if m:
-                versions.append(m.group(1))
+        db = self.state_db()
+        # ディレクトリが変更されていなければ、走査せずにデータベースから読み込む。
+        if db is not None and db.dir_is_fresh(bds_zip_dir):
+            versions = db.zip_versions(bds_zip_dir)
+        else:
+            versions = [z["version"] for z in self._scan_bds_zip_dir(bds_zip_dir)]
         if sort:
             self.sort_bds_versions(versions, reverse)
         return versions
 
+    def _scan_bds_zip_dir(self, bds_zip_dir: str) -> List[dict]:
+        """ BDS Zip ファイルのディレクトリを走査し、見つけたファイルをデータベースに記録して戻すメソッド。 """
+        st = os.stat(bds_zip_dir)
+        bds_zip_file_re = re.compile(bds_zip_file_pat)
+        zips = []
+        for file in listdir(bds_zip_dir):
+            m = bds_zip_file_re.fullmatch(file)
+            path = os.path.join(bds_zip_dir, file)
+            if m and os.path.isfile(path):
+                file_st = os.stat(path)
+                zips.append({"path": path, "version": m.group(1), "size": file_st.st_size, "mtime_ns": file_st.st_mtime_ns})
+        db = self.state_db()
+        if db is not None:
+            db.replace_zips(bds_zip_dir, zips)
+            db.mark_dir(bds_zip_dir, st)
+        return zips
+
     @classmethod
     def sort_bds_versions(cls, versions: List[str], reverse: bool = False) -> None:
         """
@@ -262,15 +822,559 @@ class McbdscDockerManager(object):
         else:
             return None
 
-    def backup(self):
-        client = self._docker_client
+    def resource_allocator(self, **allocator_opt) -> McbdscResourceAllocator:
+        """ UDP ポートと CPU を割り当てる McbdscResourceAllocator インスタンスを戻すメソッド。
+
+        割り当ては pymcbdsc_root_dir 配下の "allocations.json" に保存されます。
+        インスタンスはマネージャで共有し、 `allocator_opt` を指定した場合のみ作成し直します。
+        割り当ての変更は `locks()` の "allocations" のロックの中で行うので、他のプロセスとも重複しません。
+
+        Args:
+            **allocator_opt: McbdscResourceAllocator の初期化メソッドに渡す引数.
+
+        Returns:
+            McbdscResourceAllocator: リソースアロケータ.
+        """
+        with self._allocator_lock:
+            if self._resource_allocator is None or allocator_opt:
+                self._resource_allocator = McbdscResourceAllocator(os.path.join(self._root_dir, "allocations.json"),
+                                                                   locks=self.locks(), **allocator_opt)
+            return self._resource_allocator
+
+    def allocate_resources(self, **allocator_opt) -> Dict[str, dict]:
+        """ 管理する全コンテナに UDP ポートと CPU を割り当て、コンテナのパラメータに反映するメソッド。
+
+        管理しなくなったコンテナの割り当ては解放します。割り当ては保存されるので、何度呼び出しても
+        既存のコンテナの割り当ては変わりません。パラメータの変更は、これから作成するコンテナにのみ反映されるので、
+        `factory_containers()` より前に呼び出してください。
+
+        Args:
+            **allocator_opt: McbdscResourceAllocator の初期化メソッドに渡す引数.
+
+        Returns:
+            Dict[str, dict]: コンテナ名と、割り当ての結果の dict.
+        """
+        allocator = self.resource_allocator(**allocator_opt)
+        # ウォームプールのコンテナの割り当ては、取り出す時にサーバに引き継ぐので解放しない。
+        allocations = allocator.reconcile([param["name"] for param in self._containers_param],
+                                          keep=lambda name: name.startswith(warm_container_prefix))
+        for param in self._containers_param:
+            allocator.apply(param, allocations[param["name"]])
+        return allocations
+
+    def server_addresses(self) -> Dict[str, Tuple[str, int]]:
+        """ 管理する全コンテナの、 Bedrock Server の待ち受けアドレスを戻すメソッド。
+
+        コンテナのパラメータ(`ports` 及び `environment` の `SERVER_PORT`)から、
+        ホスト側で UDP を待ち受けているポートを求めます。 Docker API へのアクセスは行いません。
+
+        Returns:
+            Dict[str, Tuple[str, int]]: コンテナ名と、ホスト及びポートの dict.
+        """
+        pool = self._client_pool
+
+        def host_address(param):
+            # 他の Docker ホストのコンテナには、そのホストのアドレスで問い合わせる。
+            if pool is not None and param.get("host") is not None:
+                return pool.address(param["host"]) or self._status_host
+            return self._status_host
+
+        return {param["name"]: self.server_address(param, host=host_address(param)) for param in self._containers_param}
+
+    @classmethod
+    def server_address(cls, container_param: dict, host: str = "127.0.0.1") -> Tuple[str, int]:
+        """ コンテナのパラメータから、 Bedrock Server の待ち受けアドレスを求めるクラスメソッド。
+
+        Args:
+            container_param (dict): コンテナのパラメータ.
+            host (str, optional): Docker ホストのアドレス. Defaults to "127.0.0.1".
+
+        Returns:
+            Tuple[str, int]: ホストとポート.
+
+        Examples:
+
+            >>> from pymcbdsc import McbdscDockerManager
+            >>>
+            >>> McbdscDockerManager.server_address({"name": "a", "ports": {"19132/udp": 20000}})
+            ('127.0.0.1', 20000)
+            >>> McbdscDockerManager.server_address({"name": "b", "environment": {"SERVER_PORT": "19140"},
+            ...                                     "network_mode": "host"})
+            ('127.0.0.1', 19140)
+        """
+        env = container_param.get("environment") or {}
+        if isinstance(env, list):
+            # ["KEY=VALUE", ...] 形式の場合は dict に変換する。
+            env = dict(e.split("=", 1) for e in env if "=" in e)
+        container_port = int(env.get("SERVER_PORT", bds_default_port))
+        ports = container_param.get("ports") or {}
+        for key in ("{port}/udp".format(port=container_port), container_port):
+            if key not in ports:
+                continue
+            binding = ports[key]
+            # docker-py の ports には int, (host_ip, port) 又はそれらのリストを指定できる。
+            if isinstance(binding, list):
+                binding = binding[0]
+            if isinstance(binding, tuple):
+                (bind_ip, binding) = binding
+                if bind_ip not in ("", "0.0.0.0", "::"):
+                    host = bind_ip
+            if binding is not None:
+                return (host, int(binding))
+        # ポートが公開されていなければ、 host ネットワーク等でコンテナ側のポートを直接待ち受けているものとする。
+        return (host, container_port)
+
+    def query_status(self, timeout: float = 1.0, retries: int = 1) -> Dict[str, McbdscServerStatus]:
+        """ 管理する全ての Bedrock Server に RakNet の Unconnected Ping を同時に送信し、その状態を戻すメソッド。
+
+        Docker API は利用せず、ゲームのクライアントと同じ方法で問い合わせるので、
+        サーバが実際にプレイヤーを受け付けられる状態かを確認できます。
+
+        Args:
+            timeout (float, optional): 各サーバの応答を待つ秒数. Defaults to 1.0.
+            retries (int, optional): タイムアウトまでに Ping を再送する回数. Defaults to 1.
+
+        Returns:
+            Dict[str, McbdscServerStatus]: コンテナ名と、サーバの状態の dict.
+        """
+        targets = self.server_addresses()
+        skipped = {}
+        cache = self._ready_state_cache()
+        if cache is not None:
+            # キャッシュによって起動していないことが分かっているコンテナには、問い合わせない。
+            statuses = cache.container_statuses()
+            for name in list(targets.keys()):
+                if statuses.get(name) != "running":
+                    skipped[name] = McbdscServerStatus(address=targets.pop(name),
+                                                       error="container is {status}".format(status=statuses.get(name)))
+        result = query_status(targets=targets, timeout=timeout, retries=retries)
+        result.update(skipped)
+        return result
+
+    def metrics_collector(self, **metrics_opt) -> McbdscMetricsCollector:
+        """ 管理する全コンテナのリソース使用状況を収集する McbdscMetricsCollector インスタンスを戻すメソッド。
+
+        収集を開始するには、戻り値の `start()` をコールします。
+        以降に `add_server()` 及び `remove_server()` で増減したサーバは、戻り値の McbdscMetricsCollector の収集にも反映します。
+
+        Args:
+            **metrics_opt: McbdscContainerMetrics に渡す引数(capacity, history_capacity, downsample).
+
+        Returns:
+            McbdscMetricsCollector: 管理する全コンテナを対象とした McbdscMetricsCollector インスタンス.
+        """
+        self._metrics_collector = McbdscMetricsCollector(containers=self.factory_containers(), **metrics_opt)
+        return self._metrics_collector
+
+    def verify(self, workers: Optional[int] = None, use_cache: bool = True) -> List[McbdscVerifyResult]:
+        """ ローカルに保存されている BDS Zip ファイルと、バックアップリポジトリのオブジェクトを検証するメソッド。
+
+        BDS Zip ファイルは各メンバーの CRC-32 を、オブジェクトはスナップショットから参照されている全てのオブジェクトの
+        SHA-256 を検証します。前回の検証以降に変更されていないファイルは検証しません。
+
+        Args:
+            workers (int, optional): 検証するプロセスの数. None の場合は CPU の数. Defaults to None.
+            use_cache (bool, optional): 前回の検証結果を利用するか否か. Defaults to True.
+
+        Returns:
+            List[McbdscVerifyResult]: 検証結果のリスト.
+        """
+        tasks = []
+        bds_zip_dir = os.path.join(self._root_dir, self._bds_zip_dir)
+        if os.path.isdir(bds_zip_dir):
+            bds_zip_file_re = re.compile(bds_zip_file_pat)
+            for file in sorted(listdir(bds_zip_dir)):
+                if bds_zip_file_re.fullmatch(file):
+                    tasks.append((KIND_ZIP, os.path.join(bds_zip_dir, file), None))
+        repository = self.backup_repository()
+        hashes = set()
+        for snapshot in repository.list_snapshots():
+            hashes.update(f["sha256"] for f in snapshot.files.values())
+        tasks += [(KIND_OBJECT, repository.object_path(h), h) for h in sorted(hashes)]
+        cache_path = os.path.join(self._root_dir, "verify-cache.json") if use_cache else None
+        return McbdscVerifier(cache_path=cache_path, workers=workers).verify(tasks)
+
+    def backup_scheduler(self, **scheduler_opt) -> McbdscBackupScheduler:
+        """ 管理する全コンテナのバックアップを分散して実行する McbdscBackupScheduler インスタンスを戻すメソッド。
+
+        Args:
+            **scheduler_opt: McbdscBackupScheduler に渡す引数(interval, window, max_concurrent, bytes_per_second).
+
+        Returns:
+            McbdscBackupScheduler: バックアップのスケジューラ.
+        """
+        return McbdscBackupScheduler(self, **scheduler_opt)
+
+    def health_monitor(self, **health_opt) -> McbdscHealthMonitor:
+        """ 管理する全てのサーバの死活を監視し、ハング又は異常終了したサーバを再起動する McbdscHealthMonitor インスタンスを戻すメソッド。
+
+        監視を開始するには、戻り値の `start()` をコールします。
+
+        Args:
+            **health_opt: McbdscHealthMonitor に渡す引数(interval, timeout, failure_threshold, restart 等).
+
+        Returns:
+            McbdscHealthMonitor: 死活監視のモニタ.
+        """
+        return McbdscHealthMonitor(self, **health_opt)
+
+    def autoscaler(self, groups: List[McbdscServerGroup], **autoscaler_opt) -> McbdscAutoscaler:
+        """ サーバグループ毎に、プレイヤー数に応じてサーバを追加・削除する McbdscAutoscaler インスタンスを戻すメソッド。
+
+        台数の調整を開始するには、戻り値の `start()` をコールします。
+
+        Args:
+            groups (List[McbdscServerGroup]): 台数を調整するサーバグループのリスト.
+            **autoscaler_opt: McbdscAutoscaler に渡す引数(interval, scale_up_occupancy, drain_timeout 等).
+
+        Returns:
+            McbdscAutoscaler: オートスケーラ.
+        """
+        return McbdscAutoscaler(self, groups, **autoscaler_opt)
+
+    def log_monitor(self, max_events: int = 1000) -> McbdscLogMonitor:
+        """ 管理する全コンテナのログを追跡する McbdscLogMonitor インスタンスを戻すメソッド。
+
+        追跡を開始するには、戻り値の `start()` をコールします。
+        読み込んだ位置は状態を保持するデータベースに保存するので、次回の起動時に過去のログを読み直すことはありません。
+        以降に `add_server()` 及び `remove_server()` で増減したサーバは、戻り値の McbdscLogMonitor の追跡にも反映します。
+        以前に作成した McbdscLogMonitor は停止します。
+
+        Args:
+            max_events (int, optional): コンテナ毎に保持するイベントの最大数. Defaults to 1000.
+
+        Returns:
+            McbdscLogMonitor: 管理する全コンテナを対象とした McbdscLogMonitor インスタンス.
+        """
+        previous = self._log_monitor
+        if previous is not None:
+            # 同じ McbdscLogTailer を二つの McbdscLogMonitor で追跡しないよう、以前に作成したものは停止して切り離す。
+            previous.stop()
+            for name in list(previous.tailers):
+                previous.remove_tailer(name)
+        monitor = McbdscLogMonitor(tailers=[c.log_tailer(max_events=max_events, db=self.state_db())
+                                            for c in self.factory_containers()])
+        (self._log_monitor, self._log_max_events) = (monitor, max_events)
+        return monitor
+
+    def send_command(self, command: str, timeout: float = 5.0, expect: str = None) -> Dict[str, List[str]]:
+        """ 管理する全コンテナの Bedrock Server に、同時にコマンドを送信するメソッド。
+
+        コンテナ毎のコマンドチャネルは独立しているので、全体の所要時間は最も応答の遅いコンテナの応答時間となります。
+
+        Args:
+            command (str): 送信するコマンド.
+            timeout (float, optional): 各コンテナの応答を待つ秒数. Defaults to 5.0.
+            expect (str, optional): 応答の最終行に一致する正規表現. Defaults to None.
+
+        Returns:
+            Dict[str, List[str]]: コンテナ名と、応答の行のリストの dict.
+        """
         containers = self.factory_containers()
-        params = {'stdin': 1, 'stream': 1}
-        for container in containers:
-            s = client.api.attach_socket(container._container.name, params=params)
-            logger.info("send command: save hold")
-            s.send("save hold\n".encode('utf-8'))
-            s.close()
+        futures = {c.name: c.command_channel().send(command, timeout=timeout, expect=expect) for c in containers}
+        return {name: future.result() for (name, future) in futures.items()}
+
+    def template_dir(self, name: str = None) -> str:
+        """ テンプレートを保存するディレクトリ(フォルダ)を戻すメソッド。
+
+        各テンプレートは、コンテナの /volume と同じ構成(worlds ディレクトリ等)のディレクトリです。
+
+        Args:
+            name (str, optional): テンプレート名. 指定した場合は、そのテンプレートのディレクトリを戻す. Defaults to None.
+
+        Returns:
+            str: テンプレートを保存するディレクトリ(フォルダ)のパス.
+        """
+        templates = os.path.join(self._root_dir, "templates")
+        return templates if name is None else os.path.join(templates, name)
+
+    def volume_dir(self, name: str = None) -> str:
+        """ コンテナの /volume としてマウントするディレクトリ(フォルダ)を戻すメソッド。
+
+        Args:
+            name (str, optional): コンテナ名. 指定した場合は、そのコンテナのディレクトリを戻す. Defaults to None.
+
+        Returns:
+            str: ボリュームのディレクトリ(フォルダ)のパス.
+        """
+        volumes = os.path.join(self._root_dir, "volumes")
+        return volumes if name is None else os.path.join(volumes, name)
+
+    def warm_dir(self, name: str = None) -> str:
+        """ ウォームプールのコンテナの /volume としてマウントするディレクトリ(フォルダ)を戻すメソッド。
+
+        Args:
+            name (str, optional): プールのコンテナ名. 指定した場合は、そのコンテナのディレクトリを戻す. Defaults to None.
+
+        Returns:
+            str: ウォームプールのボリュームのディレクトリ(フォルダ)のパス.
+        """
+        warm = os.path.join(self.volume_dir(), ".warm")
+        return warm if name is None else os.path.join(warm, name)
+
+    def warm_pool(self, image: str = None, **pool_opt) -> McbdscWarmPool:
+        """ `image` のコンテナのウォームプールを戻すメソッド。初めて呼び出した時点で作成し、 `add_server()` で利用する。
+
+        補充を開始するには、戻り値の `start()` をコールします。
+
+        Args:
+            image (str, optional): プールするコンテナのイメージ. None の場合は "<repository>:latest". Defaults to None.
+            **pool_opt: McbdscWarmPool に渡す引数(size, low_water, container_param 等). 初めて呼び出した時点でのみ有効.
+
+        Returns:
+            McbdscWarmPool: ウォームプール.
+        """
+        image = image or "{repository}:latest".format(repository=self._repository)
+        if image not in self._warm_pools:
+            self._warm_pools[image] = McbdscWarmPool(self, image, **pool_opt)
+        return self._warm_pools[image]
+
+    def warm_pools(self) -> Dict[str, McbdscWarmPool]:
+        """ コンテナイメージと、作成済みの McbdscWarmPool インスタンスの dict を戻すメソッド。 """
+        return dict(self._warm_pools)
+
+    def clone_world(self, template: str, new_server: str, image: str = None) -> Dict[str, int]:
+        """ テンプレートのワールドを複製し、それを /volume としてマウントする新しいサーバを追加するメソッド。
+
+        テンプレートは `volume_dir(new_server)` に、 reflink 又はハードリンクを用いてデータを共有したまま複製されます。
+        その上で、複製したディレクトリを指す Docker ボリュームを作成し、 `new_server` のコンテナのパラメータに追加します。
+        `new_server` のパラメータが無ければ、 `image` (省略時は "<repository>:latest")から作成するパラメータを追加します。
+
+        Args:
+            template (str): テンプレート名.
+            new_server (str): 新しいサーバ(コンテナ)名.
+            image (str, optional): 新しいサーバのコンテナイメージ. Defaults to None.
+
+        Raises:
+            FileNotFoundError: テンプレートが存在しない場合に raise.
+            FileExistsError: `new_server` のボリュームのディレクトリが既に存在する場合に raise.
+
+        Returns:
+            Dict[str, int]: 複製に用いた方法(reflink, hardlink, copy)毎の、ファイルの数.
+        """
+        src = self.template_dir(template)
+        if not os.path.isdir(src):
+            raise FileNotFoundError("There is no template named {template}.".format(template=template))
+        dst = self.volume_dir(new_server)
+        os.makedirs(self.volume_dir(), exist_ok=True)
+        counts = McbdscWorldCloner().clone_tree(src, dst)
+        self._attach_volume(new_server, image)
+        logger.info("Cloned {template} to {name}: {counts}".format(template=template, name=new_server, counts=counts))
+        return counts
+
+    def _attach_volume(self, name: str, image: str = None) -> dict:
+        """ `volume_dir(name)` を指す Docker ボリュームを作成し、 `name` のコンテナのパラメータに追加して戻すメソッド。 """
+        volume_name = "mcbdsc-{name}".format(name=name)
+        self.docker_client.volumes.create(name=volume_name, driver="local",
+                                          driver_opts={"type": "none", "o": "bind",
+                                                       "device": os.path.abspath(self.volume_dir(name))},
+                                          labels={container_label: "true"})
+        params = [p for p in self._containers_param if p["name"] == name]
+        if params:
+            param = params[0]
+        else:
+            param = {"name": name, "image": image or "{repository}:latest".format(repository=self._repository)}
+            self._containers_param.append(param)
+        param["volumes"] = {volume_name: {"bind": "/volume", "mode": "rw"}}
+        # 次の factory_containers() で新しいサーバのコンテナが作成されるように、キャッシュを破棄する。
+        self.reset_containers()
+        return param
+
+    def add_server(self, name: str, template: str, image: str = None, allocate: bool = True) -> "McbdscDockerContainer":
+        """ テンプレートのワールドを複製した新しいサーバを追加し、そのコンテナを作成して起動するメソッド。
+
+        `volume_dir(name)` が既に存在する場合は複製せず、そのワールドを利用します。
+        前回のデーモンの起動中に追加したサーバを、改めて管理する場合等に利用します。
+        `image` のウォームプールが有れば、コンテナを作成せずにプールのコンテナを取り出して利用します。
+
+        Args:
+            name (str): 新しいサーバ(コンテナ)名.
+            template (str): テンプレート名.
+            image (str, optional): 新しいサーバのコンテナイメージ. Defaults to None.
+            allocate (bool, optional): UDP ポートと CPU を割り当てるか否か. Defaults to True.
+
+        Returns:
+            McbdscDockerContainer: 起動したサーバのコンテナ.
+        """
+        image = image or "{repository}:latest".format(repository=self._repository)
+        pool = self._warm_pools.get(image)
+        param = None
+        if pool is not None and not os.path.isdir(self.volume_dir(name)):
+            param = pool.claim(name, template)
+        if param is not None:
+            # プールのコンテナの割り当ては、既にサーバに引き継がれている。
+            self._containers_param.append(param)
+            self.reset_containers()
+        else:
+            if os.path.isdir(self.volume_dir(name)):
+                param = self._attach_volume(name, image)
+            else:
+                self.clone_world(template, name, image=image)
+                param = [p for p in self._containers_param if p["name"] == name][0]
+            if allocate:
+                McbdscResourceAllocator.apply(param, self.resource_allocator().allocate(name))
+        container = [c for c in self.factory_containers() if c.name == name][0]
+        with self.locks().lock("container", name):
+            container.start()
+        if self._log_monitor is not None:
+            self._log_monitor.add_tailer(container.log_tailer(max_events=self._log_max_events, db=self.state_db()))
+        if self._metrics_collector is not None:
+            self._metrics_collector.add_container(container)
+        logger.info("Added the server {name} from the template {template}.".format(name=name, template=template))
+        return container
+
+    def remove_server(self, name: str, remove_world: bool = True) -> None:
+        """ サーバのコンテナを停止・削除し、管理するコンテナから除くメソッド。
+
+        割り当てた UDP ポートと CPU は解放します。
+
+        Args:
+            name (str): サーバ(コンテナ)名.
+            remove_world (bool, optional): ワールド(`volume_dir(name)` と、それを指す Docker ボリューム)も削除するか否か.
+                                           Defaults to True.
+        """
+        with self.locks().lock("container", name):
+            # 停止したコンテナのログや stats API を読み直し続けないよう、停止する前に追跡と収集から除く。
+            if self._log_monitor is not None:
+                self._log_monitor.remove_tailer(name)
+            if self._metrics_collector is not None:
+                self._metrics_collector.remove_container(name)
+            for container in [c for c in self.factory_containers() if c.name == name]:
+                container.close()
+                container.stop()
+                container.remove()
+            if remove_world:
+                shutil.rmtree(self.volume_dir(name), ignore_errors=True)
+                volume_names = ["mcbdsc-{name}".format(name=name)]
+                # ウォームプールから取り出したコンテナのボリュームは、移動したワールドへのリンクを指している。
+                # 他のプロセスが取り出している最中のリンクを消さないよう、このサーバのワールドを指すリンクのみを削除する。
+                warm = self.warm_dir()
+                target = os.path.abspath(self.volume_dir(name))
+                for slot in (listdir(warm) if os.path.isdir(warm) else []):
+                    link = os.path.join(warm, slot)
+                    if os.path.islink(link) and os.readlink(link) == target:
+                        os.remove(link)
+                        volume_names.append(slot)
+                for volume_name in volume_names:
+                    try:
+                        self.docker_client.volumes.get(volume_name).remove()
+                    except docker.errors.NotFound:
+                        pass
+            self._containers_param[:] = [p for p in self._containers_param if p["name"] != name]
+            self.resource_allocator().release(name)
+            if self.state_db() is not None:
+                self.state_db().remove_log_offset(name)
+            self.reset_containers()
+        logger.info("Removed the server {name}.".format(name=name))
+
+    def backup_dir(self, name: str = None) -> str:
+        """ バックアップを保存するディレクトリ(フォルダ)を戻すメソッド。
+
+        Args:
+            name (str, optional): コンテナ名. 指定した場合は、そのコンテナのバックアップのディレクトリを戻す. Defaults to None.
+
+        Returns:
+            str: バックアップを保存するディレクトリ(フォルダ)のパス.
+        """
+        backups = os.path.join(self._root_dir, "backups")
+        return backups if name is None else os.path.join(backups, name)
+
+    def backup(self, compression: str = "gz", level: int = 6, workers: Optional[int] = None) -> Dict[str, str]:
+        """ 管理する全コンテナのワールドをバックアップするメソッド。
+
+        起動しているコンテナは `save hold` を用いてオンラインで、停止しているコンテナはそのままバックアップします。
+        バックアップは `backup_dir(name)` 配下に "<コンテナ名>-<日時>.tar.<圧縮方式>" の名前で保存されます。
+
+        Args:
+            compression (str, optional): 圧縮方式. "gz", "bz2", "xz" 又は "". Defaults to "gz".
+            level (int, optional): 圧縮レベル. Defaults to 6.
+            workers (int, optional): 圧縮するプロセスの数. None の場合は CPU の数. Defaults to None.
+
+        Returns:
+            Dict[str, str]: コンテナ名と、保存したバックアップのファイルパスの dict.
+        """
+        paths = {}
+        for container in self.factory_containers():
+            name = container.name
+            with span("backup", server=name, compression=compression) as sp, self.locks().lock("container", name):
+                dest_dir = self.backup_dir(name)
+                os.makedirs(dest_dir, exist_ok=True)
+                ext = ".tar.{compression}".format(compression=compression) if compression else ".tar"
+                filename = "{name}-{ts}{ext}".format(name=name, ts=time.strftime("%Y%m%d-%H%M%S"), ext=ext)
+                path = os.path.join(dest_dir, filename)
+                tmp = path + ".tmp"
+                logger.info("Backup {name} to {path}".format(name=name, path=path))
+                try:
+                    with open(tmp, "wb") as f:
+                        container.backup(fileobj=f, online=container.is_running(), compression=compression,
+                                         level=level, workers=workers)
+                    os.replace(tmp, path)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                sp.add(bytes=os.path.getsize(path))
+            paths[name] = path
+        return paths
+
+    def backup_repository(self, throttle=None) -> McbdscBackupRepository:
+        """ 重複排除されたバックアップを保存する McbdscBackupRepository インスタンスを戻すメソッド。
+
+        リポジトリは `backup_dir()` 配下の "repository" ディレクトリ(フォルダ)に作成されます。
+
+        Args:
+            throttle (McbdscTokenBucket, optional): 書き込むバイト数を制限するトークンバケット. Defaults to None.
+
+        Returns:
+            McbdscBackupRepository: バックアップリポジトリ.
+        """
+        return McbdscBackupRepository(os.path.join(self.backup_dir(), "repository"), throttle=throttle, db=self.state_db())
+
+    def snapshot(self) -> Dict[str, McbdscSnapshot]:
+        """ 管理する全コンテナのワールドを、バックアップリポジトリに差分でバックアップするメソッド。
+
+        前回のバックアップからサイズと更新時刻が変わっていないファイルは、コンテナから読み出しません。
+
+        Returns:
+            Dict[str, McbdscSnapshot]: コンテナ名と、保存したスナップショットの dict.
+        """
+        repository = self.backup_repository()
+        snapshots = {}
+        for container in self.factory_containers():
+            with span("snapshot", server=container.name) as sp, self.locks().lock("container", container.name):
+                snapshot = container.snapshot(repository, online=container.is_running())
+                sp.add(files=len(snapshot.files))
+            snapshots[container.name] = snapshot
+        return snapshots
+
+    def restore(self, name: str, snapshot_id: str = None, only_changed: bool = True) -> McbdscRestoreResult:
+        """ バックアップリポジトリのスナップショットを、コンテナにリストアするメソッド。
+
+        コンテナが起動している場合は、停止してリストアした後に起動し直します。
+
+        Args:
+            name (str): コンテナ名.
+            snapshot_id (str, optional): リストアするスナップショットの ID. None の場合は最新のスナップショット.
+                                         Defaults to None.
+            only_changed (bool, optional): 変更されたファイルのみを書き込むか否か. Defaults to True.
+
+        Raises:
+            ValueError: コンテナ又はスナップショットが存在しない場合に raise.
+
+        Returns:
+            McbdscRestoreResult: リストアの結果.
+        """
+        repository = self.backup_repository()
+        if snapshot_id is None:
+            snapshot = repository.latest_snapshot(name)
+            if snapshot is None:
+                raise ValueError("There is no snapshot of {name}.".format(name=name))
+        else:
+            snapshot = repository.load_snapshot(name, snapshot_id)
+        containers = [c for c in self.factory_containers() if c.name == name]
+        if not containers:
+            raise ValueError("There is no container named {name}.".format(name=name))
+        with self.locks().lock("container", name):
+            return containers[0].restore(repository, snapshot, only_changed=only_changed)
 
 
 class McbdscDockerContainer(object):
@@ -279,9 +1383,21 @@ class McbdscDockerContainer(object):
 
     def __init__(self,
                  name: str,
-                 container: Container) -> None:
+                 container: "Container",
+                 host: str = None) -> None:
         self._name = name
         self._container = container
+        self._host = host
+
+    @property
+    def name(self) -> str:
+        """ コンテナ名。 """
+        return self._name
+
+    @property
+    def host(self) -> Optional[str]:
+        """ コンテナが存在する Docker ホストのホスト名。 McbdscDockerClientPool を利用しない場合は None. """
+        return self._host
 
     def start(self, **kwargs):
         container = self._container
@@ -295,26 +1411,200 @@ class McbdscDockerContainer(object):
         container = self._container
         container.restart(**kwargs)
 
-    def remove(self):
-        pass
+    def remove(self, **kwargs):
+        container = self._container
+        container.remove(**kwargs)
 
     def stats(self, **kwargs):
+        """ コンテナのリソース使用状況を戻すメソッド。
+
+        引数は docker-py の `Container.stats()` にそのまま渡されます。
+        `stream=True` を指定した場合は、リソース使用状況を逐次戻すジェネレータとなります。
+
+        Returns:
+            リソース使用状況の dict 又は、そのジェネレータ.
+        """
+        container = self._container
+        return container.stats(**kwargs)
+
+    def command_channel(self) -> McbdscCommandChannel:
+        """ このコンテナのコンソールへの McbdscCommandChannel インスタンスを戻すメソッド。
+
+        チャネルは最初の呼び出しで作成され、以降は同じインスタンスを使い回します。
+
+        Returns:
+            McbdscCommandChannel: このコンテナのコマンドチャネル.
+        """
+        if not hasattr(self, "_command_channel"):
+            self._command_channel = McbdscCommandChannel(container=self._container)
+        return self._command_channel
+
+    def take_over(self, other: "McbdscDockerContainer") -> None:
+        """ 同じコンテナの別の McbdscDockerContainer インスタンスから、開いているコマンドチャネルを引き継ぐメソッド。
+
+        `other` が別のコンテナ(作成し直したコンテナ等)のインスタンスであれば、そのチャネルを閉じます。
+
+        Args:
+            other (McbdscDockerContainer): 引き継ぐ元のインスタンス.
+        """
+        if other is self or not hasattr(other, "_command_channel"):
+            return
+        if hasattr(self, "_command_channel") or other._container.id != self._container.id:
+            other.close()
+            return
+        self._command_channel = other._command_channel
+        del other._command_channel
+
+    def close(self) -> None:
+        """ コマンドチャネルを開いていれば閉じるメソッド。何度呼び出しても良い。 """
+        if hasattr(self, "_command_channel"):
+            channel = self._command_channel
+            del self._command_channel
+            channel.close()
+
+    def log_tailer(self, max_events: int = 1000, db=None) -> McbdscLogTailer:
+        """ このコンテナのログを差分で読み込む McbdscLogTailer インスタンスを戻すメソッド。
+
+        McbdscLogTailer は最初の呼び出しで作成され、以降は同じインスタンスを使い回すので、
+        読み込んだ位置は保持され続けます。
+
+        Args:
+            max_events (int, optional): 保持するイベントの最大数. 最初の呼び出しでのみ有効. Defaults to 1000.
+            db (McbdscStateDB, optional): 読み込んだ位置を保存するデータベース. 最初の呼び出しでのみ有効.
+                                          Defaults to None.
+
+        Returns:
+            McbdscLogTailer: このコンテナの McbdscLogTailer インスタンス.
+        """
+        if not hasattr(self, "_log_tailer"):
+            self._log_tailer = McbdscLogTailer(container=self._container, name=self._name,
+                                               max_events=max_events, db=db)
+        return self._log_tailer
+
+    def send_command(self, command: str, timeout: float = 5.0, expect: str = None) -> List[str]:
+        """ Bedrock Server のコンソールにコマンドを送信し、その応答を戻すメソッド。
+
+        Args:
+            command (str): 送信するコマンド.
+            timeout (float, optional): 応答を待つ秒数. Defaults to 5.0.
+            expect (str, optional): 応答の最終行に一致する正規表現. Defaults to None.
+
+        Returns:
+            List[str]: 応答の行のリスト.
+        """
+        return self.command_channel().send_command(command, timeout=timeout, expect=expect)
+
+    def state(self) -> dict:
+        """ コンテナの状態(Docker の State. "Running", "ExitCode", "StartedAt" 等)を取得し直して戻すメソッド。 """
         container = self._container
-        container.stats(**kwargs)
-
-    def backup(self, online=False):
-        """container = client.api.create_container(
-    image="debian",
-    command="cat",
-    stdin_open=True)
-client.api.start(container)
-s = client.api.attach_socket(container, params={'stdin': 1, 'stream': 1})
-s._sock.send("Hello, world! This is on stdin!")
-s.close()"""
+        container.reload()
+        return container.attrs.get("State") or {}
+
+    def is_running(self) -> bool:
+        """ コンテナが起動しているか否かを戻すメソッド。 """
         container = self._container
-        s = container.attach_socket(stdin=True, stream=True)
-        s._sock.send("save hold")
-        s.close()
+        container.reload()
+        return container.status == "running"
+
+    def uses_version_store(self) -> bool:
+        """ コンテナがバージョンストアをマウントしているか否かを戻すメソッド。 """
+        container = self._container
+        container.reload()
+        mounts = container.attrs.get("Mounts") or []
+        return any(m.get("Destination") == store_versions_mount for m in mounts)
+
+    def set_server_version(self, version: str, restart: bool = True) -> None:
+        """ バージョンストアを利用するコンテナで、次回の起動時に利用する BDS のバージョンを設定するメソッド。
+
+        バージョンは /volume 配下のファイルに書き込むので、コンテナが停止していても設定できます。
+
+        Args:
+            version (str): BDS のバージョン.
+            restart (bool, optional): コンテナが起動していれば、再起動するか否か. Defaults to True.
 
-    def restore(self):
-        pass
+        Raises:
+            ValueError: コンテナがバージョンストアをマウントしていない場合に raise.
+        """
+        if not self.uses_version_store():
+            raise ValueError("{name} does not mount the version store.".format(name=self._name))
+        data = "{version}\n".format(version=version).encode()
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            info = tarfile.TarInfo(server_version_file)
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+        self._container.put_archive("/volume", buf.getvalue())
+        logger.info("Set the version of {name} to {version}.".format(name=self._name, version=version))
+        if restart and self.is_running():
+            self.restart()
+
+    def backup(self, fileobj, online: bool = True, compression: str = "gz", level: int = 6,
+               workers: Optional[int] = None) -> List[Tuple[str, int]]:
+        """ コンテナのワールドを、圧縮した tar アーカイブとして `fileobj` に書き込むメソッド。
+
+        `online` が True の場合は、 `save hold` でワールドへの書き込みを一時停止し、 `save query` が報告した
+        ファイルを報告された長さだけコピーした後に `save resume` を送信します。
+        データはディスクに一時保存せず、コンテナから読み込みながら圧縮して書き込みます。
+
+        Args:
+            fileobj (BinaryIO): 書き込み先のファイルオブジェクト. シークできる必要はない.
+            online (bool, optional): 起動しているコンテナのバックアップか否か.
+                                     False の場合は、コンテナが停止しているものとして worlds ディレクトリ全体をコピーする.
+                                     Defaults to True.
+            compression (str, optional): 圧縮方式. "gz", "bz2", "xz" 又は "". Defaults to "gz".
+            level (int, optional): 圧縮レベル. Defaults to 6.
+            workers (int, optional): 圧縮するプロセスの数. None の場合は CPU の数. Defaults to None.
+
+        Returns:
+            List[Tuple[str, int]]: バックアップしたファイル(worlds ディレクトリからの相対パス)と長さのリスト.
+        """
+        if online:
+            return online_backup(self._container, self.command_channel(), fileobj=fileobj, compression=compression,
+                                 level=level, workers=workers)
+        return offline_backup(self._container, fileobj=fileobj, compression=compression, level=level, workers=workers)
+
+    def snapshot(self, repository: McbdscBackupRepository, online: bool = True) -> McbdscSnapshot:
+        """ コンテナのワールドを、バックアップリポジトリに差分でバックアップするメソッド。
+
+        Args:
+            repository (McbdscBackupRepository): 保存先のリポジトリ.
+            online (bool, optional): 起動しているコンテナのバックアップか否か. Defaults to True.
+
+        Returns:
+            McbdscSnapshot: 保存したスナップショット.
+        """
+        if online:
+            return online_snapshot(self._container, self.command_channel(), repository=repository, server=self._name)
+        return offline_snapshot(self._container, repository=repository, server=self._name)
+
+    def restore(self,
+                repository: McbdscBackupRepository,
+                snapshot: McbdscSnapshot,
+                only_changed: bool = True,
+                restart: bool = True) -> McbdscRestoreResult:
+        """ バックアップリポジトリのスナップショットを、コンテナのワールドにリストアするメソッド。
+
+        コンテナが起動している場合は停止してからリストアし、 `restart` が True であればリストア後に起動し直します。
+        リストアに失敗した場合は、不完全なワールドで起動しないようにコンテナを停止したままにします。
+
+        Args:
+            repository (McbdscBackupRepository): オブジェクトを読み込むリポジトリ.
+            snapshot (McbdscSnapshot): リストアするスナップショット.
+            only_changed (bool, optional): サイズと更新時刻がスナップショットと異なるファイルのみを書き込むか否か.
+                                           Defaults to True.
+            restart (bool, optional): リストア前に起動していたコンテナを、リストア後に起動するか否か. Defaults to True.
+
+        Returns:
+            McbdscRestoreResult: リストアの結果. `downtime` はコンテナの停止から起動までの秒数.
+        """
+        was_running = self.is_running()
+        stopped_at = time.monotonic()
+        if was_running:
+            self.stop()
+        result = restore_snapshot(self._container, repository, snapshot, only_changed=only_changed, running=False)
+        if was_running and restart:
+            self.start()
+            result.downtime = time.monotonic() - stopped_at
+        return result
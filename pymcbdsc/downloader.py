@@ -1,10 +1,23 @@
+from typing import Callable, Dict, Optional
+import hashlib
 import os
 import re
-import requests
-from .constants import bds_zip_file_pat
-from .utils import pymcbdsc_root_dir
+from logging import getLogger
+from .constants import bds_zip_file_pat, lock_dir, state_db_file
+from .db import McbdscStateDB
+from .locks import McbdscLockManager
+from .progress import McbdscProgressEvent, McbdscProgressMeter
+from .store import McbdscVersionStore
+from .trace import count, span
+from .utils import lazy_import, pymcbdsc_root_dir
 from .exceptions import FailureAgreeMeulaAndPpError
 
+# requests の import には時間がかかるので、最初に利用する時点で import する。
+requests = lazy_import("requests")
+
+
+logger = getLogger(__name__)
+
 
 class McbdscDownloader(object):
     """ Bedrock Server の最新ファイルについてダウンロードし、管理するクラス。
@@ -41,7 +54,9 @@ class McbdscDownloader(object):
                  pymcbdsc_root_dir: str = pymcbdsc_root_dir(),
                  url: str = "https://www.minecraft.net/en-us/download/server/bedrock/",
                  zip_url_pat: str = "https:\\/\\/minecraft\\.azureedge\\.net\\/bin-linux\\/" + bds_zip_file_pat,
-                 agree_to_meula_and_pp: bool = False) -> None:
+                 agree_to_meula_and_pp: bool = False,
+                 progress: Optional[Callable[[McbdscProgressEvent], None]] = None,
+                 state_db_file: Optional[str] = state_db_file) -> None:
         """ McbdscDownloader インスタンスの初期化メソッド。
 
         Args:
@@ -52,11 +67,19 @@ class McbdscDownloader(object):
                                          Defaults to ("https:\\/\\/minecraft\\.azureedge\\.net\\/bin-linux\\/"
                                                       "bedrock-server-([0-9]+\\.[0-9]+\\.[0-9]+\\.[0-9]+)\\.zip").
             agree_to_meula_and_pp (bool, optional): MEULA 及び Privacy Policy に同意するか否か. Defaults to False.
+            progress (Callable[[McbdscProgressEvent], None], optional): ダウンロードの進み具合を受け取るコールバック.
+                                                                         Defaults to None.
+            state_db_file (str, optional): 状態を保持する SQLite データベースのファイル名. pymcbdsc_root_dir の配下に作成する.
+                                           None の場合はデータベースを利用せず、ダウンロードした Zip ファイルを記録しない.
+                                           Defaults to "state.db".
         """
         self._pymcbdsc_root_dir = pymcbdsc_root_dir
         self._url = url
         self._zip_url_pat = re.compile(zip_url_pat)
         self._agree_to_meula_and_pp = agree_to_meula_and_pp
+        self._progress = progress
+        self._state_db_file = state_db_file
+        self._state_db = None
 
     def zip_url(self) -> str:
         """ Bedrock Server の zip ファイルをダウンロードできる URL を取得し戻すメソッド。
@@ -78,12 +101,15 @@ class McbdscDownloader(object):
             url = self._url
             zip_url_pat = self._zip_url_pat
 
-            res = requests.get(url)
-            res.raise_for_status()
+            with span("zip_url", url=url) as s:
+                res = requests.get(url)
+                res.raise_for_status()
+                count(http_calls=1, http_bytes=len(res.content))
 
-            m = zip_url_pat.search(res.text)
-            zip_url = m.group(0)
-            latest_version = m.group(1)
+                m = zip_url_pat.search(res.text)
+                zip_url = m.group(0)
+                latest_version = m.group(1)
+                s.set(version=latest_version)
             self._zip_url = zip_url
             self._latest_version = latest_version
         return self._zip_url
@@ -129,6 +155,15 @@ class McbdscDownloader(object):
             self._latest_filename = os.path.basename(zip_url)
         return self._latest_filename
 
+    def reset_latest_version(self) -> None:
+        """ 取得済みの最新バージョンの URL, バージョン番号及びファイル名を破棄するメソッド。
+
+        インスタンスを長時間利用する場合に、次の `zip_url()` 等でダウンロードページを取得し直します。
+        """
+        for attr in ("_zip_url", "_latest_version", "_latest_filename"):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
     def download_dir(self, relative=False) -> str:
         """ Bedrock Server の zip ファイルをダウンロードするディレクトリ(フォルダ)を戻すメソッド。
 
@@ -215,19 +250,48 @@ class McbdscDownloader(object):
         return os.path.exists(self.latest_version_zip_filepath())
 
     @classmethod
-    def download(cls, url: str, filepath: str) -> None:
+    def download(cls, url: str, filepath: str, progress: Optional[Callable[[McbdscProgressEvent], None]] = None,
+                 chunk_size: int = 1024 * 1024) -> str:
         """ `url` で指定されたファイルを、ダウンロードして `filepath` に保存するクラスメソッド。
 
         This classmethod download and save file from the `url` argument.
 
+        ファイル全体をメモリに読み込まず、 `chunk_size` バイト毎に書き込みながらハッシュ値を計算します。
+        ダウンロード中は `filepath` に ".part" を付けたファイルに書き込むので、
+        中断された場合に不完全なファイルが `filepath` に残ることはありません。
+
         Args:
             url (str): ダウンロードするファイルの URL.
             filepath (str): ダウンロードしたファイルを保存するファイルパス.
+            progress (Callable[[McbdscProgressEvent], None], optional): 進み具合を受け取るコールバック. Defaults to None.
+            chunk_size (int, optional): 一度に読み込むバイト数. Defaults to 1024 * 1024.
+
+        Returns:
+            str: ダウンロードしたファイルの SHA-256 のハッシュ値.
         """
-        res = requests.get(url)
-        res.raise_for_status()
-        with open(filepath, "wb") as f:
-            f.write(res.content)
+        with span("download", url=url):
+            res = requests.get(url, stream=True)
+            try:
+                res.raise_for_status()
+                length = res.headers.get("Content-Length")
+                meter = McbdscProgressMeter(progress, "download", total=int(length) if length and length.isdigit() else None)
+                h = hashlib.sha256()
+                part = filepath + ".part"
+                try:
+                    with open(part, "wb") as f:
+                        for chunk in res.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            h.update(chunk)
+                            meter.update(len(chunk))
+                    os.replace(part, filepath)
+                finally:
+                    if os.path.exists(part):
+                        os.remove(part)
+                count(http_calls=1, http_bytes=meter.current)
+                meter.finish()
+                return h.hexdigest()
+            finally:
+                res.close()
 
     def download_latest_version_zip_file(self, agree_to_meula_and_pp: bool = None) -> None:
         """ Bedrock Server の最新版の Zip ファイルをダウンロードするメソッド。
@@ -244,8 +308,32 @@ class McbdscDownloader(object):
             agree_to_meula_and_pp = self._agree_to_meula_and_pp
         if not agree_to_meula_and_pp:
             raise FailureAgreeMeulaAndPpError()
-        self.download(url=self.zip_url(),
-                      filepath=self.latest_version_zip_filepath())
+        filepath = self.latest_version_zip_filepath()
+        version = self.latest_version()
+        with self.locks().lock("zip", version) as lock:
+            # 他のプロセスが同じバージョンをダウンロードしていた場合は、その完了を待ち、重複してダウンロードしない。
+            if lock.waited and os.path.exists(filepath):
+                logger.info("Another process has downloaded {filepath}.".format(filepath=filepath))
+                return
+            sha256 = self.download(url=self.zip_url(), filepath=filepath, progress=self._progress)
+            # ダウンロードしたファイルのハッシュ値とサイズを、状態のデータベースに記録する。
+            st = os.stat(filepath)
+            if self.state_db() is not None:
+                self.state_db().add_zip(filepath, version, st.st_size, st.st_mtime_ns, sha256=sha256)
+
+    def state_db(self) -> Optional[McbdscStateDB]:
+        """ McbdscDockerManager と共有する、状態を保持する McbdscStateDB インスタンスを戻すメソッド。
+
+        `state_db_file` が None の場合は None を戻す。
+        """
+        if self._state_db is None and self._state_db_file is not None:
+            os.makedirs(self.root_dir(), exist_ok=True)
+            self._state_db = McbdscStateDB(os.path.join(self.root_dir(), self._state_db_file))
+        return self._state_db
+
+    def locks(self) -> McbdscLockManager:
+        """ McbdscDockerManager 等の他のプロセスと共有する、リソース毎のロックを管理する McbdscLockManager インスタンスを戻すメソッド。 """
+        return McbdscLockManager(os.path.join(self.root_dir(), lock_dir))
 
     def download_latest_version_zip_file_if_needed(self, agree_to_meula_and_pp: bool = None) -> None:
         """ Bedrock Server の最新版の Zip ファイルがローカルになかった場合にのみ、ダウンロードするメソッド。
@@ -257,3 +345,31 @@ class McbdscDownloader(object):
         """
         if not self.has_latest_version_zip_file():
             self.download_latest_version_zip_file(agree_to_meula_and_pp=agree_to_meula_and_pp)
+
+    def version_store(self) -> McbdscVersionStore:
+        """ 展開した Bedrock Server をバージョン毎に保存する McbdscVersionStore インスタンスを戻すメソッド。
+
+        This method returns the store of the extracted Bedrock Server files.
+
+        Returns:
+            McbdscVersionStore: pymcbdsc_root_dir 配下の "store" ディレクトリ(フォルダ)のバージョンストア.
+        """
+        return McbdscVersionStore(os.path.join(self._pymcbdsc_root_dir, "store"))
+
+    def extract_latest_version_zip_file_if_needed(self) -> Optional[Dict[str, int]]:
+        """ Bedrock Server の最新版がバージョンストアに展開されていなかった場合にのみ、展開するメソッド。
+
+        This method will extract the latest Bedrock Server Zip file into the version store if it does not already contain it.
+
+        Returns:
+            Optional[Dict[str, int]]: 展開した場合は `McbdscVersionStore.extract()` の戻り値. 展開済みの場合は None.
+        """
+        store = self.version_store()
+        version = self.latest_version()
+        if store.has_version(version):
+            return None
+        with self.locks().lock("store", version):
+            # ロックを待つ間に、他のプロセスが展開した場合は展開しない。
+            if store.has_version(version):
+                return None
+            return store.extract(self.latest_version_zip_filepath(), version)
@@ -9,3 +9,33 @@ class FailureAgreeMeulaAndPpError(Exception):
         例外のメッセージに、 MEULA 及び Privacy Policy への同意が必要であるということがわかりやすいメッセージを追加する。
     """
     pass
+
+
+class McbdscCommandTimeoutError(Exception):
+    """ Bedrock Server のコンソールに送信したコマンドの応答が、期限内に得られなかったことを示す例外。 """
+    pass
+
+
+class McbdscCommandChannelClosedError(Exception):
+    """ コンソールへのコマンドチャネルが閉じられている、又は応答の受信中に閉じられたことを示す例外。 """
+    pass
+
+
+class McbdscBackupError(Exception):
+    """ ワールドのバックアップ又はリストアに失敗したことを示す例外。 """
+    pass
+
+
+class McbdscDaemonUnavailableError(Exception):
+    """ `mcbdsc daemon` が起動していない為、制御ソケットに接続できないことを示す例外。 """
+    pass
+
+
+class McbdscControlError(Exception):
+    """ 制御ソケット経由で `mcbdsc daemon` に依頼した処理が失敗したことを示す例外。 """
+    pass
+
+
+class McbdscLockTimeoutError(Exception):
+    """ 他のプロセスが保持しているリソースのロックを、期限内に取得できなかったことを示す例外。 """
+    pass
@@ -0,0 +1,308 @@
+""" 管理する全てのサーバの死活を監視し、応答しなくなったサーバを再起動するモジュール。
+
+Docker の再起動ポリシーはプロセスの終了しか検出できないので、 `bedrock_server` がハングしてもコンテナは
+起動したままになります。このモジュールでは短い間隔で、全てのサーバに同時に RakNet の Unconnected Ping を送信し、
+コンテナの状態と合わせて次のように判定します。
+
+* 起動している: Ping に応答すれば "healthy" 、 `failure_threshold` 回続けて応答しなければ "unhealthy".
+  起動してから一度も応答していない間は、 `startup_timeout` 秒まで "starting" として待ちます.
+* 停止している: 終了コードが 0 又は `docker stop` によるもの(SIGTERM, SIGKILL)であれば "stopped"、
+  それ以外の終了コードや OOM Killer による終了であれば "crashed". 監視を始める前から停止しているコンテナは "stopped".
+
+"unhealthy" 及び "crashed" のサーバは、指数関数的に間隔を空けながら再起動します。 `flap_window` 秒の間に
+`flap_threshold` 回再起動したサーバは "flapping" として再起動を諦め、再び応答するまで再起動しません。
+
+This module monitors the health of the servers and restarts the hung or crashed ones with exponential backoff.
+"""
+
+from typing import Callable, Dict, List, Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from .exceptions import McbdscLockTimeoutError
+
+
+logger = getLogger(__name__)
+
+HEALTH_STARTING = "starting"
+HEALTH_HEALTHY = "healthy"
+HEALTH_UNHEALTHY = "unhealthy"
+HEALTH_STOPPED = "stopped"
+HEALTH_CRASHED = "crashed"
+HEALTH_FLAPPING = "flapping"
+HEALTH_UNKNOWN = "unknown"
+
+# `docker stop` 等、意図して停止した場合の終了コード(正常終了, SIGKILL, SIGTERM)。
+clean_exit_codes = (0, 137, 143)
+
+
+class McbdscServerHealth(object):
+    """ 一つのサーバの死活の状態と、稼働率等の統計を保持するクラス。
+
+    稼働率(`availability`)は、起動しているべき時間(起動している時間と、異常終了して停止している時間)のうち、
+    Ping に応答していた時間の割合です。意図して停止している時間は含めません。
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = HEALTH_UNKNOWN
+        self.checks = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.restarts = 0
+        self.latency = None
+        self.last_check = None
+        self.last_ok = None
+        self.last_error = None
+        self.healthy_seconds = 0.0
+        self.observed_seconds = 0.0
+        # コンテナの起動時刻(Docker の State.StartedAt)。変化した場合は、再起動されたものとする。
+        self.started_at = None
+        self.running_since = None
+        self.healthy_since = None
+        self.answered = False
+        # 直近の再起動の時刻と、バックオフの状態。
+        self.restart_times = deque()
+        self.attempts = 0
+        self.next_restart = None
+
+    @property
+    def availability(self) -> Optional[float]:
+        """ 稼働率. まだ計測していない場合は None. """
+        return self.healthy_seconds / self.observed_seconds if self.observed_seconds > 0 else None
+
+    def to_dict(self) -> dict:
+        """ 状態と統計を dict で戻すメソッド。 """
+        return {"name": self.name, "state": self.state, "availability": self.availability, "checks": self.checks,
+                "failures": self.failures, "consecutive_failures": self.consecutive_failures,
+                "restarts": self.restarts, "latency": self.latency, "last_check": self.last_check,
+                "last_ok": self.last_ok, "last_error": self.last_error, "next_restart": self.next_restart}
+
+
+class McbdscHealthMonitor(object):
+    """ 管理する全てのサーバの死活を監視し、ハング又は異常終了したサーバを再起動するクラス。
+
+    一回の確認(`check()`)では、全コンテナの状態の取得と全サーバへの Ping を同時に行うので、所要時間はサーバの数によらず
+    おおよそ `timeout` 秒です。再起動は McbdscDockerContainer.restart() で行い、バックアップやリストア等で他の処理が
+    コンテナのロックを保持している間は再起動しません。
+
+    Examples:
+
+        >>> from pymcbdsc import McbdscDockerManager
+        >>>
+        >>> params = [{"name": "mbdsc_test", "image": "bedrock:latest"}]
+        >>> manager = McbdscDockerManager(containers_param=params)  # doctest: +SKIP
+        >>> monitor = manager.health_monitor(interval=2.0)  # doctest: +SKIP
+        >>> monitor.start()  # doctest: +SKIP
+        >>> monitor.health()["mbdsc_test"].to_dict()  # doctest: +SKIP
+        {'name': 'mbdsc_test', 'state': 'healthy', 'availability': 1.0, ...}
+    """
+
+    def __init__(self,
+                 manager,
+                 interval: float = 2.0,
+                 timeout: float = 1.0,
+                 retries: int = 1,
+                 failure_threshold: int = 3,
+                 startup_timeout: float = 120.0,
+                 backoff_base: float = 10.0,
+                 backoff_max: float = 600.0,
+                 stable_seconds: float = 300.0,
+                 flap_window: float = 1800.0,
+                 flap_threshold: int = 5,
+                 restart: bool = True,
+                 clock: Callable[[], float] = time.time) -> None:
+        """ McbdscHealthMonitor インスタンスの初期化メソッド。
+
+        Args:
+            manager (McbdscDockerManager): 監視するコンテナを管理する McbdscDockerManager インスタンス.
+            interval (float, optional): 確認する間隔の秒数. Defaults to 2.0.
+            timeout (float, optional): 各サーバの Ping の応答を待つ秒数. Defaults to 1.0.
+            retries (int, optional): タイムアウトまでに Ping を再送する回数. Defaults to 1.
+            failure_threshold (int, optional): "unhealthy" と判定する、 Ping に続けて応答しなかった回数. Defaults to 3.
+            startup_timeout (float, optional): 起動してから最初に応答するまで待つ秒数. Defaults to 120.0.
+            backoff_base (float, optional): 二回目の再起動までの秒数. 以降は再起動する毎に倍にする. Defaults to 10.0.
+            backoff_max (float, optional): 再起動の間隔の最大の秒数. Defaults to 600.0.
+            stable_seconds (float, optional): 再起動の間隔を元に戻す、続けて応答していた秒数. Defaults to 300.0.
+            flap_window (float, optional): フラッピングを判定する期間の秒数. Defaults to 1800.0.
+            flap_threshold (int, optional): "flapping" と判定する、 `flap_window` 秒の間の再起動の回数. Defaults to 5.
+            restart (bool, optional): "unhealthy" 及び "crashed" のサーバを再起動するか否か. Defaults to True.
+            clock (Callable[[], float], optional): 現在時刻(UNIX 時間)を戻す関数. Defaults to time.time.
+        """
+        self._manager = manager
+        self._interval = interval
+        self._timeout = timeout
+        self._retries = retries
+        self._failure_threshold = failure_threshold
+        self._startup_timeout = startup_timeout
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._stable_seconds = stable_seconds
+        self._flap_window = flap_window
+        self._flap_threshold = flap_threshold
+        self._restart = restart
+        self._clock = clock
+        self._health = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def health(self) -> Dict[str, McbdscServerHealth]:
+        """ サーバ名と McbdscServerHealth インスタンスの dict を戻すメソッド。 """
+        with self._lock:
+            return dict(self._health)
+
+    @staticmethod
+    def _container_state(container) -> Optional[dict]:
+        try:
+            return container.state()
+        except Exception as e:
+            logger.warning("Failed to get the state of {name}: {e}".format(name=container.name, e=e))
+            return None
+
+    def check(self) -> List[str]:
+        """ 全てのサーバを一度確認し、必要があれば再起動するメソッド。
+
+        Returns:
+            List[str]: 再起動したサーバ名のリスト.
+        """
+        manager = self._manager
+        containers = manager.factory_containers()
+        # コンテナの状態の取得(Docker API)と Ping を同時に行う。
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pings = executor.submit(manager.query_status, timeout=self._timeout, retries=self._retries)
+            states = manager.map_containers(self._container_state, containers)
+        statuses = pings.result()
+        now = self._clock()
+        to_restart = []
+        with self._lock:
+            # 削除されたサーバ(オートスケーラが削除したサーバ等)の状態は破棄する。
+            names = {c.name for c in containers}
+            self._health = {name: h for (name, h) in self._health.items() if name in names}
+            for container in containers:
+                h = self._health.setdefault(container.name, McbdscServerHealth(container.name))
+                if self._evaluate(h, states.get(container.name), statuses.get(container.name), now):
+                    self._record_restart(h, now)
+                    to_restart.append(container)
+        restarted = manager.map_containers(self._restart_container, to_restart) if to_restart else {}
+        return [name for (name, ok) in restarted.items() if ok]
+
+    def _evaluate(self, h: McbdscServerHealth, state: Optional[dict], status, now: float) -> bool:
+        """ 一回の確認の結果から状態と統計を更新し、再起動するべきか否かを戻すメソッド。 """
+        dt = now - h.last_check if h.last_check is not None else 0.0
+        h.last_check = now
+        h.checks += 1
+        if state is None:
+            # Docker API の一時的な失敗では、状態を変えない。
+            return False
+        if h.running_since is None or state.get("StartedAt") != h.started_at:
+            # 起動し直している(この監視以外による再起動を含む)ので、最初の応答を待ち直す。
+            h.started_at = state.get("StartedAt")
+            h.running_since = now
+            h.answered = False
+            h.consecutive_failures = 0
+        running = bool(state.get("Running")) and not state.get("Restarting")
+        if running and status is not None and status.online:
+            if h.state != HEALTH_HEALTHY:
+                logger.info("{name} is healthy.".format(name=h.name))
+                h.healthy_since = now
+            h.state = HEALTH_HEALTHY
+            h.answered = True
+            h.consecutive_failures = 0
+            h.latency = status.latency
+            h.last_ok = now
+            h.healthy_seconds += dt
+            h.observed_seconds += dt
+            if h.attempts and now - h.healthy_since >= self._stable_seconds:
+                h.attempts = 0
+                h.next_restart = None
+            return False
+        if state.get("Restarting"):
+            # Docker の再起動ポリシーによって再起動している。
+            h.state = HEALTH_STARTING
+            return False
+        if not running:
+            exit_code = state.get("ExitCode")
+            crashed = state.get("OOMKilled") or exit_code not in clean_exit_codes
+            # 監視を始める前から停止しているコンテナは、意図して停止しているものとする。
+            if not crashed or h.state in (HEALTH_UNKNOWN, HEALTH_STOPPED):
+                h.state = HEALTH_STOPPED
+                h.consecutive_failures = 0
+                return False
+            h.last_error = "OOM killed" if state.get("OOMKilled") else "exited with code {code}".format(code=exit_code)
+        else:
+            h.last_error = status.error if status is not None else "no status"
+        h.failures += 1
+        h.consecutive_failures += 1
+        h.observed_seconds += dt
+        if running:
+            if not h.answered and now - h.running_since < self._startup_timeout:
+                h.state = HEALTH_STARTING
+                return False
+            if h.answered and h.consecutive_failures < self._failure_threshold:
+                return False
+        if h.state != HEALTH_FLAPPING:
+            new_state = HEALTH_UNHEALTHY if running else HEALTH_CRASHED
+            if h.state != new_state:
+                logger.warning("{name} is {state}: {error}".format(name=h.name, state=new_state, error=h.last_error))
+            h.state = new_state
+        return self._should_restart(h, now)
+
+    def _should_restart(self, h: McbdscServerHealth, now: float) -> bool:
+        if not self._restart or h.state == HEALTH_FLAPPING:
+            return False
+        while h.restart_times and now - h.restart_times[0] >= self._flap_window:
+            h.restart_times.popleft()
+        if len(h.restart_times) >= self._flap_threshold:
+            logger.error("{name} restarted {n} times in {window:.0f} seconds. Stop restarting it until it recovers."
+                         .format(name=h.name, n=len(h.restart_times), window=self._flap_window))
+            h.state = HEALTH_FLAPPING
+            return False
+        return h.next_restart is None or now >= h.next_restart
+
+    def _record_restart(self, h: McbdscServerHealth, now: float) -> None:
+        # 再起動に失敗しても、次の再起動までは間隔を空ける。
+        h.restarts += 1
+        h.restart_times.append(now)
+        h.next_restart = now + min(self._backoff_base * 2 ** h.attempts, self._backoff_max)
+        h.attempts += 1
+
+    def _restart_container(self, container) -> bool:
+        name = container.name
+        try:
+            with self._manager.locks().lock("container", name, timeout=0):
+                logger.warning("Restart {name}.".format(name=name))
+                container.restart()
+        except McbdscLockTimeoutError:
+            logger.info("Skip restarting {name}: another operation holds the container.".format(name=name))
+            return False
+        except Exception:
+            logger.exception("Failed to restart {name}.".format(name=name))
+            return False
+        return True
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """ `stop` がセットされるまで、 `interval` 秒毎に `check()` を実行するメソッド。 """
+        stop = stop if stop is not None else threading.Event()
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Failed to check the health of the servers.")
+            stop.wait(max(self._interval - (time.monotonic() - started), 0))
+
+    def start(self) -> None:
+        """ バックグラウンドのスレッドで監視を開始するメソッド。 """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(self._stop,), name="mcbdsc-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ 監視を停止するメソッド。 """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
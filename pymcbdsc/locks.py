@@ -0,0 +1,198 @@
+""" pymcbdsc_root_dir を共有する複数のプロセスの間で、リソース毎に排他制御する為のモジュール。
+
+cron で実行する `mcbdsc download` 、手動で実行する `mcbdsc build` や常駐するプロセスが同時に動作しても、
+同じリソース(バージョン毎の Zip ファイル、イメージのタグ、コンテナ)を操作する処理のみが互いに待つように、
+リソース毎のロックファイルに対してアドバイザリロックを取得します。
+ロックはプロセスが終了すると OS によって解放されるので、異常終了したプロセスがロックを残すことはありません。
+
+This module provides per-resource advisory file locks shared by the processes using the same pymcbdsc_root_dir.
+"""
+
+from typing import Optional
+import os
+import time
+from logging import getLogger
+from urllib.parse import quote
+from .exceptions import McbdscLockTimeoutError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+logger = getLogger(__name__)
+
+
+class McbdscFileLock(object):
+    """ ファイルに対するアドバイザリロックのクラス。
+
+    POSIX では `flock()` を利用し、共有ロック(読み込み)と排他ロック(書き込み)を区別します。
+    Windows では `msvcrt.locking()` を利用するので、共有ロックも排他ロックとして扱います。
+
+    ロックは開いたファイル毎に管理されるので、同じプロセスの別のスレッドが別のインスタンスで同じファイルをロックした場合も
+    互いに待ちます。一つのインスタンスを複数のスレッドで共有したり、再帰的に取得したりすることはできません。
+
+    Examples:
+
+        >>> import tempfile, os
+        >>> from pymcbdsc.locks import McbdscFileLock
+        >>>
+        >>> path = os.path.join(tempfile.mkdtemp(), "zip.lock")
+        >>> with McbdscFileLock(path) as lock:
+        ...     McbdscFileLock(path).acquire(timeout=0)
+        False
+        >>> lock.waited
+        False
+    """
+
+    def __init__(self, path: str, shared: bool = False, timeout: Optional[float] = None,
+                 poll_interval: float = 0.05) -> None:
+        """ McbdscFileLock インスタンスの初期化メソッド。
+
+        Args:
+            path (str): ロックファイルのパス. 存在しない場合は、ディレクトリ(フォルダ)と共に作成する.
+            shared (bool, optional): 共有ロックとするか否か. Defaults to False.
+            timeout (float, optional): `with` で取得する場合に待つ秒数. None の場合は取得できるまで待つ. Defaults to None.
+            poll_interval (float, optional): 期限付きで待つ場合に、ロックの取得を再試行する間隔の秒数. Defaults to 0.05.
+        """
+        self.path = path
+        self.shared = shared
+        self.timeout = timeout
+        self._poll_interval = poll_interval
+        self._file = None
+        # 他のプロセスがロックを保持していた為に、取得するまで待ったか否か。
+        self.waited = False
+
+    @property
+    def locked(self) -> bool:
+        """ このインスタンスがロックを保持しているか否か。 """
+        return self._file is not None
+
+    def _try_lock(self, f) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """ ロックを取得するメソッド。
+
+        Args:
+            timeout (float, optional): 待つ秒数. 0 の場合は待たず、 None の場合は取得できるまで待つ. Defaults to None.
+
+        Raises:
+            RuntimeError: このインスタンスが既にロックを保持している場合に raise.
+
+        Returns:
+            bool: ロックを取得できたか否か.
+        """
+        if self._file is not None:
+            raise RuntimeError("The lock is already acquired: {path}".format(path=self.path))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, "a+b")
+        try:
+            self.waited = False
+            if not self._try_lock(f):
+                if timeout is not None and timeout <= 0:
+                    f.close()
+                    return False
+                logger.info("Waiting for the lock held by another process: {path}".format(path=self.path))
+                self.waited = True
+                if not self._wait(f, timeout):
+                    f.close()
+                    return False
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+        return True
+
+    def _wait(self, f, timeout: Optional[float]) -> bool:
+        if timeout is None and fcntl is not None:
+            # 期限が無ければ、ポーリングせずに解放されるまでブロックする。
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(self._poll_interval)
+            if self._try_lock(f):
+                return True
+        return False
+
+    def release(self) -> None:
+        """ ロックを解放するメソッド。ロックを保持していない場合は何もしない。 """
+        f = self._file
+        if f is None:
+            return
+        self._file = None
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            f.close()
+
+    def __enter__(self) -> "McbdscFileLock":
+        if not self.acquire(timeout=self.timeout):
+            raise McbdscLockTimeoutError("Timed out waiting for the lock: {path}".format(path=self.path))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.release()
+
+
+class McbdscLockManager(object):
+    """ リソースの種類と名前毎のロックファイルを、一つのディレクトリ(フォルダ)で管理するクラス。
+
+    ロックファイルは `<lock_dir>/<種類>/<名前>.lock` に作成します。名前に含まれるファイル名に利用できない文字
+    (イメージのタグの ":" 等)はエスケープするので、 "bedrock:1.16" のような名前をそのまま指定できます。
+
+    Examples:
+
+        >>> import tempfile
+        >>> from pymcbdsc.locks import McbdscLockManager
+        >>>
+        >>> locks = McbdscLockManager(tempfile.mkdtemp())
+        >>> with locks.lock("image", "bedrock:1.16"):
+        ...     pass
+        >>> os.path.basename(locks.lock_path("image", "bedrock:1.16"))
+        'bedrock%3A1.16.lock'
+    """
+
+    def __init__(self, lock_dir: str, timeout: Optional[float] = None) -> None:
+        """ McbdscLockManager インスタンスの初期化メソッド。
+
+        Args:
+            lock_dir (str): ロックファイルを作成するディレクトリ(フォルダ)のパス.
+            timeout (float, optional): ロックを待つ秒数の既定値. None の場合は取得できるまで待つ. Defaults to None.
+        """
+        self._dir = lock_dir
+        self._timeout = timeout
+
+    def lock_path(self, kind: str, name: str) -> str:
+        """ 種類が `kind` で名前が `name` のリソースの、ロックファイルのパスを戻すメソッド。 """
+        return os.path.join(self._dir, kind, quote(name, safe="") + ".lock")
+
+    def lock(self, kind: str, name: str, shared: bool = False, timeout: Optional[float] = None) -> McbdscFileLock:
+        """ リソースのロックを戻すメソッド。 `with` で取得し、取得できなかった場合は McbdscLockTimeoutError を raise する。
+
+        Args:
+            kind (str): リソースの種類("zip", "store", "image", "container" 等).
+            name (str): リソースの名前(バージョン、タグ、コンテナ名等).
+            shared (bool, optional): 共有ロックとするか否か. Defaults to False.
+            timeout (float, optional): 待つ秒数. None の場合はインスタンスの既定値. Defaults to None.
+
+        Returns:
+            McbdscFileLock: 未取得のロック.
+        """
+        return McbdscFileLock(self.lock_path(kind, name), shared=shared,
+                              timeout=timeout if timeout is not None else self._timeout)
@@ -0,0 +1,410 @@
+""" コンテナのログを追跡し、 Bedrock Server のイベントとして解析するモジュール。
+
+コンテナのログを前回読み込んだ位置(タイムスタンプ)から差分で読み込み、
+プレイヤーの接続・切断やサーバの起動、エラーなどのイベントに変換します。
+イベントは件数に上限のあるリングバッファに保持するので、長時間動作してもメモリの使用量は一定です。
+
+This module follows the logs of the containers and parses them into the events of the Bedrock Server.
+"""
+
+from typing import Callable, Iterable, List, Optional, Tuple
+import calendar
+import re
+import threading
+import time
+from collections import deque
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+EVENT_PLAYER_CONNECTED = "player_connected"
+EVENT_PLAYER_DISCONNECTED = "player_disconnected"
+EVENT_SERVER_STARTED = "server_started"
+EVENT_SERVER_STOPPING = "server_stopping"
+EVENT_SAVE_READY = "save_ready"
+EVENT_SAVE_RESUMED = "save_resumed"
+EVENT_ERROR = "error"
+
+# "[2021-01-31 12:34:56:789 INFO] Player connected: Steve, xuid: 2535412345678901" のような行を解析する。
+_line_re = re.compile(r"^\[(?P<time>\d{4}-\d{2}-\d{2} [\d:]+)\s+(?P<level>[A-Z]+)\]\s?(?P<message>.*)$")
+_message_patterns = (
+    (EVENT_PLAYER_CONNECTED, re.compile(r"^Player connected: (?P<player>.*?), xuid: (?P<xuid>\d*)")),
+    (EVENT_PLAYER_DISCONNECTED, re.compile(r"^Player disconnected: (?P<player>.*?), xuid: (?P<xuid>\d*)")),
+    (EVENT_SERVER_STARTED, re.compile(r"^Server started\.")),
+    (EVENT_SERVER_STOPPING, re.compile(r"^(Stopping server|Quit correctly)")),
+    (EVENT_SAVE_READY, re.compile(r"^Data saved\. Files are now ready to be copied\.")),
+    (EVENT_SAVE_RESUMED, re.compile(r"^Changes to the (level|world) are resumed\.")),
+)
+_error_levels = ("ERROR", "FATAL")
+# Docker がログに付与するタイムスタンプ(RFC3339Nano)。
+_docker_ts_re = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?Z$")
+
+
+class McbdscLogEvent(object):
+    """ Bedrock Server のログから解析したイベントを表すクラス。 """
+
+    __slots__ = ("kind", "container", "timestamp", "level", "message", "player", "xuid")
+
+    def __init__(self,
+                 kind: str,
+                 container: Optional[str],
+                 timestamp: Optional[float],
+                 level: Optional[str],
+                 message: str,
+                 player: Optional[str] = None,
+                 xuid: Optional[str] = None) -> None:
+        """ McbdscLogEvent インスタンスの初期化メソッド。
+
+        Args:
+            kind (str): イベントの種類. `EVENT_*` 定数のいずれか.
+            container (str, optional): イベントが発生したコンテナ名.
+            timestamp (float, optional): Docker がログに付与した時刻(UNIX 時間).
+            level (str, optional): ログレベル(INFO, ERROR 等).
+            message (str): ログのメッセージ部.
+            player (str, optional): プレイヤーの接続・切断の場合は、プレイヤー名. Defaults to None.
+            xuid (str, optional): プレイヤーの接続・切断の場合は、プレイヤーの XUID. Defaults to None.
+        """
+        self.kind = kind
+        self.container = container
+        self.timestamp = timestamp
+        self.level = level
+        self.message = message
+        self.player = player
+        self.xuid = xuid
+
+    def __repr__(self) -> str:
+        return ("McbdscLogEvent(kind={kind!r}, container={container!r}, player={player!r}, message={message!r})"
+                .format(kind=self.kind, container=self.container, player=self.player, message=self.message))
+
+
+def parse_docker_timestamp(ts: str) -> float:
+    """ Docker がログに付与するタイムスタンプを UNIX 時間に変換する関数。
+
+    Args:
+        ts (str): "2021-01-31T12:34:56.123456789Z" 形式のタイムスタンプ.
+
+    Raises:
+        ValueError: 形式が異なる場合に raise.
+
+    Returns:
+        float: UNIX 時間.
+
+    Examples:
+
+        >>> from pymcbdsc.logs import parse_docker_timestamp
+        >>>
+        >>> parse_docker_timestamp("2021-01-31T12:34:56.5Z")
+        1612096496.5
+    """
+    m = _docker_ts_re.match(ts)
+    if not m:
+        raise ValueError("Invalid timestamp: {ts}".format(ts=ts))
+    seconds = calendar.timegm(time.strptime(m.group(1), "%Y-%m-%dT%H:%M:%S"))
+    fraction = m.group(2)
+    return seconds + (int(fraction) / 10 ** len(fraction) if fraction else 0)
+
+
+def parse_line(line: str, container: Optional[str] = None, timestamp: Optional[float] = None) -> Optional[McbdscLogEvent]:
+    """ Bedrock Server のログの一行を解析し、イベントを戻す関数。
+
+    Args:
+        line (str): ログの一行.
+        container (str, optional): コンテナ名. Defaults to None.
+        timestamp (float, optional): ログの時刻. Defaults to None.
+
+    Returns:
+        Optional[McbdscLogEvent]: イベント. イベントとして扱わない行の場合は None.
+
+    Examples:
+
+        >>> from pymcbdsc.logs import parse_line
+        >>>
+        >>> event = parse_line("[2021-01-31 12:34:56:789 INFO] Player connected: Steve, xuid: 2535412345678901")
+        >>> (event.kind, event.player, event.xuid)
+        ('player_connected', 'Steve', '2535412345678901')
+        >>> parse_line("[2021-01-31 12:34:56:789 INFO] Running AutoCompaction...") is None
+        True
+    """
+    m = _line_re.match(line)
+    if not m:
+        return None
+    level = m.group("level")
+    message = m.group("message")
+    for (kind, pattern) in _message_patterns:
+        mm = pattern.match(message)
+        if mm:
+            groups = mm.groupdict()
+            return McbdscLogEvent(kind=kind, container=container, timestamp=timestamp, level=level, message=message,
+                                  player=groups.get("player"), xuid=groups.get("xuid"))
+    if level in _error_levels:
+        return McbdscLogEvent(kind=EVENT_ERROR, container=container, timestamp=timestamp, level=level, message=message)
+    return None
+
+
+class McbdscLogTailer(object):
+    """ 一つのコンテナのログを差分で読み込み、イベントを保持するクラス。
+
+    読み込んだ最後の行の Docker のタイムスタンプ(とそのタイムスタンプの行数)を位置として保持し、
+    次回はその位置以降のみを Docker から取得するので、過去のログを読み直すことはありません。
+    位置は `offset` で取得でき、次回の初期化時に渡すことでプロセスを跨いで再開できます。
+    `db` を指定した場合は、位置を McbdscStateDB に保存し、次回の初期化時に読み込みます。
+    """
+
+    def __init__(self,
+                 container,
+                 name: Optional[str] = None,
+                 max_events: int = 1000,
+                 offset: Optional[Tuple[str, int]] = None,
+                 since: Optional[float] = None,
+                 db=None,
+                 save_interval: float = 1.0) -> None:
+        """ McbdscLogTailer インスタンスの初期化メソッド。
+
+        Args:
+            container (Container): 対象となる docker-py の Container インスタンス.
+            name (str, optional): コンテナ名. None の場合は `container.name`. Defaults to None.
+            max_events (int, optional): 保持するイベントの最大数. Defaults to 1000.
+            offset (Tuple[str, int], optional): 前回の `offset` の値. Defaults to None.
+            since (float, optional): offset を指定しない場合に、読み込みを開始する時刻(UNIX 時間).
+                                     None の場合は、最初から読み込む. Defaults to None.
+            db (McbdscStateDB, optional): 読み込んだ位置を保存するデータベース. offset を指定しない場合は、
+                                          保存されている位置から読み込む. Defaults to None.
+            save_interval (float, optional): 読み込んだ位置を `db` に保存する最短の間隔(秒). Defaults to 1.0.
+        """
+        self._container = container
+        self.name = container.name if name is None else name
+        self.events = deque(maxlen=max_events)
+        self._db = db
+        self._save_interval = save_interval
+        self._saved_at = None
+        if offset is None and db is not None:
+            offset = db.log_offset(self.name)
+        self._saved = offset
+        (self._last_ts, self._seen_at_last) = offset if offset is not None else (None, 0)
+        self._last_t = parse_docker_timestamp(self._last_ts) if self._last_ts is not None else None
+        self._skip_t = None
+        self._skip = 0
+        self._since = since
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def offset(self) -> Tuple[Optional[str], int]:
+        """ 読み込んだ位置. 最後の行の Docker のタイムスタンプと、そのタイムスタンプを持つ読み込み済みの行数。 """
+        return (self._last_ts, self._seen_at_last)
+
+    def add_listener(self, listener: Callable[[McbdscLogEvent], None]) -> None:
+        """ イベントを受け取るリスナーを登録するメソッド。
+
+        Args:
+            listener (Callable[[McbdscLogEvent], None]): イベントを引数としてコールされる関数.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[McbdscLogEvent], None]) -> None:
+        """ 登録したリスナーを除くメソッド。登録されていなければ何もしない。 """
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _open_params(self) -> dict:
+        # Docker の since はその時刻を含むので、同じタイムスタンプの読み込み済みの行は `feed` で読み飛ばす。
+        self._skip_t = self._last_t
+        self._skip = self._seen_at_last
+        since = self._last_t if self._last_t is not None else self._since
+        return {"stdout": True, "stderr": True, "timestamps": True, "since": since}
+
+    def feed(self, lines: Iterable[str]) -> List[McbdscLogEvent]:
+        """ `timestamps=True` で取得したログの行を取り込むメソッド。
+
+        既に読み込んだ位置以前の行は無視します。
+
+        Args:
+            lines (Iterable[str]): "<タイムスタンプ> <ログ>" 形式の行.
+
+        Returns:
+            List[McbdscLogEvent]: 新たに解析したイベントのリスト.
+        """
+        new_events = []
+        with self._lock:
+            for raw in lines:
+                raw = raw.rstrip("\r\n")
+                if not raw:
+                    continue
+                (ts, _, line) = raw.partition(" ")
+                try:
+                    t = parse_docker_timestamp(ts)
+                except ValueError:
+                    continue
+                # RFC3339Nano の末尾の 0 は省略されるので、文字列ではなく数値で比較する。
+                if self._last_t is not None and t < self._last_t:
+                    continue
+                if t == self._skip_t and self._skip > 0:
+                    self._skip -= 1
+                    continue
+                if t == self._last_t:
+                    self._seen_at_last += 1
+                else:
+                    (self._last_ts, self._last_t, self._seen_at_last) = (ts, t, 1)
+                event = parse_line(line.rstrip("\r"), container=self.name, timestamp=t)
+                if event is not None:
+                    self.events.append(event)
+                    new_events.append(event)
+        self.save_offset(force=False)
+        for event in new_events:
+            for listener in self._listeners:
+                try:
+                    listener(event)
+                except Exception as e:
+                    logger.warning("A listener of the log tailer raised an exception: {e}".format(e=e))
+        return new_events
+
+    def save_offset(self, force: bool = True) -> None:
+        """ 読み込んだ位置を `db` に保存するメソッド。 `db` が None の場合は何もしない。
+
+        Args:
+            force (bool, optional): False の場合は、前回の保存から `save_interval` 秒以内であれば保存しない.
+                                    Defaults to True.
+        """
+        offset = self.offset
+        if self._db is None or offset[0] is None or offset == self._saved:
+            return
+        now = time.monotonic()
+        if not force and self._saved_at is not None and now - self._saved_at < self._save_interval:
+            return
+        self._db.set_log_offset(self.name, offset)
+        (self._saved, self._saved_at) = (offset, now)
+
+    def poll(self) -> List[McbdscLogEvent]:
+        """ 前回の位置以降のログを取得し、イベントを解析するメソッド。
+
+        Returns:
+            List[McbdscLogEvent]: 新たに解析したイベントのリスト.
+        """
+        data = self._container.logs(**self._open_params())
+        return self.feed(data.decode("utf-8", errors="replace").splitlines())
+
+    def follow(self, stop: Optional[threading.Event] = None) -> None:
+        """ 前回の位置以降のログをストリーミングで読み続けるメソッド。
+
+        コンテナが停止するか、 `stop` がセットされた後に次の行を受信するまで戻りません。
+
+        Args:
+            stop (threading.Event, optional): 読み込みを停止する為のイベント. Defaults to None.
+        """
+        stream = self._container.logs(stream=True, follow=True, **self._open_params())
+        buf = b""
+        try:
+            for chunk in stream:
+                buf += chunk
+                *lines, buf = buf.split(b"\n")
+                if lines:
+                    self.feed(line.decode("utf-8", errors="replace") for line in lines)
+                if stop is not None and stop.is_set():
+                    break
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            self.save_offset()
+
+
+class McbdscLogMonitor(object):
+    """ 複数のコンテナのログを、一つのプロセスで同時に追跡するクラス。
+
+    コンテナ毎に一つのスレッドでログをストリーミングで読み続けます。
+    スレッドはほとんどの時間を I/O 待ちで過ごすので、数十のコンテナでも CPU の負荷はわずかです。
+    追跡するコンテナは、追跡を開始した後も `add_tailer()` 及び `remove_tailer()` で増減できます。
+    """
+
+    def __init__(self, tailers: List[McbdscLogTailer], retry_interval: float = 5.0) -> None:
+        """ McbdscLogMonitor インスタンスの初期化メソッド。
+
+        Args:
+            tailers (List[McbdscLogTailer]): 追跡する McbdscLogTailer インスタンスのリスト.
+            retry_interval (float, optional): ログのストリームが終了した際に、開き直すまでの秒数. Defaults to 5.0.
+        """
+        self.tailers = {}
+        self._retry_interval = retry_interval
+        self._listeners = []
+        # コンテナ名と、そのコンテナの追跡を停止する為のイベントの dict.
+        self._stops = {}
+        self._started = False
+        self._lock = threading.Lock()
+        for tailer in tailers:
+            self.add_tailer(tailer)
+
+    def add_listener(self, listener: Callable[[McbdscLogEvent], None]) -> None:
+        """ 全てのコンテナのイベントを受け取るリスナーを登録するメソッド。後から追加したコンテナのイベントも受け取る。 """
+        self._listeners.append(listener)
+
+    def _dispatch(self, event: McbdscLogEvent) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning("A listener of the log monitor raised an exception: {e}".format(e=e))
+
+    def add_tailer(self, tailer: McbdscLogTailer) -> None:
+        """ 追跡するコンテナを追加するメソッド。追跡を開始済みであれば、このコンテナの追跡もすぐに開始する。
+
+        同じ名前のコンテナを追跡している場合は、そのコンテナの追跡を停止して置き換えます。
+        """
+        with self._lock:
+            self._remove_tailer(tailer.name)
+            tailer.add_listener(self._dispatch)
+            self.tailers[tailer.name] = tailer
+            self._stops[tailer.name] = threading.Event()
+            if self._started:
+                self._start_tailer(tailer)
+
+    def remove_tailer(self, name: str) -> None:
+        """ コンテナの追跡を停止し、追跡するコンテナから除くメソッド。
+
+        McbdscDockerContainer は McbdscLogTailer を使い回すので、同じ tailer を追加し直せるよう、リスナーの登録も解除します。
+        """
+        with self._lock:
+            self._remove_tailer(name)
+
+    def _remove_tailer(self, name: str) -> None:
+        tailer = self.tailers.pop(name, None)
+        if tailer is not None:
+            tailer.remove_listener(self._dispatch)
+        stop = self._stops.pop(name, None)
+        if stop is not None:
+            stop.set()
+
+    def events(self) -> List[McbdscLogEvent]:
+        """ 全てのコンテナの保持しているイベントを、時刻順に戻すメソッド。 """
+        with self._lock:
+            tailers = list(self.tailers.values())
+        events = [e for t in tailers for e in list(t.events)]
+        events.sort(key=lambda e: e.timestamp or 0)
+        return events
+
+    def start(self) -> None:
+        """ 全てのコンテナのログの追跡を開始するメソッド。 """
+        with self._lock:
+            self._started = True
+            for tailer in self.tailers.values():
+                # 停止した追跡のスレッドが残っていても再開しないよう、新しいイベントで開始する。
+                self._stops[tailer.name] = threading.Event()
+                self._start_tailer(tailer)
+
+    def _start_tailer(self, tailer: McbdscLogTailer) -> None:
+        threading.Thread(target=self._follow, args=(tailer, self._stops[tailer.name]), daemon=True,
+                         name="mcbdsc-logs-{name}".format(name=tailer.name)).start()
+
+    def stop(self) -> None:
+        """ 全てのコンテナのログの追跡を停止するメソッド。 """
+        with self._lock:
+            self._started = False
+            for stop in self._stops.values():
+                stop.set()
+
+    def _follow(self, tailer: McbdscLogTailer, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                tailer.follow(stop=stop)
+            except Exception as e:
+                logger.warning("Failed to follow the logs of {name}: {e}".format(name=tailer.name, e=e))
+            stop.wait(self._retry_interval)
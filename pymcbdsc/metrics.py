@@ -0,0 +1,420 @@
+""" コンテナのリソース使用状況を収集し、 Prometheus 形式で出力するモジュール。
+
+Docker の stats API をコンテナ毎にストリーミングで開き、 CPU 使用率、メモリ使用量、
+ネットワーク及びブロック I/O の差分に変換した上で、コンテナ毎の固定長のリングバッファに保持します。
+
+This module collects the resource usage of the containers and exports them as the Prometheus text format.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from logging import getLogger
+from socketserver import ThreadingMixIn
+
+
+logger = getLogger(__name__)
+
+# リングバッファに保持するフィールド。
+sample_fields = ("timestamp", "cpu_percent", "memory_usage", "memory_limit",
+                 "network_rx", "network_tx", "blkio_read", "blkio_write")
+
+
+class McbdscRingBuffer(object):
+    """ array で実装した、固定長のリングバッファ。
+
+    フィールド毎に `array('d')` を一つずつ確保し、古いサンプルから上書きします。
+    `downsample` に 2 以上を指定した場合は、その数のサンプルを平均したものを一つのサンプルとして保持します。
+
+    Examples:
+
+        >>> from pymcbdsc.metrics import McbdscRingBuffer
+        >>>
+        >>> buf = McbdscRingBuffer(capacity=3, fields=("a",))
+        >>> for i in range(5):
+        ...     buf.append({"a": i})
+        >>> [s["a"] for s in buf.samples()]
+        [2.0, 3.0, 4.0]
+        >>>
+        >>> buf = McbdscRingBuffer(capacity=3, fields=("a",), downsample=2)
+        >>> for i in range(5):
+        ...     buf.append({"a": i})
+        >>> [s["a"] for s in buf.samples()]
+        [0.5, 2.5]
+    """
+
+    def __init__(self, capacity: int, fields: Iterable[str] = sample_fields, downsample: int = 1) -> None:
+        """ McbdscRingBuffer インスタンスの初期化メソッド。
+
+        Args:
+            capacity (int): 保持するサンプルの最大数.
+            fields (Iterable[str], optional): サンプルのフィールド名. Defaults to sample_fields.
+            downsample (int, optional): 一つのサンプルにまとめる入力サンプルの数. Defaults to 1.
+        """
+        self._capacity = capacity
+        self._fields = tuple(fields)
+        self._downsample = max(1, downsample)
+        self._data = {f: array("d", bytes(8 * capacity)) for f in self._fields}
+        self._head = 0
+        self._count = 0
+        self._acc = {f: 0.0 for f in self._fields}
+        self._acc_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, sample: Dict[str, float]) -> None:
+        """ サンプルを追加するメソッド。
+
+        Args:
+            sample (Dict[str, float]): フィールド名と値の dict. 存在しないフィールドは 0 として扱う.
+        """
+        with self._lock:
+            acc = self._acc
+            for f in self._fields:
+                acc[f] += sample.get(f, 0.0)
+            self._acc_count += 1
+            if self._acc_count < self._downsample:
+                return
+            n = self._acc_count
+            head = self._head
+            for f in self._fields:
+                self._data[f][head] = acc[f] / n
+                acc[f] = 0.0
+            self._acc_count = 0
+            self._head = (head + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+
+    def samples(self) -> List[Dict[str, float]]:
+        """ 保持しているサンプルを古い順に戻すメソッド。
+
+        Returns:
+            List[Dict[str, float]]: サンプルのリスト.
+        """
+        with self._lock:
+            start = (self._head - self._count) % self._capacity
+            indexes = [(start + i) % self._capacity for i in range(self._count)]
+            return [{f: self._data[f][i] for f in self._fields} for i in indexes]
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        """ 最も新しいサンプルを戻すメソッド。
+
+        Returns:
+            Optional[Dict[str, float]]: 最も新しいサンプル. サンプルがなければ None.
+        """
+        with self._lock:
+            if self._count == 0:
+                return None
+            i = (self._head - 1) % self._capacity
+            return {f: self._data[f][i] for f in self._fields}
+
+
+def _network_bytes(stats: dict) -> Tuple[int, int]:
+    rx = tx = 0
+    for net in (stats.get("networks") or {}).values():
+        rx += net.get("rx_bytes", 0)
+        tx += net.get("tx_bytes", 0)
+    return (rx, tx)
+
+
+def _blkio_bytes(stats: dict) -> Tuple[int, int]:
+    read = write = 0
+    entries = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    for entry in entries:
+        # cgroup v1 では "Read"/"Write" 、 cgroup v2 では "read"/"write" となる。
+        op = entry.get("op", "").lower()
+        if op == "read":
+            read += entry.get("value", 0)
+        elif op == "write":
+            write += entry.get("value", 0)
+    return (read, write)
+
+
+def memory_usage(stats: dict) -> Tuple[int, int]:
+    """ stats API の出力から、ページキャッシュを除いたメモリの使用量と上限(バイト)の tuple を求める関数。
+
+    Examples:
+
+        >>> from pymcbdsc.metrics import memory_usage
+        >>>
+        >>> memory_usage({"memory_stats": {"usage": 300, "limit": 1000, "stats": {"inactive_file": 100}}})
+        (200, 1000)
+    """
+    mem = stats.get("memory_stats") or {}
+    usage = mem.get("usage", 0)
+    detail = mem.get("stats") or {}
+    # docker stats コマンドと同様に、ページキャッシュを除いた値を使用量とする。
+    cache = detail.get("inactive_file", detail.get("total_inactive_file", detail.get("cache", 0)))
+    return (max(usage - cache, 0), mem.get("limit", 0))
+
+
+def cpu_percent(stats: dict) -> float:
+    """ stats API の出力から、 docker stats コマンドと同様に CPU の使用率(%, 1 CPU = 100%)を求める関数。
+
+    Examples:
+
+        >>> from pymcbdsc.metrics import cpu_percent
+        >>>
+        >>> cpu_percent({"cpu_stats": {"cpu_usage": {"total_usage": 300}, "system_cpu_usage": 2000, "online_cpus": 2},
+        ...              "precpu_stats": {"cpu_usage": {"total_usage": 100}, "system_cpu_usage": 1000}})
+        40.0
+    """
+    cpu = stats.get("cpu_stats") or {}
+    precpu = stats.get("precpu_stats") or {}
+    cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - precpu.get("cpu_usage", {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    online_cpus = cpu.get("online_cpus") or len(cpu.get("cpu_usage", {}).get("percpu_usage") or []) or 1
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    return cpu_delta / system_delta * online_cpus * 100.0
+
+
+class McbdscContainerMetrics(object):
+    """ 一つのコンテナの stats API の出力を、サンプルに変換して保持するクラス。 """
+
+    def __init__(self, name: str, capacity: int = 300, history_capacity: int = 1440, downsample: int = 60) -> None:
+        """ McbdscContainerMetrics インスタンスの初期化メソッド。
+
+        Args:
+            name (str): コンテナ名.
+            capacity (int, optional): 直近のサンプルを保持する数. Defaults to 300.
+            history_capacity (int, optional): ダウンサンプリングしたサンプルを保持する数. Defaults to 1440.
+            downsample (int, optional): ダウンサンプリングで一つにまとめるサンプルの数. Defaults to 60.
+        """
+        self.name = name
+        self.recent = McbdscRingBuffer(capacity=capacity)
+        self.history = McbdscRingBuffer(capacity=history_capacity, downsample=downsample)
+        # Prometheus の counter として出力する累積値。
+        self.totals = {"network_rx": 0, "network_tx": 0, "blkio_read": 0, "blkio_write": 0}
+        self._prev = None
+
+    def update(self, stats: dict, timestamp: Optional[float] = None) -> Optional[Dict[str, float]]:
+        """ stats API の出力(一回分)を取り込むメソッド。
+
+        ネットワーク及びブロック I/O は前回の出力との差分を求めるので、最初の出力ではサンプルは追加されません。
+
+        Args:
+            stats (dict): stats API の出力を decode した dict.
+            timestamp (float, optional): サンプルの時刻. None の場合は現在時刻. Defaults to None.
+
+        Returns:
+            Optional[Dict[str, float]]: 追加したサンプル. 追加しなかった場合は None.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        (rx, tx) = _network_bytes(stats)
+        (read, write) = _blkio_bytes(stats)
+        (usage, limit) = memory_usage(stats)
+        prev = self._prev
+        self._prev = (rx, tx, read, write)
+        self.totals = {"network_rx": rx, "network_tx": tx, "blkio_read": read, "blkio_write": write}
+        if prev is None:
+            return None
+        # コンテナの再起動でカウンタがリセットされた場合は、差分を 0 とする。
+        sample = {"timestamp": timestamp,
+                  "cpu_percent": cpu_percent(stats),
+                  "memory_usage": usage,
+                  "memory_limit": limit,
+                  "network_rx": max(rx - prev[0], 0),
+                  "network_tx": max(tx - prev[1], 0),
+                  "blkio_read": max(read - prev[2], 0),
+                  "blkio_write": max(write - prev[3], 0)}
+        self.recent.append(sample)
+        self.history.append(sample)
+        return sample
+
+
+def write_textfile(path: str, text: str) -> None:
+    """ Prometheus のテキスト形式の文字列を、一時ファイルに書き込んだ後に rename してファイルに出力する関数。
+
+    Args:
+        path (str): 出力するファイルのパス.
+        text (str): Prometheus のテキスト形式の文字列.
+    """
+    tmp = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class McbdscMetricsCollector(object):
+    """ 管理する全コンテナの stats API を同時にストリーミングで開き、リソース使用状況を収集するクラス。
+
+    コンテナ毎に一つのスレッドで stats API を読み続けるので、コンテナの数によらず
+    約 1 秒毎にサンプルが更新されます。
+    収集するコンテナは、収集を開始した後も `add_container()` 及び `remove_container()` で増減できます。
+
+    Examples:
+
+        >>> from pymcbdsc import McbdscDockerManager
+        >>>
+        >>> params = [{"name": "mcbdsc_test", "image": "bedrock:latest"}]
+        >>> manager = McbdscDockerManager(containers_param=params)  # doctest: +SKIP
+        >>> collector = manager.metrics_collector()  # doctest: +SKIP
+        >>> collector.start()  # doctest: +SKIP
+        >>> collector.write_textfile("/var/lib/node_exporter/mcbdsc.prom")  # doctest: +SKIP
+    """
+
+    def __init__(self, containers: list, **metrics_opt) -> None:
+        """ McbdscMetricsCollector インスタンスの初期化メソッド。
+
+        Args:
+            containers (list): McbdscDockerContainer インスタンスのリスト.
+            **metrics_opt: McbdscContainerMetrics に渡す引数.
+        """
+        self._metrics_opt = metrics_opt
+        self._containers = {}
+        self._metrics = {}
+        # コンテナ名と、そのコンテナの stats API の読み込みを停止する為のイベントの dict.
+        self._stops = {}
+        self._started = False
+        self._lock = threading.Lock()
+        for container in containers:
+            self.add_container(container)
+
+    def metrics(self) -> Dict[str, McbdscContainerMetrics]:
+        """ コンテナ名と McbdscContainerMetrics インスタンスの dict を戻すメソッド。 """
+        with self._lock:
+            return dict(self._metrics)
+
+    def add_container(self, container) -> None:
+        """ 収集するコンテナを追加するメソッド。収集を開始済みであれば、このコンテナの収集もすぐに開始する。
+
+        同じ名前のコンテナを収集している場合は、その収集を停止して置き換えます。
+
+        Args:
+            container (McbdscDockerContainer): 追加するコンテナ.
+        """
+        with self._lock:
+            self._remove_container(container.name)
+            self._containers[container.name] = container
+            self._metrics[container.name] = McbdscContainerMetrics(name=container.name, **self._metrics_opt)
+            self._stops[container.name] = threading.Event()
+            if self._started:
+                self._start_container(container)
+
+    def remove_container(self, name: str) -> None:
+        """ コンテナの収集を停止し、そのリソース使用状況を破棄するメソッド。 """
+        with self._lock:
+            self._remove_container(name)
+
+    def _remove_container(self, name: str) -> None:
+        self._containers.pop(name, None)
+        self._metrics.pop(name, None)
+        stop = self._stops.pop(name, None)
+        if stop is not None:
+            stop.set()
+
+    def start(self) -> None:
+        """ 各コンテナの stats API の読み込みを開始するメソッド。 """
+        with self._lock:
+            self._started = True
+            for container in self._containers.values():
+                self._stops[container.name] = threading.Event()
+                self._start_container(container)
+
+    def _start_container(self, container) -> None:
+        threading.Thread(target=self._collect,
+                         args=(container, self._metrics[container.name], self._stops[container.name]),
+                         name="mcbdsc-stats-{name}".format(name=container.name), daemon=True).start()
+
+    def stop(self) -> None:
+        """ 各コンテナの stats API の読み込みを停止するメソッド。
+
+        読み込み中のストリームは次のサンプルを受信した時点で閉じられます。
+        """
+        with self._lock:
+            self._started = False
+            for stop in self._stops.values():
+                stop.set()
+
+    def _collect(self, container, metrics: McbdscContainerMetrics, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                stream = container.stats(stream=True, decode=True)
+                for stats in stream:
+                    if stop.is_set():
+                        break
+                    metrics.update(stats)
+                if hasattr(stream, "close"):
+                    stream.close()
+            except Exception as e:
+                logger.warning("Failed to read the stats of {name}: {e}".format(name=container.name, e=e))
+            # コンテナが停止している等でストリームが終了した場合は、少し待ってから開き直す。
+            stop.wait(5)
+
+    def render_prometheus(self) -> str:
+        """ 収集したリソース使用状況を Prometheus のテキスト形式で戻すメソッド。
+
+        Returns:
+            str: Prometheus のテキスト形式の文字列.
+        """
+        gauges = (("cpu_percent", "mcbdsc_container_cpu_percent", "CPU usage of the container in percent."),
+                  ("memory_usage", "mcbdsc_container_memory_usage_bytes", "Memory usage of the container."),
+                  ("memory_limit", "mcbdsc_container_memory_limit_bytes", "Memory limit of the container."))
+        counters = (("network_rx", "mcbdsc_container_network_receive_bytes_total", "Bytes received by the container."),
+                    ("network_tx", "mcbdsc_container_network_transmit_bytes_total", "Bytes sent by the container."),
+                    ("blkio_read", "mcbdsc_container_blkio_read_bytes_total", "Bytes read from block devices."),
+                    ("blkio_write", "mcbdsc_container_blkio_write_bytes_total", "Bytes written to block devices."))
+        all_metrics = self.metrics()
+        latest = {name: m.recent.latest() for (name, m) in all_metrics.items()}
+        lines = []
+        for (field, metric, help) in gauges:
+            lines.append("# HELP {metric} {help}".format(metric=metric, help=help))
+            lines.append("# TYPE {metric} gauge".format(metric=metric))
+            for (name, sample) in sorted(latest.items()):
+                if sample is None:
+                    continue
+                lines.append('{metric}{{name="{name}"}} {value}'.format(metric=metric, name=name, value=sample[field]))
+        for (field, metric, help) in counters:
+            lines.append("# HELP {metric} {help}".format(metric=metric, help=help))
+            lines.append("# TYPE {metric} counter".format(metric=metric))
+            for (name, m) in sorted(all_metrics.items()):
+                if latest[name] is None:
+                    continue
+                lines.append('{metric}{{name="{name}"}} {value}'.format(metric=metric, name=name, value=m.totals[field]))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """ Prometheus の node_exporter の textfile collector 向けにファイルを出力するメソッド。
+
+        読み込み途中のファイルが参照されないよう、一時ファイルに書き込んだ後に rename します。
+
+        Args:
+            path (str): 出力するファイルのパス.
+        """
+        write_textfile(path, self.render_prometheus())
+
+    def serve(self, port: int, host: str = "") -> HTTPServer:
+        """ Prometheus がスクレイプできる HTTP エンドポイントを、バックグラウンドのスレッドで開始するメソッド。
+
+        Args:
+            port (int): 待ち受けるポート.
+            host (str, optional): 待ち受けるアドレス. Defaults to "".
+
+        Returns:
+            HTTPServer: 開始した HTTP サーバ. 停止する場合は `shutdown()` をコールする.
+        """
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = collector.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                logger.debug(format % args)
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = Server((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="mcbdsc-metrics-http", daemon=True).start()
+        return server
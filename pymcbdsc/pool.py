@@ -0,0 +1,304 @@
+""" 複数の Docker ホストをまとめて扱う為のモジュール。
+
+各ホストへの API 呼び出し(コンテナの一覧、 stats, 起動・停止等)はスレッドプールで同時に行うので、
+全ホストに対する操作の所要時間は、ホストの数によらず最も応答の遅いホストの所要時間程度となります。
+新しいサーバは、実際の stats から求めた CPU, メモリ及び UDP ポートの余裕が最も大きいホストに配置します。
+
+This module manages the pool of the Docker hosts.
+"""
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from urllib.parse import urlparse
+from .constants import bds_default_port
+from .metrics import cpu_percent, memory_usage
+from .trace import instrument_session
+from .utils import lazy_import
+
+if TYPE_CHECKING:
+    from docker.client import DockerClient
+
+
+logger = getLogger(__name__)
+
+docker = lazy_import("docker")
+
+T = TypeVar("T")
+
+# 同時に呼び出す API の最大数。
+_max_workers = 32
+
+
+class McbdscHostHeadroom(object):
+    """ 一つの Docker ホストの、 CPU, メモリ及び UDP ポートの余裕を表すクラス。 """
+
+    def __init__(self,
+                 host: str,
+                 cpus: float,
+                 memory: int,
+                 ports: int,
+                 cpu_used: float = 0.0,
+                 memory_used: int = 0,
+                 ports_used: int = 0,
+                 containers: int = 0) -> None:
+        """ McbdscHostHeadroom インスタンスの初期化メソッド。
+
+        Args:
+            host (str): ホスト名.
+            cpus (float): ホストの CPU の数.
+            memory (int): ホストのメモリのバイト数.
+            ports (int): サーバに割り当てられる UDP ポートの数.
+            cpu_used (float, optional): 起動しているコンテナが使用している CPU の数. Defaults to 0.0.
+            memory_used (int, optional): 起動しているコンテナが使用しているメモリのバイト数. Defaults to 0.
+            ports_used (int, optional): 公開済みの UDP ポートの数. Defaults to 0.
+            containers (int, optional): 起動しているコンテナの数. Defaults to 0.
+        """
+        self.host = host
+        self.cpus = cpus
+        self.memory = memory
+        self.ports = ports
+        self.cpu_used = cpu_used
+        self.memory_used = memory_used
+        self.ports_used = ports_used
+        self.containers = containers
+
+    @property
+    def cpu_free(self) -> float:
+        return max(self.cpus - self.cpu_used, 0.0)
+
+    @property
+    def memory_free(self) -> int:
+        return max(self.memory - self.memory_used, 0)
+
+    @property
+    def ports_free(self) -> int:
+        return max(self.ports - self.ports_used, 0)
+
+    def score(self) -> float:
+        """ 余裕の大きさを、 CPU, メモリ及び UDP ポートの空きの割合のうち最も小さいもので戻すメソッド。
+
+        サーバに必要な UDP ポートの組が空いていなければ、負の値を戻します。
+        """
+        if self.ports_free < 2:
+            return -1.0
+        ratios = [self.ports_free / self.ports]
+        if self.cpus:
+            ratios.append(self.cpu_free / self.cpus)
+        if self.memory:
+            ratios.append(self.memory_free / self.memory)
+        return min(ratios)
+
+    def reserve(self, cpus: float, memory: int) -> None:
+        """ 新しいサーバを配置した分だけ、余裕を減らすメソッド。 """
+        self.cpu_used += cpus
+        self.memory_used += memory
+        self.ports_used += 2
+        self.containers += 1
+
+    def __repr__(self) -> str:
+        return ("McbdscHostHeadroom(host={host!r}, cpu_free={cpu:.2f}, memory_free={mem}, ports_free={ports})"
+                .format(host=self.host, cpu=self.cpu_free, mem=self.memory_free, ports=self.ports_free))
+
+
+class McbdscDockerClientPool(object):
+    """ 複数の Docker ホストの DockerClient をまとめて扱うクラス。
+
+    Examples:
+
+        >>> from pymcbdsc.pool import McbdscDockerClientPool
+        >>>
+        >>> pool = McbdscDockerClientPool.from_urls({"host1": "tcp://10.0.0.1:2375",
+        ...                                         "host2": "tcp://10.0.0.2:2375"})  # doctest: +SKIP
+        >>> pool.place()  # doctest: +SKIP
+        'host2'
+    """
+
+    def __init__(self,
+                 clients: Dict[str, "DockerClient"],
+                 max_workers: int = _max_workers,
+                 port_base: int = bds_default_port,
+                 port_limit: int = 65535,
+                 server_cpus: float = 1.0,
+                 server_memory: int = 1024 * 1024 * 1024) -> None:
+        """ McbdscDockerClientPool インスタンスの初期化メソッド。
+
+        Args:
+            clients (Dict[str, "DockerClient"]): ホスト名と、そのホストに接続する DockerClient インスタンスの dict.
+            max_workers (int, optional): 同時に呼び出す API の最大数. Defaults to _max_workers.
+            port_base (int, optional): サーバに割り当てる最初の UDP ポート. Defaults to bds_default_port.
+            port_limit (int, optional): サーバに割り当てる最後の UDP ポート. Defaults to 65535.
+            server_cpus (float, optional): 配置を決める際に見込む、一つのサーバの CPU 使用量. Defaults to 1.0.
+            server_memory (int, optional): 配置を決める際に見込む、一つのサーバのメモリ使用量. Defaults to 1GiB.
+        """
+        if not clients:
+            raise ValueError("The pool needs at least one Docker host.")
+        self._clients = dict(clients)
+        self._max_workers = max_workers
+        self._port_base = port_base
+        self._port_limit = port_limit
+        self._server_cpus = server_cpus
+        self._server_memory = server_memory
+
+    @classmethod
+    def from_urls(cls, urls: Dict[str, str], client_opt: Optional[dict] = None, **pool_opt) -> "McbdscDockerClientPool":
+        """ ホスト名と Docker API の URL の dict から、 McbdscDockerClientPool インスタンスを作成するクラスメソッド。
+
+        Args:
+            urls (Dict[str, str]): ホスト名と、 Docker API の URL ("tcp://host:2375", "unix://..." 等)の dict.
+            client_opt (dict, optional): DockerClient の初期化メソッドに渡す引数. Defaults to None.
+            **pool_opt: McbdscDockerClientPool の初期化メソッドに渡す引数.
+        """
+        client_opt = client_opt or {}
+        clients = {host: docker.DockerClient(base_url=url, **client_opt) for (host, url) in urls.items()}
+        for client in clients.values():
+            instrument_session(client.api, "docker")
+        return cls(clients, **pool_opt)
+
+    @property
+    def hosts(self) -> List[str]:
+        return list(self._clients)
+
+    def client(self, host: str) -> "DockerClient":
+        return self._clients[host]
+
+    def address(self, host: str) -> Optional[str]:
+        """ ホストの Docker API の URL から、そのホストのアドレスを戻すメソッド。 UNIX ソケット等の場合は None. """
+        url = urlparse(self._clients[host].api.base_url)
+        if url.scheme not in ("http", "https", "tcp") or url.hostname in (None, "localhost"):
+            return None
+        return url.hostname
+
+    def _fan_out(self, calls: List[Callable[[], T]]) -> List[T]:
+        """ 関数のリストを同時に呼び出し、戻り値(又は raise された例外)のリストを同じ順序で戻すメソッド。 """
+        def call(f):
+            try:
+                return f()
+            except Exception as e:
+                return e
+
+        if len(calls) <= 1:
+            return [call(f) for f in calls]
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(calls))) as executor:
+            return list(executor.map(call, calls))
+
+    def map(self, func: Callable[[str, "DockerClient"], T], hosts: Optional[List[str]] = None) -> Dict[str, T]:
+        """ 全てのホストに対して `func(host, client)` を同時に呼び出すメソッド。
+
+        Args:
+            func (Callable[[str, DockerClient], T]): 呼び出す関数.
+            hosts (List[str], optional): 対象のホスト名のリスト. None の場合は全てのホスト. Defaults to None.
+
+        Returns:
+            Dict[str, T]: ホスト名と、 `func` の戻り値の dict. `func` が例外を raise したホストは、その例外が値となる.
+        """
+        hosts = hosts if hosts is not None else self.hosts
+        results = self._fan_out([lambda h=h: func(h, self._clients[h]) for h in hosts])
+        for (host, result) in zip(hosts, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to call the Docker API of {host}: {e}".format(host=host, e=result))
+        return dict(zip(hosts, results))
+
+    def list_containers(self, all: bool = True, inspect: bool = True, **list_opt) -> Dict[str, list]:
+        """ 全てのホストのコンテナの一覧を戻すメソッド。
+
+        一覧の取得と、各コンテナの詳細の取得(`inspect` が True の場合)は、いずれも全てのホストで同時に行います。
+        応答しないホストは、結果に含めません。
+
+        Args:
+            all (bool, optional): 停止しているコンテナも含めるか否か. Defaults to True.
+            inspect (bool, optional): 各コンテナの詳細を取得するか否か. False の場合は、一覧の API の情報のみを持つ.
+                                      Defaults to True.
+
+        Returns:
+            Dict[str, list]: ホスト名と、 Container インスタンスのリストの dict.
+        """
+        listed = self.map(lambda host, client: client.containers.list(all=all, sparse=True, **list_opt))
+        listed = {host: containers for (host, containers) in listed.items() if not isinstance(containers, Exception)}
+        if inspect:
+            containers = [c for cs in listed.values() for c in cs]
+            # 一覧の取得後に削除されたコンテナは除く。
+            errors = self._fan_out([c.reload for c in containers])
+            removed = {id(c) for (c, e) in zip(containers, errors) if isinstance(e, docker.errors.NotFound)}
+            listed = {host: [c for c in cs if id(c) not in removed] for (host, cs) in listed.items()}
+        return listed
+
+    def containers_by_name(self, all: bool = True) -> Dict[str, Tuple[str, object]]:
+        """ 全てのホストのコンテナについて、コンテナ名とホスト名及び Container インスタンスの dict を戻すメソッド。 """
+        found = {}
+        for (host, containers) in self.list_containers(all=all).items():
+            for container in containers:
+                name = container.name or container.attrs.get("Names", ["/"])[0].lstrip("/")
+                if name in found:
+                    logger.warning("The container {name} exists on {a} and {b}.".format(name=name, a=found[name][0], b=host))
+                    continue
+                found[name] = (host, container)
+        return found
+
+    def stats(self, containers: Dict[str, list]) -> Dict[str, List[dict]]:
+        """ コンテナの stats を一度ずつ、全てのホストで同時に取得するメソッド。
+
+        Args:
+            containers (Dict[str, list]): ホスト名と、 Container インスタンスのリストの dict.
+
+        Returns:
+            Dict[str, List[dict]]: ホスト名と、各コンテナの stats の dict のリスト. 取得に失敗したコンテナは含めない.
+        """
+        pairs = [(host, c) for (host, cs) in containers.items() for c in cs]
+        results = self._fan_out([lambda c=c: c.stats(stream=False) for (_h, c) in pairs])
+        stats = {host: [] for host in containers}
+        for ((host, c), result) in zip(pairs, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to get the stats of {id} on {host}: {e}".format(id=c.id, host=host, e=result))
+                continue
+            stats[host].append(result)
+        return stats
+
+    def headroom(self) -> Dict[str, McbdscHostHeadroom]:
+        """ 全てのホストの、 CPU, メモリ及び UDP ポートの余裕を戻すメソッド。応答しないホストは含めない。 """
+        infos = self.map(lambda host, client: client.info())
+        infos = {host: info for (host, info) in infos.items() if not isinstance(info, Exception)}
+        running = self.list_containers(all=False, inspect=False)
+        running = {host: cs for (host, cs) in running.items() if host in infos}
+        stats = self.stats(running)
+        ports = self._port_limit - self._port_base + 1
+        headrooms = {}
+        for (host, info) in infos.items():
+            h = McbdscHostHeadroom(host, cpus=float(info.get("NCPU", 0)), memory=int(info.get("MemTotal", 0)),
+                                   ports=ports, containers=len(running.get(host, [])))
+            for s in stats.get(host, []):
+                h.cpu_used += cpu_percent(s) / 100.0
+                h.memory_used += memory_usage(s)[0]
+            for container in running.get(host, []):
+                for port in container.attrs.get("Ports") or []:
+                    public = port.get("PublicPort")
+                    if port.get("Type") == "udp" and public is not None and self._port_base <= public <= self._port_limit:
+                        h.ports_used += 1
+            headrooms[host] = h
+        return headrooms
+
+    def place(self, headrooms: Optional[Dict[str, McbdscHostHeadroom]] = None) -> str:
+        """ 新しいサーバを配置するホストを決めるメソッド。
+
+        余裕が最も大きいホストを選び、そのホストの余裕から新しいサーバの見込みの使用量を差し引きます。
+        複数のサーバを配置する場合は、同じ `headrooms` を渡すことで一つのホストに集中しないようにできます。
+
+        Args:
+            headrooms (Dict[str, McbdscHostHeadroom], optional): 各ホストの余裕. None の場合は `headroom()` の戻り値.
+                                                                Defaults to None.
+
+        Raises:
+            RuntimeError: サーバを配置できるホストが無い場合に raise.
+
+        Returns:
+            str: ホスト名.
+        """
+        headrooms = headrooms if headrooms is not None else self.headroom()
+        candidates = [h for h in headrooms.values() if h.score() >= 0]
+        if not candidates:
+            raise RuntimeError("There is no Docker host which has room for a new server.")
+        # 余裕が同じであれば、コンテナの少ないホストを選ぶ。
+        best = max(candidates, key=lambda h: (h.score(), -h.containers))
+        best.reserve(self._server_cpus, self._server_memory)
+        logger.info("Place a new server on {host}.".format(host=best.host))
+        return best.host
@@ -0,0 +1,206 @@
+""" ダウンロードやコンテナイメージの Build 等、時間のかかる処理の進み具合を通知するモジュール。
+
+`McbdscProgressMeter` は処理した量を受け取り、一定の間隔毎にコールバックを `McbdscProgressEvent` で呼び出します。
+呼び出す間隔を制限するので、チャンク毎に `update()` を呼び出しても、コールバックの処理時間はほとんど増えません。
+
+This module reports the progress of the long operations, such as downloads and image builds.
+"""
+
+from typing import Callable, Optional
+import sys
+import time
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+
+class McbdscProgressEvent(object):
+    """ 処理の進み具合を表すクラス。
+
+    Args:
+        phase (str): 処理の名前("download", "build.context", "build.step", "build.layer" 等).
+        current (int): 処理した量. バイト数又はステップ数.
+        total (int, optional): 全体の量. 不明な場合は None.
+        elapsed (float): 処理を開始してからの秒数.
+        rate (float): 前回の通知からの処理速度(1 秒あたりの量). 停滞している場合は 0 に近くなる.
+                      終了の通知では、開始からの平均の速度.
+        message (str, optional): 処理中のステップ等を表すメッセージ.
+        done (bool): 処理が終わったか否か.
+    """
+
+    __slots__ = ("phase", "current", "total", "elapsed", "rate", "message", "done")
+
+    def __init__(self, phase: str, current: int, total: Optional[int] = None, elapsed: float = 0.0, rate: float = 0.0,
+                 message: Optional[str] = None, done: bool = False) -> None:
+        self.phase = phase
+        self.current = current
+        self.total = total
+        self.elapsed = elapsed
+        self.rate = rate
+        self.message = message
+        self.done = done
+
+    @property
+    def ratio(self) -> Optional[float]:
+        """ 全体に対する処理した量の割合。全体の量が不明な場合は None. """
+        return self.current / self.total if self.total else None
+
+    @property
+    def eta(self) -> Optional[float]:
+        """ 開始からの平均速度で計算した、残りの秒数。全体の量が不明な場合は None. """
+        if not self.total or not self.current or self.elapsed <= 0:
+            return None
+        return max(self.total - self.current, 0) / (self.current / self.elapsed)
+
+    def __repr__(self) -> str:
+        return "McbdscProgressEvent(phase={phase!r}, current={current}, total={total}, message={message!r})".format(
+            phase=self.phase, current=self.current, total=self.total, message=self.message)
+
+
+class McbdscProgressMeter(object):
+    """ 処理した量を集計し、 `interval` 秒毎に `callback` を呼び出すクラス。
+
+    `callback` が None の場合は何もしないので、呼び出し側はコールバックの有無を確認する必要はありません。
+
+    Examples:
+
+        >>> from pymcbdsc.progress import McbdscProgressMeter
+        >>>
+        >>> events = []
+        >>> meter = McbdscProgressMeter(events.append, "download", total=300, interval=60)
+        >>> for _ in range(3):
+        ...     meter.update(100)
+        >>> meter.finish()
+        >>> [(e.current, e.total, e.done) for e in events]
+        [(100, 300, False), (300, 300, True)]
+    """
+
+    def __init__(self, callback: Optional[Callable[[McbdscProgressEvent], None]], phase: str,
+                 total: Optional[int] = None, interval: float = 0.5) -> None:
+        self._callback = callback
+        self.phase = phase
+        self.total = total
+        self.current = 0
+        self._interval = interval
+        self._started = time.monotonic()
+        self._last_time = self._started
+        self._last_current = 0
+        self._emitted = False
+
+    def update(self, n: int = 0, current: Optional[int] = None, total: Optional[int] = None,
+               message: Optional[str] = None, force: bool = False) -> None:
+        """ 処理した量を加算し、前回の通知から `interval` 秒以上経っていればコールバックを呼び出すメソッド。
+
+        Args:
+            n (int, optional): 加算する量. Defaults to 0.
+            current (int, optional): 加算せずに設定する、処理した量. Defaults to None.
+            total (int, optional): 全体の量を更新する場合に指定する. Defaults to None.
+            message (str, optional): メッセージ. Defaults to None.
+            force (bool, optional): 間隔に関わらず通知するか否か. Defaults to False.
+        """
+        self.current = current if current is not None else self.current + n
+        if total is not None:
+            self.total = total
+        if self._callback is None:
+            return
+        now = time.monotonic()
+        # 処理が始まったことが分かるように、最初の update() では常に通知する。
+        if force or not self._emitted or now - self._last_time >= self._interval:
+            self._emit(now, message, done=False)
+
+    def finish(self, message: Optional[str] = None) -> None:
+        """ 処理が終わったことを通知するメソッド。 """
+        if self._callback is not None:
+            self._emit(time.monotonic(), message, done=True)
+
+    def _emit(self, now: float, message: Optional[str], done: bool) -> None:
+        elapsed = now - self._started
+        # 途中の通知では直近の速度を、終了の通知では平均の速度を計算する。
+        (base_time, base_current) = (self._started, 0) if done else (self._last_time, self._last_current)
+        rate = (self.current - base_current) / (now - base_time) if now > base_time else 0.0
+        (self._last_time, self._last_current, self._emitted) = (now, self.current, True)
+        event = McbdscProgressEvent(self.phase, self.current, total=self.total, elapsed=elapsed, rate=rate,
+                                    message=message, done=done)
+        try:
+            self._callback(event)
+        except Exception:
+            # 進み具合の表示に失敗しても、処理そのものは続ける。
+            logger.exception("The progress callback failed.")
+
+
+def format_bytes(n: float) -> str:
+    """ バイト数を、 "12.3MiB" のような読みやすい文字列に変換する関数。
+
+    Examples:
+
+        >>> from pymcbdsc.progress import format_bytes
+        >>>
+        >>> (format_bytes(512), format_bytes(3 * 1024 * 1024))
+        ('512B', '3.0MiB')
+    """
+    for unit in ("B", "KiB", "MiB"):
+        if abs(n) < 1024:
+            return "{n:.0f}{unit}".format(n=n, unit=unit) if unit == "B" else "{n:.1f}{unit}".format(n=n, unit=unit)
+        n /= 1024
+    return "{n:.1f}GiB".format(n=n)
+
+
+def format_event(event: McbdscProgressEvent) -> str:
+    """ McbdscProgressEvent を、一行の文字列に変換する関数。
+
+    Examples:
+
+        >>> from pymcbdsc.progress import McbdscProgressEvent, format_event
+        >>>
+        >>> format_event(McbdscProgressEvent("download", 50 * 1024 * 1024, total=100 * 1024 * 1024, elapsed=5,
+        ...                                  rate=10 * 1024 * 1024))
+        'download: 50.0MiB/100.0MiB (50%) 10.0MiB/s ETA 5s'
+        >>> format_event(McbdscProgressEvent("build.step", 3, total=12, message="RUN apt-get update"))
+        'build.step: 3/12 RUN apt-get update'
+    """
+    if event.phase == "build.step":
+        text = "{phase}: {current}/{total}".format(phase=event.phase, current=event.current, total=event.total or "?")
+    else:
+        text = "{phase}: {current}".format(phase=event.phase, current=format_bytes(event.current))
+        if event.total:
+            text += "/{total} ({ratio:.0%})".format(total=format_bytes(event.total), ratio=event.ratio)
+        text += " {rate}/s".format(rate=format_bytes(event.rate))
+        eta = event.eta
+        if eta is not None and not event.done:
+            text += " ETA {eta:.0f}s".format(eta=eta)
+    if event.done:
+        text += " done in {elapsed:.1f}s".format(elapsed=event.elapsed)
+    if event.message:
+        text += " " + event.message
+    return text
+
+
+class McbdscProgressPrinter(object):
+    """ McbdscProgressEvent を表示するコールバック。
+
+    端末に出力する場合は同じ行を書き換え、そうでない場合(ログファイル等)は `interval` 秒毎に一行ずつ出力します。
+    """
+
+    def __init__(self, stream=None, interval: float = 5.0) -> None:
+        self._stream = stream if stream is not None else sys.stderr
+        self._tty = hasattr(self._stream, "isatty") and self._stream.isatty()
+        self._interval = interval
+        self._last = {}
+        self._width = 0
+
+    def __call__(self, event: McbdscProgressEvent) -> None:
+        text = format_event(event)
+        if self._tty:
+            pad = " " * max(self._width - len(text), 0)
+            self._width = len(text)
+            self._stream.write("\r" + text + pad + ("\n" if event.done else ""))
+            if event.done:
+                self._width = 0
+            self._stream.flush()
+            return
+        now = time.monotonic()
+        if event.done or event.phase == "build.step" or now - self._last.get(event.phase, 0.0) >= self._interval:
+            self._last[event.phase] = now
+            self._stream.write(text + "\n")
+            self._stream.flush()
@@ -0,0 +1,347 @@
+""" RakNet の Unconnected Ping/Pong を用いて Bedrock Server の状態を問い合わせるモジュール。
+
+Bedrock Server は、ゲームのクライアントがサーバ一覧を表示する為に送信する RakNet の Unconnected Ping に対して、
+MOTD やバージョン、プレイヤー数を含む Unconnected Pong を応答します。
+このモジュールでは、 asyncio を用いて複数のサーバに同時に Unconnected Ping を送信し、その応答を解析します。
+
+This module queries the status of the Bedrock Servers by RakNet Unconnected Ping/Pong.
+
+See Also:
+    https://wiki.vg/Raknet_Protocol#Unconnected_Ping
+"""
+
+from typing import Dict, Optional, Tuple
+import asyncio
+import random
+import socket
+import struct
+import time
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+# RakNet のオフラインメッセージであることを示すマジックバイト列。
+OFFLINE_MESSAGE_DATA_ID = bytes.fromhex("00ffff00fefefefefdfdfdfd12345678")
+UNCONNECTED_PING = 0x01
+UNCONNECTED_PONG = 0x1c
+
+# Unconnected Ping: ID(1) + Time(8) + Magic(16) + Client GUID(8)
+_ping_struct = struct.Struct(">BQ16sQ")
+# Unconnected Pong: ID(1) + Time(8) + Server GUID(8) + Magic(16) + 文字列長(2)
+_pong_header_struct = struct.Struct(">BQQ16sH")
+
+
+class McbdscServerStatus(object):
+    """ Bedrock Server の状態を表すクラス。
+
+    サーバからの応答がなかった場合は `online` が False となり、その他の属性は None となります。
+    """
+
+    def __init__(self,
+                 address: Tuple[str, int],
+                 online: bool = False,
+                 latency: Optional[float] = None,
+                 edition: Optional[str] = None,
+                 motd: Optional[str] = None,
+                 protocol: Optional[int] = None,
+                 version: Optional[str] = None,
+                 players: Optional[int] = None,
+                 max_players: Optional[int] = None,
+                 server_guid: Optional[int] = None,
+                 level_name: Optional[str] = None,
+                 gamemode: Optional[str] = None,
+                 error: Optional[str] = None) -> None:
+        """ McbdscServerStatus インスタンスの初期化メソッド。
+
+        Args:
+            address (Tuple[str, int]): 問い合わせ先のホストとポート.
+            online (bool, optional): サーバから応答があったか否か. Defaults to False.
+            latency (float, optional): Ping を送信してから Pong を受信するまでの秒数. Defaults to None.
+            edition (str, optional): エディション(通常は "MCPE"). Defaults to None.
+            motd (str, optional): サーバ名(MOTD). Defaults to None.
+            protocol (int, optional): プロトコルバージョン. Defaults to None.
+            version (str, optional): Minecraft のバージョン. Defaults to None.
+            players (int, optional): オンラインのプレイヤー数. Defaults to None.
+            max_players (int, optional): 最大プレイヤー数. Defaults to None.
+            server_guid (int, optional): サーバの GUID. Defaults to None.
+            level_name (str, optional): ワールド名. Defaults to None.
+            gamemode (str, optional): ゲームモード. Defaults to None.
+            error (str, optional): 応答を得られなかった理由. Defaults to None.
+        """
+        self.address = address
+        self.online = online
+        self.latency = latency
+        self.edition = edition
+        self.motd = motd
+        self.protocol = protocol
+        self.version = version
+        self.players = players
+        self.max_players = max_players
+        self.server_guid = server_guid
+        self.level_name = level_name
+        self.gamemode = gamemode
+        self.error = error
+
+    def __repr__(self) -> str:
+        return ("McbdscServerStatus(address={address!r}, online={online!r}, motd={motd!r}, version={version!r}, "
+                "players={players!r}, max_players={max_players!r})"
+                .format(address=self.address, online=self.online, motd=self.motd, version=self.version,
+                        players=self.players, max_players=self.max_players))
+
+    def to_dict(self) -> dict:
+        """ 状態を dict で戻すメソッド。
+
+        Returns:
+            dict: 属性名と値の dict.
+        """
+        return dict(self.__dict__)
+
+
+def build_ping(token: int, client_guid: int) -> bytes:
+    """ Unconnected Ping パケットを作成する関数。
+
+    Args:
+        token (int): Time フィールドに設定する値. サーバは Pong でこの値をそのまま応答するので、応答の照合に利用する.
+        client_guid (int): クライアントの GUID.
+
+    Returns:
+        bytes: Unconnected Ping パケット.
+
+    Examples:
+
+        >>> from pymcbdsc.raknet import build_ping
+        >>>
+        >>> len(build_ping(token=1, client_guid=2))
+        33
+    """
+    return _ping_struct.pack(UNCONNECTED_PING, token, OFFLINE_MESSAGE_DATA_ID, client_guid)
+
+
+def build_pong(token: int, server_guid: int, server_id: str) -> bytes:
+    """ Unconnected Pong パケットを作成する関数。
+
+    主にテストや、ローカルでの疑似サーバの作成に利用します。
+
+    Args:
+        token (int): Ping の Time フィールドの値.
+        server_guid (int): サーバの GUID.
+        server_id (str): "MCPE;<MOTD>;<protocol>;<version>;<players>;<max players>;..." 形式の文字列.
+
+    Returns:
+        bytes: Unconnected Pong パケット.
+    """
+    data = server_id.encode("utf-8")
+    return _pong_header_struct.pack(UNCONNECTED_PONG, token, server_guid, OFFLINE_MESSAGE_DATA_ID, len(data)) + data
+
+
+def parse_ping(data: bytes) -> Tuple[int, int]:
+    """ Unconnected Ping パケットを解析する関数。
+
+    Args:
+        data (bytes): 受信したパケット.
+
+    Raises:
+        ValueError: Unconnected Ping パケットではない場合に raise.
+
+    Returns:
+        Tuple[int, int]: Time フィールドの値とクライアントの GUID.
+    """
+    if len(data) < _ping_struct.size or data[0] != UNCONNECTED_PING:
+        raise ValueError("Not an unconnected ping packet.")
+    (_, token, magic, client_guid) = _ping_struct.unpack_from(data)
+    if magic != OFFLINE_MESSAGE_DATA_ID:
+        raise ValueError("Invalid offline message data id.")
+    return (token, client_guid)
+
+
+def parse_pong(data: bytes) -> Tuple[int, int, str]:
+    """ Unconnected Pong パケットを解析する関数。
+
+    Args:
+        data (bytes): 受信したパケット.
+
+    Raises:
+        ValueError: Unconnected Pong パケットではない場合に raise.
+
+    Returns:
+        Tuple[int, int, str]: Time フィールドの値、サーバの GUID 及びサーバ ID 文字列.
+
+    Examples:
+
+        >>> from pymcbdsc.raknet import build_pong, parse_pong
+        >>>
+        >>> parse_pong(build_pong(token=1, server_guid=2, server_id="MCPE;Dedicated Server;"))
+        (1, 2, 'MCPE;Dedicated Server;')
+    """
+    size = _pong_header_struct.size
+    if len(data) < size or data[0] != UNCONNECTED_PONG:
+        raise ValueError("Not an unconnected pong packet.")
+    (_, token, server_guid, magic, length) = _pong_header_struct.unpack_from(data)
+    if magic != OFFLINE_MESSAGE_DATA_ID:
+        raise ValueError("Invalid offline message data id.")
+    server_id = data[size:size + length].decode("utf-8", errors="replace")
+    return (token, server_guid, server_id)
+
+
+def _to_int(s: str) -> Optional[int]:
+    try:
+        return int(s)
+    except ValueError:
+        return None
+
+
+def parse_server_id(address: Tuple[str, int], server_guid: int, server_id: str,
+                    latency: Optional[float] = None) -> McbdscServerStatus:
+    """ Pong に含まれるサーバ ID 文字列を解析し McbdscServerStatus を戻す関数。
+
+    サーバ ID 文字列は次の形式となっています。
+
+    MCPE;<MOTD>;<protocol>;<version>;<players>;<max players>;<server guid>;<level name>;<gamemode>;...
+
+    Args:
+        address (Tuple[str, int]): 問い合わせ先のホストとポート.
+        server_guid (int): サーバの GUID.
+        server_id (str): サーバ ID 文字列.
+        latency (float, optional): 応答までに要した秒数. Defaults to None.
+
+    Returns:
+        McbdscServerStatus: 解析結果.
+
+    Examples:
+
+        >>> from pymcbdsc.raknet import parse_server_id
+        >>>
+        >>> status = parse_server_id(("127.0.0.1", 19132), 1,
+        ...                          "MCPE;Dedicated Server;422;1.16.201;3;10;1;Bedrock level;Survival;1;19132;19133;")
+        >>> (status.motd, status.version, status.players, status.max_players)
+        ('Dedicated Server', '1.16.201', 3, 10)
+    """
+    # 不足しているフィールドは None として扱う。
+    fields = server_id.split(";") + [None] * 9
+    return McbdscServerStatus(address=address,
+                              online=True,
+                              latency=latency,
+                              edition=fields[0],
+                              motd=fields[1],
+                              protocol=_to_int(fields[2]) if fields[2] is not None else None,
+                              version=fields[3],
+                              players=_to_int(fields[4]) if fields[4] is not None else None,
+                              max_players=_to_int(fields[5]) if fields[5] is not None else None,
+                              server_guid=server_guid,
+                              level_name=fields[7],
+                              gamemode=fields[8])
+
+
+class _PongProtocol(asyncio.DatagramProtocol):
+    """ Pong を受信し、 Time フィールドの値をキーとして待機中の Future に結果を設定するプロトコル。 """
+
+    def __init__(self, waiters: Dict[int, asyncio.Future]) -> None:
+        self._waiters = waiters
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            (token, server_guid, server_id) = parse_pong(data)
+        except ValueError:
+            return
+        fut = self._waiters.get(token)
+        if fut is not None and not fut.done():
+            fut.set_result((server_guid, server_id, time.monotonic()))
+
+    def error_received(self, exc: Exception) -> None:
+        # ICMP Port Unreachable などは、タイムアウトとして扱う。
+        logger.debug("UDP error received: {exc}".format(exc=exc))
+
+
+async def _query_one(transport, waiters: Dict[int, asyncio.Future], address: Tuple[str, int],
+                     client_guid: int, timeout: float, retries: int) -> McbdscServerStatus:
+    loop = asyncio.get_event_loop()
+    token = random.getrandbits(63)
+    fut = loop.create_future()
+    waiters[token] = fut
+    packet = build_ping(token=token, client_guid=client_guid)
+    # UDP のパケットロスに備え、タイムアウトまでの間に retries 回だけ再送する。
+    interval = timeout / (retries + 1)
+    sent_at = time.monotonic()
+    try:
+        for _ in range(retries + 1):
+            try:
+                transport.sendto(packet, address)
+            except OSError as e:
+                return McbdscServerStatus(address=address, error=str(e))
+            done, _pending = await asyncio.wait([fut], timeout=interval)
+            if done:
+                (server_guid, server_id, received_at) = fut.result()
+                return parse_server_id(address=address, server_guid=server_guid, server_id=server_id,
+                                       latency=received_at - sent_at)
+        return McbdscServerStatus(address=address, error="timeout")
+    finally:
+        del waiters[token]
+        if not fut.done():
+            fut.cancel()
+
+
+async def query_status_async(targets: Dict[str, Tuple[str, int]],
+                             timeout: float = 1.0,
+                             retries: int = 1) -> Dict[str, McbdscServerStatus]:
+    """ 複数の Bedrock Server に同時に Unconnected Ping を送信し、その状態を戻すコルーチン。
+
+    アドレスファミリ毎に一つの UDP ソケットを共有し、 Pong の Time フィールドで応答を照合するので、
+    サーバの数が増えてもソケットの数は増えません。
+
+    Args:
+        targets (Dict[str, Tuple[str, int]]): 名前と、問い合わせ先のホスト及びポートの dict.
+        timeout (float, optional): 各サーバの応答を待つ秒数. Defaults to 1.0.
+        retries (int, optional): タイムアウトまでに Ping を再送する回数. Defaults to 1.
+
+    Returns:
+        Dict[str, McbdscServerStatus]: 名前と、サーバの状態の dict.
+    """
+    loop = asyncio.get_event_loop()
+    waiters = {}
+    client_guid = random.getrandbits(63)
+    transports = {}
+    try:
+        coros = {}
+        for (name, (host, port)) in targets.items():
+            family = socket.AF_INET6 if ":" in host else socket.AF_INET
+            if family not in transports:
+                local_addr = ("::", 0) if family == socket.AF_INET6 else ("0.0.0.0", 0)
+                (transport, _protocol) = await loop.create_datagram_endpoint(lambda: _PongProtocol(waiters),
+                                                                             local_addr=local_addr, family=family)
+                transports[family] = transport
+            coros[name] = _query_one(transports[family], waiters, (host, port), client_guid, timeout, retries)
+        names = list(coros.keys())
+        results = await asyncio.gather(*coros.values())
+        return dict(zip(names, results))
+    finally:
+        for transport in transports.values():
+            transport.close()
+
+
+def query_status(targets: Dict[str, Tuple[str, int]],
+                 timeout: float = 1.0,
+                 retries: int = 1) -> Dict[str, McbdscServerStatus]:
+    """ `query_status_async` を同期的に実行する関数。
+
+    Args:
+        targets (Dict[str, Tuple[str, int]]): 名前と、問い合わせ先のホスト及びポートの dict.
+        timeout (float, optional): 各サーバの応答を待つ秒数. Defaults to 1.0.
+        retries (int, optional): タイムアウトまでに Ping を再送する回数. Defaults to 1.
+
+    Returns:
+        Dict[str, McbdscServerStatus]: 名前と、サーバの状態の dict.
+
+    Examples:
+
+        >>> from pymcbdsc.raknet import query_status
+        >>>
+        >>> query_status({"mcbdsc_test": ("127.0.0.1", 19132)})  # doctest: +SKIP
+        {'mcbdsc_test': McbdscServerStatus(address=('127.0.0.1', 19132), online=True, motd='Dedicated Server', ...)}
+    """
+    # 呼び出し元のスレッドに設定されているイベントループを置き換えないよう、新しいループは設定せずに実行する。
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(query_status_async(targets=targets, timeout=timeout, retries=retries))
+    finally:
+        loop.close()
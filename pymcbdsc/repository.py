@@ -0,0 +1,420 @@
+""" ワールドのファイルを内容のハッシュ値で保存する、重複排除されたバックアップリポジトリのモジュール。
+
+Bedrock Server のワールドは LevelDB で保存されており、一度書き込まれた `.ldb` ファイルは変更されません。
+このモジュールでは、ワールドの各ファイルを SHA-256 のハッシュ値をファイル名としてオブジェクトとして保存し、
+バックアップ毎にファイルのパスとオブジェクトの対応(スナップショット)を JSON で保存します。
+前回のスナップショットとサイズ・更新時刻が一致するファイルは、読み込みも書き込みも行いません。
+
+リポジトリのディレクトリ構成は次のとおりです。
+
+    <repository_dir>/objects/<ハッシュ値の先頭2文字>/<ハッシュ値>
+    <repository_dir>/snapshots/<サーバ名>/<スナップショットID>.json
+
+This module provides the content-addressed, deduplicated backup repository for the worlds.
+"""
+
+from typing import BinaryIO, Dict, List, Optional, Tuple
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+from logging import getLogger
+from .backup import McbdscChunkReader, iter_world_files, run_in_volume, save_hold, worlds_dir
+
+
+logger = getLogger(__name__)
+
+# オブジェクトの読み書きに利用するバッファのサイズ。
+_copy_bufsize = 1024 * 1024
+
+
+class McbdscSnapshot(object):
+    """ ある時点のワールドの、ファイルのパスとオブジェクトの対応を表すクラス。
+
+    Examples:
+
+        >>> from pymcbdsc.repository import McbdscSnapshot
+        >>>
+        >>> snapshot = McbdscSnapshot(server="mcbdsc_test", snapshot_id="20210131-120000", timestamp=1612094400.0)
+        >>> snapshot.add("Bedrock level/level.dat", sha256="ab" * 32, size=2000, mtime=1612094400)
+        >>> (snapshot.size, len(snapshot.files))
+        (2000, 1)
+    """
+
+    def __init__(self, server: str, snapshot_id: str, timestamp: float, files: Dict[str, dict] = None) -> None:
+        """ McbdscSnapshot インスタンスの初期化メソッド。
+
+        Args:
+            server (str): サーバ(コンテナ)名.
+            snapshot_id (str): スナップショットの ID.
+            timestamp (float): スナップショットの作成時刻(UNIX 時間).
+            files (Dict[str, dict], optional): worlds ディレクトリからの相対パスと、
+                                               "sha256", "size", "mtime" をキーとする dict の dict. Defaults to None.
+        """
+        self.server = server
+        self.snapshot_id = snapshot_id
+        self.timestamp = timestamp
+        self.files = files if files is not None else {}
+
+    def add(self, path: str, sha256: str, size: int, mtime: int) -> None:
+        """ ファイルをスナップショットに追加するメソッド。 """
+        self.files[path] = {"sha256": sha256, "size": size, "mtime": mtime}
+
+    def lookup(self, path: str, size: int, mtime: int) -> Optional[str]:
+        """ サイズと更新時刻が一致するファイルがあれば、そのハッシュ値を戻すメソッド。
+
+        Args:
+            path (str): worlds ディレクトリからの相対パス.
+            size (int): ファイルのサイズ.
+            mtime (int): ファイルの更新時刻(UNIX 時間の整数).
+
+        Returns:
+            Optional[str]: 一致するファイルのハッシュ値. 一致するファイルがない場合は None.
+        """
+        f = self.files.get(path)
+        if f is not None and f["size"] == size and f["mtime"] == mtime:
+            return f["sha256"]
+        return None
+
+    @property
+    def size(self) -> int:
+        """ スナップショットに含まれるファイルの合計サイズ。 """
+        return sum(f["size"] for f in self.files.values())
+
+    def to_dict(self) -> dict:
+        return {"server": self.server, "id": self.snapshot_id, "timestamp": self.timestamp, "files": self.files}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "McbdscSnapshot":
+        return cls(server=d["server"], snapshot_id=d["id"], timestamp=d["timestamp"], files=d["files"])
+
+
+class McbdscBackupRepository(object):
+    """ ワールドのファイルを重複排除して保存するバックアップリポジトリのクラス。
+
+    Examples:
+
+        >>> import io
+        >>> import tempfile
+        >>> from pymcbdsc.repository import McbdscBackupRepository
+        >>>
+        >>> repo = McbdscBackupRepository(tempfile.mkdtemp())
+        >>> (sha256, size) = repo.store_object(io.BytesIO(b"level.dat"))
+        >>> (repo.has_object(sha256), size)
+        (True, 9)
+        >>> repo.open_object(sha256).read()
+        b'level.dat'
+    """
+
+    def __init__(self, repository_dir: str, throttle=None, db=None) -> None:
+        """ McbdscBackupRepository インスタンスの初期化メソッド。
+
+        Args:
+            repository_dir (str): リポジトリのディレクトリ(フォルダ)のパス. 存在しない場合は作成する.
+            throttle (McbdscTokenBucket, optional): オブジェクトを保存する際に、書き込むバイト数を消費させる
+                                                    トークンバケット. None の場合は制限しない. Defaults to None.
+            db (McbdscStateDB, optional): スナップショットの一覧を保持するデータベース. 指定した場合は、
+                                          変更されていないサーバのスナップショットを JSON ファイルではなく
+                                          データベースから読み込む. Defaults to None.
+        """
+        self._dir = repository_dir
+        self._throttle = throttle
+        self._db = db
+        self._objects_dir = os.path.join(repository_dir, "objects")
+        self._snapshots_dir = os.path.join(repository_dir, "snapshots")
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._snapshots_dir, exist_ok=True)
+
+    @property
+    def repository_dir(self) -> str:
+        return self._dir
+
+    def object_path(self, sha256: str) -> str:
+        """ ハッシュ値に対応するオブジェクトのファイルパスを戻すメソッド。 """
+        return os.path.join(self._objects_dir, sha256[:2], sha256)
+
+    def has_object(self, sha256: str) -> bool:
+        return os.path.exists(self.object_path(sha256))
+
+    def open_object(self, sha256: str) -> BinaryIO:
+        """ オブジェクトを読み込み用に開くメソッド。 """
+        return open(self.object_path(sha256), "rb")
+
+    def store_object(self, fileobj: BinaryIO) -> Tuple[str, int]:
+        """ ファイルオブジェクトの内容をオブジェクトとして保存するメソッド。
+
+        内容は一時ファイルに書き込みながらハッシュ値を計算し、同じ内容のオブジェクトが既にあれば一時ファイルを破棄します。
+
+        Args:
+            fileobj (BinaryIO): 保存する内容を読み込むファイルオブジェクト.
+
+        Returns:
+            Tuple[str, int]: 内容の SHA-256 のハッシュ値と、サイズ.
+        """
+        h = hashlib.sha256()
+        size = 0
+        (fd, tmp) = tempfile.mkstemp(prefix=".tmp-", dir=self._objects_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    data = fileobj.read(_copy_bufsize)
+                    if not data:
+                        break
+                    if self._throttle is not None:
+                        self._throttle.consume(len(data))
+                    h.update(data)
+                    f.write(data)
+                    size += len(data)
+            sha256 = h.hexdigest()
+            path = self.object_path(sha256)
+            if os.path.exists(path):
+                # 既に保存されているオブジェクトは、 gc の猶予期間の判定の為に更新時刻のみ更新する。
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return (sha256, size)
+
+    def servers(self) -> List[str]:
+        """ スナップショットが保存されているサーバ名のリストを戻すメソッド。 """
+        return sorted(d for d in os.listdir(self._snapshots_dir) if os.path.isdir(os.path.join(self._snapshots_dir, d)))
+
+    def _snapshot_path(self, server: str, snapshot_id: str) -> str:
+        return os.path.join(self._snapshots_dir, server, snapshot_id + ".json")
+
+    def new_snapshot(self, server: str) -> McbdscSnapshot:
+        """ 保存されているスナップショットと ID が重複しない、空のスナップショットを作成するメソッド。 """
+        now = time.time()
+        base = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        snapshot_id = base
+        i = 1
+        while os.path.exists(self._snapshot_path(server, snapshot_id)):
+            snapshot_id = "{base}-{i}".format(base=base, i=i)
+            i += 1
+        return McbdscSnapshot(server=server, snapshot_id=snapshot_id, timestamp=now)
+
+    def save_snapshot(self, snapshot: McbdscSnapshot) -> None:
+        """ スナップショットを保存するメソッド。
+
+        スナップショットは全てのオブジェクトを保存した後に書き込むので、途中で失敗したバックアップは見えません。
+        """
+        path = self._snapshot_path(snapshot.server, snapshot.snapshot_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot.to_dict(), f, sort_keys=True)
+        os.replace(tmp, path)
+        if self._db is not None:
+            self._db.add_snapshots(self._db_key(), [snapshot])
+
+    def load_snapshot(self, server: str, snapshot_id: str) -> McbdscSnapshot:
+        with open(self._snapshot_path(server, snapshot_id)) as f:
+            return McbdscSnapshot.from_dict(json.load(f))
+
+    def list_snapshots(self, server: str = None) -> List[McbdscSnapshot]:
+        """ スナップショットを古い順に戻すメソッド。
+
+        Args:
+            server (str, optional): サーバ名. None の場合は全てのサーバのスナップショットを戻す. Defaults to None.
+
+        Returns:
+            List[McbdscSnapshot]: スナップショットのリスト.
+        """
+        if self._db is not None:
+            return self._list_snapshots_from_db(server)
+        servers = self.servers() if server is None else [server]
+        snapshots = []
+        for s in servers:
+            d = os.path.join(self._snapshots_dir, s)
+            if not os.path.isdir(d):
+                continue
+            for filename in os.listdir(d):
+                if filename.endswith(".json"):
+                    snapshots.append(self.load_snapshot(s, filename[:-len(".json")]))
+        snapshots.sort(key=lambda s: (s.timestamp, s.snapshot_id))
+        return snapshots
+
+    def _db_key(self) -> str:
+        return os.path.abspath(self._dir)
+
+    def _sync_snapshots(self, server: str) -> None:
+        """ サーバのディレクトリの JSON ファイルと、データベースのスナップショットを一致させるメソッド。
+
+        既にデータベースにあるスナップショットは読み込まず、増えたものだけを読み込みます。
+        """
+        d = os.path.join(self._snapshots_dir, server)
+        key = self._db_key()
+        known = set(self._db.snapshot_ids(key, server))
+        if not os.path.isdir(d):
+            self._db.remove_snapshots(key, server, sorted(known))
+            return
+        st = os.stat(d)
+        ids = {f[:-len(".json")] for f in os.listdir(d) if f.endswith(".json")}
+        self._db.add_snapshots(key, [self.load_snapshot(server, i) for i in sorted(ids - known)])
+        self._db.remove_snapshots(key, server, sorted(known - ids))
+        self._db.mark_dir(d, st)
+
+    def _list_snapshots_from_db(self, server: str = None) -> List[McbdscSnapshot]:
+        servers = set(self.servers() if server is None else [server])
+        for s in servers:
+            d = os.path.join(self._snapshots_dir, s)
+            if not os.path.isdir(d) or not self._db.dir_is_fresh(d):
+                self._sync_snapshots(s)
+        # ディレクトリごと削除されたサーバの行は、 servers に含まれないので除外する。
+        return [McbdscSnapshot(server=r["server"], snapshot_id=r["snapshot_id"], timestamp=r["timestamp"], files=r["files"])
+                for r in self._db.snapshots(self._db_key(), server) if r["server"] in servers]
+
+    def latest_snapshot(self, server: str) -> Optional[McbdscSnapshot]:
+        snapshots = self.list_snapshots(server)
+        return snapshots[-1] if snapshots else None
+
+    def remove_snapshot(self, server: str, snapshot_id: str) -> None:
+        """ スナップショットを削除するメソッド。参照されなくなったオブジェクトは `gc()` で削除します。 """
+        os.remove(self._snapshot_path(server, snapshot_id))
+        if self._db is not None:
+            self._db.remove_snapshots(self._db_key(), server, [snapshot_id])
+
+    def prune(self, keep: int) -> List[McbdscSnapshot]:
+        """ サーバ毎に、新しい `keep` 個を残してスナップショットを削除するメソッド。
+
+        Args:
+            keep (int): 残すスナップショットの数.
+
+        Returns:
+            List[McbdscSnapshot]: 削除したスナップショットのリスト.
+        """
+        removed = []
+        for server in self.servers():
+            snapshots = self.list_snapshots(server)
+            for snapshot in snapshots[:max(len(snapshots) - keep, 0)]:
+                self.remove_snapshot(server, snapshot.snapshot_id)
+                removed.append(snapshot)
+        return removed
+
+    def gc(self, grace: float = 3600.0) -> Tuple[int, int]:
+        """ どのスナップショットからも参照されていないオブジェクトを削除するメソッド。
+
+        実行中のバックアップが保存したオブジェクトは、まだスナップショットから参照されていないので、
+        更新時刻が `grace` 秒以内のオブジェクトは削除しません。
+
+        Args:
+            grace (float, optional): 削除しないオブジェクトの、更新からの秒数. Defaults to 3600.0.
+
+        Returns:
+            Tuple[int, int]: 削除したオブジェクトの数と、その合計サイズ.
+        """
+        referenced = set()
+        for snapshot in self.list_snapshots():
+            referenced.update(f["sha256"] for f in snapshot.files.values())
+        threshold = time.time() - grace
+        (count, size) = (0, 0)
+        for prefix in os.listdir(self._objects_dir):
+            d = os.path.join(self._objects_dir, prefix)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                path = os.path.join(d, name)
+                st = os.stat(path)
+                if name in referenced or st.st_mtime > threshold:
+                    continue
+                os.remove(path)
+                count += 1
+                size += st.st_size
+        logger.info("Removed {count} objects ({size} bytes).".format(count=count, size=size))
+        return (count, size)
+
+
+def stat_world_files(container, base_dir: str = worlds_dir, running: bool = True) -> Dict[str, Tuple[int, int]]:
+    """ コンテナの、ワールドの各ファイルのサイズと更新時刻を取得する関数。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        base_dir (str, optional): コンテナ内のワールドのディレクトリ. Defaults to worlds_dir.
+        running (bool, optional): コンテナが起動しているか否か. `run_in_volume` を参照. Defaults to True.
+
+    Raises:
+        McbdscBackupError: 取得に失敗した場合に raise.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: `base_dir` からの相対パスと、サイズと更新時刻(UNIX 時間の整数)の dict.
+    """
+    output = run_in_volume(container, ["find", base_dir, "-type", "f", "-printf", "%P\\t%s\\t%T@\\n"], running=running)
+    stats = {}
+    for line in output.decode("utf-8").splitlines():
+        (path, size, mtime) = line.rsplit("\t", 2)
+        stats[path] = (int(size), int(float(mtime)))
+    return stats
+
+
+def online_snapshot(container, channel, repository: McbdscBackupRepository, server: str, **hold_opt) -> McbdscSnapshot:
+    """ 動作中のコンテナのワールドを、一貫性を保ったままリポジトリにバックアップする関数。
+
+    `save query` が報告した長さと更新時刻が前回のスナップショットと一致するファイルは、コンテナから読み出しません。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        channel (McbdscCommandChannel): 対象のコンテナのコマンドチャネル.
+        repository (McbdscBackupRepository): 保存先のリポジトリ.
+        server (str): サーバ(コンテナ)名.
+        **hold_opt: `save_hold` に渡す引数.
+
+    Returns:
+        McbdscSnapshot: 保存したスナップショット.
+    """
+    last = repository.latest_snapshot(server)
+    snapshot = repository.new_snapshot(server)
+    with save_hold(channel, **hold_opt) as files:
+        mtimes = {path: mtime for (path, (_size, mtime)) in stat_world_files(container).items()}
+        changed = []
+        for (path, length) in files:
+            mtime = mtimes.get(path, 0)
+            sha256 = last.lookup(path, length, mtime) if last is not None else None
+            if sha256 is not None and repository.has_object(sha256):
+                snapshot.add(path, sha256=sha256, size=length, mtime=mtime)
+            else:
+                changed.append((path, length))
+        for wf in iter_world_files(container, changed):
+            (sha256, size) = repository.store_object(wf.fileobj)
+            snapshot.add(wf.path, sha256=sha256, size=size, mtime=mtimes.get(wf.path, int(wf.mtime)))
+    repository.save_snapshot(snapshot)
+    logger.info("Snapshot {server}/{id}: {changed} of {total} files were changed."
+                .format(server=server, id=snapshot.snapshot_id, changed=len(changed), total=len(files)))
+    return snapshot
+
+
+def offline_snapshot(container, repository: McbdscBackupRepository, server: str) -> McbdscSnapshot:
+    """ 停止しているコンテナのワールドを、リポジトリにバックアップする関数。
+
+    worlds ディレクトリ全体を一度の `get_archive` で受信しますが、サイズと更新時刻が前回のスナップショットと
+    一致するファイルは、ハッシュ値の計算もリポジトリへの書き込みも行いません。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        repository (McbdscBackupRepository): 保存先のリポジトリ.
+        server (str): サーバ(コンテナ)名.
+
+    Returns:
+        McbdscSnapshot: 保存したスナップショット.
+    """
+    last = repository.latest_snapshot(server)
+    snapshot = repository.new_snapshot(server)
+    (stream, _stat) = container.get_archive(worlds_dir, chunk_size=None)
+    with tarfile.open(fileobj=io.BufferedReader(McbdscChunkReader(stream)), mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            # get_archive のアーカイブは "worlds/..." となっているので、先頭のディレクトリ名を取り除く。
+            path = member.name.split("/", 1)[1]
+            mtime = int(member.mtime)
+            sha256 = last.lookup(path, member.size, mtime) if last is not None else None
+            if sha256 is None or not repository.has_object(sha256):
+                (sha256, _size) = repository.store_object(tar.extractfile(member))
+            snapshot.add(path, sha256=sha256, size=member.size, mtime=mtime)
+    repository.save_snapshot(snapshot)
+    return snapshot
@@ -0,0 +1,172 @@
+""" バックアップリポジトリのスナップショットを、コンテナのボリュームにリストアするモジュール。
+
+リストアするファイルは、 tar アーカイブとしてジェネレータで少しずつ生成しながら `put_archive` で送信するので、
+ワールド全体の tar アーカイブをメモリやディスク上に作成することはありません。
+
+This module restores the snapshot of the backup repository into the volume of the container.
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+import posixpath
+import tarfile
+import time
+from logging import getLogger
+from .backup import run_in_volume, worlds_dir
+from .repository import McbdscBackupRepository, McbdscSnapshot, stat_world_files
+
+
+logger = getLogger(__name__)
+
+# tar アーカイブを生成する際に、一度に読み込むオブジェクトのサイズ。
+_chunk_size = 1024 * 1024
+# 一度の rm コマンドで削除するファイルの最大数。
+_rm_batch = 500
+
+
+class McbdscRestoreResult(object):
+    """ リストアの結果を表すクラス。 """
+
+    def __init__(self, files: int = 0, size: int = 0, removed: int = 0, seconds: float = 0.0,
+                 downtime: float = 0.0) -> None:
+        """ McbdscRestoreResult インスタンスの初期化メソッド。
+
+        Args:
+            files (int, optional): 書き込んだファイルの数. Defaults to 0.
+            size (int, optional): 書き込んだファイルの合計サイズ. Defaults to 0.
+            removed (int, optional): スナップショットに含まれない為に削除したファイルの数. Defaults to 0.
+            seconds (float, optional): ボリュームへの書き込みに要した秒数. Defaults to 0.0.
+            downtime (float, optional): コンテナを停止していた秒数. Defaults to 0.0.
+        """
+        self.files = files
+        self.size = size
+        self.removed = removed
+        self.seconds = seconds
+        self.downtime = downtime
+
+    @property
+    def throughput(self) -> float:
+        """ ボリュームへの書き込みのスループット(バイト/秒)。 """
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+
+def diff_snapshot(snapshot: McbdscSnapshot, current: Dict[str, Tuple[int, int]]) -> Tuple[List[str], List[str]]:
+    """ スナップショットと現在のワールドのファイルを比較する関数。
+
+    Args:
+        snapshot (McbdscSnapshot): リストアするスナップショット.
+        current (Dict[str, Tuple[int, int]]): 現在のファイルのパスと、サイズと更新時刻の dict.
+
+    Returns:
+        Tuple[List[str], List[str]]: サイズ又は更新時刻が異なる(又は存在しない)ファイルのリストと、
+                                     スナップショットに含まれないファイルのリスト.
+
+    Examples:
+
+        >>> from pymcbdsc.repository import McbdscSnapshot
+        >>> from pymcbdsc.restore import diff_snapshot
+        >>>
+        >>> snapshot = McbdscSnapshot(server="a", snapshot_id="1", timestamp=0)
+        >>> snapshot.add("db/000005.ldb", sha256="0" * 64, size=10, mtime=100)
+        >>> snapshot.add("level.dat", sha256="1" * 64, size=20, mtime=100)
+        >>> diff_snapshot(snapshot, {"db/000005.ldb": (10, 100), "level.dat": (20, 200), "db/000007.ldb": (30, 200)})
+        (['level.dat'], ['db/000007.ldb'])
+    """
+    changed = [path for (path, f) in sorted(snapshot.files.items())
+               if current.get(path) != (f["size"], f["mtime"])]
+    removed = sorted(path for path in current if path not in snapshot.files)
+    return (changed, removed)
+
+
+def iter_snapshot_tar(repository: McbdscBackupRepository,
+                      snapshot: McbdscSnapshot,
+                      paths: Optional[List[str]] = None,
+                      arcname_prefix: str = "worlds",
+                      chunk_size: int = _chunk_size) -> Iterator[bytes]:
+    """ スナップショットのファイルを含む tar アーカイブを、少しずつ生成するジェネレータ。
+
+    各ファイルはリポジトリのオブジェクトから `chunk_size` ずつ読み込むので、
+    メモリに保持するのは高々一つのチャンクのみです。
+
+    Args:
+        repository (McbdscBackupRepository): オブジェクトを読み込むリポジトリ.
+        snapshot (McbdscSnapshot): リストアするスナップショット.
+        paths (List[str], optional): アーカイブに含めるファイルのパス. None の場合は全てのファイル. Defaults to None.
+        arcname_prefix (str, optional): アーカイブ内のパスの接頭辞. Defaults to "worlds".
+        chunk_size (int, optional): 一度に読み込むサイズ. Defaults to _chunk_size.
+
+    Yields:
+        bytes: tar アーカイブのデータ.
+    """
+    paths = sorted(snapshot.files) if paths is None else paths
+    dirs = set()
+    for path in paths:
+        f = snapshot.files[path]
+        # 親ディレクトリのエントリを先に出力しておく。
+        parents = []
+        parent = posixpath.dirname("{prefix}/{path}".format(prefix=arcname_prefix, path=path))
+        while parent and parent not in dirs:
+            parents.append(parent)
+            dirs.add(parent)
+            parent = posixpath.dirname(parent)
+        for d in reversed(parents):
+            info = tarfile.TarInfo(name=d)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = int(snapshot.timestamp)
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+        info = tarfile.TarInfo(name="{prefix}/{path}".format(prefix=arcname_prefix, path=path))
+        info.size = f["size"]
+        info.mtime = f["mtime"]
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        remaining = f["size"]
+        with repository.open_object(f["sha256"]) as obj:
+            while remaining > 0:
+                data = obj.read(min(chunk_size, remaining))
+                if not data:
+                    raise EOFError("The object of {path} is shorter than the snapshot.".format(path=path))
+                remaining -= len(data)
+                yield data
+        (_blocks, rest) = divmod(f["size"], tarfile.BLOCKSIZE)
+        if rest:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - rest)
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def restore_snapshot(container,
+                     repository: McbdscBackupRepository,
+                     snapshot: McbdscSnapshot,
+                     only_changed: bool = True,
+                     running: bool = False) -> McbdscRestoreResult:
+    """ スナップショットを、コンテナの worlds ディレクトリにリストアする関数。
+
+    スナップショットに含まれないファイルは削除し、ワールドをスナップショットと同じ状態にします。
+    リストアしたファイルの更新時刻はスナップショットの更新時刻となるので、
+    その後のバックアップやリストアでは変更されていないファイルとして扱われます。
+
+    Args:
+        container (Container): 対象となる docker-py の Container インスタンス.
+        repository (McbdscBackupRepository): オブジェクトを読み込むリポジトリ.
+        snapshot (McbdscSnapshot): リストアするスナップショット.
+        only_changed (bool, optional): サイズと更新時刻がスナップショットと異なるファイルのみを書き込むか否か.
+                                       Defaults to True.
+        running (bool, optional): コンテナが起動しているか否か. `run_in_volume` を参照. Defaults to False.
+
+    Returns:
+        McbdscRestoreResult: リストアの結果.
+    """
+    started = time.monotonic()
+    current = stat_world_files(container, running=running)
+    (changed, removed) = diff_snapshot(snapshot, current)
+    if not only_changed:
+        changed = sorted(snapshot.files)
+    for i in range(0, len(removed), _rm_batch):
+        paths = ["{base}/{path}".format(base=worlds_dir, path=p) for p in removed[i:i + _rm_batch]]
+        run_in_volume(container, ["rm", "-f", "--"] + paths, running=running)
+    if changed:
+        container.put_archive(posixpath.dirname(worlds_dir), iter_snapshot_tar(repository, snapshot, changed))
+    result = McbdscRestoreResult(files=len(changed), size=sum(snapshot.files[p]["size"] for p in changed),
+                                 removed=len(removed), seconds=time.monotonic() - started)
+    logger.info("Restored {files} files ({size} bytes) and removed {removed} files in {sec:.2f} seconds."
+                .format(files=result.files, size=result.size, removed=result.removed, sec=result.seconds))
+    return result
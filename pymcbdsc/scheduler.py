@@ -0,0 +1,229 @@
+""" 管理する全てのサーバのバックアップを、ディスク I/O が集中しないように分散して実行するモジュール。
+
+バックアップは一定の間隔(サイクル)毎に実行しますが、全てのサーバを一度に開始せず、サイクルの先頭から
+`window` 秒の間に均等にずらして開始します。同時に実行するバックアップの数と、一秒あたりに書き込むバイト数は
+それぞれ制限できます。
+
+前回のバックアップ以降にプレイヤーの接続がなかったサーバはワールドが変化していないので、バックアップしません。
+プレイヤーが接続しているサーバや、前回のバックアップ以降の接続が多いサーバほど、サイクルの早い時刻に実行します。
+
+This module schedules the backups of the servers so that they do not saturate the disk at once.
+"""
+
+from typing import Callable, List, Optional, Set, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from .logs import EVENT_PLAYER_CONNECTED, EVENT_PLAYER_DISCONNECTED, EVENT_SERVER_STARTED, McbdscLogEvent
+
+
+logger = getLogger(__name__)
+
+
+class McbdscTokenBucket(object):
+    """ 一秒あたりの処理量を制限するトークンバケットのクラス。
+
+    複数のスレッドから同時に `consume()` しても、合計で `rate` を超えないように待ちます。
+
+    Examples:
+
+        >>> from pymcbdsc.scheduler import McbdscTokenBucket
+        >>>
+        >>> bucket = McbdscTokenBucket(rate=1000 * 1000)
+        >>> bucket.consume(1000)
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        """ McbdscTokenBucket インスタンスの初期化メソッド。
+
+        Args:
+            rate (float): 一秒あたりに補充するトークンの数(バイト数).
+            burst (float, optional): 溜めておけるトークンの最大数. None の場合は `rate` と同じ. Defaults to None.
+            clock (Callable[[], float], optional): 現在時刻を戻す関数. Defaults to time.monotonic.
+        """
+        self._rate = rate
+        self._burst = burst if burst is not None else rate
+        self._clock = clock
+        self._tokens = self._burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        """ `n` 個のトークンを消費するメソッド。トークンが足りなければ、補充されるまで待つ。 """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            # 先にトークンを借りておき、不足分が補充されるまで待つ。ロックを解放してから待つので、他のスレッドは後ろに並ぶ。
+            self._tokens -= n
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class McbdscBackupScheduler(object):
+    """ 管理する全てのサーバのバックアップを、分散して実行するクラス。
+
+    プレイヤーの接続状況は、 McbdscLogMonitor のリスナーとして `record_event()` を登録することで把握します。
+
+    Examples:
+
+        >>> from pymcbdsc import McbdscDockerManager
+        >>> from pymcbdsc.scheduler import McbdscBackupScheduler
+        >>>
+        >>> params = [{"name": "mbdsc_test", "image": "bedrock:latest"}]
+        >>> manager = McbdscDockerManager(containers_param=params)  # doctest: +SKIP
+        >>> scheduler = McbdscBackupScheduler(manager, interval=3600, window=1800, max_concurrent=2)  # doctest: +SKIP
+        >>> monitor = manager.log_monitor()  # doctest: +SKIP
+        >>> monitor.add_listener(scheduler.record_event)  # doctest: +SKIP
+        >>> monitor.start()  # doctest: +SKIP
+        >>> scheduler.run()  # doctest: +SKIP
+    """
+
+    def __init__(self,
+                 manager,
+                 interval: float = 3600.0,
+                 window: Optional[float] = None,
+                 max_concurrent: int = 1,
+                 bytes_per_second: Optional[float] = None,
+                 clock: Callable[[], float] = time.time) -> None:
+        """ McbdscBackupScheduler インスタンスの初期化メソッド。
+
+        Args:
+            manager (McbdscDockerManager): バックアップするコンテナを管理する McbdscDockerManager インスタンス.
+            interval (float, optional): バックアップのサイクルの秒数. Defaults to 3600.0.
+            window (float, optional): 各サイクルで、バックアップの開始を分散させる秒数.
+                                      None の場合は `interval` の半分. Defaults to None.
+            max_concurrent (int, optional): 同時に実行するバックアップの最大数. Defaults to 1.
+            bytes_per_second (float, optional): 全てのバックアップの合計で、一秒あたりに書き込むバイト数の上限.
+                                                None の場合は制限しない. Defaults to None.
+            clock (Callable[[], float], optional): 現在時刻(UNIX 時間)を戻す関数. Defaults to time.time.
+        """
+        self._manager = manager
+        self._interval = interval
+        self._window = window if window is not None else interval / 2
+        self._max_concurrent = max_concurrent
+        self._throttle = McbdscTokenBucket(bytes_per_second) if bytes_per_second else None
+        self._clock = clock
+        self._lock = threading.Lock()
+        # サーバ名と、前回のバックアップの時刻、それ以降のプレイヤーの接続数、接続中のプレイヤーの dict.
+        self._last_backup = {}
+        self._sessions = {}
+        self._online = {}
+
+    def _last_backup_time(self, name: str) -> Optional[float]:
+        if name not in self._last_backup:
+            snapshot = self._manager.backup_repository().latest_snapshot(name)
+            self._last_backup[name] = snapshot.timestamp if snapshot is not None else None
+        return self._last_backup[name]
+
+    def record_event(self, event: McbdscLogEvent) -> None:
+        """ ログのイベントから、プレイヤーの接続状況を記録するメソッド。McbdscLogMonitor のリスナーとして登録する。
+
+        前回のバックアップより前のイベント(起動直後に読み込んだ過去のログ等)では、接続数は数えません。
+        """
+        name = event.container
+        with self._lock:
+            online = self._online.setdefault(name, set())
+            if event.kind == EVENT_PLAYER_CONNECTED:
+                online.add(event.player)
+                last = self._last_backup_time(name)
+                if last is None or event.timestamp is None or event.timestamp > last:
+                    self._sessions[name] = self._sessions.get(name, 0) + 1
+            elif event.kind == EVENT_PLAYER_DISCONNECTED:
+                online.discard(event.player)
+            elif event.kind == EVENT_SERVER_STARTED:
+                online.clear()
+
+    def activity(self, name: str) -> Tuple[int, int]:
+        """ サーバに接続中のプレイヤーの数と、前回のバックアップ以降のプレイヤーの接続数を戻すメソッド。 """
+        with self._lock:
+            return (len(self._online.get(name, ())), self._sessions.get(name, 0))
+
+    def online_players(self, name: str) -> Set[str]:
+        with self._lock:
+            return set(self._online.get(name, ()))
+
+    def plan(self, names: List[str], cycle_start: float) -> List[Tuple[float, str]]:
+        """ サイクル内で、各サーバのバックアップを開始する時刻を決めるメソッド。
+
+        バックアップが必要なサーバを優先度の高い順に並べ、 `window` 秒の間に均等に割り当てます。
+        一度もバックアップされていないサーバは、プレイヤーの接続がなくてもバックアップします。
+
+        Args:
+            names (List[str]): サーバ名のリスト.
+            cycle_start (float): サイクルの開始時刻(UNIX 時間).
+
+        Returns:
+            List[Tuple[float, str]]: バックアップを開始する時刻とサーバ名のリスト. 時刻の早い順.
+        """
+        candidates = []
+        for name in names:
+            (online, sessions) = self.activity(name)
+            with self._lock:
+                never = self._last_backup_time(name) is None
+            if online == 0 and sessions == 0 and not never:
+                logger.debug("Skip the backup of {name}: no player activity.".format(name=name))
+                continue
+            candidates.append((-online, -sessions, name))
+        candidates.sort()
+        step = self._window / len(candidates) if candidates else 0
+        return [(cycle_start + i * step, name) for (i, (_o, _s, name)) in enumerate(candidates)]
+
+    def backup(self, container) -> None:
+        """ 一つのコンテナを、バックアップリポジトリに差分でバックアップするメソッド。 """
+        name = container.name
+        with self._lock:
+            # バックアップ中の接続は、次のバックアップの為に数える。
+            started = self._clock()
+            sessions = self._sessions.pop(name, 0)
+        try:
+            repository = self._manager.backup_repository(throttle=self._throttle)
+            # 手動の `mcbdsc backup` 等、同じコンテナを操作する他のプロセスの処理が終わるまで待つ。
+            with self._manager.locks().lock("container", name):
+                snapshot = container.snapshot(repository, online=container.is_running())
+        except Exception:
+            with self._lock:
+                self._sessions[name] = self._sessions.get(name, 0) + sessions
+            logger.exception("Failed to backup {name}.".format(name=name))
+            return
+        with self._lock:
+            self._last_backup[name] = started
+        logger.info("Backup {name}: {id} ({sec:.1f} seconds)"
+                    .format(name=name, id=snapshot.snapshot_id, sec=self._clock() - started))
+
+    def run_cycle(self, cycle_start: Optional[float] = None, stop: Optional[threading.Event] = None) -> List[str]:
+        """ 一つのサイクルを実行し、全てのバックアップが終わるまで待つメソッド。
+
+        Args:
+            cycle_start (float, optional): サイクルの開始時刻. None の場合は現在時刻. Defaults to None.
+            stop (threading.Event, optional): セットされると、まだ開始していないバックアップを中止する. Defaults to None.
+
+        Returns:
+            List[str]: バックアップを開始したサーバ名のリスト.
+        """
+        stop = stop if stop is not None else threading.Event()
+        cycle_start = cycle_start if cycle_start is not None else self._clock()
+        containers = {c.name: c for c in self._manager.factory_containers()}
+        started = []
+        with ThreadPoolExecutor(max_workers=self._max_concurrent) as executor:
+            for (due, name) in self.plan(sorted(containers), cycle_start):
+                if stop.wait(max(due - self._clock(), 0)):
+                    break
+                executor.submit(self.backup, containers[name])
+                started.append(name)
+        return started
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """ `stop` がセットされるまで、 `interval` 秒毎にサイクルを実行するメソッド。
+
+        サイクルは UNIX 時間が `interval` で割り切れる時刻に開始するので、複数のホストでも開始時刻が揃います。
+        """
+        stop = stop if stop is not None else threading.Event()
+        while not stop.is_set():
+            now = self._clock()
+            cycle_start = now - now % self._interval + self._interval
+            if stop.wait(cycle_start - now):
+                break
+            self.run_cycle(cycle_start, stop=stop)
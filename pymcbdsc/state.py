@@ -0,0 +1,214 @@
+""" Docker の events API を購読し、コンテナとコンテナイメージの状態をメモリ上に保持するモジュール。
+
+pymcbdsc のラベルが付与されたコンテナと、 Bedrock Server のリポジトリのコンテナイメージについて、
+一本の events ストリームから状態の変化を受け取り、キャッシュを最新に保ちます。
+ストリームが切断された場合は、再接続時に一覧を取得し直して同期します。
+
+This module keeps the state of the containers and the images in memory by subscribing the Docker events API.
+"""
+
+from typing import Dict, List, Optional
+import threading
+import time
+from logging import getLogger
+from .constants import container_label
+
+
+logger = getLogger(__name__)
+
+# events の Action と、それによって遷移するコンテナの状態。
+_action2status = {"create": "created",
+                  "start": "running",
+                  "restart": "running",
+                  "unpause": "running",
+                  "pause": "paused",
+                  "die": "exited",
+                  "stop": "exited"}
+
+
+class McbdscStateCache(object):
+    """ Docker の events API によって、コンテナの状態とコンテナイメージのタグを保持するクラス。
+
+    Examples:
+
+        >>> import docker
+        >>> from pymcbdsc.state import McbdscStateCache
+        >>>
+        >>> cache = McbdscStateCache(docker.from_env())  # doctest: +SKIP
+        >>> cache.start()  # doctest: +SKIP
+        >>> cache.wait_ready(timeout=10)  # doctest: +SKIP
+        True
+        >>> cache.container_statuses()  # doctest: +SKIP
+        {'mcbdsc_test': 'running'}
+    """
+
+    def __init__(self,
+                 docker_client,
+                 repository: str = "bedrock",
+                 label: str = container_label,
+                 reconnect_interval: float = 5.0) -> None:
+        """ McbdscStateCache インスタンスの初期化メソッド。
+
+        Args:
+            docker_client (DockerClient): Docker ホストに接続する DockerClient インスタンス.
+            repository (str, optional): 対象とするコンテナイメージのリポジトリ. Defaults to "bedrock".
+            label (str, optional): 対象とするコンテナに付与されているラベル. Defaults to container_label.
+            reconnect_interval (float, optional): events ストリームが切断された際に、再接続するまでの秒数.
+                                                  Defaults to 5.0.
+        """
+        self._docker_client = docker_client
+        self._repository = repository
+        self._label = label
+        self._reconnect_interval = reconnect_interval
+        self._containers = {}
+        self._image_tags = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._stream = None
+        self._thread = None
+
+    def start(self) -> None:
+        """ events ストリームの購読を開始するメソッド。 """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mcbdsc-state-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ events ストリームの購読を停止するメソッド。 """
+        self._stop.set()
+        self._ready.clear()
+        stream = self._stream
+        if stream is not None:
+            stream.close()
+        self._thread = None
+
+    def is_ready(self) -> bool:
+        """ キャッシュが同期済みで、最新の状態を保持しているか否かを戻すメソッド。 """
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """ キャッシュが同期されるまで待つメソッド。
+
+        Args:
+            timeout (float, optional): 待つ秒数. None の場合は同期されるまで待ち続ける. Defaults to None.
+
+        Returns:
+            bool: 同期されたか否か.
+        """
+        return self._ready.wait(timeout)
+
+    def container_statuses(self) -> Dict[str, str]:
+        """ コンテナ名と、その状態(running, exited 等)の dict を戻すメソッド。 """
+        with self._lock:
+            return {name: c["State"]["Status"] for (name, c) in self._containers.items()}
+
+    def container_status(self, name: str) -> Optional[str]:
+        """ 指定されたコンテナの状態を戻すメソッド。
+
+        Args:
+            name (str): コンテナ名.
+
+        Returns:
+            Optional[str]: コンテナの状態. コンテナが存在しない場合は None.
+        """
+        with self._lock:
+            c = self._containers.get(name)
+            return c["State"]["Status"] if c is not None else None
+
+    def container_attrs(self) -> Dict[str, dict]:
+        """ コンテナ名と、 docker-py の Container モデルを作成できる最小限の属性の dict を戻すメソッド。
+
+        戻り値の属性は `client.containers.prepare_model()` に渡すことで、 API を呼び出さずに Container インスタンスにできます。
+        """
+        with self._lock:
+            return {name: dict(c) for (name, c) in self._containers.items()}
+
+    def rename_container(self, old: str, new: str) -> None:
+        """ コンテナの名前の変更を、イベントを待たずにキャッシュに反映するメソッド。 """
+        with self._lock:
+            self._rename_container(old, new)
+
+    def _rename_container(self, old: str, new: str) -> None:
+        c = self._containers.pop(old, None)
+        if c is not None:
+            c["Name"] = "/" + new
+            self._containers[new] = c
+
+    def image_tags(self) -> List[str]:
+        """ 対象のリポジトリの、全てのコンテナイメージのタグ("bedrock:1.16" 等)のリストを戻すメソッド。 """
+        with self._lock:
+            return [tag for tags in self._image_tags.values() for tag in tags]
+
+    def resync(self) -> None:
+        """ コンテナとコンテナイメージの一覧を取得し、キャッシュを同期し直すメソッド。 """
+        client = self._docker_client
+        containers = client.containers.list(all=True, filters={"label": self._label})
+        d = {}
+        for c in containers:
+            d[c.name] = {"Id": c.id, "Name": "/" + c.name, "State": {"Status": c.status}}
+        with self._lock:
+            self._containers = d
+        self._resync_images()
+
+    def _resync_images(self) -> None:
+        images = self._docker_client.images.list(self._repository)
+        d = {image.id: list(image.tags) for image in images}
+        with self._lock:
+            self._image_tags = d
+
+    def handle_event(self, event: dict) -> None:
+        """ events API から受信したイベントを、キャッシュに反映するメソッド。
+
+        Args:
+            event (dict): decode 済みのイベント.
+        """
+        etype = event.get("Type")
+        action = event.get("Action") or event.get("status") or ""
+        actor = event.get("Actor") or {}
+        attributes = actor.get("Attributes") or {}
+        if etype == "container":
+            # events API のフィルタは全ての種類のイベントに適用されてしまうので、ラベルはここで確認する。
+            if self._label not in attributes:
+                return
+            name = attributes.get("name")
+            # "exec_start: /bin/sh" のように、 Action に詳細が付与されている場合がある。
+            action = action.split(":")[0]
+            with self._lock:
+                if action == "destroy":
+                    self._containers.pop(name, None)
+                elif action == "rename":
+                    self._rename_container(attributes.get("oldName", "").lstrip("/"), name)
+                elif action in _action2status:
+                    c = self._containers.setdefault(name, {"Id": actor.get("ID"), "Name": "/" + name,
+                                                           "State": {"Status": "created"}})
+                    c["State"]["Status"] = _action2status[action]
+        elif etype == "image":
+            image_name = attributes.get("name", "")
+            # タグの付け外しや削除では、どのタグが変わったかがイベントからは正確に分からないので、一覧を取得し直す。
+            if image_name.split(":")[0] == self._repository or actor.get("ID") in self._image_tags:
+                self._resync_images()
+
+    def _run(self) -> None:
+        client = self._docker_client
+        while not self._stop.is_set():
+            try:
+                # 一覧の取得中に発生したイベントを取りこぼさないよう、一覧の取得前の時刻からイベントを受信する。
+                since = int(time.time()) - 1
+                self.resync()
+                self._stream = client.events(since=since, decode=True, filters={"type": ["container", "image"]})
+                self._ready.set()
+                logger.debug("The state cache is synchronized.")
+                for event in self._stream:
+                    self.handle_event(event)
+                    if self._stop.is_set():
+                        break
+            except Exception as e:
+                if not self._stop.is_set():
+                    logger.warning("The Docker events stream was disconnected: {e}".format(e=e))
+            finally:
+                self._ready.clear()
+                self._stream = None
+            self._stop.wait(self._reconnect_interval)
@@ -0,0 +1,165 @@
+""" 展開した BDS をバージョン毎にホスト上に保存し、読み込み専用で共有する為のモジュール。
+
+BDS Zip ファイルを一度だけ `<store_dir>/versions/<バージョン>` に展開し、コンテナはこれを読み込み専用で
+バインドマウントして利用します。バージョン間で内容が同じファイルは、 `<store_dir>/objects` 配下の
+ファイルへのハードリンクとして一つだけ保存します。
+
+This module stores the extracted BDS on the host by version and shares them read-only with the containers.
+"""
+
+from typing import Dict, List, Tuple
+import hashlib
+import os
+import re
+import shutil
+import stat
+import tempfile
+import zipfile
+from logging import getLogger
+from .constants import bds_version_pat
+
+
+logger = getLogger(__name__)
+
+_copy_bufsize = 1024 * 1024
+_version_re = re.compile(bds_version_pat)
+
+
+class McbdscVersionStore(object):
+    """ 展開した BDS を、バージョン毎に重複排除して保存するクラス。
+
+    Examples:
+
+        >>> from pymcbdsc.store import McbdscVersionStore
+        >>>
+        >>> store = McbdscVersionStore("/var/lib/pymcbdsc/store")  # doctest: +SKIP
+        >>> store.extract("/var/lib/pymcbdsc/downloads/bedrock-server-1.16.201.02.zip", "1.16.201.02")  # doctest: +SKIP
+        {'files': 1234, 'linked': 1200, 'stored': 34}
+        >>> store.versions()  # doctest: +SKIP
+        ['1.16.200.02', '1.16.201.02']
+    """
+
+    def __init__(self, store_dir: str) -> None:
+        """ McbdscVersionStore インスタンスの初期化メソッド。
+
+        Args:
+            store_dir (str): 保存先のディレクトリ(フォルダ)のパス.
+        """
+        self._dir = store_dir
+        self._versions_dir = os.path.join(store_dir, "versions")
+        self._objects_dir = os.path.join(store_dir, "objects")
+
+    @property
+    def versions_dir(self) -> str:
+        """ バージョン毎のディレクトリを含むディレクトリ。コンテナにはこのディレクトリを読み込み専用でマウントする。 """
+        return self._versions_dir
+
+    def version_dir(self, version: str) -> str:
+        return os.path.join(self._versions_dir, version)
+
+    def has_version(self, version: str) -> bool:
+        return os.path.isdir(self.version_dir(version))
+
+    def versions(self) -> List[str]:
+        """ 展開済みのバージョンのリストを、昇順で戻すメソッド。 """
+        if not os.path.isdir(self._versions_dir):
+            return []
+        versions = [v for v in os.listdir(self._versions_dir) if _version_re.fullmatch(v)]
+        versions.sort(key=lambda s: list(map(int, s.split('.'))))
+        return versions
+
+    def _store_member(self, z: zipfile.ZipFile, info: zipfile.ZipInfo, executable: bool) -> Tuple[str, bool]:
+        h = hashlib.sha256()
+        (fd, tmp) = tempfile.mkstemp(prefix=".tmp-", dir=self._objects_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with z.open(info) as src:
+                    while True:
+                        data = src.read(_copy_bufsize)
+                        if not data:
+                            break
+                        h.update(data)
+                        f.write(data)
+            # 実行権限の有無が異なるファイルは、内容が同じでも別のオブジェクトとする。
+            name = h.hexdigest() + (".x" if executable else "")
+            path = os.path.join(self._objects_dir, name[:2], name)
+            if os.path.exists(path):
+                return (path, False)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp, 0o555 if executable else 0o444)
+            os.replace(tmp, path)
+            return (path, True)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def extract(self, zip_path: str, version: str) -> Dict[str, int]:
+        """ BDS Zip ファイルを展開して保存するメソッド。
+
+        展開は一時ディレクトリで行い、完了してからバージョンのディレクトリに名前を変更するので、
+        展開途中のバージョンがコンテナから見えることはありません。
+
+        Args:
+            zip_path (str): BDS Zip ファイルのパス.
+            version (str): BDS のバージョン.
+
+        Raises:
+            ValueError: Zip ファイルに、展開先の外を指すパスが含まれる場合に raise.
+
+        Returns:
+            Dict[str, int]: 展開したファイルの数("files")と、そのうち既存のオブジェクトにリンクした数("linked")、
+                            新たに保存した数("stored").
+        """
+        if not _version_re.fullmatch(version):
+            raise ValueError("Invalid version: {version}".format(version=version))
+        os.makedirs(self._versions_dir, exist_ok=True)
+        os.makedirs(self._objects_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-{version}-".format(version=version), dir=self._versions_dir)
+        counts = {"files": 0, "linked": 0, "stored": 0}
+        try:
+            with zipfile.ZipFile(zip_path) as z:
+                for info in z.infolist():
+                    name = info.filename
+                    parts = name.replace("\\", "/").split("/")
+                    if name.startswith("/") or ".." in parts:
+                        raise ValueError("Unsafe path in the zip file: {name}".format(name=name))
+                    dest = os.path.join(tmp_dir, *[p for p in parts if p])
+                    if name.endswith("/"):
+                        os.makedirs(dest, exist_ok=True)
+                        continue
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    mode = info.external_attr >> 16
+                    executable = bool(mode & stat.S_IXUSR) or parts[-1] == "bedrock_server"
+                    (obj, stored) = self._store_member(z, info, executable)
+                    os.link(obj, dest)
+                    counts["files"] += 1
+                    counts["stored" if stored else "linked"] += 1
+            dest_dir = self.version_dir(version)
+            if os.path.exists(dest_dir):
+                raise FileExistsError("The version is already extracted: {version}".format(version=version))
+            os.rename(tmp_dir, dest_dir)
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+        logger.info("Extracted {version}: {counts}".format(version=version, counts=counts))
+        return counts
+
+    def remove(self, version: str) -> None:
+        """ 展開済みのバージョンを削除するメソッド。どのバージョンからも参照されなくなったオブジェクトは `gc()` で削除する。 """
+        shutil.rmtree(self.version_dir(version))
+
+    def gc(self) -> int:
+        """ どのバージョンからもリンクされていないオブジェクトを削除し、その数を戻すメソッド。 """
+        count = 0
+        if not os.path.isdir(self._objects_dir):
+            return count
+        for prefix in os.listdir(self._objects_dir):
+            d = os.path.join(self._objects_dir, prefix)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                path = os.path.join(d, name)
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+                    count += 1
+        return count
@@ -0,0 +1,254 @@
+""" ダウンロードやコンテナイメージの Build 等の処理時間を計測する、軽量なトレースのモジュール。
+
+処理を `span()` で囲むと、所要時間と、その間に数えたバイト数や HTTP / Docker API の呼び出し回数を記録します。
+終了したスパンは "pymcbdsc.trace" ロガーに DEBUG レベルの JSON として出力し、登録したリスナーに渡します。
+スパンはスレッド毎に入れ子にでき、 `count()` で数えた値は実行中の全てのスパン(親のスパンを含む)に加算します。
+
+This module provides the lightweight tracing, which records the duration and the counters of each phase.
+"""
+
+from typing import Callable, Dict, List, Optional
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from logging import getLogger, DEBUG
+
+
+logger = getLogger(__name__)
+
+
+class McbdscSpan(object):
+    """ 計測している一つの処理を表すクラス。 """
+
+    def __init__(self, name: str, parent: Optional["McbdscSpan"] = None, **attrs) -> None:
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.counters = {}
+        self.started = time.time()
+        self._started = time.monotonic()
+        self.duration = None
+        self.error = None
+
+    def add(self, **counters) -> None:
+        """ このスパンのカウンタに加算するメソッド。親のスパンには加算しない。 """
+        for (k, v) in counters.items():
+            self.counters[k] = self.counters.get(k, 0) + v
+
+    def set(self, **attrs) -> None:
+        """ このスパンの属性を設定するメソッド。 """
+        self.attrs.update(attrs)
+
+    def finish(self) -> None:
+        self.duration = time.monotonic() - self._started
+
+    def path(self) -> str:
+        """ 親のスパンの名前を "/" で連結した名前を戻すメソッド。 """
+        return self.name if self.parent is None else self.parent.path() + "/" + self.name
+
+    def to_dict(self) -> dict:
+        d = {"span": self.name, "path": self.path(), "start": self.started, "duration": self.duration,
+             "thread": threading.current_thread().name, "pid": os.getpid()}
+        d.update(self.attrs)
+        d.update(self.counters)
+        if self.error is not None:
+            d["error"] = self.error
+        return d
+
+
+class McbdscTracer(object):
+    """ スパンを管理するクラス。通常はモジュールの `tracer` インスタンスを利用します。
+
+    Examples:
+
+        >>> from pymcbdsc.trace import McbdscTracer
+        >>>
+        >>> tracer = McbdscTracer()
+        >>> spans = []
+        >>> tracer.add_listener(spans.append)
+        >>> with tracer.span("build_image", tag="bedrock:1.16.201.02"):
+        ...     with tracer.span("build_image.context") as span:
+        ...         span.add(bytes=1024)
+        ...     tracer.count(docker_calls=1)
+        >>> [(s.path(), s.counters) for s in spans]
+        [('build_image/build_image.context', {'bytes': 1024}), ('build_image', {'docker_calls': 1})]
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._listeners = []
+
+    def _stack(self) -> List[McbdscSpan]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def add_listener(self, listener: Callable[[McbdscSpan], None]) -> None:
+        """ 終了したスパンを受け取る関数を登録するメソッド。 """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[McbdscSpan], None]) -> None:
+        self._listeners.remove(listener)
+
+    def current(self) -> Optional[McbdscSpan]:
+        """ このスレッドで実行中の、最も内側のスパンを戻すメソッド。 """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """ `with` で囲んだ処理を計測するメソッド。
+
+        Args:
+            name (str): スパンの名前.
+            **attrs: スパンの属性. JSON に変換できる値である必要がある.
+
+        Yields:
+            McbdscSpan: 計測しているスパン.
+        """
+        stack = self._stack()
+        span = McbdscSpan(name, parent=stack[-1] if stack else None, **attrs)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.finish()
+            stack.pop()
+            self._emit(span)
+
+    def traced(self, name: str) -> Callable:
+        """ 関数全体を `span(name)` で囲むデコレータを戻すメソッド。 """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, **counters) -> None:
+        """ このスレッドで実行中の全てのスパンのカウンタに加算するメソッド。スパンの外では何もしない。 """
+        for span in self._stack():
+            span.add(**counters)
+
+    def _emit(self, span: McbdscSpan) -> None:
+        if logger.isEnabledFor(DEBUG):
+            logger.debug(json.dumps(span.to_dict(), sort_keys=True, default=str))
+        for listener in self._listeners:
+            listener(span)
+
+
+# pymcbdsc 全体で共有するトレーサー。
+tracer = McbdscTracer()
+span = tracer.span
+traced = tracer.traced
+count = tracer.count
+
+
+def instrument_session(session, kind: str) -> None:
+    """ requests.Session の応答毎に、 `<kind>_calls` と `<kind>_bytes` を数えるフックを追加する関数。
+
+    docker-py の APIClient は requests.Session なので、 Docker API の呼び出し回数も同じ方法で数えられます。
+    ストリーミングの応答は Content-Length が無いので、バイト数には加算しません。
+
+    Args:
+        session (requests.Session): 対象のセッション.
+        kind (str): カウンタ名の接頭辞("http", "docker" 等).
+    """
+    hooks = session.hooks.setdefault("response", [])
+    if any(getattr(h, "_mcbdsc_kind", None) == kind for h in hooks):
+        return
+
+    def hook(response, *args, **kwargs):
+        length = response.headers.get("Content-Length")
+        count(**{kind + "_calls": 1, kind + "_bytes": int(length) if length and length.isdigit() else 0})
+        return response
+    hook._mcbdsc_kind = kind
+    hooks.append(hook)
+
+
+class McbdscCountingReader(object):
+    """ 読み込んだバイト数を数え、最後まで読み込んだ時刻を記録するファイルオブジェクトのラッパー。
+
+    Build コンテキストのアップロードのように、他のライブラリが読み込む処理の進み具合を計測する為に利用します。
+    `callback` を指定した場合は、読み込む毎にそのバイト数で呼び出します。
+    requests は `tell()` と `seek()` で Content-Length を求めるので、 `fileno()` は提供しません。
+    """
+
+    def __init__(self, fileobj, callback: Optional[Callable[[int], None]] = None) -> None:
+        self._fileobj = fileobj
+        self._callback = callback
+        self.bytes = 0
+        self.eof_at = None
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        self.bytes += len(data)
+        if data and self._callback is not None:
+            self._callback(len(data))
+        if not data and self.eof_at is None:
+            self.eof_at = time.monotonic()
+        return data
+
+    def tell(self) -> int:
+        return self._fileobj.tell()
+
+    def seek(self, *args) -> int:
+        return self._fileobj.seek(*args)
+
+
+class McbdscProfile(object):
+    """ 終了したスパンを名前毎に集計し、フェーズ毎の所要時間の表を作成するクラス。
+
+    Examples:
+
+        >>> from pymcbdsc.trace import McbdscProfile, McbdscTracer
+        >>>
+        >>> tracer = McbdscTracer()
+        >>> profile = McbdscProfile()
+        >>> tracer.add_listener(profile.record)
+        >>> for _ in range(2):
+        ...     with tracer.span("download") as s:
+        ...         s.add(http_calls=1, http_bytes=1000)
+        >>> profile.summary()["download"]["count"], profile.summary()["download"]["http_bytes"]
+        (2, 2000)
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._phases = {}
+
+    def record(self, span: McbdscSpan) -> None:
+        with self._lock:
+            phase = self._phases.setdefault(span.path(), {"count": 0, "seconds": 0.0, "max": 0.0, "errors": 0})
+            phase["count"] += 1
+            phase["seconds"] += span.duration
+            phase["max"] = max(phase["max"], span.duration)
+            phase["errors"] += 1 if span.error is not None else 0
+            for (k, v) in span.counters.items():
+                phase[k] = phase.get(k, 0) + v
+
+    def summary(self) -> Dict[str, dict]:
+        """ スパンのパスと、回数・合計秒数・最大秒数・エラー数・カウンタの合計の dict を戻すメソッド。 """
+        with self._lock:
+            return {path: dict(phase) for (path, phase) in self._phases.items()}
+
+    def render(self) -> str:
+        """ 集計結果を、開始順ではなくパスの順に並べたテキストの表として戻すメソッド。 """
+        lines = ["{phase:<48} {count:>5} {seconds:>10} {max:>10}  counters".format(
+            phase="phase", count="count", seconds="total(s)", max="max(s)")]
+        fixed = ("count", "seconds", "max", "errors")
+        for (path, phase) in sorted(self.summary().items()):
+            depth = path.count("/")
+            counters = " ".join(("{k}={v:.3f}" if isinstance(v, float) else "{k}={v}").format(k=k, v=v)
+                                for (k, v) in sorted(phase.items()) if k not in fixed or (k == "errors" and v))
+            lines.append("{phase:<48} {count:>5} {seconds:>10.3f} {max:>10.3f}  {counters}".format(
+                phase="  " * depth + path.rsplit("/", 1)[-1], count=phase["count"], seconds=phase["seconds"],
+                max=phase["max"], counters=counters))
+        return "\n".join(lines)
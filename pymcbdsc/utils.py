@@ -2,6 +2,9 @@
 # >>> os_name = "posix"
 # >>> p = mock.patch('pymcbdsc.utils.os_name', os_name)
 from os import name as os_name
+import importlib
+import threading
+import types
 
 
 def pymcbdsc_root_dir():
@@ -32,3 +35,46 @@ def pymcbdsc_root_dir():
     else:
         r = "/var/lib/pymcbdsc"
     return r
+
+
+class McbdscLazyModule(types.ModuleType):
+    """ 属性に初めてアクセスした時点で、実際のモジュールを import するモジュールのクラス。
+
+    docker-py や requests の import には時間がかかるので、これらを必要としないサブコマンドや
+    `import pymcbdsc` を速くする為に利用します。モジュールの属性として保持するので、
+    `mock.patch('pymcbdsc.docker.docker')` 等でそのまま置き換えることができます。
+
+    Examples:
+
+        >>> from pymcbdsc.utils import McbdscLazyModule
+        >>>
+        >>> json = McbdscLazyModule("json")
+        >>> json.dumps([1])
+        '[1]'
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__["_lazy_lock"] = threading.Lock()
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with self.__dict__["_lazy_lock"]:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> McbdscLazyModule:
+    """ `name` のモジュールを、属性に初めてアクセスした時点で import する McbdscLazyModule を戻す関数。 """
+    return McbdscLazyModule(name)
@@ -0,0 +1,275 @@
+""" BDS Zip ファイルとバックアップリポジトリのオブジェクトが破損していないかを検証するモジュール。
+
+BDS Zip ファイルは mmap で開いてセントラルディレクトリを読み込み、各メンバーを展開しながら CRC-32 を検証します。
+バックアップリポジトリのオブジェクトは、内容の SHA-256 がファイル名(ハッシュ値)と一致するかを検証します。
+検証はプロセスプールで並列に行い、結果をキャッシュに記録するので、次回以降は変更されていないファイルを検証しません。
+
+This module verifies the integrity of the BDS zip files and the objects of the backup repository.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+KIND_ZIP = "zip"
+KIND_OBJECT = "object"
+
+_eocd = struct.Struct("<4s4H2LH")
+_eocd_sig = b"PK\x05\x06"
+_cd_header = struct.Struct("<4s6H3L5H2L")
+_cd_sig = b"PK\x01\x02"
+_local_header = struct.Struct("<4s5H3L2H")
+_local_sig = b"PK\x03\x04"
+# ZIP64 を示す値。これらの値を含む Zip ファイルは zipfile モジュールで検証する。
+_zip64_markers = (0xFFFF, 0xFFFFFFFF)
+_chunk_size = 1024 * 1024
+
+
+def _find_eocd(mm: mmap.mmap) -> Tuple:
+    # EOCD は末尾のコメント(最大 65535 バイト)の直前にある。
+    start = max(0, len(mm) - _eocd.size - 0xFFFF)
+    pos = mm.rfind(_eocd_sig, start)
+    if pos < 0:
+        raise zipfile.BadZipFile("End of central directory record not found.")
+    return _eocd.unpack_from(mm, pos)
+
+
+def _check_member(mm: mmap.mmap, name: str, method: int, crc: int, csize: int, usize: int, offset: int) -> None:
+    header = _local_header.unpack_from(mm, offset)
+    if header[0] != _local_sig:
+        raise zipfile.BadZipFile("Bad local file header: {name}".format(name=name))
+    start = offset + _local_header.size + header[9] + header[10]
+    if start + csize > len(mm):
+        raise zipfile.BadZipFile("Truncated member: {name}".format(name=name))
+    actual_crc = 0
+    length = 0
+    d = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+    for pos in range(start, start + csize, _chunk_size):
+        data = mm[pos:min(pos + _chunk_size, start + csize)]
+        if d is not None:
+            data = d.decompress(data)
+        actual_crc = zlib.crc32(data, actual_crc)
+        length += len(data)
+    if d is not None:
+        data = d.flush()
+        actual_crc = zlib.crc32(data, actual_crc)
+        length += len(data)
+    if length != usize or actual_crc != crc:
+        raise zipfile.BadZipFile("Bad CRC-32 or size: {name}".format(name=name))
+
+
+def verify_zip(path: str) -> Optional[str]:
+    """ Zip ファイルの全てのメンバーを展開し、 CRC-32 とサイズを検証する関数。
+
+    Args:
+        path (str): Zip ファイルのパス.
+
+    Returns:
+        Optional[str]: 破損している場合は、その内容を表すメッセージ. 破損していなければ None.
+
+    Examples:
+
+        >>> import os
+        >>> import tempfile
+        >>> import zipfile
+        >>> from pymcbdsc.verify import verify_zip
+        >>>
+        >>> path = os.path.join(tempfile.mkdtemp(), "bedrock-server-1.16.201.02.zip")
+        >>> with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        ...     z.writestr("bedrock_server", b"ELF" * 1000)
+        >>> verify_zip(path) is None
+        True
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return "Empty file."
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                (_sig, _disk, _cd_disk, _n_disk, n_entries, cd_size, cd_offset, _comment) = _find_eocd(mm)
+                if n_entries in _zip64_markers or cd_offset in _zip64_markers or cd_size in _zip64_markers:
+                    return _verify_zip_by_zipfile(path)
+                pos = cd_offset
+                for _ in range(n_entries):
+                    h = _cd_header.unpack_from(mm, pos)
+                    if h[0] != _cd_sig:
+                        raise zipfile.BadZipFile("Bad central directory header.")
+                    (method, crc, csize, usize, name_len, extra_len, comment_len, offset) = \
+                        (h[4], h[7], h[8], h[9], h[10], h[11], h[12], h[16])
+                    name = mm[pos + _cd_header.size:pos + _cd_header.size + name_len].decode("utf-8", "replace")
+                    pos += _cd_header.size + name_len + extra_len + comment_len
+                    if csize in _zip64_markers or usize in _zip64_markers or offset in _zip64_markers:
+                        return _verify_zip_by_zipfile(path)
+                    if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                        return _verify_zip_by_zipfile(path)
+                    _check_member(mm, name, method, crc, csize, usize, offset)
+    except (zipfile.BadZipFile, zlib.error, struct.error, OSError, ValueError) as e:
+        return str(e)
+    return None
+
+
+def _verify_zip_by_zipfile(path: str) -> Optional[str]:
+    with zipfile.ZipFile(path) as z:
+        bad = z.testzip()
+    return "Bad CRC-32: {name}".format(name=bad) if bad is not None else None
+
+
+def verify_object(path: str, sha256: str) -> Optional[str]:
+    """ バックアップリポジトリのオブジェクトの内容が、ハッシュ値と一致するかを検証する関数。
+
+    Args:
+        path (str): オブジェクトのファイルパス.
+        sha256 (str): 期待するハッシュ値.
+
+    Returns:
+        Optional[str]: 一致しない場合は、その内容を表すメッセージ. 一致すれば None.
+    """
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(_chunk_size)
+                if not data:
+                    break
+                h.update(data)
+    except OSError as e:
+        return str(e)
+    actual = h.hexdigest()
+    return None if actual == sha256 else "SHA-256 mismatch: {actual}".format(actual=actual)
+
+
+def _verify(task: Tuple[str, str, Optional[str]]) -> Optional[str]:
+    (kind, path, expected) = task
+    if kind == KIND_ZIP:
+        return verify_zip(path)
+    return verify_object(path, expected)
+
+
+class McbdscVerifyResult(object):
+    """ 一つのファイルの検証結果を表すクラス。 """
+
+    def __init__(self, kind: str, path: str, error: Optional[str], size: int, cached: bool = False) -> None:
+        """ McbdscVerifyResult インスタンスの初期化メソッド。
+
+        Args:
+            kind (str): ファイルの種類. KIND_ZIP 又は KIND_OBJECT.
+            path (str): ファイルのパス.
+            error (str, optional): 破損している場合は、その内容を表すメッセージ. 破損していなければ None.
+            size (int): ファイルのサイズ.
+            cached (bool, optional): 前回の結果をキャッシュから戻したか否か. Defaults to False.
+        """
+        self.kind = kind
+        self.path = path
+        self.error = error
+        self.size = size
+        self.cached = cached
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class McbdscVerifier(object):
+    """ ファイルの検証をプロセスプールで並列に行い、結果をキャッシュするクラス。
+
+    キャッシュには、検証に成功したファイルのサイズと更新時刻を記録します。
+    次回の検証で、サイズと更新時刻が一致するファイルは検証せずに成功とします。
+    失敗したファイルは、毎回検証し直します。
+
+    Examples:
+
+        >>> from pymcbdsc.verify import McbdscVerifier, KIND_ZIP
+        >>>
+        >>> verifier = McbdscVerifier("/var/lib/pymcbdsc/verify-cache.json")  # doctest: +SKIP
+        >>> path = "/var/lib/pymcbdsc/downloads/bedrock-server-1.16.201.02.zip"
+        >>> results = verifier.verify([(KIND_ZIP, path, None)])  # doctest: +SKIP
+        >>> [r.ok for r in results]  # doctest: +SKIP
+        [True]
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, workers: Optional[int] = None) -> None:
+        """ McbdscVerifier インスタンスの初期化メソッド。
+
+        Args:
+            cache_path (str, optional): 結果のキャッシュを保存するファイルのパス. None の場合はキャッシュしない.
+                                        Defaults to None.
+            workers (int, optional): 検証するプロセスの数. None の場合は CPU の数. 1 の場合はプロセスプールを利用しない.
+                                     Defaults to None.
+        """
+        self._cache_path = cache_path
+        self._workers = workers if workers is not None else (os.cpu_count() or 1)
+        self._cache = self._load_cache()
+
+    def _load_cache(self) -> Dict[str, dict]:
+        if self._cache_path is None or not os.path.exists(self._cache_path):
+            return {}
+        try:
+            with open(self._cache_path) as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning("The verify cache is broken and ignored: {path}".format(path=self._cache_path))
+            return {}
+
+    def _save_cache(self) -> None:
+        if self._cache_path is None:
+            return
+        tmp = self._cache_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._cache, f, sort_keys=True)
+        os.replace(tmp, self._cache_path)
+
+    def verify(self, tasks: Iterable[Tuple[str, str, Optional[str]]]) -> List[McbdscVerifyResult]:
+        """ ファイルを検証するメソッド。
+
+        Args:
+            tasks (Iterable[Tuple[str, str, Optional[str]]]): ファイルの種類(KIND_ZIP 又は KIND_OBJECT)、パス、
+                                                             期待するハッシュ値(KIND_OBJECT の場合のみ)のリスト.
+
+        Returns:
+            List[McbdscVerifyResult]: 検証結果のリスト. `tasks` と同じ順序.
+        """
+        results = []
+        todo = []
+        for (kind, path, expected) in tasks:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                results.append(McbdscVerifyResult(kind, path, str(e), 0))
+                continue
+            key = [kind, st.st_size, st.st_mtime_ns, expected]
+            if self._cache.get(path) == key:
+                results.append(McbdscVerifyResult(kind, path, None, st.st_size, cached=True))
+                continue
+            result = McbdscVerifyResult(kind, path, None, st.st_size)
+            results.append(result)
+            todo.append((result, (kind, path, expected), key))
+        if not todo:
+            return results
+        started = time.monotonic()
+        args = [task for (_r, task, _k) in todo]
+        if self._workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                # オブジェクトは小さいファイルが多いので、まとめてワーカーに渡す。
+                errors = list(executor.map(_verify, args, chunksize=max(1, len(args) // (self._workers * 4))))
+        else:
+            errors = [_verify(task) for task in args]
+        for ((result, _task, key), error) in zip(todo, errors):
+            result.error = error
+            if error is None:
+                self._cache[result.path] = key
+            else:
+                self._cache.pop(result.path, None)
+        self._save_cache()
+        logger.info("Verified {n} files ({size} bytes) in {sec:.1f} seconds."
+                    .format(n=len(todo), size=sum(r.size for (r, _t, _k) in todo), sec=time.monotonic() - started))
+        return results
@@ -0,0 +1,350 @@
+""" 作成済みで一度起動したコンテナを、コンテナイメージ毎にプールしておくモジュール。
+
+新しいサーバのコンテナを作成して初めて起動する際は、コンテナの作成に加えて Bedrock Server がワールドの生成や
+パックの読み込みを行うので、プレイヤーが接続できるまでに時間がかかります。ウォームプールでは、これらを済ませて
+停止したコンテナを予め用意しておき、サーバを追加する際にはその一つを取り出して(claim)、名前を付け替えて起動します。
+
+コンテナのボリューム、環境変数及び公開するポートは作成後に変更できないので、次のように引き継ぎます。
+
+* ワールド: プールのコンテナは `warm_dir(<コンテナ名>)` を /volume としてマウントしています. 取り出す際に、
+  そのディレクトリを `volume_dir(<サーバ名>)` に移動し(テンプレートを指定した場合は、テンプレートを複製し)、
+  元のパスにはシンボリックリンクを残します.
+* ポートと CPU: プールのコンテナに割り当てたものを、 McbdscResourceAllocator.rename() でサーバに引き継ぎます.
+* その他の設定: プールの `container_param` (環境変数等)で作成したコンテナなので、プール毎に同じ設定となります.
+
+プールのコンテナが `low_water` 個を下回ると、バックグラウンドで `size` 個まで補充します。
+
+This module keeps a warm pool of pre-created and pre-started containers for each image.
+"""
+
+from typing import Callable, List, Optional
+import copy
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from .allocator import McbdscResourceAllocator
+from .clone import McbdscWorldCloner
+from .constants import container_label, warm_container_prefix, warm_label
+from .exceptions import McbdscLockTimeoutError
+from .logs import EVENT_SERVER_STARTED, parse_line
+
+
+logger = getLogger(__name__)
+
+
+class McbdscWarmPool(object):
+    """ 一つのコンテナイメージの、作成済みで一度起動したコンテナのプールを管理するクラス。
+
+    Examples:
+
+        >>> from pymcbdsc import McbdscDockerManager
+        >>>
+        >>> manager = McbdscDockerManager()  # doctest: +SKIP
+        >>> pool = manager.warm_pool("bedrock:1.16", size=2, low_water=1)  # doctest: +SKIP
+        >>> pool.start()  # doctest: +SKIP
+        >>> manager.add_server("event-01", "event", image="bedrock:1.16")  # doctest: +SKIP
+    """
+
+    def __init__(self,
+                 manager,
+                 image: str,
+                 size: int = 2,
+                 low_water: int = 1,
+                 container_param: Optional[dict] = None,
+                 allocate: bool = True,
+                 warmup_timeout: float = 300.0,
+                 poll_interval: float = 1.0,
+                 interval: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """ McbdscWarmPool インスタンスの初期化メソッド。
+
+        Args:
+            manager (McbdscDockerManager): コンテナを管理する McbdscDockerManager インスタンス.
+            image (str): プールするコンテナのイメージ. "bedrock:1.16" の様にマイナーバージョンのタグも指定できる.
+            size (int, optional): 補充する際の、プールのコンテナの数. Defaults to 2.
+            low_water (int, optional): プールのコンテナがこの数を下回ると補充する. Defaults to 1.
+            container_param (dict, optional): プールのコンテナを作成するパラメータ(環境変数等).
+                                              name, image 及び volumes は上書きする. Defaults to None.
+            allocate (bool, optional): プールのコンテナに UDP ポートと CPU を割り当てるか否か. Defaults to True.
+            warmup_timeout (float, optional): 初めて起動してから、起動が完了するまで待つ秒数. Defaults to 300.0.
+            poll_interval (float, optional): 起動が完了したかを確認する間隔の秒数. Defaults to 1.0.
+            interval (float, optional): 補充が必要かを確認する間隔の秒数. Defaults to 60.0.
+            clock (Callable[[], float], optional): 起動を待つ時間を計る関数. Defaults to time.monotonic.
+        """
+        if size < 1 or not 0 <= low_water <= size:
+            raise ValueError("Invalid size of the warm pool: size {size}, low water {low}".format(size=size, low=low_water))
+        self._manager = manager
+        self._image = image
+        self._size = size
+        self._low_water = low_water
+        self._container_param = container_param or {}
+        self._allocate = allocate
+        self._warmup_timeout = warmup_timeout
+        self._poll_interval = poll_interval
+        self._interval = interval
+        self._clock = clock
+        self._available = []
+        self._warming = 0
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def image(self) -> str:
+        """ プールするコンテナのイメージ。 """
+        return self._image
+
+    @property
+    def slot_prefix(self) -> str:
+        """ プールのコンテナ名の接頭辞。 "mcbdsc-warm-bedrock-1.16-" の様に、コンテナ名に使えない文字は "-" とする。 """
+        return "{prefix}{image}-".format(prefix=warm_container_prefix, image=re.sub(r"[^a-zA-Z0-9_.-]", "-", self._image))
+
+    def available(self) -> List[str]:
+        """ 取り出せるプールのコンテナ名のリストを戻すメソッド。 """
+        with self._lock:
+            return list(self._available)
+
+    def status(self) -> dict:
+        """ プールのコンテナの数と、補充中のコンテナの数等を dict で戻すメソッド。 """
+        with self._lock:
+            return {"image": self._image, "available": list(self._available), "warming": self._warming,
+                    "size": self._size, "low_water": self._low_water}
+
+    def discover(self) -> List[str]:
+        """ 以前に作成して停止しているプールのコンテナを探し、プールに加えるメソッド。
+
+        Returns:
+            List[str]: プールに加えたコンテナ名のリスト.
+        """
+        filters = {"label": "{label}={image}".format(label=warm_label, image=self._image)}
+        found = [c.name for c in self._manager.docker_client.containers.list(all=True, filters=filters)
+                 if c.status == "exited" and c.name.startswith(self.slot_prefix)]
+        with self._lock:
+            added = [name for name in sorted(found) if name not in self._available]
+            self._available.extend(added)
+        return added
+
+    def _slot_param(self, slot: str) -> dict:
+        param = copy.deepcopy(self._container_param)
+        param.update(name=slot, image=self._image, volumes={slot: {"bind": "/volume", "mode": "rw"}},
+                     stdin_open=True, tty=True)
+        self._manager.set_container_label(param)
+        labels = param["labels"]
+        if isinstance(labels, list):
+            labels = param["labels"] = dict.fromkeys(labels, "")
+        labels[warm_label] = self._image
+        return param
+
+    def fill(self) -> List[str]:
+        """ プールのコンテナが `size` 個になるまで、コンテナを同時に作成して一度起動するメソッド。
+
+        Returns:
+            List[str]: プールに加えたコンテナ名のリスト.
+        """
+        with self._lock:
+            n = self._size - len(self._available) - self._warming
+            self._warming += max(n, 0)
+        if n <= 0:
+            return []
+        logger.info("Warm up {n} containers of {image}.".format(n=n, image=self._image))
+        slots = []
+        try:
+            # 割り当ては同じファイルを読み書きするので、スレッドに渡す前に一つずつ行う。
+            reserved = []
+            for _ in range(n):
+                slot = "{prefix}{id}".format(prefix=self.slot_prefix, id=uuid.uuid4().hex[:8])
+                try:
+                    resources = self._manager.resource_allocator().allocate(slot) if self._allocate else None
+                except Exception as e:
+                    logger.error("Failed to allocate resources for {slot}: {e}".format(slot=slot, e=e))
+                    break
+                reserved.append((slot, resources))
+            if not reserved:
+                return []
+            with ThreadPoolExecutor(max_workers=len(reserved)) as executor:
+                futures = [executor.submit(self._warm_one, slot, resources) for (slot, resources) in reserved]
+            for f in futures:
+                if f.exception() is not None:
+                    logger.error("Failed to warm up a container of {image}: {e}".format(image=self._image, e=f.exception()))
+                elif f.result() is not None:
+                    slots.append(f.result())
+        finally:
+            with self._lock:
+                self._warming -= n
+        return slots
+
+    def _warm_one(self, slot: str, resources: Optional[dict] = None) -> Optional[str]:
+        """ プールのコンテナを一つ作成して一度起動するメソッド。
+
+        Args:
+            slot (str): プールのコンテナ名.
+            resources (dict, optional): `slot` に割り当て済みの UDP ポートと CPU. Defaults to None.
+
+        Returns:
+            Optional[str]: プールに加えたコンテナ名. 起動が完了しなかった場合は None.
+        """
+        manager = self._manager
+        world = manager.warm_dir(slot)
+        container = None
+        try:
+            os.makedirs(world)
+            manager.docker_client.volumes.create(name=slot, driver="local",
+                                                 driver_opts={"type": "none", "o": "bind",
+                                                              "device": os.path.abspath(world)},
+                                                 labels={container_label: "true"})
+            param = self._slot_param(slot)
+            if resources is not None:
+                McbdscResourceAllocator.apply(param, resources)
+            container = manager.docker_client.containers.create(**param)
+            container.start()
+            started = self._wait_started(container)
+            container.stop()
+        except Exception:
+            self._discard(slot, container)
+            raise
+        if not started:
+            logger.warning("{slot} did not start in {timeout} seconds.".format(slot=slot, timeout=self._warmup_timeout))
+            self._discard(slot, container)
+            return None
+        with self._lock:
+            self._available.append(slot)
+        logger.info("Added {slot} to the warm pool.".format(slot=slot))
+        return slot
+
+    def _wait_started(self, container) -> bool:
+        """ Bedrock Server が "Server started." を出力するまで待ち、起動が完了したか否かを戻すメソッド。 """
+        deadline = self._clock() + self._warmup_timeout
+        while True:
+            container.reload()
+            if container.status not in ("created", "running"):
+                return False
+            lines = container.logs(tail=100).decode("utf-8", "replace").splitlines()
+            if any(e is not None and e.kind == EVENT_SERVER_STARTED for e in map(parse_line, lines)):
+                return True
+            if self._clock() >= deadline:
+                return False
+            time.sleep(self._poll_interval)
+
+    def _discard(self, slot: str, container=None) -> None:
+        """ プールのコンテナと、そのボリューム及び割り当てを削除するメソッド。 """
+        manager = self._manager
+        try:
+            if container is not None:
+                container.remove(force=True)
+            manager.docker_client.volumes.get(slot).remove()
+        except Exception as e:
+            logger.warning("Failed to remove {slot}: {e}".format(slot=slot, e=e))
+        shutil.rmtree(manager.warm_dir(slot), ignore_errors=True)
+        if self._allocate:
+            manager.resource_allocator().release(slot)
+
+    def claim(self, name: str, template: Optional[str] = None) -> Optional[dict]:
+        """ プールのコンテナを一つ取り出し、 `name` のサーバとするメソッド。
+
+        コンテナ名を `name` に変更し、ワールドを `volume_dir(name)` に移動します(`template` を指定した場合は、
+        テンプレートのワールドを複製します)。コンテナは起動しません。他のプロセスが取り出している最中のコンテナは飛ばします。
+
+        Args:
+            name (str): サーバ(コンテナ)名.
+            template (str, optional): テンプレート名. None の場合は、プールのコンテナが生成したワールドを利用する.
+                                      Defaults to None.
+
+        Raises:
+            FileNotFoundError: テンプレートが存在しない場合に raise.
+            FileExistsError: `volume_dir(name)` が既に存在する場合に raise.
+
+        Returns:
+            Optional[dict]: サーバのコンテナのパラメータ. 取り出せるコンテナが無い場合は None.
+        """
+        manager = self._manager
+        dst = manager.volume_dir(name)
+        if template is not None and not os.path.isdir(manager.template_dir(template)):
+            raise FileNotFoundError("There is no template named {template}.".format(template=template))
+        if os.path.exists(dst):
+            raise FileExistsError("The world of {name} already exists: {dst}".format(name=name, dst=dst))
+        param = None
+        for slot in self.available():
+            try:
+                with manager.locks().lock("container", slot, timeout=0):
+                    param = self._claim_slot(slot, name, template)
+            except McbdscLockTimeoutError:
+                continue
+            except Exception as e:
+                logger.warning("Failed to claim {slot}: {e}".format(slot=slot, e=e))
+            if param is not None:
+                break
+        with self._lock:
+            if len(self._available) < self._low_water:
+                self._refill.set()
+        return param
+
+    def _claim_slot(self, slot: str, name: str, template: Optional[str]) -> Optional[dict]:
+        manager = self._manager
+        with self._lock:
+            if slot not in self._available:
+                return None
+            self._available.remove(slot)
+        found = manager._find_container(slot)
+        if found is None:
+            # 他のプロセスが取り出した。
+            return None
+        container = found[1]
+        world = manager.warm_dir(slot)
+        dst = manager.volume_dir(name)
+        os.makedirs(manager.volume_dir(), exist_ok=True)
+        if template is not None:
+            McbdscWorldCloner().clone_tree(manager.template_dir(template), dst)
+            shutil.rmtree(world)
+        else:
+            os.rename(world, dst)
+        # プールのコンテナのボリュームは元のパスを指しているので、そこから移動先へのリンクを残す。
+        os.symlink(os.path.abspath(dst), world)
+        container.rename(name)
+        if manager._state_cache is not None:
+            # 直後の factory_containers() で作成し直さないよう、名前の変更のイベントを待たずにキャッシュに反映する。
+            manager._state_cache.rename_container(slot, name)
+        param = self._slot_param(slot)
+        param["name"] = name
+        del param["labels"][warm_label]
+        if self._allocate:
+            allocator = manager.resource_allocator()
+            allocator.rename(slot, name)
+            McbdscResourceAllocator.apply(param, allocator.allocations()[name])
+        logger.info("Claimed {slot} from the warm pool as {name}.".format(slot=slot, name=name))
+        return param
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """ `stop` がセットされるまで、プールのコンテナが `low_water` 個を下回れば補充するメソッド。 """
+        stop = stop if stop is not None else threading.Event()
+        try:
+            self.discover()
+        except Exception:
+            logger.exception("Failed to discover the warm containers of {image}.".format(image=self._image))
+        while not stop.is_set():
+            if len(self.available()) < self._low_water:
+                try:
+                    self.fill()
+                except Exception:
+                    logger.exception("Failed to fill the warm pool of {image}.".format(image=self._image))
+            self._refill.wait(self._interval)
+            self._refill.clear()
+
+    def start(self) -> None:
+        """ バックグラウンドのスレッドで補充を開始するメソッド。 """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(self._stop,), name="mcbdsc-warm-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ 補充を停止するメソッド。補充中のコンテナの起動が終わるまで待つ。 """
+        self._stop.set()
+        self._refill.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
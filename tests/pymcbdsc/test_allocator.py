@@ -0,0 +1,124 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import pymcbdsc
+from pymcbdsc import allocator
+from pymcbdsc.allocator import McbdscResourceAllocator
+from pymcbdsc.locks import McbdscLockManager
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+topology = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+
+
+class TestMcbdscResourceAllocator(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.state_path = os.path.join(self.test_dir, "allocations.json")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir)
+
+    def test_allocate(self) -> None:
+        alloc = McbdscResourceAllocator(self.state_path, topology=topology)
+        results = alloc.reconcile(["a", "b", "c", "d", "e"])
+        self.assertEqual([(r["port"], r["portv6"]) for r in results.values()],
+                         [(19132, 19133), (19134, 19135), (19136, 19137), (19138, 19139), (19140, 19141)])
+        # NUMA ノードを交互に割り当て、スロットが足りなければ共有することを確認する。
+        self.assertEqual([(r["cpuset"], r["mems"]) for r in results.values()],
+                         [("0-1", "0"), ("4-5", "1"), ("2-3", "0"), ("6-7", "1"), ("0-1", "0")])
+        self.assertEqual({r["threads"] for r in results.values()}, {2})
+
+        # 解放したポートとスロットが、番号の小さい順に再利用されることを確認する。
+        results = alloc.reconcile(["a", "c", "d", "e", "f"])
+        self.assertEqual(results["f"], {"port": 19134, "portv6": 19135, "cpuset": "4-5", "mems": "1", "threads": 2})
+        self.assertEqual(results["a"]["port"], 19132)
+
+        # 保存した割り当てを読み込み、既存のサーバの割り当てが変わらないことを確認する。
+        reloaded = McbdscResourceAllocator(self.state_path, topology=topology)
+        self.assertEqual(reloaded.reconcile(["a", "c", "d", "e", "f"]), results)
+        reloaded.release("c")
+        self.assertEqual(reloaded.allocate("g")["port"], 19136)
+
+    def test_allocate_without_cpus(self) -> None:
+        alloc = McbdscResourceAllocator(topology=topology, cpus_per_server=None, port_base=20000, port_limit=20003)
+        self.assertEqual(alloc.allocate("a"), {"port": 20000, "portv6": 20001, "cpuset": None, "mems": None, "threads": None})
+        alloc.allocate("b")
+        with self.assertRaises(RuntimeError):
+            alloc.allocate("c")
+
+    def test_rename(self) -> None:
+        alloc = McbdscResourceAllocator(self.state_path, topology=topology)
+        alloc.reconcile(["a", "b"])
+        a = alloc.allocations()["a"]
+        alloc.rename("a", "c")
+        # 割り当てがそのまま引き継がれ、保存されていることを確認する。
+        reloaded = McbdscResourceAllocator(self.state_path, topology=topology)
+        self.assertEqual(reloaded.allocations(), {"b": alloc.allocations()["b"], "c": a})
+        with self.assertRaises(KeyError):
+            alloc.rename("a", "d")
+        with self.assertRaises(KeyError):
+            alloc.rename("b", "c")
+
+    def test_shared_file(self) -> None:
+        # 同じファイルを共有するインスタンスが、互いの割り当てを読み込み直して重複なく割り当てることを確認する。
+        locks = McbdscLockManager(os.path.join(self.test_dir, "locks"))
+        allocators = [McbdscResourceAllocator(self.state_path, topology=topology, locks=locks) for _ in range(4)]
+        allocators[0].allocate("a")
+        self.assertEqual(allocators[1].allocate("b")["port"], 19134)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: allocators[i % 4].allocate("s{i}".format(i=i)), range(40)))
+        allocations = McbdscResourceAllocator(self.state_path, topology=topology).allocations()
+        self.assertEqual(len(allocations), 42)
+        self.assertEqual(len({a["port"] for a in allocations.values()}), 42)
+        self.assertEqual(allocators[2].allocations(), allocations)
+        # 一時ファイルが残っていないことを確認する。
+        self.assertEqual(sorted(os.listdir(self.test_dir)), ["allocations.json", "locks"])
+
+    def test_numa_topology(self) -> None:
+        node_dir = os.path.join(self.test_dir, "node")
+        for (node, cpulist) in ((0, "0-3,8-11\n"), (1, "4-7,12-15\n")):
+            os.makedirs(os.path.join(node_dir, "node{n}".format(n=node)))
+            with open(os.path.join(node_dir, "node{n}".format(n=node), "cpulist"), "w") as f:
+                f.write(cpulist)
+        os.makedirs(os.path.join(node_dir, "power"))
+        self.assertEqual(allocator.numa_topology(node_dir),
+                         {0: [0, 1, 2, 3, 8, 9, 10, 11], 1: [4, 5, 6, 7, 12, 13, 14, 15]})
+        self.assertEqual(list(allocator.numa_topology(os.path.join(self.test_dir, "missing"))), [0])
+
+
+class TestMcbdscDockerManagerAllocateResources(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_allocate_resources(self) -> None:
+        params = [{"name": "a", "image": "bedrock:latest", "environment": {"SERVER_NAME": "a"}},
+                  {"name": "b", "image": "bedrock:latest"}]
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, containers_param=params)
+        manager.allocate_resources(topology=topology)
+        self.assertEqual(params[0]["environment"],
+                         {"SERVER_NAME": "a", "SERVER_PORT": "19132", "SERVER_PORTV6": "19133", "MAX_THREADS": "2"})
+        self.assertEqual(params[1]["ports"], {"19134/udp": 19134, "19135/udp": 19135})
+        self.assertEqual((params[1]["cpuset_cpus"], params[1]["cpuset_mems"]), ("4-5", "1"))
+        self.assertEqual(manager.server_addresses(), {"a": ("127.0.0.1", 19132), "b": ("127.0.0.1", 19134)})
+        # インスタンスはマネージャで共有されることを確認する。
+        self.assertIs(manager.resource_allocator(), manager.resource_allocator())
+        self.assertEqual(manager.resource_allocator().allocations()["b"]["cpuset"], "4-5")
+
+        # 別のインスタンスでも、同じ割り当てとなることを確認する。
+        params2 = [{"name": "b", "image": "bedrock:latest"}]
+        manager2 = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, containers_param=params2)
+        self.assertEqual(manager2.allocate_resources(topology=topology)["b"]["port"], 19134)
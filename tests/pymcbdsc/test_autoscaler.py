@@ -0,0 +1,148 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+from pymcbdsc.autoscaler import McbdscAutoscaler, McbdscServerGroup
+from pymcbdsc.logs import EVENT_PLAYER_CONNECTED, EVENT_PLAYER_DISCONNECTED, McbdscLogEvent
+from pymcbdsc.raknet import McbdscServerStatus
+from .test_utils import os_name2test_root_dir
+
+
+class DummyClock(object):
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeManager(object):
+    """ サーバ名と、そのプレイヤー数のみを管理する McbdscDockerManager の代わり。 """
+
+    def __init__(self, volume_dir: str, players: dict = None) -> None:
+        self.players = dict(players or {})
+        self.offline = set()
+        self.containers = {}
+        self.added = []
+        self.removed = []
+        self._volume_dir = volume_dir
+
+    def server_addresses(self) -> dict:
+        return {name: ("127.0.0.1", 19132) for name in self.players}
+
+    def query_status(self, timeout: float = 1.0) -> dict:
+        return {name: McbdscServerStatus(("127.0.0.1", 19132), online=True, players=n, max_players=10)
+                if name not in self.offline else McbdscServerStatus(("127.0.0.1", 19132), error="timed out")
+                for (name, n) in self.players.items()}
+
+    def volume_dir(self, name: str = None) -> str:
+        return self._volume_dir if name is None else os.path.join(self._volume_dir, name)
+
+    def factory_containers(self) -> list:
+        return [self.container(name) for name in self.players]
+
+    def container(self, name: str):
+        if name not in self.containers:
+            self.containers[name] = mock.MagicMock()
+            self.containers[name].name = name
+        return self.containers[name]
+
+    def add_server(self, name: str, template: str, image: str = None, allocate: bool = True) -> None:
+        self.players[name] = 0
+        self.added.append(name)
+
+    def remove_server(self, name: str) -> None:
+        del self.players[name]
+        self.removed.append(name)
+
+
+class TestMcbdscServerGroup(unittest.TestCase):
+
+    def test_server_index(self) -> None:
+        group = McbdscServerGroup("event", template="event")
+        self.assertEqual(group.server_index("event-12"), 12)
+        self.assertIsNone(group.server_index("event-x"))
+        self.assertIsNone(group.server_index("events-01"))
+        with self.assertRaises(ValueError):
+            McbdscServerGroup("event", template="event", min_servers=3, max_servers=2)
+
+
+class TestMcbdscAutoscaler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        self.manager = FakeManager(os.path.join(self.test_dir, "volumes"), {"lobby": 3})
+        self.group = McbdscServerGroup("event", template="event", min_servers=1, max_servers=4)
+        self.clock = DummyClock(1000.0)
+        self.autoscaler = McbdscAutoscaler(self.manager, [self.group], scale_up_cooldown=60, scale_down_cooldown=300,
+                                           drain_timeout=120, clock=self.clock)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def check(self, seconds: float = 30.0) -> dict:
+        self.clock.now += seconds
+        return self.autoscaler.check()["event"]
+
+    def test_scale_up(self) -> None:
+        # 最小の台数までは、クールダウンによらず追加することを確認する。
+        self.assertEqual(self.check()["added"], ["event-01"])
+        self.manager.players["event-01"] = 8
+        self.assertEqual(self.check(seconds=60)["added"], ["event-02"])
+        # クールダウンの間は追加しないことを確認する。
+        self.manager.players.update({"event-01": 10, "event-02": 10})
+        self.assertEqual(self.check()["added"], [])
+        # 使用率が target_occupancy となる台数まで、まとめて追加することを確認する。
+        self.assertEqual(self.check()["added"], ["event-03", "event-04"])
+        status = self.autoscaler.status()["event"]
+        self.assertEqual((status["players"], status["capacity"]), (20, 40))
+        self.assertEqual(status["servers"], ["event-01", "event-02", "event-03", "event-04"])
+        # 最大の台数より多くは追加しないことを確認する。
+        self.manager.players.update({"event-03": 10, "event-04": 10})
+        self.assertEqual(self.check(seconds=60)["added"], [])
+        self.assertNotIn("lobby", self.manager.removed)
+
+    def test_scale_down(self) -> None:
+        self.manager.players.update({"event-01": 1, "event-02": 0, "event-03": 2})
+        self.check()
+        # 最初の確認又は前回の追加・削除からクールダウンの間は、削除しないことを確認する。
+        self.assertEqual(self.check(seconds=200)["drained"], [])
+        self.assertEqual(self.check(seconds=100)["drained"], ["event-02", "event-01"])
+        self.manager.containers["event-01"].send_command.assert_called_once_with(
+            "say This server will close soon. Please move to another server.")
+        self.assertEqual(self.autoscaler.status()["event"]["draining"], ["event-01", "event-02"])
+        # プレイヤーが居ないサーバはすぐに、居るサーバは drain_timeout 秒経ってから削除することを確認する。
+        self.assertEqual(self.check()["removed"], ["event-02"])
+        self.assertEqual(self.check(seconds=90)["removed"], ["event-01"])
+        self.assertEqual(self.manager.removed, ["event-02", "event-01"])
+        self.assertEqual(self.autoscaler.status()["event"]["servers"], ["event-03"])
+
+    def test_undrain(self) -> None:
+        self.manager.players.update({"event-01": 1, "event-02": 2})
+        self.check()
+        self.assertEqual(self.check(seconds=300)["drained"], ["event-01"])
+        # ドレイン中に使用率が上がれば、新しく追加せずにドレインを止めることを確認する。
+        self.manager.players.update({"event-01": 3, "event-02": 6})
+        result = self.check()
+        self.assertEqual((result["added"], result["removed"]), ([], []))
+        self.assertEqual(self.autoscaler.status()["event"]["servers"], ["event-01", "event-02"])
+
+    def test_log_players(self) -> None:
+        # Ping に応答しないサーバのプレイヤー数は、ログから数えることを確認する。
+        self.manager.players["event-01"] = 0
+        self.manager.offline.add("event-01")
+        for (kind, player) in ((EVENT_PLAYER_CONNECTED, "Steve"), (EVENT_PLAYER_CONNECTED, "Alex"),
+                               (EVENT_PLAYER_CONNECTED, "Steve"), (EVENT_PLAYER_DISCONNECTED, "Alex")):
+            self.autoscaler.record_event(McbdscLogEvent(kind, "event-01", None, None, "", player=player))
+        self.check()
+        self.assertEqual(self.autoscaler.status()["event"]["players"], 1)
+
+    def test_adopt(self) -> None:
+        # ワールドが残っている、前回の起動中に追加したサーバを再び管理することを確認する。
+        for name in ("event-02", "event-05", "other-01"):
+            os.makedirs(os.path.join(self.test_dir, "volumes", name))
+        self.check()
+        self.assertEqual(self.manager.added, ["event-02", "event-05"])
+        # 余分なサーバは、プレイヤーが居なければドレインすることを確認する。
+        self.assertEqual(self.check(seconds=300)["drained"], ["event-05"])
@@ -0,0 +1,143 @@
+import unittest
+from unittest import mock
+import io
+import tarfile
+import pymcbdsc
+from pymcbdsc import backup
+
+
+world = {"Bedrock level/db/000005.ldb": b"L" * 5000,
+         "Bedrock level/db/CURRENT": b"MANIFEST-000010\n",
+         "Bedrock level/level.dat": b"D" * 300}
+
+
+def make_tar(files: dict, prefix: str = "") -> bytes:
+    """ files の内容を含む tar アーカイブを作成する関数。 """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        if prefix:
+            info = tarfile.TarInfo(name=prefix)
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        for (path, data) in files.items():
+            info = tarfile.TarInfo(name=prefix + "/" + path if prefix else path.rsplit("/", 1)[-1])
+            info.size = len(data)
+            info.mtime = 1600000000
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class DummyWorldContainer(object):
+    """ get_archive で world の内容を戻す、 Container を模したクラス。 """
+
+    def __init__(self, files: dict) -> None:
+        self.files = files
+        self.requested = []
+
+    def get_archive(self, path, chunk_size=None):
+        self.requested.append(path)
+        if path == backup.worlds_dir:
+            data = make_tar(self.files, prefix="worlds")
+        else:
+            rel = path[len(backup.worlds_dir) + 1:]
+            data = make_tar({rel: self.files[rel]})
+        # チャンクに分割して戻す。
+        return (iter([data[i:i + 1000] for i in range(0, len(data), 1000)]), {})
+
+
+class DummyChannel(object):
+    """ save hold/query/resume に応答する、 McbdscCommandChannel を模したクラス。 """
+
+    def __init__(self, files, not_ready: int = 1) -> None:
+        self.files = files
+        self.not_ready = not_ready
+        self.commands = []
+
+    def send_command(self, command, timeout=None, expect=None):
+        self.commands.append(command)
+        if command == "save hold":
+            return ["Saving..."]
+        if command == "save query":
+            if self.not_ready > 0:
+                self.not_ready -= 1
+                return ["A previous save has not been completed."]
+            return ["Data saved. Files are now ready to be copied.",
+                    ", ".join("{p}:{n}".format(p=p, n=n) for (p, n) in self.files)]
+        if command == "save resume":
+            return ["Changes to the level are resumed."]
+
+
+def read_archive(data: bytes, mode: str = "r:gz") -> dict:
+    with tarfile.open(fileobj=io.BytesIO(data), mode=mode) as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar if m.isfile()}
+
+
+class TestBackup(unittest.TestCase):
+
+    def test_parse_save_query(self) -> None:
+        act = backup.parse_save_query(["Data saved. Files are now ready to be copied.",
+                                       "a, b/db/000001.ldb:10, a, b/level.dat:20"])
+        exp = [("a, b/db/000001.ldb", 10), ("a, b/level.dat", 20)]
+        self.assertEqual(act, exp)
+
+        # 準備ができていない応答では None となることを確認する。
+        self.assertIsNone(backup.parse_save_query(["A previous save has not been completed."]))
+        self.assertIsNone(backup.parse_save_query(["Data saved. Files are now ready to be copied."]))
+
+        with self.assertRaises(pymcbdsc.exceptions.McbdscBackupError):
+            backup.parse_save_query(["Data saved. Files are now ready to be copied.", "broken"])
+
+    def test_online_backup(self) -> None:
+        # save query で報告される長さは、実際のファイルよりも短い場合がある。
+        reported = [("Bedrock level/db/000005.ldb", 4000), ("Bedrock level/db/CURRENT", 16),
+                    ("Bedrock level/level.dat", 300)]
+        container = DummyWorldContainer(world)
+        channel = DummyChannel(reported)
+        out = io.BytesIO()
+        act = backup.online_backup(container, channel, fileobj=out, poll_interval=0)
+        self.assertEqual(act, reported)
+
+        # save hold, save query (準備中), save query, save resume の順に送信されることを確認する。
+        self.assertEqual(channel.commands, ["save hold", "save query", "save query", "save resume"])
+        # 報告されたファイルのみを get_archive で取得していることを確認する。
+        self.assertEqual(container.requested, [backup.worlds_dir + "/" + p for (p, _) in reported])
+
+        # 報告された長さで切り詰められていることを確認する。
+        files = read_archive(out.getvalue())
+        self.assertEqual(files["worlds/Bedrock level/db/000005.ldb"], b"L" * 4000)
+        self.assertEqual(files["worlds/Bedrock level/db/CURRENT"], world["Bedrock level/db/CURRENT"])
+        self.assertEqual(files["worlds/Bedrock level/level.dat"], world["Bedrock level/level.dat"])
+
+    def test_online_backup_failure(self) -> None:
+        # 報告された長さよりもファイルが短い場合は失敗し、それでも save resume が送信されることを確認する。
+        channel = DummyChannel([("Bedrock level/level.dat", 301)], not_ready=0)
+        with self.assertRaises(pymcbdsc.exceptions.McbdscBackupError):
+            backup.online_backup(DummyWorldContainer(world), channel, fileobj=io.BytesIO())
+        self.assertEqual(channel.commands[-1], "save resume")
+
+    def test_online_backup_timeout(self) -> None:
+        channel = DummyChannel([], not_ready=100)
+        with self.assertRaises(pymcbdsc.exceptions.McbdscBackupError):
+            backup.online_backup(DummyWorldContainer(world), channel, fileobj=io.BytesIO(), timeout=0, poll_interval=0)
+        self.assertEqual(channel.commands[-1], "save resume")
+
+    def test_offline_backup(self) -> None:
+        container = DummyWorldContainer(world)
+        out = io.BytesIO()
+        act = backup.offline_backup(container, fileobj=out, compression="xz")
+        self.assertEqual(sorted(act), sorted((p, len(d)) for (p, d) in world.items()))
+        # worlds ディレクトリ全体を一度で取得していることを確認する。
+        self.assertEqual(container.requested, [backup.worlds_dir])
+        files = read_archive(out.getvalue(), mode="r:xz")
+        self.assertEqual(files, {"worlds/" + p: d for (p, d) in world.items()})
+
+    def test_container_backup(self) -> None:
+        container = mock.MagicMock()
+        container.get_archive.side_effect = DummyWorldContainer(world).get_archive
+        mcbdsc_container = pymcbdsc.McbdscDockerContainer(name="test", container=container)
+        channel = DummyChannel([("Bedrock level/level.dat", 300)], not_ready=0)
+        with mock.patch.object(mcbdsc_container, "command_channel", return_value=channel):
+            out = io.BytesIO()
+            act = mcbdsc_container.backup(fileobj=out)
+        self.assertEqual(act, [("Bedrock level/level.dat", 300)])
+        self.assertEqual(list(read_archive(out.getvalue()).keys()), ["worlds/Bedrock level/level.dat"])
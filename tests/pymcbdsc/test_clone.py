@@ -0,0 +1,216 @@
+import unittest
+from unittest import mock
+import errno
+import os
+import shutil
+import pymcbdsc
+from pymcbdsc import clone
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+template_files = {"worlds/Bedrock level/db/000005.ldb": b"L" * 100,
+                  "worlds/Bedrock level/db/000007.ldb": b"M" * 100,
+                  "worlds/Bedrock level/db/CURRENT": b"MANIFEST-000010\n",
+                  "worlds/Bedrock level/db/MANIFEST-000010": b"manifest",
+                  "worlds/Bedrock level/level.dat": b"D" * 10,
+                  "whitelist.json": b"[]"}
+
+
+def make_template(template_dir: str) -> None:
+    for (path, data) in template_files.items():
+        p = os.path.join(template_dir, *path.split("/"))
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "wb") as f:
+            f.write(data)
+
+
+def read_tree(root: str) -> dict:
+    files = {}
+    for (dirpath, _dirnames, filenames) in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return files
+
+
+def unsupported_ioctl(fd, request, arg):
+    raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+
+class TestMcbdscWorldCloner(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        self.src = os.path.join(self.test_dir, "templates", "event")
+        self.dst = os.path.join(self.test_dir, "volumes", "event01")
+        make_template(self.src)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir)
+
+    @unittest.skipIf(clone.fcntl is None, "fcntl is not available.")
+    def test_clone_tree_hardlink(self) -> None:
+        with mock.patch("pymcbdsc.clone.fcntl.ioctl", side_effect=unsupported_ioctl) as ioctl:
+            counts = clone.McbdscWorldCloner().clone_tree(self.src, self.dst)
+        # reflink は最初のファイルでのみ試行されることを確認する。
+        self.assertEqual(ioctl.call_count, 1)
+        self.assertEqual(counts, {"reflink": 0, "hardlink": 2, "copy": 4})
+        self.assertEqual(read_tree(self.dst), template_files)
+
+        # .ldb ファイルはハードリンクされ、それ以外のファイルはコピーされていることを確認する。
+        def same_inode(path):
+            return os.path.samefile(os.path.join(self.src, path), os.path.join(self.dst, path))
+        self.assertTrue(same_inode("worlds/Bedrock level/db/000005.ldb"))
+        self.assertFalse(same_inode("worlds/Bedrock level/level.dat"))
+
+        # 複製したワールドへの書き込みが、テンプレートに影響しないことを確認する。
+        with open(os.path.join(self.dst, "worlds", "Bedrock level", "level.dat"), "wb") as f:
+            f.write(b"changed")
+        self.assertEqual(read_tree(self.src), template_files)
+
+    @unittest.skipIf(clone.fcntl is None, "fcntl is not available.")
+    def test_clone_tree_reflink(self) -> None:
+        def fake_ficlone(fd, request, arg):
+            self.assertEqual(request, clone.FICLONE)
+            os.write(fd, os.pread(arg, 1024 * 1024, 0))
+
+        with mock.patch("pymcbdsc.clone.fcntl.ioctl", side_effect=fake_ficlone):
+            counts = clone.McbdscWorldCloner().clone_tree(self.src, self.dst)
+        self.assertEqual(counts, {"reflink": 6, "hardlink": 0, "copy": 0})
+        self.assertEqual(read_tree(self.dst), template_files)
+
+    def test_clone_tree_copy(self) -> None:
+        counts = clone.McbdscWorldCloner(use_reflink=False, use_hardlink=False).clone_tree(self.src, self.dst)
+        self.assertEqual(counts, {"reflink": 0, "hardlink": 0, "copy": 6})
+        self.assertEqual(read_tree(self.dst), template_files)
+        # 複製先が既に存在する場合は失敗することを確認する。
+        with self.assertRaises(FileExistsError):
+            clone.McbdscWorldCloner().clone_tree(self.src, self.dst)
+
+
+class TestMcbdscDockerManagerCloneWorld(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        make_template(os.path.join(self.test_dir, "templates", "event"))
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        self.manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir,
+                                                    containers_param=[{"name": "a", "image": "bedrock:1.16"}])
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_clone_world(self) -> None:
+        manager = self.manager
+        manager.clone_world("event", "a")
+        manager.clone_world("event", "b")
+        dst = os.path.join(self.test_dir, "volumes", "b")
+        self.assertEqual(read_tree(dst), template_files)
+
+        client = self.mock_docker.from_env.return_value
+        client.volumes.create.assert_called_with(name="mcbdsc-b", driver="local",
+                                                 driver_opts={"type": "none", "o": "bind", "device": os.path.abspath(dst)},
+                                                 labels={"pymcbdsc": "true"})
+        # 既存のパラメータにはボリュームが追加され、新しいサーバのパラメータは追加されることを確認する。
+        self.assertEqual(manager._containers_param,
+                         [{"name": "a", "image": "bedrock:1.16",
+                           "volumes": {"mcbdsc-a": {"bind": "/volume", "mode": "rw"}}},
+                          {"name": "b", "image": "bedrock:latest",
+                           "volumes": {"mcbdsc-b": {"bind": "/volume", "mode": "rw"}}}])
+
+        with self.assertRaises(FileNotFoundError):
+            manager.clone_world("missing", "c")
+        with self.assertRaises(FileExistsError):
+            manager.clone_world("event", "b")
+
+    def test_add_and_remove_server(self) -> None:
+        manager = self.manager
+        client = self.mock_docker.from_env.return_value
+        client.containers.list.return_value = []
+        container = manager.add_server("event-01", "event")
+        self.assertEqual(container.name, "event-01")
+        container._container.start.assert_called_once_with()
+        dst = os.path.join(self.test_dir, "volumes", "event-01")
+        self.assertEqual(read_tree(dst), template_files)
+        # UDP ポートが割り当てられていることを確認する。
+        param = manager._containers_param[1]
+        self.assertEqual(param["name"], "event-01")
+        self.assertIn("SERVER_PORT", param["environment"])
+        self.assertEqual(list(manager.resource_allocator().allocations()), ["event-01"])
+
+        manager.remove_server("event-01")
+        container._container.stop.assert_called_once_with()
+        container._container.remove.assert_called_once_with()
+        client.volumes.get.assert_called_once_with("mcbdsc-event-01")
+        self.assertFalse(os.path.exists(dst))
+        self.assertEqual([p["name"] for p in manager._containers_param], ["a"])
+        self.assertEqual(manager.resource_allocator().allocations(), {})
+
+    def test_add_server_log_monitor(self) -> None:
+        # 追跡を開始した後に追加、削除したサーバが、ログの追跡にも反映されることを確認する。
+        manager = self.manager
+        self.mock_docker.from_env.return_value.containers.list.return_value = []
+        monitor = manager.log_monitor()
+        self.assertEqual(list(monitor.tailers), ["a"])
+        with mock.patch.object(monitor, "_start_tailer") as start_tailer:
+            monitor._started = True
+            manager.add_server("event-01", "event")
+            self.assertEqual(list(monitor.tailers), ["a", "event-01"])
+            start_tailer.assert_called_once_with(monitor.tailers["event-01"])
+        manager.remove_server("event-01")
+        self.assertEqual(list(monitor.tailers), ["a"])
+        # 作成し直すと、以前の McbdscLogMonitor からは切り離されることを確認する。
+        self.assertEqual(list(manager.log_monitor().tailers), ["a"])
+        self.assertEqual(monitor.tailers, {})
+
+    def test_add_server_metrics_collector(self) -> None:
+        # 収集を開始した後に追加、削除したサーバが、リソース使用状況の収集にも反映されることを確認する。
+        manager = self.manager
+        self.mock_docker.from_env.return_value.containers.list.return_value = []
+        collector = manager.metrics_collector()
+        self.assertEqual(list(collector.metrics()), ["a"])
+        manager.add_server("event-01", "event")
+        self.assertEqual(list(collector.metrics()), ["a", "event-01"])
+        manager.remove_server("event-01")
+        self.assertEqual(list(collector.metrics()), ["a"])
+
+    def test_add_and_remove_server_channels(self) -> None:
+        # 一覧を取得し直しても、開いているコマンドチャネルは同じコンテナのインスタンスに引き継がれ、
+        # 削除したサーバのチャネルは閉じられることを確認する。
+        manager = self.manager
+        client = self.mock_docker.from_env.return_value
+        created = []
+
+        def create(**kwargs):
+            container = mock.MagicMock(id="id-" + kwargs["name"])
+            container.name = kwargs["name"]
+            created.append(container)
+            return container
+
+        client.containers.create.side_effect = create
+        client.containers.list.side_effect = lambda all=False, filters=None: list(created)
+        with mock.patch("pymcbdsc.docker.McbdscCommandChannel", side_effect=lambda container: mock.MagicMock()):
+            channel = manager.factory_containers()[0].command_channel()
+            container = manager.add_server("event-01", "event")
+            self.assertIs(manager.factory_containers()[0].command_channel(), channel)
+            event_channel = container.command_channel()
+            manager.remove_server("event-01")
+            event_channel.close.assert_called_once_with()
+            self.assertIs(manager.factory_containers()[0].command_channel(), channel)
+            channel.close.assert_not_called()
+
+    def test_add_server_existing_world(self) -> None:
+        # ワールドが残っているサーバは、複製せずにそのワールドを利用することを確認する。
+        dst = os.path.join(self.test_dir, "volumes", "event-01")
+        os.makedirs(dst)
+        self.mock_docker.from_env.return_value.containers.list.return_value = []
+        self.manager.add_server("event-01", "event", allocate=False)
+        self.assertEqual(read_tree(dst), {})
+        self.assertEqual(self.manager._containers_param[1],
+                         {"name": "event-01", "image": "bedrock:latest", "labels": {"pymcbdsc": "true"},
+                          "volumes": {"mcbdsc-event-01": {"bind": "/volume", "mode": "rw"}},
+                          "stdin_open": True, "tty": True})
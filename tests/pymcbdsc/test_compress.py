@@ -0,0 +1,57 @@
+import unittest
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from pymcbdsc import backup
+from pymcbdsc.compress import McbdscParallelCompressor
+
+
+data = (os.urandom(1000) + b"\0" * 3000) * 100
+
+
+class TestMcbdscParallelCompressor(unittest.TestCase):
+
+    def _compress(self, compression: str, **opt) -> bytes:
+        out = io.BytesIO()
+        with McbdscParallelCompressor(out, compression=compression, block_size=10000, **opt) as f:
+            # ブロックの境界と一致しない長さで書き込む。
+            for i in range(0, len(data), 7777):
+                f.write(data[i:i + 7777])
+        return out.getvalue()
+
+    def test_gz(self) -> None:
+        act = self._compress("gz", workers=2)
+        self.assertEqual(gzip.decompress(act), data)
+        # ブロック毎に gzip メンバーが出力されていることを確認する。
+        self.assertEqual(act.count(b"\x1f\x8b\x08"), len(data) // 10000)
+
+    def test_xz(self) -> None:
+        self.assertEqual(lzma.decompress(self._compress("xz", workers=2, level=1)), data)
+
+    def test_bz2(self) -> None:
+        self.assertEqual(bz2.decompress(self._compress("bz2", workers=1)), data)
+
+    def test_executor(self) -> None:
+        # 指定した Executor は、 close() で shutdown されないことを確認する。
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            act = self._compress("gz", workers=3, executor=executor)
+            self.assertEqual(gzip.decompress(act), data)
+            self.assertEqual(executor.submit(len, b"abc").result(), 3)
+
+    def test_invalid_compression(self) -> None:
+        with self.assertRaises(ValueError):
+            McbdscParallelCompressor(io.BytesIO(), compression="zip")
+
+    def test_write_archive(self) -> None:
+        files = [backup.McbdscWorldFile(path="level{i}.dat".format(i=i), size=len(data), mtime=0,
+                                        fileobj=io.BytesIO(data)) for i in range(3)]
+        out = io.BytesIO()
+        backup.write_archive(files, out, compression="gz", workers=2)
+        # 並列に圧縮したアーカイブを、 tarfile でそのまま展開できることを確認する。
+        with tarfile.open(fileobj=io.BytesIO(out.getvalue()), mode="r:gz") as tar:
+            self.assertEqual(tar.getnames(), ["worlds/level0.dat", "worlds/level1.dat", "worlds/level2.dat"])
+            self.assertEqual(tar.extractfile("worlds/level2.dat").read(), data)
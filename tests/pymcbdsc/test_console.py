@@ -0,0 +1,170 @@
+import unittest
+from unittest import mock
+import socket
+import struct
+import threading
+import time
+import pymcbdsc
+from pymcbdsc.console import McbdscCommandChannel
+
+
+class DummyConsole(object):
+    """ attach ソケットの向こう側で、コマンドに応答する疑似 Bedrock Server のコンソール。 """
+
+    def __init__(self, tty: bool = True, echo: bool = True) -> None:
+        self.tty = tty
+        self.echo = echo
+        self.received = []
+        self.resume = threading.Event()
+        (self.client_sock, self.server_sock) = socket.socketpair()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def container(self):
+        container = mock.MagicMock()
+        container.name = "mcbdsc_test"
+        container.attrs = {"Config": {"Tty": self.tty}}
+        container.attach_socket.return_value = self.client_sock
+        return container
+
+    def write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        if not self.tty:
+            data = struct.pack(">BxxxL", 1, len(data)) + data
+        self.server_sock.sendall(data)
+
+    def _serve(self) -> None:
+        buf = b""
+        while True:
+            try:
+                data = self.server_sock.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                command = line.decode("utf-8")
+                self.received.append(command)
+                if self.echo:
+                    self.write(command + "\r\n")
+                if command == "list":
+                    self.write("There are 1/10 players online:\r\nSteve\r\n")
+                elif command.startswith("say "):
+                    self.write("[Server] {msg}\n".format(msg=command[4:]))
+                elif command == "wait":
+                    self.resume.wait(5)
+                    self.write("[Server] resumed\n")
+                elif command == "silent":
+                    pass
+
+    def close(self) -> None:
+        self.server_sock.close()
+
+
+class TestMcbdscCommandChannel(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.console = DummyConsole()
+        self.container = self.console.container()
+        self.channel = McbdscCommandChannel(self.container, idle=0.05)
+
+    def tearDown(self) -> None:
+        self.channel.close()
+        self.console.close()
+
+    def test_send_command(self) -> None:
+        # エコーバックされたコマンドは応答に含まれず、 expect に一致する行までが応答となることを確認する。
+        act = self.channel.send_command("list", expect=r"players online")
+        exp = ["There are 1/10 players online:"]
+        self.assertEqual(act, exp)
+
+        # expect を指定しない場合は、出力が途切れるまでが応答となることを確認する。
+        act = self.channel.send_command("say hello")
+        exp = ["[Server] hello"]
+        self.assertEqual(act, exp)
+
+        # attach ソケットは一度だけ開かれ、コマンドは改行付きで書き込まれていることを確認する。
+        self.assertEqual(self.container.attach_socket.call_count, 1)
+        self.assertEqual(self.console.received, ["list", "say hello"])
+
+    def test_timeout(self) -> None:
+        with self.assertRaises(pymcbdsc.exceptions.McbdscCommandTimeoutError):
+            self.channel.send_command("silent", timeout=0.2)
+        # タイムアウトの後も、後続のコマンドを送信できることを確認する。
+        act = self.channel.send_command("say again", timeout=1)
+        self.assertEqual(act, ["[Server] again"])
+
+    def test_expect_response(self) -> None:
+        act = self.channel.send_command("save hold", expect_response=False)
+        self.assertEqual(act, [])
+
+    def test_queued_commands(self) -> None:
+        # 多数のコマンドをキューに積んでも、それぞれの応答が対応付けられることを確認する。
+        futures = [self.channel.send("say {i}".format(i=i), expect=r"\[Server\]") for i in range(200)]
+        for (i, future) in enumerate(futures):
+            self.assertEqual(future.result(timeout=5), ["[Server] {i}".format(i=i)])
+
+    def test_pipelined_commands(self) -> None:
+        # expect を指定したコマンドは、応答を待たずに後続のコマンドが書き込まれることを確認する。
+        first = self.channel.send("wait", expect=r"resumed")
+        second = self.channel.send("list", expect=r"players online")
+        for _ in range(100):
+            if len(self.channel._inflight) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.channel._inflight), 2)
+        self.assertFalse(first.done())
+        # 応答は古いコマンドから順に対応付けられることを確認する。
+        self.console.resume.set()
+        self.assertEqual(first.result(timeout=2), ["[Server] resumed"])
+        self.assertEqual(second.result(timeout=2), ["There are 1/10 players online:"])
+
+    def test_serialized_without_expect(self) -> None:
+        # expect を指定しないコマンドの応答が完了するまで、後続のコマンドは書き込まれないことを確認する。
+        first = self.channel.send("say one")
+        second = self.channel.send("say two")
+        self.assertEqual(first.result(timeout=2), ["[Server] one"])
+        self.assertEqual(second.result(timeout=2), ["[Server] two"])
+
+    def test_listener(self) -> None:
+        lines = []
+        self.channel.add_listener(lines.append)
+        self.channel.send_command("list", expect=r"players online")
+        self.assertIn("There are 1/10 players online:", lines)
+
+    def test_closed(self) -> None:
+        self.channel.close()
+        with self.assertRaises(pymcbdsc.exceptions.McbdscCommandChannelClosedError):
+            self.channel.send("list")
+
+
+class TestMcbdscCommandChannelWithoutTty(unittest.TestCase):
+
+    def test_send_command(self) -> None:
+        # tty が無効なコンテナの多重化された出力ストリームを解析できることを確認する。
+        console = DummyConsole(tty=False, echo=False)
+        channel = McbdscCommandChannel(console.container(), idle=0.05)
+        try:
+            act = channel.send_command("list", expect=r"players online")
+            exp = ["There are 1/10 players online:"]
+            self.assertEqual(act, exp)
+        finally:
+            channel.close()
+            console.close()
+
+    def test_partial_attrs(self) -> None:
+        # Config を持たない Container インスタンスでも、取得し直して tty の有無を判定することを確認する。
+        console = DummyConsole(echo=False)
+        container = console.container()
+        container.attrs = {"Id": "id-test", "Name": "/mcbdsc_test"}
+        container.reload.side_effect = lambda: container.attrs.update(Config={"Tty": True})
+        channel = McbdscCommandChannel(container, idle=0.05)
+        try:
+            act = channel.send_command("list", expect=r"players online")
+            self.assertEqual(act, ["There are 1/10 players online:"])
+            container.reload.assert_called_once_with()
+        finally:
+            channel.close()
+            console.close()
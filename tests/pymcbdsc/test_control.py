@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+import json
+import os
+import shutil
+import socket
+import stat
+from argparse import Namespace
+import pymcbdsc
+from pymcbdsc import __main__ as cli
+from pymcbdsc.control import McbdscControlClient, McbdscControlServer, McbdscControlService, control_socket_path
+from pymcbdsc.exceptions import McbdscControlError, McbdscDaemonUnavailableError
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix domain sockets are not supported on this platform.")
+class TestMcbdscControl(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        self.socket_path = control_socket_path(self.test_dir)
+        self.factory = mock.Mock(side_effect=lambda: pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir))
+        self.downloader = pymcbdsc.McbdscDownloader(pymcbdsc_root_dir=self.test_dir)
+        self.service = McbdscControlService(self.factory, self.downloader)
+        self.server = McbdscControlServer(self.service, self.socket_path)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_call(self) -> None:
+        client = McbdscControlClient(self.socket_path, timeout=5.0)
+        with self.assertRaises(McbdscDaemonUnavailableError):
+            client.call("ping")
+        self.server.start()
+        # ソケットは所有者のみが読み書きできることを確認する。
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode) & 0o077, 0)
+
+        self.assertEqual(client.call("ping")["pid"], os.getpid())
+        self.assertEqual(client.call("list_backups"), [])
+        self.assertEqual(client.call("list_backups", name="a"), [])
+        # McbdscDockerManager は一度だけ作成され、リクエストの間で共有されることを確認する。
+        self.factory.assert_called_once_with()
+
+        with self.assertRaisesRegex(McbdscControlError, "Unknown method"):
+            client.call("unknown")
+        with self.assertRaisesRegex(McbdscControlError, "TypeError"):
+            client.call("list_backups", unknown=1)
+
+    def test_multiple_requests(self) -> None:
+        self.server.start()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        try:
+            sock.sendall(b'{"method": "ping"}\n\nnot json\n{"method": "list_backups", "params": {"name": "a"}}\n')
+            with sock.makefile("rb") as f:
+                responses = [json.loads(f.readline().decode()) for _ in range(3)]
+        finally:
+            sock.close()
+        self.assertIn("result", responses[0])
+        self.assertIn("error", responses[1])
+        self.assertEqual(responses[2], {"result": []})
+
+    def test_stale_socket(self) -> None:
+        # 終了したデーモンが残したソケットファイルは削除して待ち受けることを確認する。
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.socket_path)
+        stale.close()
+        self.server.start()
+        self.assertIn("pid", McbdscControlClient(self.socket_path).call("ping"))
+
+        # 既に他のデーモンが待ち受けていれば、起動しないことを確認する。
+        with self.assertRaises(RuntimeError):
+            McbdscControlServer(self.service, self.socket_path).start()
+
+        self.server.stop()
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_cli_call(self) -> None:
+        args = Namespace(root_dir=self.test_dir, no_daemon=False, profile=False, no_progress=True, docker_host=None)
+        with mock.patch('pymcbdsc.__main__.control_service') as mock_service:
+            # デーモンが起動していなければ、このプロセスで実行することを確認する。
+            mock_service.return_value.call.return_value = ["in-process"]
+            self.assertEqual(cli.call(args, self.downloader, "list_backups", name="a"), ["in-process"])
+            mock_service.return_value.call.assert_called_once_with("list_backups", {"name": "a"})
+
+            mock_service.reset_mock()
+            self.server.start()
+            self.assertEqual(cli.call(args, self.downloader, "list_backups", name="a"), [])
+            mock_service.assert_not_called()
+
+            args.no_daemon = True
+            self.assertEqual(cli.call(args, self.downloader, "list_backups"), ["in-process"])
+
+            # service を指定した場合は、そのインスタンスで実行することを確認する。
+            service = mock.Mock()
+            cli.call(args, self.downloader, "verify", service=service, workers=2)
+            service.call.assert_called_once_with("verify", {"workers": 2})
+
+    def test_build(self) -> None:
+        self.server.start()
+        client = McbdscControlClient(self.socket_path, timeout=5.0)
+        # ダウンロードされていないバージョンは、 Build せずにエラーとなることを確認する。
+        with mock.patch.object(pymcbdsc.McbdscDockerManager, "get_bds_versions_from_local_file", return_value=["1.16.0.2"]):
+            with self.assertRaisesRegex(McbdscControlError, "1.17.0.3"):
+                client.call("build", version="1.17.0.3")
+            with mock.patch.object(pymcbdsc.McbdscDockerManager, "build_image") as build_image, \
+                    mock.patch.object(pymcbdsc.McbdscDockerManager, "set_latest_tag_to_latest_image"), \
+                    mock.patch.object(pymcbdsc.McbdscDockerManager, "set_minor_tags"):
+                self.assertEqual(client.call("build", version="1.16.0.2"), {"version": "1.16.0.2"})
+                build_image.assert_called_once_with(version="1.16.0.2")
+
+    def test_metrics(self) -> None:
+        collector = mock.Mock()
+        collector.render_prometheus.return_value = "# metrics\n"
+        with mock.patch.object(pymcbdsc.McbdscDockerManager, "metrics_collector", return_value=collector):
+            self.server.start()
+            client = McbdscControlClient(self.socket_path, timeout=5.0)
+            # 収集は最初の呼び出しで一度だけ開始され、以降の呼び出しで共有されることを確認する。
+            self.assertEqual(client.call("metrics"), "# metrics\n")
+            self.assertEqual(client.call("metrics", port=9999), "# metrics\n")
+            client.call("metrics", port=9999)
+            collector.start.assert_called_once_with()
+            collector.serve.assert_called_once_with(port=9999)
+            self.service.close()
+            collector.stop.assert_called_once_with()
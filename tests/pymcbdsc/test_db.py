@@ -0,0 +1,233 @@
+import io
+import unittest
+from unittest import mock
+import os
+import shutil
+import time
+import pymcbdsc
+from pymcbdsc.db import McbdscStateDB
+from pymcbdsc.repository import McbdscBackupRepository
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher, create_empty_files
+
+
+def make_old(path: str, seconds: float = 60.0) -> None:
+    """ 走査した結果が記録されるように、ディレクトリの mtime を過去にする関数。 """
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def dummy_image(image_id: str, tags: list) -> mock.MagicMock:
+    image = mock.MagicMock()
+    image.id = image_id
+    image.tags = tags
+    return image
+
+
+def dummy_container(container_id: str, name: str) -> mock.MagicMock:
+    container = mock.MagicMock()
+    container.id = container_id
+    container.name = name
+    return container
+
+
+class TestMcbdscStateDB(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.db = McbdscStateDB(os.path.join(self.test_dir, "state.db"), ttl=60.0)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_zips(self) -> None:
+        self.db.add_zip("/d/bedrock-server-1.0.0.0.zip", "1.0.0.0", 10, 100, sha256="aa")
+        self.db.add_zip("/d/bedrock-server-1.1.0.0.zip", "1.1.0.0", 20, 200, sha256="bb")
+        # サイズと mtime が変わっていないファイルのハッシュ値は引き継ぎ、変わったファイルのハッシュ値は破棄する。
+        self.db.replace_zips("/d", [
+            {"path": "/d/bedrock-server-1.0.0.0.zip", "version": "1.0.0.0", "size": 10, "mtime_ns": 100},
+            {"path": "/d/bedrock-server-1.1.0.0.zip", "version": "1.1.0.0", "size": 21, "mtime_ns": 201}])
+        self.assertEqual({z["version"]: z["sha256"] for z in self.db.zips("/d")}, {"1.0.0.0": "aa", "1.1.0.0": None})
+        self.assertEqual(self.db.zip_versions("/other"), [])
+
+    def test_images_and_containers(self) -> None:
+        self.db.add_image_tag("bedrock", "bedrock:1.0.0.0", "sha256:1", fingerprint="f1")
+        self.assertFalse(self.db.is_synced("images:bedrock"))
+        self.db.replace_images("bedrock", {"sha256:1": ["bedrock:1.0.0.0", "bedrock:latest"], "sha256:2": ["bedrock:1.1.0.0"]})
+        self.assertTrue(self.db.is_synced("images:bedrock"))
+        self.assertEqual(self.db.image_tags("bedrock"), ["bedrock:1.0.0.0", "bedrock:1.1.0.0", "bedrock:latest"])
+        self.assertEqual(self.db.image("bedrock:1.0.0.0")["fingerprint"], "f1")
+        self.db.expire()
+        self.assertFalse(self.db.is_synced("images:bedrock"))
+
+        self.db.add_container("a", None, "id-a", spec_hash="h", ports={"19132/udp": 19132})
+        self.db.replace_containers(["a", "b", "c"], {"a": {"host": None, "container_id": "id-a"},
+                                                     "b": {"host": "h1", "container_id": "id-b"}})
+        self.assertEqual(self.db.containers(), {"a": {"host": None, "container_id": "id-a", "spec_hash": "h",
+                                                      "ports": {"19132/udp": 19132}},
+                                                "b": {"host": "h1", "container_id": "id-b", "spec_hash": None,
+                                                      "ports": None}})
+
+    def test_write_failure(self) -> None:
+        # 書き込みに失敗しても例外を raise せず、警告を出力することを確認する。
+        with self.assertLogs("pymcbdsc.db", level="WARNING"):
+            self.db.add_image_tag("bedrock", "bedrock:latest", object())
+        self.assertEqual(self.db.image_tags("bedrock"), [])
+
+    def test_dir_is_fresh(self) -> None:
+        d = os.path.join(self.test_dir, "d")
+        os.makedirs(d)
+        # mtime が新しすぎるディレクトリは記録しない。
+        self.db.mark_dir(d, os.stat(d))
+        self.assertFalse(self.db.dir_is_fresh(d))
+        make_old(d)
+        self.db.mark_dir(d, os.stat(d))
+        self.assertTrue(self.db.dir_is_fresh(d))
+        create_empty_files(d, ["a"])
+        self.assertFalse(self.db.dir_is_fresh(d))
+
+
+class TestMcbdscDockerManagerStateDB(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        self.client = self.mock_docker.from_env.return_value
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_get_bds_versions_from_local_file(self) -> None:
+        downloads_dir = os.path.join(self.test_dir, "downloads")
+        os.makedirs(downloads_dir)
+        create_empty_files(downloads_dir, ["bedrock-server-1.0.0.0.zip", "bedrock-server-1.10.0.0.zip", "other.zip"])
+        make_old(downloads_dir)
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir)
+        self.assertEqual(manager.get_bds_versions_from_local_file(), ["1.0.0.0", "1.10.0.0"])
+
+        # ディレクトリが変更されていなければ、別のインスタンスでも走査しないことを確認する。
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir)
+        with mock.patch('pymcbdsc.docker.listdir', side_effect=AssertionError("scanned")):
+            self.assertEqual(manager.get_bds_versions_from_local_file(reverse=True), ["1.10.0.0", "1.0.0.0"])
+
+        # ファイルが追加されると、走査し直すことを確認する。
+        create_empty_files(downloads_dir, ["bedrock-server-1.2.0.0.zip"])
+        self.assertEqual(manager.get_bds_latest_version_from_local_file(), "1.10.0.0")
+        self.assertIn("1.2.0.0", manager.get_bds_versions_from_local_file())
+
+    def test_list_image_tags(self) -> None:
+        self.client.images.list.return_value = [dummy_image("sha256:1", ["bedrock:1.16.201.02", "bedrock:latest"])]
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir)
+        self.assertEqual(manager.get_bds_versions_from_container_image(), ["1.16.201.02"])
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir)
+        self.assertEqual(sorted(manager.list_image_tags()), ["bedrock:1.16.201.02", "bedrock:latest"])
+        self.assertEqual(self.client.images.list.call_count, 1)
+
+        # タグの付与は、データベースにも書き込むことを確認する。
+        self.client.images.get.return_value = dummy_image("sha256:1", ["bedrock:1.16.201.02"])
+        manager.set_tag("1.16.201.02", "1.16")
+        self.assertIn("bedrock:1.16", manager.list_image_tags())
+
+    def test_build_image(self) -> None:
+        create_empty_files(self.test_dir, ["Dockerfile"])
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir)
+        self.mock_docker.utils.tar.side_effect = lambda *args, **kwargs: io.BytesIO(b"\0" * 1024)
+        self.client.api.build.side_effect = lambda **kwargs: iter([{"aux": {"ID": "sha256:1"}}])
+        self.client.images.get.return_value = dummy_image("sha256:1", ["bedrock:1.0.0.0"])
+        manager.build_image(version="1.0.0.0")
+        self.assertEqual(self.client.api.build.call_count, 1)
+
+        # フィンガープリントが一致し、イメージが存在すれば Build しないことを確認する。
+        (image, logs) = manager.build_image(version="1.0.0.0")
+        self.assertEqual((image.id, logs), ("sha256:1", []))
+        self.assertEqual(self.client.api.build.call_count, 1)
+
+        # Dockerfile が変更されれば、 Build し直すことを確認する。
+        with open(os.path.join(self.test_dir, "Dockerfile"), "w") as f:
+            f.write("FROM ubuntu:20.04\n")
+        manager.build_image(version="1.0.0.0")
+        self.assertEqual(self.client.api.build.call_count, 2)
+
+    def test_factory_containers(self) -> None:
+        self.client.containers.list.return_value = [dummy_container("id-a", "a")]
+        self.client.containers.create.return_value = dummy_container("id-b", "b")
+        params = [{"name": "a", "image": "bedrock:latest"},
+                  {"name": "b", "image": "bedrock:latest", "ports": {"19132/udp": 19134}}]
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, containers_param=params)
+        manager.factory_containers()
+        db = manager.state_db()
+        self.assertEqual(db.containers()["b"]["ports"], {"19132/udp": 19134})
+
+        # 全てのコンテナが記録されていれば、別のインスタンスでも一覧を取得しないことを確認する。
+        params = [{"name": "a", "image": "bedrock:latest"},
+                  {"name": "b", "image": "bedrock:1.16", "ports": {"19132/udp": 19134}}]
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, containers_param=params)
+        with self.assertLogs("pymcbdsc.docker", level="WARNING") as cm:
+            containers = manager.factory_containers()
+        self.assertEqual([c.name for c in containers], ["a", "b"])
+        self.assertEqual(self.client.containers.list.call_count, 1)
+        self.client.containers.prepare_model.assert_called_with({"Id": "id-b", "Name": "/b"})
+        # パラメータが変わったコンテナを警告することを確認する。
+        self.assertIn("The container b was created with different parameters.", cm.output[0])
+
+        manager.reset_containers()
+        manager.factory_containers()
+        self.assertEqual(self.client.containers.list.call_count, 2)
+
+    def test_without_state_db(self) -> None:
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, state_db_file=None)
+        self.assertIsNone(manager.state_db())
+        self.client.images.list.return_value = []
+        manager.list_image_tags()
+        manager.list_image_tags()
+        self.assertEqual(self.client.images.list.call_count, 2)
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "state.db")))
+
+
+class TestMcbdscBackupRepositoryStateDB(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.db = McbdscStateDB(os.path.join(self.test_dir, "state.db"))
+        self.repo = McbdscBackupRepository(os.path.join(self.test_dir, "repository"), db=self.db)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        shutil.rmtree(self.test_dir)
+
+    def add_snapshot(self, server: str, snapshot_id: str, timestamp: float) -> None:
+        snapshot = pymcbdsc.repository.McbdscSnapshot(server=server, snapshot_id=snapshot_id, timestamp=timestamp)
+        snapshot.add("level.dat", sha256="ab" * 32, size=10, mtime=1)
+        self.repo.save_snapshot(snapshot)
+
+    def test_list_snapshots(self) -> None:
+        self.add_snapshot("a", "2", 2.0)
+        self.add_snapshot("a", "1", 1.0)
+        self.add_snapshot("b", "1", 3.0)
+        self.assertEqual([(s.server, s.snapshot_id) for s in self.repo.list_snapshots()], [("a", "1"), ("a", "2"), ("b", "1")])
+        for server in ("a", "b"):
+            make_old(os.path.join(self.test_dir, "repository", "snapshots", server))
+        self.repo.list_snapshots()
+
+        # 変更されていないサーバのスナップショットは、 JSON ファイルを読み込まないことを確認する。
+        with mock.patch.object(self.repo, "load_snapshot", side_effect=AssertionError("loaded")):
+            snapshots = self.repo.list_snapshots(server="a")
+        self.assertEqual([s.snapshot_id for s in snapshots], ["1", "2"])
+        self.assertEqual(snapshots[0].files["level.dat"]["size"], 10)
+
+        self.repo.remove_snapshot("a", "1")
+        self.assertEqual([s.snapshot_id for s in self.repo.list_snapshots(server="a")], ["2"])
+
+        # 他のインスタンスが保存したスナップショットと、削除されたサーバを反映することを確認する。
+        other = McbdscBackupRepository(os.path.join(self.test_dir, "repository"))
+        snapshot = other.new_snapshot("a")
+        other.save_snapshot(snapshot)
+        shutil.rmtree(os.path.join(self.test_dir, "repository", "snapshots", "b"))
+        self.assertEqual([(s.server, s.snapshot_id) for s in self.repo.list_snapshots()],
+                         [("a", "2"), ("a", snapshot.snapshot_id)])
@@ -1,12 +1,15 @@
 from typing import List
+import io
 import unittest
 from unittest import mock
 import os
 import random
 import shutil
+from docker.errors import BuildError
 import pymcbdsc
 # os_name2test_root_dir: os.name で取得できる OS の名前と、各 OS でのテストケース実行時に利用するテスト用ディレクトリパスのペア。
 from .test_utils import os_name2test_root_dir
+from .test_raknet import DummyBedrockServer
 from . import stop_patcher, create_empty_files
 
 
@@ -28,7 +31,41 @@ class TestMcbdscDockerManager(unittest.TestCase):
         pass
 
     def test_build_image(self) -> None:
-        pass
+        events = []
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, state_db_file=None, progress=events.append)
+        client = self.mock_docker.from_env.return_value
+        self.mock_docker.utils.tar.side_effect = lambda *args, **kwargs: io.BytesIO(b"\0" * 1024)
+        output = [{"stream": "Step 1/2 : FROM ubuntu:20.04"}, {"stream": "\n"},
+                  {"status": "Downloading", "id": "abc", "progressDetail": {"current": 10, "total": 100}},
+                  {"stream": "Step 2/2 : COPY ./entrypoint.sh ./"}, {"aux": {"ID": "sha256:0123abcd"}},
+                  {"stream": "Successfully built 0123abcd\n"}]
+
+        def build(fileobj, **kwargs):
+            while fileobj.read(256):
+                pass
+            return iter(output)
+        client.api.build.side_effect = build
+        (image, logs) = manager.build_image(version="1.0.0.0")
+
+        # 出力をストリーミングで受け取り、 Build した Image を取得することを確認する。
+        self.assertTrue(client.api.build.call_args[1]["decode"])
+        client.images.get.assert_called_once_with("0123abcd")
+        self.assertEqual(list(logs), output)
+
+        # コンテキストのアップロード、ステップ及びレイヤーの進み具合が通知されることを確認する。
+        progress = [(e.phase, e.current, e.total, e.done) for e in events]
+        self.assertEqual(progress[0], ("build.context", 256, 1024, False))
+        self.assertIn(("build.context", 1024, 1024, True), progress)
+        self.assertIn(("build.layer", 10, 100, False), progress)
+        steps = [(e.current, e.message) for e in events if e.phase == "build.step" and not e.done]
+        self.assertEqual(steps, [(1, "FROM ubuntu:20.04"), (2, "COPY ./entrypoint.sh ./")])
+        self.assertEqual(progress[-1], ("build.step", 2, 2, True))
+
+        # Build に失敗した場合は BuildError を raise することを確認する。
+        self.mock_docker.errors.BuildError = BuildError
+        client.api.build.side_effect = lambda **kwargs: iter([{"error": "failed to build"}])
+        with self.assertRaises(BuildError):
+            manager.build_image(version="1.0.0.0")
 
     def test_get_image(self) -> None:
         pass
@@ -48,6 +85,62 @@ class TestMcbdscDockerManager(unittest.TestCase):
     def test_get_bds_versions_from_container_image(self) -> None:
         pass
 
+    def test_set_container_label(self) -> None:
+        Manager = pymcbdsc.McbdscDockerManager
+
+        # labels が指定されていない場合に、 dict で追加されることを確認する。
+        param = {"name": "a"}
+        Manager.set_container_label(param)
+        self.assertEqual(param["labels"], {"pymcbdsc": "true"})
+
+        # 既存の labels が保持されることを確認する。
+        param = {"name": "a", "labels": {"foo": "bar"}}
+        Manager.set_container_label(param)
+        self.assertEqual(param["labels"], {"foo": "bar", "pymcbdsc": "true"})
+
+        # list で指定されている場合に、重複して追加されないことを確認する。
+        param = {"name": "a", "labels": ["pymcbdsc"]}
+        Manager.set_container_label(param)
+        self.assertEqual(param["labels"], ["pymcbdsc"])
+
+    def test_server_address(self) -> None:
+        Manager = pymcbdsc.McbdscDockerManager
+
+        # ports が指定されていない場合は、デフォルトのポートとなることを確認する。
+        act = Manager.server_address({"name": "a"})
+        exp = ("127.0.0.1", 19132)
+        self.assertEqual(act, exp)
+
+        # ports の様々な指定方法で、ホスト側のポートが戻ることを確認する。
+        for ports in [{"19132/udp": 20000}, {"19132/udp": ("", 20000)}, {"19132/udp": [20000, 20001]}]:
+            act = Manager.server_address({"name": "a", "ports": ports})
+            exp = ("127.0.0.1", 20000)
+            self.assertEqual(act, exp)
+
+        # バインドするアドレスが指定されている場合は、そのアドレスとなることを確認する。
+        act = Manager.server_address({"name": "a", "ports": {"19132/udp": ("192.0.2.1", 20000)}})
+        exp = ("192.0.2.1", 20000)
+        self.assertEqual(act, exp)
+
+        # environment の SERVER_PORT が考慮されることを確認する。
+        act = Manager.server_address({"name": "a", "environment": ["SERVER_PORT=20010"],
+                                      "ports": {"20010/udp": 30000}})
+        exp = ("127.0.0.1", 30000)
+        self.assertEqual(act, exp)
+
+    def test_query_status(self) -> None:
+        server_id = "MCPE;Dedicated Server;422;1.16.201;1;10;1234;Bedrock level;Survival;1;19132;19133;"
+        with DummyBedrockServer(server_id) as s1, DummyBedrockServer(server_id, respond=False) as s2:
+            params = [{"name": "s1", "image": "bedrock:latest", "ports": {"19132/udp": s1.address[1]}},
+                      {"name": "s2", "image": "bedrock:latest", "ports": {"19132/udp": s2.address[1]}}]
+            manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, containers_param=params)
+            act = manager.query_status(timeout=0.3)
+            self.assertTrue(act["s1"].online)
+            self.assertEqual(act["s1"].players, 1)
+            self.assertFalse(act["s2"].online)
+            # 状態の問い合わせで Docker API を利用していないことを確認する。
+            self.assertFalse(self.mock_docker.from_env.return_value.containers.list.called)
+
     def _dummy_bds(self) -> List:
         return (["bedrock-server-1.0.0.0.zip",
                  "bedrock-server-1.1.1.1.zip",
@@ -3,6 +3,7 @@ import unittest
 from unittest import mock
 import os
 import shutil
+import threading
 import pymcbdsc
 # os_name2root_dir: os.name で取得できる OS の名前と、各 OS のデフォルトとなる pymbdsc_root_dir のデフォルト値のペア。
 # os_name2test_root_dir: os.name で取得できる OS の名前と、各 OS でのテストケース実行時に利用するテスト用ディレクトリパスのペア。
@@ -69,6 +70,9 @@ class TestMcbdscDownloader(unittest.TestCase):
         content = mock.PropertyMock()
         content.return_value = self.mocked_response_content
         type(response).content = content
+        # ダウンロードはストリーミングで読み込むので、 iter_content() もモックする。
+        response.iter_content.side_effect = lambda chunk_size: [self.mocked_response_content]
+        response.headers = {"Content-Length": str(len(self.mocked_response_content))}
 
     # 以下、テストメソッドの定義。
 
@@ -178,13 +182,37 @@ class TestMcbdscDownloader(unittest.TestCase):
         mcbdsc.download(url=testurl, filepath=testfile)
         # testurl を get しているか確認する。
         act = self.mock_requests.get.call_args
-        exp = unittest.mock.call(testurl)
+        exp = unittest.mock.call(testurl, stream=True)
         self.assertEqual(act, exp)
         # ファイルが意図したとおりの内容で保存されているか確認する。
         with open(testfile, 'rb') as f:
             act = f.read()
         exp = self.mocked_response_content
         self.assertEqual(act, exp)
+        self.assertFalse(os.path.exists(testfile + ".part"))
+
+    def test_download_progress(self) -> None:
+        mcbdsc = self.mcbdsc
+        response = self.response
+        response.headers = {"Content-Length": "30"}
+        response.iter_content.side_effect = lambda chunk_size: [b"x" * 10] * 3
+        events = []
+
+        testfile = os.path.join(self.test_dir, "download_test")
+        mcbdsc.download(url="https://example.com/dummy_file", filepath=testfile, progress=events.append)
+        # 最初のチャンクと、終了時に通知されることを確認する。
+        self.assertEqual([(e.phase, e.current, e.total, e.done) for e in events],
+                         [("download", 10, 30, False), ("download", 30, 30, True)])
+
+        # ダウンロードが中断された場合は、途中までのファイルが残らないことを確認する。
+        def broken_stream(chunk_size):
+            yield b"x" * 10
+            raise IOError("connection reset")
+        response.iter_content.side_effect = broken_stream
+        with self.assertRaises(IOError):
+            mcbdsc.download(url="https://example.com/dummy_file", filepath=testfile + "2")
+        self.assertFalse(os.path.exists(testfile + "2.part"))
+        self.assertFalse(os.path.exists(testfile + "2"))
 
     def _test_download_latest_version_zip_file(self, mcbdsc, params) -> None:
         os.makedirs(mcbdsc.download_dir(), exist_ok=True)
@@ -195,7 +223,7 @@ class TestMcbdscDownloader(unittest.TestCase):
         self.assertEqual(act_path, exp_path)
         # _set_dummy_url_response により戻されたダミーの URL に対して get しているか確認する。
         act = self.mock_requests.get.call_args
-        exp = unittest.mock.call(self.mocked_response_url)
+        exp = unittest.mock.call(self.mocked_response_url, stream=True)
         self.assertEqual(act, exp)
         # ファイルが意図したとおりの内容で保存されているか確認する。
         with open(act_path, 'rb') as f:
@@ -238,6 +266,46 @@ class TestMcbdscDownloader(unittest.TestCase):
         self._set_dummy_url_response()
         self._test_download_latest_version_zip_file(mcbdsc=mcbdsc, params={})
 
+    def test_download_latest_version_zip_file_without_state_db(self) -> None:
+        # state_db_file を None とした場合は、状態のデータベースを作成しないことを確認する。
+        mcbdsc = self.gen_downloader(agree_to_meula_and_pp=True, state_db_file=None)
+        self._set_dummy_file_response()
+        self._set_dummy_url_response()
+        self._test_download_latest_version_zip_file(mcbdsc=mcbdsc, params={})
+        self.assertIsNone(mcbdsc.state_db())
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "state.db")))
+
+    def test_download_latest_version_zip_file_coalesce(self) -> None:
+        mcbdsc = self.gen_downloader(agree_to_meula_and_pp=True)
+        self._set_dummy_file_response()
+        self._set_dummy_url_response()
+        os.makedirs(mcbdsc.download_dir(), exist_ok=True)
+        path = os.path.join(mcbdsc.download_dir(), self.mocked_response_bds_file)
+
+        # 他のプロセスが同じバージョンのダウンロード中(ロックを保持中)に、二つ目のダウンロードを開始する。
+        waiting = threading.Event()
+        errors = []
+
+        def download():
+            try:
+                mcbdsc.download_latest_version_zip_file()
+            except Exception as e:
+                errors.append(e)
+        with mock.patch("pymcbdsc.locks.logger.info", side_effect=lambda msg: waiting.set()):
+            with mcbdsc.locks().lock("zip", self.mocked_response_bds_ver):
+                thread = threading.Thread(target=download)
+                thread.start()
+                self.assertTrue(waiting.wait(5))
+                with open(path, "wb") as f:
+                    f.write(b"DOWNLOADED BY ANOTHER PROCESS")
+            thread.join(5)
+        self.assertEqual(errors, [])
+
+        # 二つ目のダウンロードは最初のダウンロードの完了を待ち、ファイルをダウンロードし直さないことを確認する。
+        self.assertNotIn(mock.call(self.mocked_response_url, stream=True), self.mock_requests.get.call_args_list)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"DOWNLOADED BY ANOTHER PROCESS")
+
     def test_download_latest_version_zip_file_if_needed(self) -> None:
         mcbdsc = self.mcbdsc
 
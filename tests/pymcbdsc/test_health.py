@@ -0,0 +1,159 @@
+import unittest
+from unittest import mock
+from pymcbdsc.exceptions import McbdscLockTimeoutError
+from pymcbdsc.health import McbdscHealthMonitor
+from pymcbdsc.raknet import McbdscServerStatus
+
+
+class DummyClock(object):
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestMcbdscHealthMonitor(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.container = mock.MagicMock()
+        self.container.name = "a"
+        self.set_state(running=True, started_at="t0")
+        self.online = True
+        manager = mock.MagicMock()
+        manager.factory_containers.return_value = [self.container]
+        manager.map_containers.side_effect = lambda func, containers: {c.name: func(c) for c in containers}
+        manager.query_status.side_effect = lambda **kwargs: {
+            "a": McbdscServerStatus(("127.0.0.1", 19132), online=self.online, latency=0.001 if self.online else None,
+                                    error=None if self.online else "timed out")}
+        self.manager = manager
+        self.clock = DummyClock(1000.0)
+        self.monitor = McbdscHealthMonitor(manager, failure_threshold=3, startup_timeout=60, backoff_base=10,
+                                           backoff_max=40, stable_seconds=100, flap_window=1000, flap_threshold=3,
+                                           clock=self.clock)
+
+    def set_state(self, running: bool, started_at: str, exit_code: int = 0, oom: bool = False) -> None:
+        self.container.state.return_value = {"Running": running, "Restarting": False, "StartedAt": started_at,
+                                             "ExitCode": exit_code, "OOMKilled": oom}
+
+    def check(self, seconds: float = 2.0) -> list:
+        self.clock.now += seconds
+        return self.monitor.check()
+
+    @property
+    def health(self):
+        return self.monitor.health()["a"]
+
+    def test_hung(self) -> None:
+        self.check()
+        self.assertEqual(self.health.state, "healthy")
+
+        # 応答しなくなっても、 failure_threshold 回続くまでは再起動しないことを確認する。
+        self.online = False
+        self.assertEqual(self.check(), [])
+        self.assertEqual(self.check(), [])
+        self.assertEqual(self.health.state, "healthy")
+        self.assertEqual(self.check(), ["a"])
+        self.assertEqual(self.health.state, "unhealthy")
+        self.container.restart.assert_called_once_with()
+
+        # 再起動しても応答しない場合は、間隔を空けて再起動することを確認する。
+        self.assertEqual(self.check(), [])
+        self.assertEqual(self.health.state, "unhealthy")
+        self.assertEqual(self.check(seconds=10), ["a"])
+        self.assertEqual(self.health.next_restart, self.clock.now + 20)
+
+        # 再起動によって起動時刻が変わると、最初の応答を待つことを確認する。
+        self.set_state(running=True, started_at="t1")
+        self.assertEqual(self.check(seconds=30), [])
+        self.assertEqual(self.health.state, "starting")
+        self.online = True
+        self.check()
+        self.assertEqual(self.health.state, "healthy")
+        self.assertEqual(self.health.restarts, 2)
+
+    def test_startup_timeout(self) -> None:
+        self.online = False
+        self.check()
+        self.assertEqual(self.health.state, "starting")
+        self.assertEqual(self.check(seconds=50), [])
+        # 起動してから startup_timeout 秒経っても応答しなければ、再起動することを確認する。
+        self.assertEqual(self.check(seconds=10), ["a"])
+
+    def test_crashed(self) -> None:
+        self.check()
+        # 意図した停止では再起動しないことを確認する。
+        self.set_state(running=False, started_at="t0", exit_code=143)
+        self.assertEqual(self.check(), [])
+        self.assertEqual(self.health.state, "stopped")
+
+        # 異常終了した場合は、すぐに再起動することを確認する。
+        self.set_state(running=True, started_at="t1")
+        self.check()
+        self.set_state(running=False, started_at="t1", exit_code=139)
+        self.assertEqual(self.check(), ["a"])
+        self.assertEqual(self.health.state, "crashed")
+        self.assertEqual(self.health.last_error, "exited with code 139")
+
+    def test_stopped_before_monitoring(self) -> None:
+        # 監視を始める前に停止したコンテナは、終了コードによらず再起動しないことを確認する。
+        self.set_state(running=False, started_at="t0", exit_code=1)
+        self.assertEqual(self.check(), [])
+        self.assertEqual(self.health.state, "stopped")
+
+    def test_flapping(self) -> None:
+        self.check()
+        for i in range(3):
+            self.set_state(running=False, started_at="t{i}".format(i=i), oom=True)
+            self.assertEqual(self.check(seconds=50), ["a"])
+            self.set_state(running=True, started_at="t{i}".format(i=i + 1))
+            self.check()
+        # flap_window 秒の間に flap_threshold 回再起動した後は、再起動しないことを確認する。
+        self.set_state(running=False, started_at="t3", oom=True)
+        self.assertEqual(self.check(seconds=50), [])
+        self.assertEqual(self.health.state, "flapping")
+        self.assertEqual(self.check(seconds=50), [])
+        self.assertEqual(self.health.state, "flapping")
+        # 応答するようになれば、 flapping は解除されることを確認する。
+        self.set_state(running=True, started_at="t4")
+        self.check()
+        self.assertEqual(self.health.state, "healthy")
+
+    def test_backoff_reset(self) -> None:
+        self.check()
+        self.set_state(running=False, started_at="t0", exit_code=1)
+        self.check()
+        self.assertEqual(self.health.attempts, 1)
+        self.set_state(running=True, started_at="t1")
+        self.check()
+        # stable_seconds 秒続けて応答すれば、再起動の間隔が元に戻ることを確認する。
+        self.check(seconds=100)
+        self.assertEqual(self.health.attempts, 0)
+        self.assertIsNone(self.health.next_restart)
+
+    def test_availability(self) -> None:
+        self.check()
+        self.check(seconds=30)
+        self.online = False
+        self.check(seconds=10)
+        self.assertAlmostEqual(self.health.availability, 0.75)
+        d = self.health.to_dict()
+        self.assertEqual((d["checks"], d["failures"], d["last_error"]), (3, 1, "timed out"))
+
+    def test_locked(self) -> None:
+        # 他の処理がコンテナのロックを保持している間は、再起動しないことを確認する。
+        self.manager.locks.return_value.lock.return_value.__enter__.side_effect = McbdscLockTimeoutError()
+        self.check()
+        self.set_state(running=False, started_at="t0", exit_code=1)
+        self.assertEqual(self.check(), [])
+        self.container.restart.assert_not_called()
+        self.manager.locks.return_value.lock.assert_called_with("container", "a", timeout=0)
+
+    def test_no_restart(self) -> None:
+        monitor = McbdscHealthMonitor(self.manager, restart=False, clock=self.clock)
+        monitor.check()
+        self.set_state(running=False, started_at="t0", exit_code=1)
+        self.assertEqual(monitor.check(), [])
+        self.assertEqual(monitor.health()["a"].state, "crashed")
+        self.container.restart.assert_not_called()
@@ -0,0 +1,161 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+import threading
+import time
+import pymcbdsc
+from pymcbdsc.exceptions import McbdscLockTimeoutError
+from pymcbdsc.locks import McbdscFileLock, McbdscLockManager
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+class TestMcbdscFileLock(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        self.path = os.path.join(self.test_dir, "locks", "zip", "1.0.0.0.lock")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir)
+
+    def test_exclusive(self) -> None:
+        lock = McbdscFileLock(self.path)
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.locked)
+        self.assertTrue(os.path.exists(self.path))
+        # 同じプロセスであっても、別のインスタンスでは取得できないことを確認する。
+        self.assertFalse(McbdscFileLock(self.path).acquire(timeout=0))
+        self.assertFalse(McbdscFileLock(self.path, shared=True).acquire(timeout=0.1))
+        with self.assertRaises(RuntimeError):
+            lock.acquire()
+        lock.release()
+        self.assertFalse(lock.locked)
+        other = McbdscFileLock(self.path)
+        self.assertTrue(other.acquire(timeout=0))
+        self.assertFalse(other.waited)
+        other.release()
+
+    @unittest.skipIf(os.name == "nt", "Shared locks are exclusive on Windows.")
+    def test_shared(self) -> None:
+        with McbdscFileLock(self.path, shared=True):
+            with McbdscFileLock(self.path, shared=True, timeout=0):
+                pass
+            with self.assertRaises(McbdscLockTimeoutError):
+                with McbdscFileLock(self.path, timeout=0.1):
+                    pass
+
+    def test_wait(self) -> None:
+        lock = McbdscFileLock(self.path)
+        lock.acquire()
+        # 別のスレッドで待っているロックが、解放後に取得されることを確認する。
+        other = McbdscFileLock(self.path)
+        thread = threading.Thread(target=other.acquire)
+        thread.start()
+        time.sleep(0.1)
+        self.assertFalse(other.locked)
+        lock.release()
+        thread.join(5)
+        self.assertTrue(other.locked)
+        self.assertTrue(other.waited)
+        other.release()
+
+    def test_timeout(self) -> None:
+        with McbdscFileLock(self.path):
+            with self.assertRaises(McbdscLockTimeoutError):
+                with McbdscFileLock(self.path, timeout=0.1):
+                    pass
+
+
+class TestMcbdscLockManager(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.locks = McbdscLockManager(os.path.join(self.test_dir, "locks"), timeout=0.1)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir)
+
+    def test_lock_path(self) -> None:
+        act = self.locks.lock_path("image", "bedrock:1.16")
+        exp = os.path.join(self.test_dir, "locks", "image", "bedrock%3A1.16.lock")
+        self.assertEqual(act, exp)
+        # 名前にパスの区切り文字が含まれていても、ディレクトリの外を指さないことを確認する。
+        self.assertEqual(os.path.dirname(self.locks.lock_path("container", "../x")),
+                         os.path.join(self.test_dir, "locks", "container"))
+
+    def test_lock(self) -> None:
+        # 種類又は名前が異なるリソースのロックは、互いに待たないことを確認する。
+        with self.locks.lock("image", "bedrock:1.16"):
+            with self.locks.lock("image", "bedrock:1.17"), self.locks.lock("container", "bedrock:1.16"):
+                pass
+            with self.assertRaises(McbdscLockTimeoutError):
+                with self.locks.lock("image", "bedrock:1.16"):
+                    pass
+
+
+class TestMcbdscDockerManagerLocks(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        self.client = self.mock_docker.from_env.return_value
+        self.manager = pymcbdsc.McbdscDockerManager(containers_param=[{"name": "mcbdsc_a"}, {"name": "mcbdsc_b"}],
+                                                    pymcbdsc_root_dir=self.test_dir, state_db_file=None)
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_set_tag(self) -> None:
+        # 他のプロセスが同じタグを操作している間は、タグを付与しないことを確認する。
+        with self.manager.locks().lock("image", "bedrock:1.16"):
+            thread = threading.Thread(target=self.manager.set_tag, kwargs={"version": "1.16.0.1", "tag": "1.16"})
+            thread.start()
+            time.sleep(0.1)
+            self.client.images.get.return_value.tag.assert_not_called()
+            # 別のタグは待たずに付与できることを確認する。
+            self.manager.set_tag(version="1.17.0.1", tag="1.17")
+            self.client.images.get.return_value.tag.assert_called_once_with(repository="bedrock", tag="1.17")
+        thread.join(5)
+        self.assertEqual(self.client.images.get.return_value.tag.call_count, 2)
+
+    def test_start_containers(self) -> None:
+        self.client.containers.list.return_value = []
+        self.client.containers.create.side_effect = lambda **kwargs: mock.MagicMock()
+        containers = self.manager.factory_containers()
+        started = []
+        for c in containers:
+            c._container.start.side_effect = lambda name=c.name: started.append(name)
+        # ロックされているコンテナのみが、ロックの解放まで起動を待つことを確認する。
+        with self.manager.locks().lock("container", "mcbdsc_a"):
+            thread = threading.Thread(target=self.manager.start_containers)
+            thread.start()
+            time.sleep(0.1)
+            self.assertEqual(started, ["mcbdsc_b"])
+        thread.join(5)
+        self.assertEqual(sorted(started), ["mcbdsc_a", "mcbdsc_b"])
+
+    def test_factory_containers(self) -> None:
+        # ロックを待つ間に他のプロセスが作成したコンテナは、作成し直さないことを確認する。
+        self.client.containers.list.return_value = []
+        created = mock.MagicMock()
+        created.name = "mcbdsc_a"
+
+        def create_by_other():
+            time.sleep(0.1)
+            self.client.containers.list.return_value = [created]
+
+        manager = pymcbdsc.McbdscDockerManager(containers_param=[{"name": "mcbdsc_a"}],
+                                               pymcbdsc_root_dir=self.test_dir, state_db_file=None)
+        with manager.locks().lock("container", "mcbdsc_a"):
+            thread = threading.Thread(target=manager.factory_containers)
+            thread.start()
+            create_by_other()
+        thread.join(5)
+        self.client.containers.create.assert_not_called()
+        self.assertIs(manager.factory_containers()[0]._container, created)
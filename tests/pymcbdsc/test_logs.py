@@ -0,0 +1,203 @@
+import unittest
+from unittest import mock
+import os
+import tempfile
+import threading
+import time
+from pymcbdsc import logs
+from pymcbdsc.db import McbdscStateDB
+
+
+log_lines = ["2021-01-31T12:00:00.1Z [2021-01-31 12:00:00:100 INFO] Starting Server",
+             "2021-01-31T12:00:01.2Z [2021-01-31 12:00:01:200 INFO] Server started.",
+             "2021-01-31T12:00:02.3Z [2021-01-31 12:00:02:300 INFO] Player connected: Steve, xuid: 1234",
+             "2021-01-31T12:00:02.3Z [2021-01-31 12:00:02:300 INFO] Player connected: Alex, xuid: 5678",
+             "2021-01-31T12:00:03.4Z [2021-01-31 12:00:03:400 ERROR] Something went wrong",
+             "2021-01-31T12:00:04.5Z [2021-01-31 12:00:04:500 INFO] Player disconnected: Steve, xuid: 1234"]
+
+
+class TestParse(unittest.TestCase):
+
+    def test_parse_line(self) -> None:
+        act = logs.parse_line("[2021-01-31 12:00:02:300 INFO] Player connected: Steve, xuid: 1234", container="c")
+        self.assertEqual((act.kind, act.player, act.xuid, act.container, act.level),
+                         (logs.EVENT_PLAYER_CONNECTED, "Steve", "1234", "c", "INFO"))
+
+        act = logs.parse_line("[2021-01-31 12:00:02 INFO] Player disconnected: Steve Jobs, xuid: 1234")
+        self.assertEqual((act.kind, act.player), (logs.EVENT_PLAYER_DISCONNECTED, "Steve Jobs"))
+
+        act = logs.parse_line("[2021-01-31 12:00:02:300 INFO] Server started.")
+        self.assertEqual(act.kind, logs.EVENT_SERVER_STARTED)
+
+        act = logs.parse_line("[2021-01-31 12:00:02:300 INFO] Data saved. Files are now ready to be copied.")
+        self.assertEqual(act.kind, logs.EVENT_SAVE_READY)
+
+        act = logs.parse_line("[2021-01-31 12:00:02:300 ERROR] Something went wrong")
+        self.assertEqual((act.kind, act.message), (logs.EVENT_ERROR, "Something went wrong"))
+
+        # イベントとして扱わない行は None となることを確認する。
+        self.assertIsNone(logs.parse_line("[2021-01-31 12:00:02:300 INFO] Level Name: Bedrock level"))
+        self.assertIsNone(logs.parse_line("NO LOG DATA"))
+
+    def test_parse_docker_timestamp(self) -> None:
+        self.assertEqual(logs.parse_docker_timestamp("1970-01-01T00:00:01Z"), 1)
+        self.assertAlmostEqual(logs.parse_docker_timestamp("1970-01-01T00:00:01.000000001Z"), 1.000000001)
+        with self.assertRaises(ValueError):
+            logs.parse_docker_timestamp("1970-01-01 00:00:01")
+
+
+class TestMcbdscLogTailer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.container = mock.MagicMock()
+        self.container.name = "mcbdsc_test"
+
+    def _set_logs(self, lines) -> None:
+        self.container.logs.return_value = ("\n".join(lines) + "\n").encode("utf-8")
+
+    def test_poll(self) -> None:
+        tailer = logs.McbdscLogTailer(self.container, max_events=3)
+
+        self._set_logs(log_lines[0:3])
+        act = [e.kind for e in tailer.poll()]
+        exp = [logs.EVENT_SERVER_STARTED, logs.EVENT_PLAYER_CONNECTED]
+        self.assertEqual(act, exp)
+        self.assertEqual(tailer.offset, ("2021-01-31T12:00:02.3Z", 1))
+        # 最初は since を指定せずに読み込むことを確認する。
+        self.assertIsNone(self.container.logs.call_args[1]["since"])
+
+        # 前回の位置を含んで Docker から戻された場合でも、読み込み済みの行は無視されることを確認する。
+        self._set_logs(log_lines[2:])
+        act = [(e.kind, e.player) for e in tailer.poll()]
+        exp = [(logs.EVENT_PLAYER_CONNECTED, "Alex"), (logs.EVENT_ERROR, None),
+               (logs.EVENT_PLAYER_DISCONNECTED, "Steve")]
+        self.assertEqual(act, exp)
+        self.assertEqual(self.container.logs.call_args[1]["since"], logs.parse_docker_timestamp("2021-01-31T12:00:02.3Z"))
+
+        # 保持するイベントの数が max_events を超えないことを確認する。
+        self.assertEqual(len(tailer.events), 3)
+        self.assertEqual(tailer.events[-1].kind, logs.EVENT_PLAYER_DISCONNECTED)
+
+        # 新しいログがなければ、イベントは追加されないことを確認する。
+        self._set_logs(log_lines[-1:])
+        self.assertEqual(tailer.poll(), [])
+
+    def test_offset(self) -> None:
+        # 前回の位置から再開できることを確認する。
+        tailer = logs.McbdscLogTailer(self.container, offset=("2021-01-31T12:00:02.300Z", 1))
+        self._set_logs(log_lines[2:4])
+        act = [e.player for e in tailer.poll()]
+        exp = ["Alex"]
+        self.assertEqual(act, exp)
+        self.assertEqual(tailer.offset, ("2021-01-31T12:00:02.300Z", 2))
+
+    def test_offset_db(self) -> None:
+        # 読み込んだ位置がデータベースに保存され、次のインスタンスがその位置から再開することを確認する。
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        db = McbdscStateDB(os.path.join(tmp.name, "state.db"))
+        self.addCleanup(db.close)
+        tailer = logs.McbdscLogTailer(self.container, db=db, save_interval=60)
+        self._set_logs(log_lines[0:3])
+        tailer.poll()
+        self.assertEqual(db.log_offset("mcbdsc_test"), ("2021-01-31T12:00:02.3Z", 1))
+        # save_interval 秒以内は保存しないことを確認する。
+        self._set_logs(log_lines[2:4])
+        tailer.poll()
+        self.assertEqual(db.log_offset("mcbdsc_test"), ("2021-01-31T12:00:02.3Z", 1))
+        tailer.save_offset()
+        self.assertEqual(db.log_offset("mcbdsc_test"), tailer.offset)
+
+        restarted = logs.McbdscLogTailer(self.container, db=db)
+        self._set_logs(log_lines)
+        self.assertEqual([(e.kind, e.player) for e in restarted.poll()],
+                         [(logs.EVENT_ERROR, None), (logs.EVENT_PLAYER_DISCONNECTED, "Steve")])
+
+    def test_listener(self) -> None:
+        tailer = logs.McbdscLogTailer(self.container)
+        events = []
+        tailer.add_listener(events.append)
+        tailer.feed(log_lines)
+        self.assertEqual(len(events), 5)
+
+    def test_follow(self) -> None:
+        tailer = logs.McbdscLogTailer(self.container)
+        # 行の途中で分割されたチャンクでも解析できることを確認する。
+        data = ("\n".join(log_lines) + "\n").encode("utf-8")
+        self.container.logs.return_value = iter([data[:50], data[50:120], data[120:]])
+        tailer.follow()
+        self.assertEqual(len(tailer.events), 5)
+        self.assertTrue(self.container.logs.call_args[1]["follow"])
+
+
+class TestMcbdscLogMonitor(unittest.TestCase):
+
+    def test_monitor(self) -> None:
+        tailers = []
+        for i in range(20):
+            container = mock.MagicMock()
+            container.name = "mcbdsc_{i}".format(i=i)
+            container.logs.return_value = iter([("\n".join(log_lines) + "\n").encode("utf-8")])
+            tailers.append(logs.McbdscLogTailer(container))
+        monitor = logs.McbdscLogMonitor(tailers, retry_interval=10)
+        received = []
+        lock = threading.Lock()
+
+        def listener(event):
+            with lock:
+                received.append(event)
+
+        monitor.add_listener(listener)
+        monitor.start()
+        for _ in range(100):
+            if len(received) == 100:
+                break
+            time.sleep(0.01)
+        monitor.stop()
+        self.assertEqual(len(received), 100)
+        self.assertEqual(len(monitor.events()), 100)
+
+    def test_add_and_remove_tailer(self) -> None:
+        def make_tailer(name):
+            container = mock.MagicMock()
+            container.name = name
+            container.logs.return_value = iter([("\n".join(log_lines) + "\n").encode("utf-8")])
+            return logs.McbdscLogTailer(container)
+
+        monitor = logs.McbdscLogMonitor([make_tailer("mcbdsc_0")], retry_interval=10)
+        received = []
+        monitor.add_listener(received.append)
+        monitor.start()
+        # 追跡を開始した後に追加したコンテナのイベントも、登録済みのリスナーが受け取ることを確認する。
+        monitor.add_tailer(make_tailer("mcbdsc_1"))
+        for _ in range(100):
+            if len(received) == 10:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(received), 10)
+        self.assertEqual({e.container for e in received}, {"mcbdsc_0", "mcbdsc_1"})
+
+        # 除いたコンテナの追跡のスレッドが終了することを確認する。
+        monitor.remove_tailer("mcbdsc_1")
+        self.assertEqual(list(monitor.tailers), ["mcbdsc_0"])
+        for _ in range(100):
+            if "mcbdsc-logs-mcbdsc_1" not in [t.name for t in threading.enumerate()]:
+                break
+            time.sleep(0.01)
+        self.assertNotIn("mcbdsc-logs-mcbdsc_1", [t.name for t in threading.enumerate()])
+        self.assertEqual(len(monitor.events()), 5)
+        monitor.stop()
+
+    def test_add_same_tailer(self) -> None:
+        # 同じ tailer を除いてから追加し直しても、イベントは一度だけ届くことを確認する。
+        container = mock.MagicMock()
+        container.name = "mcbdsc_0"
+        tailer = logs.McbdscLogTailer(container)
+        monitor = logs.McbdscLogMonitor([tailer])
+        received = []
+        monitor.add_listener(received.append)
+        monitor.remove_tailer("mcbdsc_0")
+        monitor.add_tailer(tailer)
+        monitor.add_tailer(tailer)
+        tailer.feed(log_lines)
+        self.assertEqual(len(received), 5)
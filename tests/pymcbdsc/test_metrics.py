@@ -0,0 +1,155 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+import time
+from urllib.request import urlopen
+from pymcbdsc import metrics
+from .test_utils import os_name2test_root_dir
+
+
+def dummy_stats(cpu: int, system: int, rx: int, tx: int, read: int, write: int,
+                pre_cpu: int = 0, pre_system: int = 0) -> dict:
+    """ stats API の出力を模した dict を戻す関数。 """
+    return {"cpu_stats": {"cpu_usage": {"total_usage": cpu}, "system_cpu_usage": system, "online_cpus": 4},
+            "precpu_stats": {"cpu_usage": {"total_usage": pre_cpu}, "system_cpu_usage": pre_system},
+            "memory_stats": {"usage": 300, "limit": 1000, "stats": {"inactive_file": 100}},
+            "networks": {"eth0": {"rx_bytes": rx, "tx_bytes": tx}, "eth1": {"rx_bytes": rx, "tx_bytes": tx}},
+            "blkio_stats": {"io_service_bytes_recursive": [{"op": "Read", "value": read},
+                                                           {"op": "Write", "value": write}]}}
+
+
+class TestMcbdscRingBuffer(unittest.TestCase):
+
+    def test_append(self) -> None:
+        buf = metrics.McbdscRingBuffer(capacity=4, fields=("a", "b"))
+        self.assertEqual(len(buf), 0)
+        self.assertIsNone(buf.latest())
+
+        for i in range(3):
+            buf.append({"a": i, "b": i * 10})
+        self.assertEqual(len(buf), 3)
+        self.assertEqual([s["a"] for s in buf.samples()], [0, 1, 2])
+
+        # 容量を超えた場合に、古いサンプルから上書きされることを確認する。
+        for i in range(3, 10):
+            buf.append({"a": i, "b": i * 10})
+        self.assertEqual(len(buf), 4)
+        self.assertEqual([s["a"] for s in buf.samples()], [6, 7, 8, 9])
+        self.assertEqual(buf.latest(), {"a": 9, "b": 90})
+
+    def test_downsample(self) -> None:
+        buf = metrics.McbdscRingBuffer(capacity=2, fields=("a",), downsample=3)
+        for i in range(8):
+            buf.append({"a": i})
+        # (0, 1, 2), (3, 4, 5) の平均のみが保持され、 6, 7 は集計中となることを確認する。
+        self.assertEqual([s["a"] for s in buf.samples()], [1, 4])
+
+
+class TestMcbdscContainerMetrics(unittest.TestCase):
+
+    def test_update(self) -> None:
+        m = metrics.McbdscContainerMetrics(name="test", capacity=10, history_capacity=10, downsample=2)
+
+        # 最初の出力では差分が求まらないので、サンプルは追加されないことを確認する。
+        act = m.update(dummy_stats(cpu=100, system=1000, rx=10, tx=20, read=30, write=40), timestamp=1)
+        self.assertIsNone(act)
+
+        act = m.update(dummy_stats(cpu=200, system=2000, rx=15, tx=30, read=60, write=80,
+                                   pre_cpu=100, pre_system=1000), timestamp=2)
+        self.assertEqual(act["timestamp"], 2)
+        # (200 - 100) / (2000 - 1000) * 4 CPU * 100
+        self.assertAlmostEqual(act["cpu_percent"], 40.0)
+        # usage からページキャッシュを除いた値となることを確認する。
+        self.assertEqual(act["memory_usage"], 200)
+        self.assertEqual(act["memory_limit"], 1000)
+        # 全インタフェースの合計の差分となることを確認する。
+        self.assertEqual(act["network_rx"], 10)
+        self.assertEqual(act["network_tx"], 20)
+        self.assertEqual(act["blkio_read"], 30)
+        self.assertEqual(act["blkio_write"], 40)
+        self.assertEqual(m.totals, {"network_rx": 30, "network_tx": 60, "blkio_read": 60, "blkio_write": 80})
+        self.assertEqual(len(m.recent), 1)
+        self.assertEqual(len(m.history), 0)
+
+        # カウンタがリセットされた場合に、差分が負にならないことを確認する。
+        act = m.update(dummy_stats(cpu=0, system=0, rx=0, tx=0, read=0, write=0), timestamp=3)
+        self.assertEqual(act["network_rx"], 0)
+        self.assertEqual(act["cpu_percent"], 0)
+        self.assertEqual(len(m.history), 1)
+
+
+class TestMcbdscMetricsCollector(unittest.TestCase):
+
+    def setUp(self) -> None:
+        test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(test_dir, exist_ok=True)
+        self.test_dir = test_dir
+        container = mock.MagicMock()
+        container.name = "mcbdsc_test"
+        samples = [dummy_stats(cpu=100, system=1000, rx=10, tx=20, read=30, write=40),
+                   dummy_stats(cpu=200, system=2000, rx=15, tx=30, read=60, write=80, pre_cpu=100, pre_system=1000)]
+        container.stats.side_effect = lambda **kwargs: iter(samples)
+        self.container = container
+        self.collector = metrics.McbdscMetricsCollector(containers=[container])
+
+    def tearDown(self) -> None:
+        self.collector.stop()
+        shutil.rmtree(self.test_dir)
+
+    def _wait_for_samples(self) -> None:
+        m = self.collector.metrics()["mcbdsc_test"]
+        for _ in range(100):
+            if len(m.recent):
+                return
+            time.sleep(0.01)
+        self.fail("No samples were collected.")
+
+    def test_collect(self) -> None:
+        self.collector.start()
+        self._wait_for_samples()
+        self.container.stats.assert_called_with(stream=True, decode=True)
+
+        text = self.collector.render_prometheus()
+        self.assertIn('mcbdsc_container_cpu_percent{name="mcbdsc_test"} 40.0', text)
+        self.assertIn('mcbdsc_container_memory_usage_bytes{name="mcbdsc_test"} 200.0', text)
+        self.assertIn('mcbdsc_container_network_receive_bytes_total{name="mcbdsc_test"} 30', text)
+        self.assertIn("# TYPE mcbdsc_container_blkio_write_bytes_total counter", text)
+
+        # textfile として出力できることを確認する。
+        path = os.path.join(self.test_dir, "mcbdsc.prom")
+        self.collector.write_textfile(path)
+        with open(path) as f:
+            self.assertEqual(f.read(), text)
+
+        # HTTP で取得できることを確認する。
+        server = self.collector.serve(port=0, host="127.0.0.1")
+        try:
+            with urlopen("http://127.0.0.1:{port}/metrics".format(port=server.server_address[1])) as res:
+                self.assertEqual(res.read().decode("utf-8"), text)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_add_and_remove_container(self) -> None:
+        # 収集を開始した後に追加したコンテナも収集し、除いたコンテナは出力されないことを確認する。
+        self.collector.start()
+        other = mock.MagicMock()
+        other.name = "mcbdsc_other"
+        other.stats.side_effect = self.container.stats.side_effect
+        self.collector.add_container(other)
+        m = self.collector.metrics()["mcbdsc_other"]
+        for _ in range(100):
+            if len(m.recent):
+                break
+            time.sleep(0.01)
+        self.assertIn('mcbdsc_container_cpu_percent{name="mcbdsc_other"} 40.0', self.collector.render_prometheus())
+
+        self.collector.remove_container("mcbdsc_other")
+        self.assertEqual(list(self.collector.metrics()), ["mcbdsc_test"])
+        self.assertNotIn("mcbdsc_other", self.collector.render_prometheus())
+
+    def test_render_prometheus_without_samples(self) -> None:
+        # サンプルがないコンテナは出力されないことを確認する。
+        text = self.collector.render_prometheus()
+        self.assertNotIn("mcbdsc_test", text)
@@ -0,0 +1,226 @@
+import unittest
+from unittest import mock
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+import pymcbdsc
+from pymcbdsc.pool import McbdscDockerClientPool, McbdscHostHeadroom
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+api_version = "1.41"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeDockerApi(object):
+    """ Docker Engine API の一部(info, コンテナの一覧・詳細・作成・起動・停止・stats)を模擬する HTTP サーバ。
+
+    全ての応答を `delay` 秒遅らせることで、応答の遅いホストを模擬します。
+    """
+
+    def __init__(self, ncpu: int = 4, memory: int = 8 * 1024 ** 3, delay: float = 0.0) -> None:
+        self.ncpu = ncpu
+        self.memory = memory
+        self.delay = delay
+        self.containers = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _reply(self, status: int, body=None) -> None:
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                fake.handle(self, "GET")
+
+            def do_POST(self) -> None:
+                fake.handle(self, "POST")
+
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "tcp://127.0.0.1:{port}".format(port=self.server.server_address[1])
+
+    def add_container(self, name: str, running: bool = True, cpus: float = 0.0, memory: int = 0, ports=()) -> str:
+        cid = "{:064x}".format(len(self.containers) + 1)
+        self.containers[cid] = {"name": name, "running": running, "cpus": cpus, "memory": memory, "ports": list(ports)}
+        return cid
+
+    def _summary(self, cid: str) -> dict:
+        c = self.containers[cid]
+        return {"Id": cid, "Names": ["/" + c["name"]], "State": "running" if c["running"] else "exited",
+                "Ports": [{"PrivatePort": p, "PublicPort": p, "Type": "udp"} for p in c["ports"]]}
+
+    def _inspect(self, cid: str) -> dict:
+        c = self.containers[cid]
+        return {"Id": cid, "Name": "/" + c["name"], "State": {"Status": "running" if c["running"] else "exited"},
+                "Config": {}, "Mounts": []}
+
+    def _stats(self, cid: str) -> dict:
+        c = self.containers[cid]
+        # 1 秒あたりのシステム全体の CPU 時間に対して、 `cpus` 個分の CPU 時間を使用したことにする。
+        system = 1000000000 * self.ncpu
+        return {"cpu_stats": {"cpu_usage": {"total_usage": int(2 * c["cpus"] * 1e9)},
+                              "system_cpu_usage": 2 * system, "online_cpus": self.ncpu},
+                "precpu_stats": {"cpu_usage": {"total_usage": int(c["cpus"] * 1e9)}, "system_cpu_usage": system},
+                "memory_stats": {"usage": c["memory"], "limit": self.memory, "stats": {}}}
+
+    def handle(self, handler, method: str) -> None:
+        time.sleep(self.delay)
+        url = urlparse(handler.path)
+        path = url.path.split("/")[2:] if url.path.startswith("/v") else url.path.split("/")[1:]
+        query = parse_qs(url.query)
+        with self._lock:
+            self.requests.append((method, "/".join(path)))
+            if method == "GET" and path == ["info"]:
+                return handler._reply(200, {"NCPU": self.ncpu, "MemTotal": self.memory})
+            if method == "GET" and path == ["containers", "json"]:
+                show_all = query.get("all", ["0"])[0] in ("1", "true", "True")
+                return handler._reply(200, [self._summary(cid) for (cid, c) in self.containers.items()
+                                            if show_all or c["running"]])
+            if method == "POST" and path == ["containers", "create"]:
+                length = int(handler.headers.get("Content-Length", 0))
+                body = json.loads(handler.rfile.read(length) or b"{}")
+                bindings = (body.get("HostConfig") or {}).get("PortBindings") or {}
+                ports = [int(b[0]["HostPort"]) for b in bindings.values()]
+                cid = self.add_container(query["name"][0], running=False, ports=ports)
+                return handler._reply(201, {"Id": cid, "Warnings": []})
+            if len(path) == 3 and path[0] == "containers" and path[1] in self.containers:
+                cid = path[1]
+                if method == "GET" and path[2] == "json":
+                    return handler._reply(200, self._inspect(cid))
+                if method == "GET" and path[2] == "stats":
+                    return handler._reply(200, self._stats(cid))
+                if method == "POST" and path[2] in ("start", "stop"):
+                    self.containers[cid]["running"] = path[2] == "start"
+                    return handler._reply(204)
+            return handler._reply(404, {"message": "not found"})
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_pool(apis: dict, **pool_opt) -> McbdscDockerClientPool:
+    return McbdscDockerClientPool.from_urls({host: api.url for (host, api) in apis.items()},
+                                            client_opt={"version": api_version}, **pool_opt)
+
+
+class TestMcbdscHostHeadroom(unittest.TestCase):
+
+    def test_score(self) -> None:
+        h = McbdscHostHeadroom("a", cpus=4, memory=1000, ports=10, cpu_used=1, memory_used=500, ports_used=2)
+        self.assertEqual(h.score(), 0.5)
+        h.reserve(cpus=2, memory=0)
+        self.assertEqual(h.score(), 0.25)
+        self.assertEqual(McbdscHostHeadroom("b", cpus=4, memory=1000, ports=10, ports_used=9).score(), -1.0)
+
+
+class TestMcbdscDockerClientPool(unittest.TestCase):
+
+    def test_headroom_and_place(self) -> None:
+        with FakeDockerApi() as busy, FakeDockerApi() as idle:
+            busy.add_container("a", cpus=3.0, memory=2 * 1024 ** 3, ports=[19132, 19133])
+            busy.add_container("stopped", running=False, cpus=4.0)
+            idle.add_container("b", cpus=0.5, memory=1024 ** 3, ports=[19132, 19133])
+            pool = make_pool({"busy": busy, "idle": idle})
+            self.assertEqual(pool.address("busy"), "127.0.0.1")
+
+            headrooms = pool.headroom()
+            self.assertAlmostEqual(headrooms["busy"].cpu_free, 1.0)
+            self.assertEqual(headrooms["busy"].memory_free, 6 * 1024 ** 3)
+            self.assertEqual(headrooms["busy"].ports_used, 2)
+            self.assertEqual(headrooms["busy"].containers, 1)
+            self.assertAlmostEqual(headrooms["idle"].cpu_free, 3.5)
+
+            # 余裕の大きいホストに配置し、配置した分だけ余裕が減ることを確認する。
+            self.assertEqual([pool.place(headrooms) for _ in range(4)], ["idle", "idle", "idle", "busy"])
+
+            containers = pool.containers_by_name()
+            self.assertEqual({name: host for (name, (host, _c)) in containers.items()},
+                             {"a": "busy", "stopped": "busy", "b": "idle"})
+            self.assertEqual(containers["stopped"][1].status, "exited")
+
+    def test_unreachable_host(self) -> None:
+        with FakeDockerApi() as api:
+            pool = make_pool({"up": api})
+            pool._clients["down"] = McbdscDockerClientPool.from_urls({"down": "tcp://127.0.0.1:1"},
+                                                                     client_opt={"version": api_version}).client("down")
+            self.assertEqual(list(pool.headroom()), ["up"])
+            self.assertEqual(pool.place(), "up")
+
+    def test_fan_out(self) -> None:
+        delay = 0.3
+        apis = [FakeDockerApi(delay=delay) for _ in range(4)]
+        for api in apis:
+            api.__enter__()
+        try:
+            pool = make_pool({"host{i}".format(i=i): api for (i, api) in enumerate(apis)})
+            started = time.monotonic()
+            infos = pool.map(lambda host, client: client.info())
+            elapsed = time.monotonic() - started
+            self.assertEqual(len(infos), 4)
+            # 全ホストの所要時間の合計ではなく、一つのホストの所要時間程度で終わることを確認する。
+            self.assertLess(elapsed, delay * len(apis) * 0.75)
+        finally:
+            for api in apis:
+                api.__exit__()
+
+
+class TestMcbdscDockerManagerClientPool(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_factory_containers(self) -> None:
+        with FakeDockerApi() as busy, FakeDockerApi() as idle:
+            busy.add_container("a", cpus=3.5, ports=[19132, 19133])
+            pool = make_pool({"busy": busy, "idle": idle})
+            params = [{"name": "a", "image": "bedrock:latest"},
+                      {"name": "b", "image": "bedrock:latest", "ports": {"19132/udp": 19134}}]
+            manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, containers_param=params,
+                                                   client_pool=pool)
+            # docker.from_env() を呼び出さないことを確認する。
+            self.mock_docker.from_env.assert_not_called()
+
+            containers = manager.factory_containers()
+            self.assertEqual([(c.name, c.host) for c in containers], [("a", "busy"), ("b", "idle")])
+            self.assertEqual(params[1]["host"], "idle")
+            self.assertEqual([c["name"] for c in idle.containers.values()], ["b"])
+            self.assertEqual(manager.server_addresses()["b"], ("127.0.0.1", 19134))
+
+            manager.start_containers()
+            self.assertTrue(all(c["running"] for c in idle.containers.values()))
+            stats = manager.container_stats()
+            self.assertEqual(sorted(stats), ["a", "b"])
+            manager.stop_containers()
+            self.assertFalse(any(c["running"] for api in (busy, idle) for c in api.containers.values()))
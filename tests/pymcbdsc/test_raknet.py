@@ -0,0 +1,112 @@
+import unittest
+import asyncio
+import socket
+import threading
+from pymcbdsc import raknet
+
+
+class DummyBedrockServer(object):
+    """ Unconnected Ping に Unconnected Pong を応答する、 UDP の疑似 Bedrock Server。 """
+
+    def __init__(self, server_id: str, respond: bool = True) -> None:
+        self.server_id = server_id
+        self.respond = respond
+        self.received = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def _serve(self) -> None:
+        while not self._stop.is_set():
+            try:
+                (data, addr) = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            (token, _client_guid) = raknet.parse_ping(data)
+            self.received += 1
+            if self.respond:
+                self.sock.sendto(raknet.build_pong(token=token, server_guid=1234, server_id=self.server_id), addr)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.sock.close()
+
+
+class TestRaknet(unittest.TestCase):
+
+    server_id = "MCPE;Dedicated Server;422;1.16.201;3;10;1234;Bedrock level;Survival;1;19132;19133;"
+
+    def test_ping_pong(self) -> None:
+        # 作成した Ping を解析すると、元の値が戻ることを確認する。
+        act = raknet.parse_ping(raknet.build_ping(token=10, client_guid=20))
+        exp = (10, 20)
+        self.assertEqual(act, exp)
+
+        # 作成した Pong を解析すると、元の値が戻ることを確認する。
+        act = raknet.parse_pong(raknet.build_pong(token=10, server_guid=30, server_id=self.server_id))
+        exp = (10, 30, self.server_id)
+        self.assertEqual(act, exp)
+
+        # Pong ではないパケットは ValueError となることを確認する。
+        with self.assertRaises(ValueError):
+            raknet.parse_pong(raknet.build_ping(token=10, client_guid=20))
+        with self.assertRaises(ValueError):
+            raknet.parse_pong(b"\x1c")
+
+    def test_parse_server_id(self) -> None:
+        st = raknet.parse_server_id(("127.0.0.1", 19132), 1234, self.server_id, latency=0.01)
+        self.assertTrue(st.online)
+        self.assertEqual(st.edition, "MCPE")
+        self.assertEqual(st.motd, "Dedicated Server")
+        self.assertEqual(st.protocol, 422)
+        self.assertEqual(st.version, "1.16.201")
+        self.assertEqual(st.players, 3)
+        self.assertEqual(st.max_players, 10)
+        self.assertEqual(st.level_name, "Bedrock level")
+        self.assertEqual(st.gamemode, "Survival")
+
+        # フィールドが不足していても例外とならないことを確認する。
+        st = raknet.parse_server_id(("127.0.0.1", 19132), 1234, "MCPE;Dedicated Server")
+        self.assertEqual(st.motd, "Dedicated Server")
+        self.assertIsNone(st.players)
+
+    def test_query_status(self) -> None:
+        with DummyBedrockServer(self.server_id) as s1, \
+                DummyBedrockServer(self.server_id.replace("3;10", "0;20")) as s2, \
+                DummyBedrockServer(self.server_id, respond=False) as s3:
+            act = raknet.query_status({"s1": s1.address, "s2": s2.address, "s3": s3.address}, timeout=0.5, retries=1)
+
+            self.assertEqual(sorted(act.keys()), ["s1", "s2", "s3"])
+            self.assertTrue(act["s1"].online)
+            self.assertEqual((act["s1"].players, act["s1"].max_players), (3, 10))
+            self.assertTrue(act["s2"].online)
+            self.assertEqual((act["s2"].players, act["s2"].max_players), (0, 20))
+            self.assertGreaterEqual(act["s1"].latency, 0)
+
+            # 応答しないサーバはタイムアウトとなり、再送されていることを確認する。
+            self.assertFalse(act["s3"].online)
+            self.assertEqual(act["s3"].error, "timeout")
+            self.assertEqual(s3.received, 2)
+
+    def test_query_status_empty(self) -> None:
+        self.assertEqual(raknet.query_status({}), {})
+
+    def test_query_status_keeps_event_loop(self) -> None:
+        # 呼び出し元のスレッドに設定されているイベントループを置き換えないことを確認する。
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            raknet.query_status({})
+            self.assertIs(asyncio.get_event_loop(), loop)
+            self.assertFalse(loop.is_closed())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -0,0 +1,116 @@
+import unittest
+from unittest import mock
+import io
+import os
+import shutil
+from pymcbdsc import repository
+from pymcbdsc.repository import McbdscBackupRepository
+from .test_backup import DummyChannel, DummyWorldContainer, world
+from .test_utils import os_name2test_root_dir
+
+
+class DummyStatContainer(DummyWorldContainer):
+    """ exec_run で find コマンドの実行結果を戻す、 Container を模したクラス。 """
+
+    def __init__(self, files: dict, mtimes: dict = None) -> None:
+        super().__init__(files)
+        self.mtimes = mtimes if mtimes is not None else {}
+
+    def exec_run(self, cmd):
+        output = "".join("{p}\t{s}\t{m}.5\n".format(p=p, s=len(d), m=self.mtimes.get(p, 1600000000))
+                         for (p, d) in self.files.items())
+        return (0, output.encode("utf-8"))
+
+
+class TestMcbdscBackupRepository(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os.path.join(os_name2test_root_dir[os.name], "repository")
+        self.repo = McbdscBackupRepository(self.test_dir)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(os_name2test_root_dir[os.name])
+
+    def test_store_object(self) -> None:
+        (h1, size) = self.repo.store_object(io.BytesIO(b"x" * 3000000))
+        self.assertEqual(size, 3000000)
+        (h2, _) = self.repo.store_object(io.BytesIO(b"x" * 3000000))
+        self.assertEqual(h1, h2)
+        # 同じ内容は一つのオブジェクトとして保存され、一時ファイルは残らないことを確認する。
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, "objects")), [h1[:2]])
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, "objects", h1[:2])), [h1])
+
+    def test_snapshots(self) -> None:
+        repo = self.repo
+        s1 = repo.new_snapshot("a")
+        repo.save_snapshot(s1)
+        # 同じ時刻に作成しても、 ID が重複しないことを確認する。
+        s2 = repo.new_snapshot("a")
+        self.assertNotEqual(s1.snapshot_id, s2.snapshot_id)
+        repo.save_snapshot(s2)
+        repo.save_snapshot(repo.new_snapshot("b"))
+
+        self.assertEqual(repo.servers(), ["a", "b"])
+        self.assertEqual(len(repo.list_snapshots()), 3)
+        self.assertEqual(repo.latest_snapshot("a").snapshot_id, s2.snapshot_id)
+        self.assertIsNone(repo.latest_snapshot("c"))
+
+        removed = repo.prune(keep=1)
+        self.assertEqual([s.snapshot_id for s in removed], [s1.snapshot_id])
+        self.assertEqual(len(repo.list_snapshots("a")), 1)
+
+    def test_gc(self) -> None:
+        repo = self.repo
+        (h1, _) = repo.store_object(io.BytesIO(b"referenced"))
+        (h2, _) = repo.store_object(io.BytesIO(b"unreferenced"))
+        snapshot = repo.new_snapshot("a")
+        snapshot.add("level.dat", sha256=h1, size=10, mtime=0)
+        repo.save_snapshot(snapshot)
+
+        # 猶予期間内のオブジェクトは削除されないことを確認する。
+        self.assertEqual(repo.gc(), (0, 0))
+        self.assertEqual(repo.gc(grace=-1), (1, len(b"unreferenced")))
+        self.assertTrue(repo.has_object(h1))
+        self.assertFalse(repo.has_object(h2))
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.repo = McbdscBackupRepository(os.path.join(os_name2test_root_dir[os.name], "repository"))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(os_name2test_root_dir[os.name])
+
+    def test_online_snapshot(self) -> None:
+        reported = [("Bedrock level/db/000005.ldb", 4000), ("Bedrock level/db/CURRENT", 16),
+                    ("Bedrock level/level.dat", 300)]
+        container = DummyStatContainer(world)
+        s1 = repository.online_snapshot(container, DummyChannel(reported, not_ready=0), self.repo, "a", poll_interval=0)
+        self.assertEqual(s1.files["Bedrock level/db/000005.ldb"]["size"], 4000)
+        self.assertEqual(s1.files["Bedrock level/level.dat"]["mtime"], 1600000000)
+        with self.repo.open_object(s1.files["Bedrock level/db/000005.ldb"]["sha256"]) as f:
+            self.assertEqual(f.read(), b"L" * 4000)
+
+        # サイズと更新時刻が変わったファイルのみを読み出すことを確認する。
+        container = DummyStatContainer(world, mtimes={"Bedrock level/level.dat": 1600000100})
+        channel = DummyChannel(reported, not_ready=0)
+        s2 = repository.online_snapshot(container, channel, self.repo, "a", poll_interval=0)
+        self.assertEqual(container.requested, [repository.worlds_dir + "/Bedrock level/level.dat"])
+        self.assertEqual(s2.files["Bedrock level/db/000005.ldb"], s1.files["Bedrock level/db/000005.ldb"])
+        self.assertEqual(channel.commands[-1], "save resume")
+        self.assertEqual(len(self.repo.list_snapshots("a")), 2)
+
+    def test_offline_snapshot(self) -> None:
+        container = DummyWorldContainer(world)
+        s1 = repository.offline_snapshot(container, self.repo, "a")
+        self.assertEqual(sorted(s1.files), sorted(world))
+
+        changed = dict(world)
+        changed["Bedrock level/level.dat"] = b"E" * 301
+        with mock.patch.object(self.repo, "store_object", wraps=self.repo.store_object) as store_object:
+            s2 = repository.offline_snapshot(DummyWorldContainer(changed), self.repo, "a")
+        # 変更されたファイルのみを保存することを確認する。
+        self.assertEqual(store_object.call_count, 1)
+        with self.repo.open_object(s2.files["Bedrock level/level.dat"]["sha256"]) as f:
+            self.assertEqual(f.read(), b"E" * 301)
@@ -0,0 +1,118 @@
+import unittest
+from unittest import mock
+import io
+import os
+import shutil
+import tarfile
+import pymcbdsc
+from pymcbdsc import restore
+from pymcbdsc.backup import McbdscChunkReader, worlds_dir
+from pymcbdsc.repository import McbdscBackupRepository
+from .test_utils import os_name2test_root_dir
+
+
+class DummyVolumeContainer(object):
+    """ ボリュームの内容をメモリ上に保持し、 find, rm 及び put_archive に応答する、 Container を模したクラス。 """
+
+    def __init__(self, files: dict) -> None:
+        # パスと、 (内容, 更新時刻) の dict.
+        self.files = files
+        self.status = "running"
+        self.calls = []
+        self.client = mock.MagicMock()
+        self.client.containers.run.side_effect = lambda image, entrypoint, **kwargs: self._run(entrypoint)
+        self.attrs = {"Config": {"Image": "bedrock:latest"}}
+        self.id = "id-test"
+
+    def _run(self, cmd) -> bytes:
+        self.calls.append(cmd[0])
+        if cmd[0] == "find":
+            return "".join("{p}\t{s}\t{m}.0\n".format(p=p, s=len(d), m=m)
+                           for (p, (d, m)) in sorted(self.files.items())).encode("utf-8")
+        if cmd[0] == "rm":
+            for path in cmd[3:]:
+                self.files.pop(path[len(worlds_dir) + 1:], None)
+            return b""
+
+    def exec_run(self, cmd):
+        return (0, self._run(cmd))
+
+    def put_archive(self, path, data):
+        self.calls.append("put_archive")
+        # 全体を bytes として渡されず、ジェネレータで渡されることを確認する為に、 bytes であれば失敗させる。
+        assert not isinstance(data, bytes)
+        with tarfile.open(fileobj=io.BufferedReader(McbdscChunkReader(data)), mode="r|") as tar:
+            for member in tar:
+                if member.isfile():
+                    self.files[member.name.split("/", 1)[1]] = (tar.extractfile(member).read(), member.mtime)
+        return True
+
+    def reload(self) -> None:
+        pass
+
+    def stop(self, **kwargs) -> None:
+        self.calls.append("stop")
+        self.status = "exited"
+
+    def start(self, **kwargs) -> None:
+        self.calls.append("start")
+        self.status = "running"
+
+
+class TestRestore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.repo = McbdscBackupRepository(os.path.join(os_name2test_root_dir[os.name], "repository"))
+        snapshot = self.repo.new_snapshot("a")
+        for (path, data, mtime) in [("Bedrock level/db/000005.ldb", b"L" * 5000, 100),
+                                    ("Bedrock level/db/CURRENT", b"MANIFEST-000010\n", 100),
+                                    ("Bedrock level/level.dat", b"D" * 512, 200)]:
+            (sha256, size) = self.repo.store_object(io.BytesIO(data))
+            snapshot.add(path, sha256=sha256, size=size, mtime=mtime)
+        self.repo.save_snapshot(snapshot)
+        self.snapshot = snapshot
+
+    def tearDown(self) -> None:
+        shutil.rmtree(os_name2test_root_dir[os.name])
+
+    def test_iter_snapshot_tar(self) -> None:
+        data = b"".join(restore.iter_snapshot_tar(self.repo, self.snapshot, chunk_size=1000))
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            names = tar.getnames()
+            self.assertEqual(tar.extractfile("worlds/Bedrock level/db/000005.ldb").read(), b"L" * 5000)
+            self.assertEqual(tar.getmember("worlds/Bedrock level/level.dat").mtime, 200)
+        # 親ディレクトリが、ファイルより先に一度ずつ含まれることを確認する。
+        self.assertEqual(names, ["worlds", "worlds/Bedrock level", "worlds/Bedrock level/db",
+                                 "worlds/Bedrock level/db/000005.ldb", "worlds/Bedrock level/db/CURRENT",
+                                 "worlds/Bedrock level/level.dat"])
+
+    def test_restore_only_changed(self) -> None:
+        container = DummyVolumeContainer({"Bedrock level/db/000005.ldb": (b"L" * 5000, 100),
+                                          "Bedrock level/db/CURRENT": (b"MANIFEST-000012\n", 300),
+                                          "Bedrock level/db/000012.ldb": (b"N" * 10, 300)})
+        result = restore.restore_snapshot(container, self.repo, self.snapshot, running=False)
+        self.assertEqual((result.files, result.size, result.removed), (2, 16 + 512, 1))
+        self.assertEqual(container.files, {"Bedrock level/db/000005.ldb": (b"L" * 5000, 100),
+                                           "Bedrock level/db/CURRENT": (b"MANIFEST-000010\n", 100),
+                                           "Bedrock level/level.dat": (b"D" * 512, 200)})
+        # 停止しているコンテナでは、一時的なコンテナでコマンドを実行していることを確認する。
+        self.assertEqual(container.client.containers.run.call_args[1]["volumes_from"], ["id-test"])
+
+        # リストア直後は、変更されたファイルがないことを確認する。
+        result = restore.restore_snapshot(container, self.repo, self.snapshot, running=False)
+        self.assertEqual((result.files, result.removed), (0, 0))
+        self.assertEqual(container.calls.count("put_archive"), 1)
+
+        # only_changed が False の場合は、全てのファイルを書き込むことを確認する。
+        result = restore.restore_snapshot(container, self.repo, self.snapshot, only_changed=False, running=False)
+        self.assertEqual(result.files, 3)
+
+    def test_container_restore(self) -> None:
+        container = DummyVolumeContainer({})
+        mcbdsc_container = pymcbdsc.McbdscDockerContainer(name="a", container=container)
+        result = mcbdsc_container.restore(self.repo, self.snapshot)
+        # 停止、リストア、起動の順に行われることを確認する。
+        self.assertEqual(container.calls, ["stop", "find", "put_archive", "start"])
+        self.assertEqual(result.files, 3)
+        self.assertGreater(result.downtime, 0)
+        self.assertEqual(container.status, "running")
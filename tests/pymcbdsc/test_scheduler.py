@@ -0,0 +1,110 @@
+import unittest
+from unittest import mock
+import threading
+from pymcbdsc import logs
+from pymcbdsc.scheduler import McbdscBackupScheduler, McbdscTokenBucket
+
+
+def player_event(kind: str, name: str, player: str, timestamp: float) -> logs.McbdscLogEvent:
+    return logs.McbdscLogEvent(kind=kind, container=name, timestamp=timestamp, level="INFO", message="", player=player)
+
+
+class DummyClock(object):
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestMcbdscTokenBucket(unittest.TestCase):
+
+    def test_consume(self) -> None:
+        clock = DummyClock()
+        bucket = McbdscTokenBucket(rate=100, clock=clock)
+        with mock.patch("pymcbdsc.scheduler.time.sleep") as sleep:
+            bucket.consume(100)
+            self.assertFalse(sleep.called)
+            # トークンが不足すると、補充されるまで待つことを確認する。
+            bucket.consume(50)
+            sleep.assert_called_once_with(0.5)
+            # 時間が経過すると補充されることを確認する。
+            clock.now = 1.5
+            sleep.reset_mock()
+            bucket.consume(100)
+            self.assertFalse(sleep.called)
+
+
+class TestMcbdscBackupScheduler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.containers = []
+        for name in ["a", "b", "c", "d"]:
+            c = mock.MagicMock()
+            c.name = name
+            c.is_running.return_value = True
+            self.containers.append(c)
+        manager = mock.MagicMock()
+        manager.factory_containers.return_value = self.containers
+        # "d" 以外は、時刻 1000 にバックアップ済みとする。
+        snapshots = {name: mock.MagicMock(timestamp=1000.0) for name in ["a", "b", "c"]}
+        manager.backup_repository.return_value.latest_snapshot.side_effect = snapshots.get
+        self.manager = manager
+        self.clock = DummyClock(5000.0)
+        self.scheduler = McbdscBackupScheduler(manager, interval=3600, window=600, max_concurrent=2, clock=self.clock)
+
+    def test_plan(self) -> None:
+        s = self.scheduler
+        # a: バックアップ以前の接続のみ(起動時に読み込んだ過去のログ)。
+        s.record_event(player_event(logs.EVENT_PLAYER_CONNECTED, "a", "Steve", 900.0))
+        s.record_event(player_event(logs.EVENT_PLAYER_DISCONNECTED, "a", "Steve", 950.0))
+        # b: バックアップ以降に二回接続し、一人が接続中。
+        s.record_event(player_event(logs.EVENT_PLAYER_CONNECTED, "b", "Steve", 2000.0))
+        s.record_event(player_event(logs.EVENT_PLAYER_DISCONNECTED, "b", "Steve", 2100.0))
+        s.record_event(player_event(logs.EVENT_PLAYER_CONNECTED, "b", "Alex", 2200.0))
+        # c: バックアップ以降に三回接続したが、誰も接続していない。
+        for t in [2000.0, 2100.0, 2200.0]:
+            s.record_event(player_event(logs.EVENT_PLAYER_CONNECTED, "c", "Steve", t))
+            s.record_event(player_event(logs.EVENT_PLAYER_DISCONNECTED, "c", "Steve", t + 10))
+
+        self.assertEqual(s.activity("a"), (0, 0))
+        self.assertEqual(s.activity("b"), (1, 2))
+        self.assertEqual(s.online_players("b"), {"Alex"})
+
+        # a はスキップされ、接続中の b、接続数の多い c、一度もバックアップされていない d の順に、 window に分散される。
+        act = s.plan(["a", "b", "c", "d"], cycle_start=3600.0)
+        exp = [(3600.0, "b"), (3800.0, "c"), (4000.0, "d")]
+        self.assertEqual(act, exp)
+
+    def test_run_cycle(self) -> None:
+        s = self.scheduler
+        s.record_event(player_event(logs.EVENT_PLAYER_CONNECTED, "b", "Steve", 2000.0))
+        s.record_event(player_event(logs.EVENT_PLAYER_DISCONNECTED, "b", "Steve", 2010.0))
+        act = s.run_cycle(cycle_start=self.clock.now - 1000)
+        self.assertEqual(act, ["b", "d"])
+        self.assertTrue(self.containers[1].snapshot.called)
+        self.assertFalse(self.containers[0].snapshot.called)
+        # バックアップ後は接続数がリセットされ、次のサイクルではスキップされることを確認する。
+        self.assertEqual(s.activity("b"), (0, 0))
+        self.assertEqual(s.plan(["a", "b", "c", "d"], cycle_start=0), [])
+
+        # 接続中のプレイヤーがいるサーバは、接続数によらずバックアップされることを確認する。
+        s.record_event(player_event(logs.EVENT_PLAYER_CONNECTED, "a", "Steve", 900.0))
+        self.assertEqual(s.plan(["a", "b", "c", "d"], cycle_start=0), [(0, "a")])
+
+    def test_backup_failure(self) -> None:
+        s = self.scheduler
+        s.record_event(player_event(logs.EVENT_PLAYER_CONNECTED, "b", "Steve", 2000.0))
+        s.record_event(player_event(logs.EVENT_PLAYER_DISCONNECTED, "b", "Steve", 2010.0))
+        self.containers[1].snapshot.side_effect = RuntimeError("failed")
+        s.backup(self.containers[1])
+        # 失敗した場合は、次のサイクルで再度バックアップされることを確認する。
+        self.assertEqual(s.activity("b"), (0, 1))
+
+    def test_run_stop(self) -> None:
+        stop = threading.Event()
+        stop.set()
+        scheduler = McbdscBackupScheduler(self.manager, interval=3600)
+        scheduler.run(stop)
+        self.assertFalse(self.manager.factory_containers.called)
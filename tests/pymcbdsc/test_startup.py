@@ -0,0 +1,66 @@
+from typing import Dict, List
+import unittest
+from unittest import mock
+import os
+import subprocess
+import sys
+import pymcbdsc
+
+
+# `import pymcbdsc` にかける時間の上限(マイクロ秒)。 docker-py と requests を import すると、これを大きく超える。
+import_budget_us = 50000
+# import するべきでない重いモジュール。
+heavy_modules = ("docker", "requests")
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(pymcbdsc.__file__)))
+
+
+def importtime(args: List[str]) -> Dict[str, int]:
+    """ `python -X importtime` で `args` を実行し、 import したモジュール名と累積時間(マイクロ秒)の dict を戻す関数。 """
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=project_root,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        (_self_us, cumulative_us, name) = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative_us)
+    return modules
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime and the module __getattr__ require Python3.7 or later.")
+class TestStartup(unittest.TestCase):
+
+    def assertNotImported(self, modules: Dict[str, int]) -> None:
+        for name in heavy_modules:
+            self.assertNotIn(name, modules)
+
+    def test_import_pymcbdsc(self) -> None:
+        modules = importtime(["-c", "import pymcbdsc; pymcbdsc.version; pymcbdsc.pymcbdsc_root_dir()"])
+        self.assertNotImported(modules)
+        self.assertLess(modules["pymcbdsc"], import_budget_us)
+
+    def test_cli_without_docker(self) -> None:
+        # ヘルプとダウンロードのサブコマンドは、 docker-py を import しないことを確認する。
+        modules = importtime(["-m", "pymcbdsc", "help", "download"])
+        self.assertNotImported(modules)
+        modules = importtime(["-c", "import pymcbdsc.downloader"])
+        self.assertNotIn("docker", modules)
+
+    def test_lazy_attributes(self) -> None:
+        # McbdscDockerManager を参照すると pymcbdsc.docker (とそれが import するモジュール)を import するが、
+        # docker-py は利用するまで import しない。
+        modules = importtime(["-c", "import pymcbdsc; pymcbdsc.McbdscDockerManager"])
+        self.assertIn("pymcbdsc.backup", modules)
+        self.assertNotImported(modules)
+        self.assertIs(pymcbdsc.McbdscDockerManager, pymcbdsc.docker.McbdscDockerManager)
+        with self.assertRaises(AttributeError):
+            pymcbdsc.NotDefined
+
+    def test_lazy_docker_client(self) -> None:
+        with mock.patch('pymcbdsc.docker.docker') as mock_docker:
+            # 初期化しただけでは Docker に接続せず、初めて利用する時点で接続することを確認する。
+            manager = pymcbdsc.McbdscDockerManager(containers_param=[])
+            mock_docker.from_env.assert_not_called()
+            self.assertIs(manager.docker_client, mock_docker.from_env.return_value)
+            self.assertIs(manager.docker_client, mock_docker.from_env.return_value)
+            mock_docker.from_env.assert_called_once_with()
@@ -0,0 +1,218 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+import threading
+from docker.models.containers import Container
+import pymcbdsc
+from pymcbdsc.backup import run_in_volume
+from pymcbdsc.state import McbdscStateCache
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+def container_event(action: str, name: str, labels=("pymcbdsc",), **attributes) -> dict:
+    attrs = {label: "true" for label in labels}
+    attrs.update(attributes)
+    attrs["name"] = name
+    return {"Type": "container", "Action": action, "Actor": {"ID": "id-" + name, "Attributes": attrs}}
+
+
+def image_event(action: str, name: str) -> dict:
+    return {"Type": "image", "Action": action, "Actor": {"ID": "sha256:" + name, "Attributes": {"name": name}}}
+
+
+class DummyEventStream(object):
+    """ events API のストリームを模したクラス。 events を戻した後、 release がセットされるまで待つ。 """
+
+    def __init__(self, events, release: threading.Event = None) -> None:
+        self.events = events
+        self.release = release
+
+    def __iter__(self):
+        yield from self.events
+        if self.release is not None:
+            self.release.wait(5)
+
+    def close(self) -> None:
+        if self.release is not None:
+            self.release.set()
+
+
+def dummy_container(name: str, status: str):
+    c = mock.MagicMock()
+    c.name = name
+    c.id = "id-" + name
+    c.status = status
+    return c
+
+
+def dummy_image(tags):
+    image = mock.MagicMock()
+    image.id = "sha256:" + tags[0]
+    image.tags = tags
+    return image
+
+
+class TestMcbdscStateCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        client = mock.MagicMock()
+        client.containers.list.return_value = [dummy_container("a", "running"), dummy_container("b", "exited")]
+        client.images.list.return_value = [dummy_image(["bedrock:1.16.201.02", "bedrock:1.16", "bedrock:latest"])]
+        self.client = client
+        self.cache = McbdscStateCache(client)
+
+    def test_resync(self) -> None:
+        self.cache.resync()
+        self.assertEqual(self.cache.container_statuses(), {"a": "running", "b": "exited"})
+        self.assertEqual(self.cache.image_tags(), ["bedrock:1.16.201.02", "bedrock:1.16", "bedrock:latest"])
+        # ラベルで絞り込んでコンテナの一覧を取得していることを確認する。
+        self.client.containers.list.assert_called_with(all=True, filters={"label": "pymcbdsc"})
+        self.client.images.list.assert_called_with("bedrock")
+
+    def test_handle_container_event(self) -> None:
+        cache = self.cache
+        cache.resync()
+
+        cache.handle_event(container_event("stop", "a"))
+        self.assertEqual(cache.container_status("a"), "exited")
+
+        cache.handle_event(container_event("start", "b"))
+        self.assertEqual(cache.container_status("b"), "running")
+
+        # 新しいコンテナが追加されることを確認する。
+        cache.handle_event(container_event("create", "c"))
+        self.assertEqual(cache.container_status("c"), "created")
+        self.assertEqual(cache.container_attrs()["c"]["Id"], "id-c")
+
+        cache.handle_event(container_event("rename", "d", oldName="/c"))
+        self.assertIsNone(cache.container_status("c"))
+        self.assertEqual(cache.container_attrs()["d"]["Name"], "/d")
+
+        cache.handle_event(container_event("destroy", "d"))
+        self.assertIsNone(cache.container_status("d"))
+
+        # ラベルのないコンテナのイベントは無視することを確認する。
+        cache.handle_event(container_event("create", "other", labels=()))
+        self.assertIsNone(cache.container_status("other"))
+
+        # 状態に影響しないイベントは無視することを確認する。
+        cache.handle_event(container_event("exec_start: /bin/sh", "a"))
+        self.assertEqual(cache.container_status("a"), "exited")
+
+    def test_handle_image_event(self) -> None:
+        cache = self.cache
+        cache.resync()
+        self.assertEqual(self.client.images.list.call_count, 1)
+
+        # 対象のリポジトリのイベントでは一覧を取得し直すことを確認する。
+        self.client.images.list.return_value = [dummy_image(["bedrock:1.17.0.03", "bedrock:latest"])]
+        cache.handle_event(image_event("tag", "bedrock:latest"))
+        self.assertEqual(self.client.images.list.call_count, 2)
+        self.assertEqual(cache.image_tags(), ["bedrock:1.17.0.03", "bedrock:latest"])
+
+        # 他のリポジトリのイベントは無視することを確認する。
+        cache.handle_event(image_event("tag", "ubuntu:20.04"))
+        self.assertEqual(self.client.images.list.call_count, 2)
+
+    def test_run(self) -> None:
+        release = threading.Event()
+        # 一本目のストリームは一つのイベントを受信した後に切断され、二本目のストリームは停止されるまで続く。
+        self.client.events.side_effect = [DummyEventStream([container_event("stop", "a")]),
+                                          DummyEventStream([container_event("start", "b")], release)]
+        cache = McbdscStateCache(self.client, reconnect_interval=0)
+        cache.start()
+        try:
+            for _ in range(500):
+                if cache.container_status("b") == "running":
+                    break
+                threading.Event().wait(0.01)
+            self.assertTrue(cache.is_ready())
+            self.assertEqual(cache.container_status("b"), "running")
+            # 切断後に再接続し、一覧を取得し直していることを確認する。
+            self.assertEqual(self.client.events.call_count, 2)
+            self.assertEqual(self.client.containers.list.call_count, 2)
+            self.assertEqual(self.client.events.call_args[1]["filters"], {"type": ["container", "image"]})
+        finally:
+            cache.stop()
+        self.assertFalse(cache.is_ready())
+        self.assertTrue(release.is_set())
+
+
+class TestMcbdscDockerManagerWithStateCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(test_dir, exist_ok=True)
+        self.test_dir = test_dir
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        client = self.mock_docker.from_env.return_value
+        client.containers.list.return_value = [dummy_container("a", "running")]
+        client.images.list.return_value = [dummy_image(["bedrock:1.16.201.02", "bedrock:latest"]),
+                                           dummy_image(["bedrock:1.16.100.04"])]
+        # events ストリームは、停止されるまで何も受信しない。
+        self.release = threading.Event()
+        client.events.return_value = DummyEventStream([], self.release)
+        self.client = client
+        params = [{"name": "a", "image": "bedrock:latest"}, {"name": "b", "image": "bedrock:latest"}]
+        self.manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=test_dir, containers_param=params)
+
+    def tearDown(self) -> None:
+        self.release.set()
+        self.manager.stop_state_cache()
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_factory_containers(self) -> None:
+        cache = self.manager.start_state_cache()
+        cache.wait_ready(5)
+        self.client.containers.list.reset_mock()
+
+        containers = self.manager.factory_containers()
+        self.assertEqual([c.name for c in containers], ["a", "b"])
+        # 一覧は API ではなくキャッシュから取得し、キャッシュに無いコンテナのみを名前で探していることを確認する。
+        self.client.containers.list.assert_called_once_with(all=True, filters={"name": "^/b$"})
+        self.client.containers.prepare_model.assert_called_once_with(
+            {"Id": "id-a", "Name": "/a", "State": {"Status": "running"}})
+        # 未作成のコンテナは、ラベルを付与して作成されることを確認する。
+        self.client.containers.create.assert_called_once_with(name="b", image="bedrock:latest",
+                                                              labels={"pymcbdsc": "true"})
+
+    def test_factory_containers_not_in_cache(self) -> None:
+        cache = self.manager.start_state_cache()
+        cache.wait_ready(5)
+        # ラベルが無くキャッシュに含まれないコンテナは、作成せずに Docker ホストから探して利用することを確認する。
+        b = dummy_container("b", "exited")
+        self.client.containers.list.side_effect = lambda all=False, filters=None: [b]
+        containers = self.manager.factory_containers()
+        self.assertEqual([c.name for c in containers], ["a", "b"])
+        self.assertIs(containers[1]._container, b)
+        self.client.containers.create.assert_not_called()
+
+    def test_factory_containers_partial_attrs(self) -> None:
+        # キャッシュから作成した Container インスタンスは Config 及び Mounts を持たないが、
+        # それらを参照する処理は取得し直して参照することを確認する。
+        cache = self.manager.start_state_cache()
+        cache.wait_ready(5)
+        containers = self.client.containers
+        containers.prepare_model.side_effect = lambda attrs: Container(attrs=attrs, client=self.client,
+                                                                       collection=containers)
+        containers.get.return_value = Container(attrs={
+            "Id": "id-a", "Name": "/a", "State": {"Status": "exited"}, "Config": {"Image": "bedrock:1.16"},
+            "Mounts": [{"Destination": "/opt/bedrock-versions"}]})
+        container = self.manager.factory_containers()[0]
+        self.assertNotIn("Mounts", container._container.attrs)
+        self.assertTrue(container.uses_version_store())
+        run_in_volume(container._container, ["true"], running=False)
+        self.assertEqual(containers.run.call_args[0], ("bedrock:1.16",))
+
+    def test_get_bds_versions_from_container_image(self) -> None:
+        cache = self.manager.start_state_cache()
+        cache.wait_ready(5)
+        self.client.images.list.reset_mock()
+        act = self.manager.get_bds_versions_from_container_image()
+        exp = ["1.16.100.04", "1.16.201.02"]
+        self.assertEqual(act, exp)
+        self.assertFalse(self.client.images.list.called)
@@ -0,0 +1,152 @@
+import unittest
+from unittest import mock
+import io
+import os
+import shutil
+import stat
+import tarfile
+import zipfile
+import pymcbdsc
+from pymcbdsc.store import McbdscVersionStore
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+def make_bds_zip(path: str, files: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        for (name, (data, mode)) in files.items():
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFREG | mode) << 16
+            z.writestr(info, data)
+
+
+old_files = {"bedrock_server": (b"ELF-old", 0o755),
+             "libCrypto.so": (b"crypto", 0o644),
+             "behavior_packs/vanilla/manifest.json": (b"{}", 0o644),
+             "server.properties": (b"server-name=Dedicated Server\n", 0o644)}
+new_files = dict(old_files, bedrock_server=(b"ELF-new", 0o755))
+
+
+class TestMcbdscVersionStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        self.store = McbdscVersionStore(os.path.join(self.test_dir, "store"))
+        self.old_zip = os.path.join(self.test_dir, "downloads", "bedrock-server-1.16.200.02.zip")
+        self.new_zip = os.path.join(self.test_dir, "downloads", "bedrock-server-1.16.201.02.zip")
+        make_bds_zip(self.old_zip, old_files)
+        make_bds_zip(self.new_zip, new_files)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir)
+
+    def test_extract(self) -> None:
+        store = self.store
+        self.assertEqual(store.extract(self.old_zip, "1.16.200.02"), {"files": 4, "linked": 0, "stored": 4})
+        # 内容が同じファイルは、既存のオブジェクトにリンクされることを確認する。
+        self.assertEqual(store.extract(self.new_zip, "1.16.201.02"), {"files": 4, "linked": 3, "stored": 1})
+        self.assertEqual(store.versions(), ["1.16.200.02", "1.16.201.02"])
+
+        old_dir = store.version_dir("1.16.200.02")
+        new_dir = store.version_dir("1.16.201.02")
+        self.assertTrue(os.path.samefile(os.path.join(old_dir, "libCrypto.so"), os.path.join(new_dir, "libCrypto.so")))
+        self.assertFalse(os.path.samefile(os.path.join(old_dir, "bedrock_server"),
+                                          os.path.join(new_dir, "bedrock_server")))
+        with open(os.path.join(new_dir, "behavior_packs", "vanilla", "manifest.json"), "rb") as f:
+            self.assertEqual(f.read(), b"{}")
+        # 実行権限が保たれ、全てのファイルが読み込み専用であることを確認する。
+        mode = os.stat(os.path.join(new_dir, "bedrock_server")).st_mode
+        self.assertTrue(mode & stat.S_IXUSR)
+        self.assertFalse(mode & stat.S_IWUSR)
+
+        # 展開済みのバージョンは上書きしないことを確認する。
+        with self.assertRaises(FileExistsError):
+            store.extract(self.new_zip, "1.16.201.02")
+        self.assertEqual([n for n in os.listdir(store.versions_dir) if n.startswith(".tmp-")], [])
+
+    def test_extract_unsafe_path(self) -> None:
+        path = os.path.join(self.test_dir, "downloads", "bedrock-server-1.16.202.02.zip")
+        make_bds_zip(path, {"../evil": (b"x", 0o644)})
+        with self.assertRaises(ValueError):
+            self.store.extract(path, "1.16.202.02")
+        self.assertFalse(self.store.has_version("1.16.202.02"))
+        self.assertEqual(os.listdir(self.store.versions_dir), [])
+
+    def test_gc(self) -> None:
+        store = self.store
+        store.extract(self.old_zip, "1.16.200.02")
+        store.extract(self.new_zip, "1.16.201.02")
+        self.assertEqual(store.gc(), 0)
+        store.remove("1.16.200.02")
+        # 古いバージョンでのみ利用されていた bedrock_server のオブジェクトのみが削除されることを確認する。
+        self.assertEqual(store.gc(), 1)
+        self.assertEqual(store.versions(), ["1.16.201.02"])
+        with open(os.path.join(store.version_dir("1.16.201.02"), "bedrock_server"), "rb") as f:
+            self.assertEqual(f.read(), b"ELF-new")
+
+
+class TestMcbdscDockerManagerVersionStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        make_bds_zip(os.path.join(self.test_dir, "downloads", "bedrock-server-1.16.201.02.zip"), new_files)
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        self.manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir,
+                                                    containers_param=[{"name": "a", "image": "bedrock:latest"}])
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_set_version_store_param(self) -> None:
+        manager = self.manager
+        param = {"name": "a", "environment": ["SERVER_NAME=a", "BEDROCK_SERVER_VER=1.0.0.0"]}
+        with self.assertRaises(ValueError):
+            manager.set_version_store_param(param, "1.16.201.02")
+
+        with mock.patch('pymcbdsc.downloader.requests'):
+            downloader = pymcbdsc.McbdscDownloader(pymcbdsc_root_dir=self.test_dir)
+            with mock.patch.object(downloader, "latest_version", return_value="1.16.201.02"), \
+                    mock.patch.object(downloader, "latest_filename", return_value="bedrock-server-1.16.201.02.zip"):
+                self.assertEqual(downloader.extract_latest_version_zip_file_if_needed()["files"], 4)
+                self.assertIsNone(downloader.extract_latest_version_zip_file_if_needed())
+
+        manager.set_version_store_param(param, "1.16.201.02")
+        versions_dir = os.path.abspath(os.path.join(self.test_dir, "store", "versions"))
+        self.assertEqual(param, {"name": "a",
+                                 "image": "bedrock-runtime:latest",
+                                 "volumes": {versions_dir: {"bind": "/opt/bedrock-versions", "mode": "ro"}},
+                                 "environment": ["SERVER_NAME=a",
+                                                 "BEDROCK_VERSIONS_DIR=/opt/bedrock-versions",
+                                                 "BEDROCK_SERVER_VER=1.16.201.02"]})
+
+    def test_switch_version(self) -> None:
+        manager = self.manager
+        manager.version_store().extract(os.path.join(self.test_dir, "downloads", "bedrock-server-1.16.201.02.zip"),
+                                        "1.16.201.02")
+        dc_container = mock.MagicMock()
+        dc_container.name = "a"
+        dc_container.status = "running"
+        dc_container.attrs = {"Mounts": []}
+        self.mock_docker.from_env.return_value.containers.list.return_value = [dc_container]
+
+        # バージョンストアをマウントしていないコンテナは切り替えられないことを確認する。
+        with self.assertRaises(ValueError):
+            manager.switch_version("a", "1.16.201.02")
+        with self.assertRaises(ValueError):
+            manager.switch_version("missing", "1.16.201.02")
+        with self.assertRaises(ValueError):
+            manager.switch_version("a", "1.16.300.01")
+
+        # キャッシュ等から作成したコンテナの様に Mounts を持たなくても、取得し直して判定することを確認する。
+        dc_container.attrs = {"Id": "id-a", "Name": "/a"}
+        dc_container.reload.side_effect = lambda: dc_container.attrs.update(
+            Mounts=[{"Destination": "/opt/bedrock-versions"}])
+        manager.switch_version("a", "1.16.201.02")
+        (path, data) = dc_container.put_archive.call_args[0]
+        self.assertEqual(path, "/volume")
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(tar.extractfile("bedrock_server_version").read(), b"1.16.201.02\n")
+        dc_container.restart.assert_called_once_with()
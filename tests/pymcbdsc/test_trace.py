@@ -0,0 +1,167 @@
+import io
+import json
+import unittest
+from unittest import mock
+import os
+import shutil
+import pymcbdsc
+from pymcbdsc.trace import McbdscCountingReader, McbdscProfile, McbdscTracer, instrument_session, tracer
+# os_name2test_root_dir: os.name で取得できる OS の名前と、各 OS でのテストケース実行時に利用するテスト用ディレクトリパスのペア。
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+class TestMcbdscTracer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tracer = McbdscTracer()
+        self.spans = []
+        self.tracer.add_listener(self.spans.append)
+
+    def test_span(self) -> None:
+        with self.tracer.span("outer", tag="a") as outer:
+            self.assertIs(self.tracer.current(), outer)
+            with self.tracer.span("inner") as inner:
+                inner.add(bytes=10)
+                self.tracer.count(http_calls=1)
+            self.tracer.count(http_calls=1)
+        self.assertIsNone(self.tracer.current())
+
+        # 内側のスパンから先に終了し、 count() は実行中の全てのスパンに加算されることを確認する。
+        self.assertEqual([s.path() for s in self.spans], ["outer/inner", "outer"])
+        self.assertEqual(self.spans[0].counters, {"bytes": 10, "http_calls": 1})
+        self.assertEqual(self.spans[1].counters, {"http_calls": 2})
+        self.assertEqual(self.spans[1].attrs, {"tag": "a"})
+        self.assertGreaterEqual(self.spans[1].duration, self.spans[0].duration)
+
+        # スパンの外の count() は無視されることを確認する。
+        self.tracer.count(http_calls=1)
+
+    def test_error(self) -> None:
+        with self.assertRaises(ValueError):
+            with self.tracer.span("fail"):
+                raise ValueError()
+        self.assertEqual(self.spans[0].error, "ValueError")
+        self.assertIsNotNone(self.spans[0].duration)
+
+    def test_json_log(self) -> None:
+        with self.assertLogs("pymcbdsc.trace", level="DEBUG") as logs:
+            with self.tracer.span("download", url="https://example.com/a.zip") as span:
+                span.add(http_bytes=100)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["span"], "download")
+        self.assertEqual(record["url"], "https://example.com/a.zip")
+        self.assertEqual(record["http_bytes"], 100)
+        self.assertIn("duration", record)
+
+    def test_profile(self) -> None:
+        profile = McbdscProfile()
+        self.tracer.add_listener(profile.record)
+        for _ in range(3):
+            with self.tracer.span("build_image"):
+                with self.tracer.span("build_image.build") as span:
+                    span.add(upload_bytes=10)
+        summary = profile.summary()
+        self.assertEqual(summary["build_image"]["count"], 3)
+        self.assertEqual(summary["build_image/build_image.build"]["upload_bytes"], 30)
+        text = profile.render()
+        self.assertIn("  build_image.build", text)
+        self.assertIn("upload_bytes=30", text)
+
+    def test_instrument_session(self) -> None:
+        session = mock.MagicMock()
+        session.hooks = {"response": []}
+        instrument_session(session, "docker")
+        # 同じ種類のフックは一度しか追加されないことを確認する。
+        instrument_session(session, "docker")
+        self.assertEqual(len(session.hooks["response"]), 1)
+
+        response = mock.MagicMock()
+        response.headers = {"Content-Length": "42"}
+        spans = []
+        tracer.add_listener(spans.append)
+        try:
+            with tracer.span("api"):
+                session.hooks["response"][0](response)
+                response.headers = {}
+                session.hooks["response"][0](response)
+        finally:
+            tracer.remove_listener(spans.append)
+        self.assertEqual(spans[0].counters, {"docker_calls": 2, "docker_bytes": 42})
+
+    def test_counting_reader(self) -> None:
+        reader = McbdscCountingReader(io.BytesIO(b"x" * 100))
+        self.assertEqual(len(reader.read(60)), 60)
+        self.assertIsNone(reader.eof_at)
+        reader.read(60)
+        reader.read(60)
+        self.assertEqual(reader.bytes, 100)
+        self.assertIsNotNone(reader.eof_at)
+
+
+class TestMcbdscDockerManagerTrace(unittest.TestCase):
+
+    def setUp(self) -> None:
+        test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(test_dir, exist_ok=True)
+        self.test_dir = test_dir
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        self.client = self.mock_docker.from_env.return_value
+        self.spans = []
+        tracer.add_listener(self.spans.append)
+
+    def tearDown(self) -> None:
+        tracer.remove_listener(self.spans.append)
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(os_name2test_root_dir[os.name])
+
+    def test_build_image(self) -> None:
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, state_db_file=None)
+        with open(os.path.join(self.test_dir, ".dockerignore"), "w") as f:
+            f.write("# comment\nbackups\n\n")
+        self.mock_docker.utils.tar.return_value = io.BytesIO(b"\0" * 1024)
+
+        def build(fileobj, **kwargs):
+            # docker-py と同じく、コンテキストを最後まで読み込んでから Build する。
+            while fileobj.read(100):
+                pass
+            return iter([{"aux": {"ID": "sha256:1"}}])
+        self.client.api.build.side_effect = build
+        manager.build_image(version="1.0.0.0")
+
+        # .dockerignore の除外設定と、コンテキスト内の Dockerfile のパスが渡されることを確認する。
+        self.mock_docker.utils.tar.assert_called_once_with(self.test_dir, exclude=["backups"],
+                                                           dockerfile=("Dockerfile", None))
+        kwargs = self.client.api.build.call_args[1]
+        self.assertTrue(kwargs["custom_context"])
+        self.assertEqual(kwargs["dockerfile"], "Dockerfile")
+        self.assertEqual(kwargs["tag"], "bedrock:1.0.0.0")
+
+        spans = {s.path(): s for s in self.spans}
+        self.assertEqual(spans["build_image/build_image.context"].counters, {"bytes": 1024})
+        self.assertEqual(spans["build_image/build_image.build"].counters["upload_bytes"], 1024)
+        self.assertIn("upload_seconds", spans["build_image/build_image.build"].counters)
+        self.assertEqual(spans["build_image"].attrs, {"tag": "bedrock:1.0.0.0"})
+
+    def test_set_minor_tags(self) -> None:
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, state_db_file=None)
+        with mock.patch.object(manager, "get_bds_versions_from_container_image",
+                               return_value=["1.16.200.2", "1.16.201.2", "1.17.0.1"]):
+            manager.set_minor_tags()
+        paths = [s.path() for s in self.spans]
+        self.assertEqual(paths.count("set_minor_tags/set_tag"), 2)
+        self.assertEqual(paths[-1], "set_minor_tags")
+
+    def test_backup(self) -> None:
+        manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, state_db_file=None)
+        container = mock.MagicMock()
+        container.name = "mbdsc_test"
+        container.is_running.return_value = False
+        container.backup.side_effect = lambda fileobj, **kwargs: fileobj.write(b"x" * 100)
+        with mock.patch.object(manager, "factory_containers", return_value=[container]):
+            manager.backup(compression="")
+        span = self.spans[-1]
+        self.assertEqual(span.path(), "backup")
+        self.assertEqual(span.attrs, {"server": "mbdsc_test", "compression": ""})
+        self.assertEqual(span.counters, {"bytes": 100})
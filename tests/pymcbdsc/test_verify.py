@@ -0,0 +1,120 @@
+import unittest
+from unittest import mock
+import io
+import os
+import shutil
+import zipfile
+import pymcbdsc
+from pymcbdsc import verify
+from pymcbdsc.repository import McbdscBackupRepository
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+def make_zip(path: str) -> None:
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr(zipfile.ZipInfo("bedrock_server"), os.urandom(2000) + b"\0" * 100000,
+                   compress_type=zipfile.ZIP_DEFLATED)
+        z.writestr(zipfile.ZipInfo("server.properties"), b"server-name=Dedicated Server\n",
+                   compress_type=zipfile.ZIP_STORED)
+        z.comment = b"comment"
+
+
+def corrupt(path: str, offset: int) -> None:
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        b = f.read(1)
+        f.seek(offset)
+        f.write(bytes([b[0] ^ 0xFF]))
+
+
+class TestVerify(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(self.test_dir, exist_ok=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir)
+
+    def test_verify_zip(self) -> None:
+        path = os.path.join(self.test_dir, "a.zip")
+        make_zip(path)
+        self.assertIsNone(verify.verify_zip(path))
+
+        # 圧縮されたデータの破損を検出できることを確認する。
+        corrupt(path, 1000)
+        self.assertIsNotNone(verify.verify_zip(path))
+
+        # 末尾が欠けた Zip ファイルを検出できることを確認する。
+        make_zip(path)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 30)
+        self.assertIsNotNone(verify.verify_zip(path))
+
+        open(path, "w").close()
+        self.assertEqual(verify.verify_zip(path), "Empty file.")
+
+    def test_verify_object(self) -> None:
+        repo = McbdscBackupRepository(os.path.join(self.test_dir, "repository"))
+        (sha256, _size) = repo.store_object(io.BytesIO(b"level.dat"))
+        self.assertIsNone(verify.verify_object(repo.object_path(sha256), sha256))
+        corrupt(repo.object_path(sha256), 0)
+        self.assertIn("mismatch", verify.verify_object(repo.object_path(sha256), sha256))
+
+    def test_verifier(self) -> None:
+        paths = [os.path.join(self.test_dir, "{i}.zip".format(i=i)) for i in range(3)]
+        for path in paths:
+            make_zip(path)
+        corrupt(paths[1], 1000)
+        cache_path = os.path.join(self.test_dir, "cache.json")
+        tasks = [(verify.KIND_ZIP, path, None) for path in paths]
+        tasks.append((verify.KIND_OBJECT, os.path.join(self.test_dir, "missing"), "0" * 64))
+
+        results = verify.McbdscVerifier(cache_path, workers=2).verify(tasks)
+        self.assertEqual([r.ok for r in results], [True, False, True, False])
+        self.assertEqual([r.cached for r in results], [False, False, False, False])
+
+        # 成功したファイルはキャッシュされ、失敗したファイルは検証し直すことを確認する。
+        with mock.patch("pymcbdsc.verify._verify", return_value="broken") as _verify:
+            results = verify.McbdscVerifier(cache_path, workers=1).verify(tasks)
+        self.assertEqual([r.cached for r in results], [True, False, True, False])
+        self.assertEqual(_verify.call_count, 1)
+
+        # 変更されたファイルは検証し直すことを確認する。
+        make_zip(paths[0])
+        os.utime(paths[0], ns=(0, 0))
+        results = verify.McbdscVerifier(cache_path, workers=1).verify(tasks[:1])
+        self.assertEqual((results[0].ok, results[0].cached), (True, False))
+
+
+class TestMcbdscDockerManagerVerify(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        os.makedirs(os.path.join(self.test_dir, "downloads"), exist_ok=True)
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.patcher_docker.start()
+        self.manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir)
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def test_verify(self) -> None:
+        make_zip(os.path.join(self.test_dir, "downloads", "bedrock-server-1.16.201.02.zip"))
+        make_zip(os.path.join(self.test_dir, "downloads", "other.zip"))
+        repo = self.manager.backup_repository()
+        snapshot = repo.new_snapshot("a")
+        (sha256, size) = repo.store_object(io.BytesIO(b"level.dat"))
+        snapshot.add("level.dat", sha256=sha256, size=size, mtime=0)
+        snapshot.add("missing.dat", sha256="0" * 64, size=1, mtime=0)
+        repo.save_snapshot(snapshot)
+
+        results = self.manager.verify(workers=1)
+        act = [(r.kind, os.path.basename(r.path), r.ok) for r in results]
+        exp = [(verify.KIND_ZIP, "bedrock-server-1.16.201.02.zip", True),
+               (verify.KIND_OBJECT, "0" * 64, False),
+               (verify.KIND_OBJECT, sha256, True)]
+        self.assertEqual(sorted(act), sorted(exp))
+        self.assertTrue(os.path.exists(os.path.join(self.test_dir, "verify-cache.json")))
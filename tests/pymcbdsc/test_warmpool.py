@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+import os
+import re
+import shutil
+import pymcbdsc
+from .test_clone import make_template, read_tree, template_files
+from .test_utils import os_name2test_root_dir
+from . import stop_patcher
+
+
+started_log = b"[2021-01-31 12:34:56:789 INFO] Server started.\n"
+
+
+class TestMcbdscWarmPool(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = os_name2test_root_dir[os.name]
+        make_template(os.path.join(self.test_dir, "templates", "event"))
+        self.patcher_docker = mock.patch('pymcbdsc.docker.docker')
+        self.mock_docker = self.patcher_docker.start()
+        self.client = self.mock_docker.from_env.return_value
+        self.containers = []
+        self.client.containers.create.side_effect = self.create_container
+        self.client.containers.list.side_effect = self.list_containers
+        self.manager = pymcbdsc.McbdscDockerManager(pymcbdsc_root_dir=self.test_dir, state_db_file=None)
+        self.pool = self.manager.warm_pool("bedrock:1.16", size=2, low_water=1, poll_interval=0)
+
+    def tearDown(self) -> None:
+        stop_patcher(self.patcher_docker)
+        shutil.rmtree(self.test_dir)
+
+    def create_container(self, **kwargs):
+        container = mock.MagicMock()
+        container.name = kwargs["name"]
+        container.status = "running"
+        container.logs.return_value = started_log
+        container.rename.side_effect = lambda name: setattr(container, "name", name)
+        self.containers.append(container)
+        return container
+
+    def list_containers(self, all=False, filters=None):
+        pat = (filters or {}).get("name")
+        return [c for c in self.containers if pat is None or re.search(pat, "/" + c.name)]
+
+    def test_fill(self) -> None:
+        slots = self.pool.fill()
+        self.assertEqual(sorted(slots), sorted(self.pool.available()))
+        self.assertEqual(len(slots), 2)
+        for container in self.containers:
+            slot = container.name
+            self.assertIn(slot, slots)
+            self.assertTrue(slot.startswith("mcbdsc-warm-bedrock-1.16-"))
+            container.start.assert_called_once_with()
+            container.stop.assert_called_once_with()
+            self.assertTrue(os.path.isdir(self.manager.warm_dir(slot)))
+        param = self.client.containers.create.call_args[1]
+        self.assertEqual(param["image"], "bedrock:1.16")
+        self.assertEqual(param["labels"], {"pymcbdsc": "true", "pymcbdsc.warm": "bedrock:1.16"})
+        self.assertEqual(param["volumes"], {param["name"]: {"bind": "/volume", "mode": "rw"}})
+        # プールのコンテナにはそれぞれ別のポートが割り当てられていることを確認する。
+        ports = sorted(a["port"] for a in self.manager.resource_allocator().allocations().values())
+        self.assertEqual(ports, [19132, 19134])
+        # `size` 個揃っていれば、作成しないことを確認する。
+        self.assertEqual(self.pool.fill(), [])
+
+    def test_fill_not_started(self) -> None:
+        # 起動が完了しなかったコンテナは、プールに加えずに削除することを確認する。
+        self.pool = self.manager.warm_pool("bedrock:1.17", size=1, poll_interval=0, warmup_timeout=0)
+        self.client.containers.create.side_effect = None
+        container = self.client.containers.create.return_value
+        container.status = "running"
+        container.logs.return_value = b"Starting Server\n"
+        self.assertEqual(self.pool.fill(), [])
+        container.remove.assert_called_once_with(force=True)
+        self.assertEqual(self.manager.resource_allocator().allocations(), {})
+        self.assertEqual(os.listdir(self.manager.warm_dir()), [])
+
+    def test_fill_allocation_failed(self) -> None:
+        # 割り当てられるポートが足りなければ、割り当てられた分だけ作成することを確認する。
+        self.manager.resource_allocator(port_limit=19133)
+        slots = self.pool.fill()
+        self.assertEqual(len(slots), 1)
+        self.client.containers.create.assert_called_once()
+        self.assertEqual(list(self.manager.resource_allocator().allocations()), slots)
+        self.assertEqual(os.listdir(self.manager.warm_dir()), slots)
+        self.assertEqual(self.pool.status()["warming"], 0)
+
+    def test_add_server(self) -> None:
+        self.pool.fill()
+        (slot, rest) = self.pool.available()
+        warm = [c for c in self.containers if c.name == slot][0]
+        allocations = self.manager.resource_allocator().allocations()
+        container = self.manager.add_server("event-01", "event", image="bedrock:1.16")
+        # プールのコンテナの名前を変えて起動し、コンテナを作成しないことを確認する。
+        self.assertEqual(self.client.containers.create.call_count, 2)
+        self.assertIs(container._container, warm)
+        warm.rename.assert_called_once_with("event-01")
+        self.assertEqual(warm.start.call_count, 2)
+        self.assertEqual(self.pool.available(), [rest])
+        # ワールドはテンプレートから複製され、プールのボリュームのパスからリンクされていることを確認する。
+        dst = self.manager.volume_dir("event-01")
+        self.assertEqual(read_tree(dst), template_files)
+        self.assertEqual(os.path.realpath(self.manager.warm_dir(slot)), os.path.realpath(dst))
+        # ポートの割り当てが引き継がれていることを確認する。
+        self.assertEqual(self.manager.resource_allocator().allocations()["event-01"], allocations[slot])
+        self.assertNotIn(slot, self.manager.resource_allocator().allocations())
+        param = self.manager._containers_param[0]
+        self.assertEqual((param["name"], param["ports"]), ("event-01", {
+            "{port}/udp".format(port=allocations[slot]["port"]): allocations[slot]["port"],
+            "{port}/udp".format(port=allocations[slot]["portv6"]): allocations[slot]["portv6"]}))
+
+        # 他のサーバのワールドを指すリンクは、リンク先が無くても削除しないことを確認する。
+        other = self.manager.warm_dir("mcbdsc-warm-bedrock-1.16-other")
+        os.symlink(os.path.abspath(self.manager.volume_dir("event-02")), other)
+        self.manager.remove_server("event-01")
+        self.assertFalse(os.path.lexists(self.manager.warm_dir(slot)))
+        self.assertTrue(os.path.islink(other))
+        self.client.volumes.get.assert_any_call(slot)
+        self.assertEqual(list(self.manager.resource_allocator().allocations()), [rest])
+
+    def test_add_server_empty_pool(self) -> None:
+        # プールが空であれば、コンテナを作成することを確認する。
+        self.manager.add_server("event-01", "event", image="bedrock:1.16")
+        self.client.containers.create.assert_called_once()
+        self.assertEqual(self.client.containers.create.call_args[1]["name"], "event-01")
+
+    def test_discover(self) -> None:
+        self.create_container(name="mcbdsc-warm-bedrock-1.16-0001").status = "exited"
+        self.create_container(name="mcbdsc-warm-bedrock-1.16-0002")
+        self.create_container(name="event-01").status = "exited"
+        self.assertEqual(self.pool.discover(), ["mcbdsc-warm-bedrock-1.16-0001"])
+        self.assertEqual(self.pool.discover(), [])